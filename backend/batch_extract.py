@@ -0,0 +1,157 @@
+"""Extraction en lot des KPIs ESG sur un dossier de rapports PDF.
+
+Utilise le même pipeline que /api/process, affiche le profil de chaque document
+puis le cumul par étape. Chaque job est aussi ajouté au journal JSONL de
+performance (esg_profiling.PERF_LOG_PATH). Avec ``--workers N``, les PDF sont
+traités en parallèle par le pool de processus (esg_workers).
+
+Le manifeste de run (esg_manifest) garde, par empreinte de contenu, les PDF
+traités et leurs résultats: un run interrompu reprend au PDF suivant, les PDF
+déjà traités sous la même configuration (KPIs, seuils, version du pipeline)
+sont sautés, et les résultats non encore fusionnés dans all_extracted_kpis.csv
+le sont au run suivant. Le script n'importe pas l'API (esg_banchmarking): pas
+de moniteur Ollama ni de résumés LLM lancés depuis la ligne de commande.
+
+    python batch_extract.py "esg kpis A+ critical(Sheet1).csv" reports --min-confidence 0.3 --workers 4
+"""
+import os
+import argparse
+
+from esg_extraction import load_kpi_list, process_pdf, stage_configs
+from esg_manifest import RUN_MANIFEST_PATH, RunManifest, stage_fingerprints
+from esg_profiling import format_perf_summary, format_stage_table
+from esg_results import load_existing_results, merge_results, save_results
+from esg_workers import ExtractionWorkers, WorkerError
+
+
+STAGE = 'process_pdf'   # étape unique du manifeste: process_pdf traite tout le document
+
+
+def find_pdfs(folder):
+    pdfs = []
+    for root, _, files in os.walk(folder):
+        pdfs.extend(os.path.join(root, name) for name in files if name.lower().endswith('.pdf'))
+    return sorted(pdfs)
+
+
+def run_in_process(pdfs, kpi_embeddings, all_kpis, kpi_df, min_confidence):
+    """(pdf, résultats, profil, erreur) de chaque PDF, traité dans ce processus"""
+    for pdf_path in pdfs:
+        job_stats = {}
+        try:
+            results = process_pdf(pdf_path, kpi_embeddings, all_kpis, kpi_df, min_confidence, job_stats=job_stats)
+        except Exception as e:
+            yield pdf_path, [], job_stats, e
+            continue
+        yield pdf_path, results, job_stats, None
+
+
+def run_in_workers(workers, pdfs, kpi_file, min_confidence):
+    """Comme run_in_process, les PDF étant tous soumis d'emblée au pool de processus (KPIs relus par chacun)"""
+    pool = ExtractionWorkers(workers=workers).start()
+    try:
+        tasks = [(pdf_path, pool.submit('extract_pdf', os.path.abspath(pdf_path), os.path.abspath(kpi_file),
+                                        min_confidence)) for pdf_path in pdfs]
+        for pdf_path, task_id in tasks:
+            try:
+                results, job_stats = pool.result(task_id)
+            except WorkerError as e:
+                yield pdf_path, [], {}, e
+                continue
+            yield pdf_path, results, job_stats, None
+    finally:
+        pool.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extraction en lot des KPIs ESG")
+    parser.add_argument('kpi_file', help="Fichier des KPIs (CSV ou Excel)")
+    parser.add_argument('pdf_folder', help="Dossier des rapports PDF (parcouru récursivement)")
+    parser.add_argument('--min-confidence', type=float, default=0.3)
+    parser.add_argument('--limit', type=int, default=None, help="Nombre maximal de PDF à traiter")
+    parser.add_argument('--rerun', action='store_true', help="Retraiter les PDF déjà traités sous cette configuration")
+    parser.add_argument('--no-save', action='store_true', help="Ne pas écrire les résultats")
+    parser.add_argument('--workers', type=int, default=0, help="Processus d'extraction (0: dans ce processus)")
+    parser.add_argument('--manifest', default=RUN_MANIFEST_PATH, help="Manifeste de reprise (SQLite)")
+    args = parser.parse_args()
+
+    kpi_df, _, _, kpi_embeddings, all_kpis = load_kpi_list(args.kpi_file)
+    if not all_kpis:
+        print("❌ Aucun KPI trouvé dans le fichier KPI")
+        return
+
+    manifest = RunManifest(args.manifest)
+    config = dict(stage_configs(args.kpi_file, args.min_confidence))
+    fingerprint = stage_fingerprints([(STAGE, config)])[STAGE]
+    found = find_pdfs(args.pdf_folder)
+    docs = {path: manifest.document_hash(path) for path in found}   # relu seulement si le fichier a changé
+    pdfs, seen = [], set()
+    for path in found:
+        if docs[path] in seen:
+            continue   # même contenu sous un autre nom
+        seen.add(docs[path])
+        if args.rerun or not manifest.is_done(docs[path], STAGE, fingerprint):
+            pdfs.append(path)
+    if args.limit:
+        pdfs = pdfs[:args.limit]
+    print(f"📄 {len(pdfs)} PDF à traiter ({len(found) - len(pdfs)} déjà traités sous cette configuration "
+          f"ou hors limite), {len(all_kpis)} KPIs")
+
+    run_id = manifest.start_run('batch_extract', {'kpi_file': args.kpi_file, 'config': config})
+    records = []
+    processed = 0
+    status = 'interrupted'
+    if args.workers > 0:
+        jobs = run_in_workers(args.workers, pdfs, args.kpi_file, args.min_confidence)
+    else:
+        jobs = run_in_process(pdfs, kpi_embeddings, all_kpis, kpi_df, args.min_confidence)
+    try:
+        for i, (pdf_path, results, job_stats, error) in enumerate(jobs, 1):
+            if error is not None:
+                print(f"❌ [{i}/{len(pdfs)}] {os.path.basename(pdf_path)}: {error}")
+                continue
+            # Résultats conservés dans le manifeste: un arrêt après ce PDF ne le fait pas retraiter
+            manifest.complete(docs[pdf_path], STAGE, fingerprint, os.path.basename(pdf_path), results, run_id)
+            processed += 1
+            if job_stats:
+                records.append(job_stats)
+                print(f"[{i}/{len(pdfs)}] {format_perf_summary(job_stats)} -> {len(results)} KPIs")
+        status = 'finished'
+    finally:
+        manifest.finish_run(run_id, processed, status)
+
+    if records:
+        total_wall = sum(record['wall_s'] for record in records)
+        total_pages = sum(record['pages'] for record in records)
+        print(f"\n=== BILAN: {len(records)} documents, {total_pages} pages, {total_wall:.1f}s "
+              f"({total_pages / total_wall if total_wall else 0:.1f} pages/s), "
+              f"pic RSS {max(record['peak_rss_mb'] for record in records)} Mo ===")
+        print(format_stage_table(records))
+
+    if not args.no_save:
+        merge_pending(manifest, fingerprint)
+
+
+def merge_pending(manifest, fingerprint):
+    """Fusionner dans les résultats de l'API les PDF traités pas encore fusionnés (ce run et les précédents)"""
+    pending = [(doc, source, results) for doc, source, results in manifest.unmerged(STAGE, fingerprint)
+               if results is not None]
+    if not pending:
+        return
+    new_results = [row for _, _, results in pending for row in results]
+    if not new_results:
+        manifest.mark_merged([doc for doc, _, _ in pending], STAGE)
+        return
+    existing_results = load_existing_results()
+    if not existing_results.empty:
+        # Un PDF retraité remplace ses anciennes lignes (configuration différente)
+        existing_results = existing_results[~existing_results['source_file'].isin({s for _, s, _ in pending})]
+    all_results = merge_results(existing_results, new_results)
+    if save_results(all_results):
+        manifest.mark_merged([doc for doc, _, _ in pending], STAGE)
+        # Index et profils d'entreprise rafraîchis par l'API au prochain accès (version du CSV)
+        print(f"💾 {len(new_results)} nouveaux KPIs ({len(pending)} PDF), {len(all_results)} au total")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""Coordinateur de l'extraction du corpus SASB sur plusieurs machines.
+
+    # une fois, sur le coordinateur
+    python corpus_extract.py enqueue "esg kpis A+ critical(Sheet1).csv" --queue dir:/mnt/esg/queue \\
+        --reports-dir /mnt/esg/reports --results-dir /mnt/esg/corpus_results
+    # sur chaque machine de calcul
+    python esg_workers.py --queue dir:/mnt/esg/queue --workers 8 --preload esg_extraction,esg_corpus
+    # suivi, puis fusion dans all_extracted_kpis.csv
+    python corpus_extract.py status --queue dir:/mnt/esg/queue --results-dir /mnt/esg/corpus_results
+    python corpus_extract.py collect --queue dir:/mnt/esg/queue --results-dir /mnt/esg/corpus_results
+
+En local, une file SQLite (chemin sans préfixe) et plusieurs hôtes sur la même
+machine suffisent. ``enqueue`` peut être relancé: les rapports déjà traités ou
+déjà en file sont ignorés.
+
+Sur une seule machine, ``run`` traite le corpus en flux (esg_pipeline), chaque
+étape ayant ses threads ou processus, avec le débit par étape affiché en continu.
+Un run interrompu reprend où il s'est arrêté (manifeste esg_manifest): rapports
+traités sous la même configuration sautés, étapes à jour non refaites:
+
+    python corpus_extract.py run "esg kpis A+ critical(Sheet1).csv" --text-processes 8 --fetch-threads 16
+"""
+import os
+import argparse
+from functools import partial
+
+from esg_corpus import (
+    CORPUS_RESULTS_DIR, REPORTS_CSV, REPORTS_DIR, checkpoint_stage, completed_reports, init_encoder_process,
+    is_report_done, load_kpis, load_merged, load_reports, load_result, new_item, pipeline_fingerprints,
+    result_version, resume_item, save_merged, source_key, stage_embed, stage_fetch, stage_match, stage_persist,
+    stage_segment, stage_text, stage_values
+)
+from esg_manifest import RUN_MANIFEST_PATH, RunManifest
+from esg_results import load_existing_results, merge_results, save_results
+from esg_workers import TASK_QUEUE_PATH, open_queue
+
+CPU_COUNT = os.cpu_count() or 1
+
+
+def pending_reports(args, is_done=None):
+    """(rapports du corpus, rapports à traiter); par défaut, traité = fichier résultat présent"""
+    reports = load_reports(args.reports_csv)
+    if is_done is None:
+        completed = completed_reports(args.results_dir)
+        is_done = lambda report: report['id'] in completed   # noqa: E731
+    todo = reports if args.rerun else [report for report in reports if not is_done(report)]
+    if args.limit:
+        todo = todo[:args.limit]
+    return reports, todo
+
+
+def enqueue(args):
+    queue = open_queue(args.queue)
+    reports, todo = pending_reports(args)
+    added = 0
+    for report in todo:
+        if args.rerun:
+            queue.take(report['id'])   # résultat précédent non relevé: la tâche peut être remise en file
+        added += queue.put(report['id'], 'process_report', report, os.path.abspath(args.kpi_file),
+                           args.min_confidence, os.path.abspath(args.reports_dir),
+                           os.path.abspath(args.results_dir))
+    print(f"📥 {added} rapports mis en file, {len(todo) - added} déjà en file, "
+          f"{len(reports) - len(todo)} déjà traités ou hors limite ({len(reports)} au total)")
+
+
+def status(args):
+    counts = open_queue(args.queue).counts()
+    print(f"File: {', '.join(f'{state} {count}' for state, count in sorted(counts.items())) or 'vide'}")
+    print(f"Résultats écrits: {len(completed_reports(args.results_dir))}")
+
+
+def collect(args):
+    queue = open_queue(args.queue)
+    finished = queue.finished()
+    failed = [(task_id, error) for task_id, state, _, error in finished if state == 'failed']
+    for task_id, error in failed:
+        print(f"❌ {task_id}: {error}")
+
+    # Résultats nouveaux ou réécrits (rapport retraité) depuis la dernière fusion
+    merged = load_merged(args.results_dir)
+    pending = {}
+    for rid in sorted(completed_reports(args.results_dir)):
+        try:
+            version = result_version(rid, args.results_dir)
+            if merged.get(rid) != version:
+                pending[rid] = (version, load_result(rid, args.results_dir))
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Résultat illisible {rid}: {e}")
+    if pending:
+        new_results = [row for _, record in pending.values() for row in record['results']]
+        sources = {record['source_file'] for _, record in pending.values() if record.get('source_file')}
+        existing_results = load_existing_results()
+        if not existing_results.empty:
+            # Un rapport retraité remplace ses anciennes lignes (configuration différente)
+            existing_results = existing_results[~existing_results['source_file'].isin(sources)]
+        all_results = merge_results(existing_results, new_results)
+        if not save_results(all_results):
+            print("❌ Sauvegarde impossible: tâches laissées dans la file")
+            return
+        merged.update((rid, version) for rid, (version, _) in pending.items())
+        save_merged(merged, args.results_dir)
+        print(f"💾 {len(new_results)} KPIs fusionnés ({len(pending)} rapports), {len(all_results)} au total "
+              f"(index et profils rafraîchis par l'API au prochain accès)")
+
+    for task_id, _, _, _ in finished:
+        queue.take(task_id)
+    print(f"✅ {len(finished) - len(failed)} tâches terminées relevées, {len(failed)} en échec "
+          f"(relancer enqueue pour les remettre en file)")
+
+
+def run(args):
+    import esg_extraction  # noqa: F401  modèles chargés avant fork, partagés par les processus des étapes
+    from esg_pipeline import Pipeline, Stage
+
+    manifest = RunManifest(args.manifest)
+    fingerprints = pipeline_fingerprints(args.kpi_file, args.min_confidence)
+    reports, todo = pending_reports(
+        args, lambda report: is_report_done(manifest, report, fingerprints, args.results_dir))
+    print(f"📄 {len(todo)} rapports à traiter ({len(reports) - len(todo)} déjà traités sous cette configuration "
+          f"ou hors limite)")
+    if not todo:
+        return
+    run_id = manifest.start_run('corpus_pipeline', {'kpi_file': args.kpi_file, 'fingerprints': fingerprints})
+    reports_dir, results_dir = os.path.abspath(args.reports_dir), os.path.abspath(args.results_dir)
+
+    def fetch(item):
+        item = stage_fetch(item, reports_dir)
+        if args.rerun:
+            item['doc'] = manifest.document_hash(item['path'], key=source_key(item['report']))
+            return item
+        return resume_item(manifest, item, fingerprints, results_dir)
+
+    kpis = {}   # rempli après le démarrage des pools (encodage des KPIs dans un processus d'encodage)
+    failures = []
+    pipeline = Pipeline([
+        Stage('fetch', fetch, workers=args.fetch_threads),
+        Stage('text', stage_text, workers=args.text_processes, processes=True),
+        Stage('segment', stage_segment, workers=args.segment_processes, processes=True),
+        Stage('embed', stage_embed, workers=args.embed_processes, processes=True,
+              initializer=init_encoder_process, initargs=(args.torch_threads,)),
+        Stage('match', partial(stage_match, kpis=kpis), workers=2),
+        Stage('values', partial(stage_values, kpis=kpis, min_confidence=args.min_confidence),
+              workers=args.value_processes, processes=True),
+        Stage('persist', partial(stage_persist, results_dir=results_dir), workers=2),
+    ], report_interval=args.report_interval,
+        on_error=lambda stage, item, message: failures.append((stage, item['report'], message)),
+        on_stage_done=checkpoint_stage(manifest, fingerprints, run_id))
+
+    pipeline.start()
+    try:
+        kpi_df, embeddings, all_kpis = pipeline.stage('embed').call(load_kpis, args.kpi_file)
+    except Exception:
+        pipeline.stop()
+        raise
+    if not all_kpis or embeddings is None:
+        pipeline.stop()
+        print("❌ Aucun KPI trouvé dans le fichier KPI")
+        return
+    kpis.update(kpi_df=kpi_df, embeddings=embeddings, all_kpis=all_kpis)
+
+    counts = {}
+    status = 'interrupted'
+    try:
+        for summary in pipeline.run(new_item(report) for report in todo):
+            counts[summary['status']] = counts.get(summary['status'], 0) + 1
+        status = 'finished'
+    finally:
+        manifest.finish_run(run_id, sum(counts.values()), status)
+    print(pipeline.report())
+    for stage, report, message in failures:
+        print(f"❌ {stage} {report['company']} {report['year']}: {message}")
+    print(f"✅ {counts.get('done', 0)} rapports extraits, {counts.get('unchanged', 0)} inchangés, "
+          f"{counts.get('skipped', 0)} écartés (HTML, texte vide), {len(failures)} en échec: "
+          f"fusionner avec `corpus_extract.py collect`")
+
+
+def main():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--queue', default=TASK_QUEUE_PATH, help="Fichier SQLite ou dir:/dossier/partagé")
+    common.add_argument('--results-dir', default=CORPUS_RESULTS_DIR)
+    parser = argparse.ArgumentParser(description="Extraction du corpus SASB par le pool d'extraction")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    parser_enqueue = commands.add_parser('enqueue', parents=[common], help="Mettre les rapports du corpus en file")
+    parser_enqueue.add_argument('kpi_file', help="Fichier des KPIs (CSV ou Excel), même chemin sur chaque machine")
+    parser_enqueue.add_argument('--reports-csv', default=REPORTS_CSV)
+    parser_enqueue.add_argument('--reports-dir', default=REPORTS_DIR)
+    parser_enqueue.add_argument('--min-confidence', type=float, default=0.3)
+    parser_enqueue.add_argument('--limit', type=int, default=None)
+    parser_enqueue.add_argument('--rerun', action='store_true', help="Retraiter les rapports déjà traités")
+    parser_enqueue.set_defaults(func=enqueue)
+
+    parser_run = commands.add_parser('run', parents=[common], help="Traiter le corpus en flux sur cette machine")
+    parser_run.add_argument('kpi_file', help="Fichier des KPIs (CSV ou Excel)")
+    parser_run.add_argument('--reports-csv', default=REPORTS_CSV)
+    parser_run.add_argument('--reports-dir', default=REPORTS_DIR)
+    parser_run.add_argument('--min-confidence', type=float, default=0.3)
+    parser_run.add_argument('--limit', type=int, default=None)
+    parser_run.add_argument('--rerun', action='store_true',
+                            help="Tout retraiter, sans sauter ni reprendre les rapports du manifeste")
+    parser_run.add_argument('--fetch-threads', type=int, default=8)
+    parser_run.add_argument('--text-processes', type=int, default=max(1, CPU_COUNT // 2))
+    parser_run.add_argument('--segment-processes', type=int, default=max(1, CPU_COUNT // 4))
+    parser_run.add_argument('--embed-processes', type=int, default=max(1, CPU_COUNT // 4))
+    parser_run.add_argument('--torch-threads', type=int, default=1, help="Threads torch par processus d'encodage")
+    parser_run.add_argument('--value-processes', type=int, default=1)
+    parser_run.add_argument('--report-interval', type=float, default=10, help="Secondes entre deux relevés de débit")
+    parser_run.add_argument('--manifest', default=RUN_MANIFEST_PATH, help="Manifeste de reprise (SQLite)")
+    parser_run.set_defaults(func=run)
+
+    commands.add_parser('status', parents=[common], help="État de la file et des résultats") \
+        .set_defaults(func=status)
+    commands.add_parser('collect', parents=[common], help="Fusionner les résultats dans all_extracted_kpis.csv") \
+        .set_defaults(func=collect)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""Service asynchrone des routes liées au LLM.
+
+Sous WSGI, chaque requête de chat occupe un thread pendant toute la génération
+Ollama (jusqu'à 120 s): quelques chats simultanés suffisent à bloquer
+l'extraction et le tableau de bord. ``AsyncServer`` sert les routes LLM avec
+asyncio (aiohttp) et ``AsyncOllamaClient``: une requête qui attend son tour
+dans la file LLM ou ses jetons n'occupe aucun thread. Seules les étapes
+bloquantes courtes (retrieval, pandas, SQLite) passent par un petit pool
+(``run_sync``).
+
+Toutes les autres routes sont déléguées à l'application Flask par un pont WSGI
+exécuté dans son propre pool de threads, que les chats ne peuvent plus
+saturer. Les routes asyncio alimentent les mêmes séries HTTP (latence, requêtes,
+requêtes en cours) que celles mesurées par Flask (``metrics_middleware``). Le
+serveur remplace donc ``app.run`` sur le même port::
+
+    ESG_ASYNC=1 python esg_banchmarking.py
+"""
+import os
+import io
+import sys
+import json
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+from esg_metrics import HTTP_IN_FLIGHT, HTTP_LATENCY, HTTP_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+ASYNC_ENABLED = os.environ.get('ESG_ASYNC', '0').lower() in ('1', 'true', 'yes')
+PREPARE_THREADS = int(os.environ.get('ESG_ASYNC_PREPARE_THREADS', 4))   # préparation des prompts
+WSGI_THREADS = int(os.environ.get('ESG_ASYNC_WSGI_THREADS', 8))         # routes Flask (tableau de bord, extraction)
+SSE_HEADERS = {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+_HOP_BY_HOP = {'connection', 'keep-alive', 'transfer-encoding', 'content-length'}
+
+
+def json_response(payload, status=200):
+    """Réponse JSON (accents conservés, comme jsonify)"""
+    return web.json_response(payload, status=status,
+                             dumps=lambda data: json.dumps(data, ensure_ascii=False, default=str))
+
+
+async def read_json(request):
+    """Corps JSON de la requête ({} s'il est absent ou invalide)"""
+    try:
+        data = await request.json()
+    except (ValueError, UnicodeDecodeError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+async def sse_response(request, events):
+    """Diffuser ``events`` (itérable asynchrone de chaînes SSE) en Server-Sent Events"""
+    response = web.StreamResponse(headers=SSE_HEADERS)
+    await response.prepare(request)
+    try:
+        async for event in events:
+            await response.write(event.encode('utf-8'))
+    except ConnectionResetError:
+        logger.info("Client SSE déconnecté")
+    finally:
+        await events.aclose()
+    return response
+
+
+def metrics_middleware(skip=()):
+    """Middleware aiohttp: latence, requêtes et requêtes en cours, comme ``esg_metrics.install_metrics``
+
+    Libellé par gabarit de route (/api/company/{company_name}); les gestionnaires
+    de ``skip`` (pont WSGI, déjà mesuré par Flask) ne sont pas comptés deux fois.
+    """
+    @web.middleware
+    async def middleware(request, handler):
+        if request.match_info.handler in skip:
+            return await handler(request)
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else 'unmatched'
+        start = time.perf_counter()
+        status = 500
+        HTTP_IN_FLIGHT.inc()
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            HTTP_LATENCY.observe(time.perf_counter() - start, route=route, method=request.method)
+            HTTP_REQUESTS.inc(route=route, method=request.method, status=status)
+    return middleware
+
+
+class AsyncServer:
+    """Routes asyncio déclarées par ``route``, le reste servi par l'application WSGI"""
+
+    def __init__(self, wsgi_app=None, prepare_threads=PREPARE_THREADS, wsgi_threads=WSGI_THREADS,
+                 cors_origins=()):
+        self.wsgi_app = wsgi_app
+        self.cors_origins = set(cors_origins)
+        self.wsgi_threads = wsgi_threads
+        self.prepare_pool = ThreadPoolExecutor(prepare_threads, thread_name_prefix='async-prepare')
+        self.wsgi_pool = ThreadPoolExecutor(wsgi_threads, thread_name_prefix='wsgi')
+        self.routes = []
+        self.on_cleanup = []
+
+    def route(self, method, path):
+        """Décorateur: ``async def handler(request)`` servi sans thread"""
+        def decorator(handler):
+            self.routes.append((method, path, handler))
+            return handler
+        return decorator
+
+    async def run_sync(self, fn, *args, **kwargs):
+        """Exécuter une étape bloquante (retrieval, pandas, SQLite) dans le pool de préparation"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.prepare_pool, lambda: fn(*args, **kwargs))
+
+    async def acquire(self, lock):
+        """Prendre un ``threading.Lock`` sans bloquer la boucle (libéré par l'appelant)"""
+        loop = asyncio.get_running_loop()
+        acquired = loop.run_in_executor(self.prepare_pool, lock.acquire)
+        try:
+            await asyncio.shield(acquired)
+        except asyncio.CancelledError:
+            # Requête annulée pendant l'attente: rendre le verrou dès qu'il est obtenu
+            acquired.add_done_callback(lambda _: lock.release())
+            raise
+
+    def build(self):
+        if web is None:
+            raise RuntimeError("Le paquet 'aiohttp' est requis pour le mode asynchrone (pip install aiohttp)")
+        app = web.Application(client_max_size=200 * 1024 * 1024,
+                              middlewares=[metrics_middleware(skip=(self._wsgi_handler,))])
+        for method, path, handler in self.routes:
+            app.router.add_route(method, path, handler)
+        if self.wsgi_app is not None:
+            app.router.add_route('*', '/{tail:.*}', self._wsgi_handler)
+        app.on_response_prepare.append(self._add_cors)
+        for callback in self.on_cleanup:
+            app.on_cleanup.append(lambda _app, callback=callback: callback())
+        return app
+
+    def serve(self, host='0.0.0.0', port=5000):
+        print(f"⚡ Serveur asynchrone: {len(self.routes)} routes LLM sous asyncio, "
+              f"autres routes via WSGI ({self.wsgi_threads} threads)")
+        web.run_app(self.build(), host=host, port=port, print=None)
+
+    async def _add_cors(self, request, response):
+        # Les réponses Flask portent déjà les en-têtes de flask_cors
+        origin = request.headers.get('Origin')
+        if origin in self.cors_origins and 'Access-Control-Allow-Origin' not in response.headers:
+            response.headers['Access-Control-Allow-Origin'] = origin
+            response.headers['Vary'] = 'Origin'
+
+    async def _wsgi_handler(self, request):
+        """Pont WSGI: la requête Flask s'exécute dans ``wsgi_pool``, réponse relayée par morceaux"""
+        loop = asyncio.get_running_loop()
+        body = await request.read()
+        environ = wsgi_environ(request, body)
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = headers
+
+        def call_app():
+            result = self.wsgi_app(environ, start_response)
+            return result, iter(result)
+
+        result, chunks = await loop.run_in_executor(self.wsgi_pool, call_app)
+        response = None
+        try:
+            while True:
+                chunk = await loop.run_in_executor(self.wsgi_pool, next, chunks, None)
+                if response is None:
+                    response = web.StreamResponse(status=started['status'])
+                    for name, value in started['headers']:
+                        if name.lower() not in _HOP_BY_HOP:
+                            response.headers.add(name, value)
+                    await response.prepare(request)
+                if chunk is None:
+                    break
+                if chunk:
+                    await response.write(chunk)
+        finally:
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(self.wsgi_pool, result.close)
+        await response.write_eof()
+        return response
+
+
+def wsgi_environ(request, body):
+    """Environnement WSGI (PEP 3333) d'une requête aiohttp"""
+    host, _, port = (request.host or 'localhost').partition(':')
+    environ = {
+        'REQUEST_METHOD': request.method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': request.path.encode('utf-8').decode('latin-1'),   # PEP 3333: octets en latin-1
+        'QUERY_STRING': request.query_string,
+        'SERVER_NAME': host,
+        'SERVER_PORT': port or ('443' if request.secure else '80'),
+        'SERVER_PROTOCOL': f"HTTP/{request.version.major}.{request.version.minor}",
+        'REMOTE_ADDR': request.remote or '',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': request.scheme,
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in request.headers.items():
+        key = name.upper().replace('-', '_')
+        if key == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif key != 'CONTENT_LENGTH':
+            key = f"HTTP_{key}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
@@ -1,35 +1,49 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
 import os
-import re
 import pandas as pd
-import pdfplumber
-import spacy
-from sentence_transformers import SentenceTransformer, util
-import fitz  # PyMuPDF
-import numpy as np
-from collections import defaultdict
 from datetime import datetime
-import tempfile
 import io
 import logging
 from werkzeug.utils import secure_filename
 import requests
-import json
 import time
+from esg_extraction import kpi_model, load_kpi_list, process_pdf
+from esg_results import OUTPUT_CSV, load_existing_results, merge_results, save_results
+from esg_metrics import install_metrics, observe_worker_job
+from esg_workers import ExtractionWorkers, WorkerError
+from esg_llm_cache import LLMResponseCache, cache_key, file_version
+from esg_retrieval import CONTEXT_TOKEN_BUDGET, ResultsIndex
+from esg_companies import CompanyMatcher
+from esg_sessions import SessionStore
+from esg_router import QueryRouter
+from esg_insights import CompanyInsightStore, InsightSummarizer, profile_text
+from esg_benchmark import BenchmarkRunner, benchmark_table
+from esg_prompt import Section, assemble, compact_table, token_counter
+from esg_ollama import (
+    AsyncOllamaClient, OllamaClient, OllamaHealthMonitor, OllamaHTTPError, OllamaUnavailable, generation_stats,
+    sse_event
+)
+from esg_scheduler import (
+    PRIORITY_ANALYSIS, PRIORITY_INTERACTIVE, LLMDeadlineExceeded, LLMQueueFull, LLMScheduler, deadline_in
+)
+from esg_async import ASYNC_ENABLED, AsyncServer, json_response, read_json, sse_response
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+CORS_ORIGINS = ["http://localhost:3000", "http://127.0.0.1:3000"]
+
 app = Flask(__name__)
-CORS(app, origins=["http://localhost:3000", "http://127.0.0.1:3000"])
+CORS(app, origins=CORS_ORIGINS)
+install_metrics(app)  # GET /api/metrics
+# ESG_ASYNC=1: routes LLM servies par asyncio, le reste par Flask dans un pool de threads
+async_server = AsyncServer(app, cors_origins=CORS_ORIGINS)
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'pdf', 'xlsx', 'xls', 'csv'}
-OUTPUT_CSV = "all_extracted_kpis.csv"
-OUTPUT_EXCEL = "all_extracted_kpis.xlsx"
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024  # 200MB max
@@ -41,571 +55,204 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 OLLAMA_BASE_URL = "http://localhost:11434"
 OLLAMA_MODEL = "mistral"  # ou "llama3.2" selon votre préférence
 
-# Charger les modèles NLP au démarrage
-print("Chargement des modèles NLP...")
-try:
-    nlp = spacy.load("en_core_web_sm")
-    nlp.max_length = 3000000  # Augmenter la limite de texte
-except OSError:
-    print("Téléchargement du modèle spaCy...")
-    os.system("python -m spacy download en_core_web_sm")
-    nlp = spacy.load("en_core_web_sm")
-    nlp.max_length = 3000000
+# État d'Ollama sondé en arrière-plan (les endpoints lisent le cache)
+ollama_monitor = OllamaHealthMonitor(OLLAMA_BASE_URL).start()
+# Générations limitées à OLLAMA_MAX_IN_FLIGHT, le chat passe avant les analyses
+llm_scheduler = LLMScheduler()
+ollama_client = OllamaClient(OLLAMA_BASE_URL, OLLAMA_MODEL, monitor=ollama_monitor, scheduler=llm_scheduler)
+async_ollama = AsyncOllamaClient(ollama_client)   # même file et même coupe-circuit, sans thread par génération
+async_server.on_cleanup.append(async_ollama.close)
+llm_cache = LLMResponseCache()   # Réponses déjà générées pour des données inchangées
+OLLAMA_CHAT_OPTIONS = {
+    "temperature": 0.3,
+    "top_p": 0.9,
+    "top_k": 40,
+    "num_predict": 500,  # Augmenter pour des réponses plus détaillées
+    "num_ctx": 4096      # Fixe: changer num_ctx d'un appel à l'autre recharge le modèle dans Ollama
+}
+HISTORY_TOKEN_BUDGET = 600       # jetons d'historique rejoués quand le contexte Ollama est perdu
 
-kpi_model = SentenceTransformer('all-MiniLM-L6-v2')
+# Lignes de résultats encodées une fois, pour le contexte du chatbot
+results_index = ResultsIndex(kpi_model)
+company_matcher = CompanyMatcher()
+chat_sessions = SessionStore()   # conversation_id -> historique + contexte Ollama
+query_router = QueryRouter(company_matcher)   # questions factuelles résolues sans LLM
+# Profils d'entreprise et synthèses LLM mis à jour en tâche de fond après l'ingestion
+insight_store = CompanyInsightStore()
+insight_worker = InsightSummarizer(insight_store, ollama_client)
+# Benchmark map-reduce: analyses par entreprise en parallèle, cachées par empreinte des données
+benchmark_runner = BenchmarkRunner(ollama_client, async_client=async_ollama)
+# Extraction des PDF hors du processus API (ESG_EXTRACTION_WORKERS=0: dans le thread de la requête)
+extraction_workers = ExtractionWorkers()
 
 # Fonctions utilitaires
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def safe_read_csv(file_path):
-    """Safely read CSV with error handling for inconsistent columns"""
-    try:
-        return pd.read_csv(file_path)
-    except pd.errors.ParserError:
-        try:
-            return pd.read_csv(file_path, on_bad_lines='skip', engine='python')
-        except TypeError:
-            return pd.read_csv(file_path, error_bad_lines=False, engine='python')
-    except Exception as e:
-        logger.error(f"Error reading CSV: {e}")
-        return pd.DataFrame()
+# Extraction dans le pool de processus
+def extract_pdf_job(pdf_path, kpi_path, kpi_embeddings, all_kpis, kpi_df, min_confidence=0.3, job_stats=None):
+    """process_pdf dans un processus de travail (ou dans ce thread si le pool est désactivé)
 
-# Charger les résultats existants
-def load_existing_results():
-    if os.path.exists(OUTPUT_CSV):
-        try:
-            existing_df = safe_read_csv(OUTPUT_CSV)
-            logger.info(f"Chargement de {len(existing_df)} KPIs existants")
-            return existing_df
-        except Exception as e:
-            logger.error(f"Erreur lors du chargement des résultats existants: {e}")
-            return pd.DataFrame()
-    return pd.DataFrame()
+    Le processus de travail relit les KPIs depuis ``kpi_path`` (arguments de tâche en JSON).
+    """
+    if not extraction_workers.enabled:
+        return process_pdf(pdf_path, kpi_embeddings, all_kpis, kpi_df, min_confidence, job_stats=job_stats)
+    results, record = extraction_workers.run('extract_pdf', os.path.abspath(pdf_path), os.path.abspath(kpi_path),
+                                             min_confidence)
+    observe_worker_job(record)
+    if job_stats is not None:
+        job_stats.update(record)
+    return results
 
-# Sauvegarder les résultats
-def save_results(all_results):
-    if not all_results.empty:
-        try:
-            all_results.to_csv(OUTPUT_CSV, index=False, encoding='utf-8-sig')
-            all_results.to_excel(OUTPUT_EXCEL, index=False)
-            logger.info(f"Résultats sauvegardés: {len(all_results)} KPIs")
-            return True
-        except Exception as e:
-            logger.error(f"Erreur lors de la sauvegarde: {e}")
-            return False
-    return False
+# Fonctions pour le chatbot - CORRIGÉES
+def check_ollama_connection():
+    """Vérifier si Ollama est accessible (état en cache, sans appel réseau)"""
+    return ollama_monitor.available
 
-# Charger la liste des KPIs - CORRIGÉ
-def load_kpi_list(file_path):
-    file_extension = os.path.splitext(file_path)[1].lower()
-    
-    if file_extension == '.csv':
-        encodings = ['utf-8', 'latin-1', 'iso-8859-1', 'windows-1252']
-        for encoding in encodings:
-            try:
-                df = pd.read_csv(file_path, sep=';', encoding=encoding)
-                break
-            except UnicodeDecodeError:
-                continue
-        else:
-            raise ValueError("Impossible de décoder le fichier CSV")
-    
-    elif file_extension in ['.xlsx', '.xls']:
-        df = pd.read_excel(file_path)
-    
-    else:
-        raise ValueError("Format de fichier non supporté")
-    
-    print(f"Colonnes disponibles: {list(df.columns)}")
-    print(f"Shape du DataFrame: {df.shape}")
-    
-    # Vérifier si le fichier est le fichier de résultats existant ou un nouveau fichier KPI
-    if 'kpi_name' in df.columns and 'value' in df.columns:
-        # C'est un fichier de résultats existant, on le traite différemment
-        print("Fichier de résultats existant détecté")
-        kpi_list = df['kpi_name'].dropna().unique().tolist()
-        kpi_list_fr = []
-    else:
-        # C'est un nouveau fichier KPI
-        kpi_name_col = None
-        kpi_name_fr_col = None
-        
-        for col in df.columns:
-            col_lower = col.lower()
-            if 'kpi' in col_lower and 'name' in col_lower and 'fr' not in col_lower:
-                kpi_name_col = col
-            elif 'kpi' in col_lower and 'name' in col_lower and 'fr' in col_lower:
-                kpi_name_fr_col = col
-            elif 'name' in col_lower and kpi_name_col is None:
-                kpi_name_col = col
-            elif 'nom' in col_lower and kpi_name_fr_col is None:
-                kpi_name_fr_col = col
-        
-        # Fallback: utiliser les premières colonnes
-        if kpi_name_col is None and len(df.columns) > 0:
-            kpi_name_col = df.columns[0]
-        if kpi_name_fr_col is None and len(df.columns) > 1:
-            kpi_name_fr_col = df.columns[1]
-        
-        print(f"Colonne KPI anglais: {kpi_name_col}")
-        print(f"Colonne KPI français: {kpi_name_fr_col}")
-        
-        kpi_list = df[kpi_name_col].dropna().unique().tolist() if kpi_name_col else []
-        kpi_list_fr = df[kpi_name_fr_col].dropna().unique().tolist() if kpi_name_fr_col else []
-    
-    print(f"KPIs anglais chargés: {len(kpi_list)}")
-    print(f"KPIs français chargés: {len(kpi_list_fr)}")
-    
-    all_kpis = kpi_list + kpi_list_fr
-    if all_kpis:
-        kpi_embeddings = kpi_model.encode(all_kpis, convert_to_tensor=True)
-    else:
-        kpi_embeddings = None
-    
-    return df, kpi_list, kpi_list_fr, kpi_embeddings, all_kpis
+def get_available_models():
+    """Obtenir la liste des modèles disponibles (dernière sonde)"""
+    return ollama_monitor.models
 
-# Extraire le texte d'un PDF
-def extract_text_from_pdf(pdf_path):
-    text_content = ""
-    
-    try:
-        with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                text = page.extract_text()
-                if text:
-                    text_content += text + "\n"
-                
-                tables = page.extract_tables()
-                for table in tables:
-                    for row in table:
-                        text_content += " | ".join(str(cell) for cell in row if cell is not None) + "\n"
-                    text_content += "\n"
-    except Exception as e:
-        logger.error(f"Erreur avec pdfplumber: {e}")
-    
-    if len(text_content.strip()) < 100:
-        try:
-            doc = fitz.open(pdf_path)
-            for page in doc:
-                text_content += page.get_text("text") + "\n"
-        except Exception as e:
-            logger.error(f"Erreur avec PyMuPDF: {e}")
-    
-    return text_content
-
-# Nettoyer le texte
-def clean_text(text):
-    lines = text.split('\n')
-    cleaned_lines = []
-    
-    for line in lines:
-        if re.match(r'^\s*\d+\s*$', line):
-            continue
-        if re.match(r'^.*www\.\w+\.com.*$', line):
-            continue
-        if len(line.strip()) < 5:
-            continue
-        cleaned_lines.append(line)
-    
-    return '\n'.join(cleaned_lines)
-
-# Diviser le texte en chunks
-def split_text_into_chunks(text, max_chars=500000):
-    if len(text) <= max_chars:
-        return [text]
-    
-    chunks = []
-    paragraphs = text.split('\n\n')
-    
-    current_chunk = ""
-    for paragraph in paragraphs:
-        if len(current_chunk) + len(paragraph) < max_chars:
-            current_chunk += paragraph + "\n\n"
-        else:
-            if current_chunk:
-                chunks.append(current_chunk)
-            current_chunk = paragraph + "\n\n"
-    
-    if current_chunk:
-        chunks.append(current_chunk)
-    
-    if any(len(chunk) > max_chars for chunk in chunks):
-        refined_chunks = []
-        for chunk in chunks:
-            if len(chunk) <= max_chars:
-                refined_chunks.append(chunk)
-            else:
-                sentences = re.split(r'[.!?]+', chunk)
-                current_refined = ""
-                for sentence in sentences:
-                    if len(current_refined) + len(sentence) < max_chars:
-                        current_refined += sentence + ". "
-                    else:
-                        if current_refined:
-                            refined_chunks.append(current_refined)
-                        current_refined = sentence + ". "
-                if current_refined:
-                    refined_chunks.append(current_refined)
-        chunks = refined_chunks
-    
-    return chunks
-
-# Trouver les KPIs pertinents
-def find_relevant_kpis(text, kpi_embeddings, all_kpis, threshold=0.4):
-    if not all_kpis or kpi_embeddings is None:
-        return {}
-        
-    cleaned_text = clean_text(text)
-    
-    print(f"Texte nettoyé: {len(cleaned_text)} caractères")
-    
-    if len(cleaned_text) > 1000000:
-        chunks = split_text_into_chunks(cleaned_text)
-        print(f"Texte divisé en {len(chunks)} chunks")
-    else:
-        chunks = [cleaned_text]
-    
-    relevant_kpis = defaultdict(list)
-    
-    for chunk_idx, chunk in enumerate(chunks):
-        print(f"Traitement du chunk {chunk_idx + 1}/{len(chunks)}")
-        
-        try:
-            if len(chunk) > 10000:
-                sentences = re.split(r'[.!?]+', chunk)
-                sentences = [s.strip() for s in sentences if len(s.strip()) > 20]
-            else:
-                doc = nlp(chunk)
-                sentences = [sent.text for sent in doc.sents if len(sent.text) > 20]
-        except Exception as e:
-            print(f"Erreur segmentation: {e}")
-            sentences = re.split(r'[.!?]+', chunk)
-            sentences = [s.strip() for s in sentences if len(s.strip()) > 20]
-        
-        print(f"Chunk {chunk_idx + 1}: {len(sentences)} phrases à traiter")
-        
-        for i, sentence in enumerate(sentences):
-            if i % 50 == 0 and i > 0:
-                print(f"  Traité {i}/{len(sentences)} phrases...")
-                
-            try:
-                sentence_embedding = kpi_model.encode(sentence, convert_to_tensor=True)
-                cos_scores = util.pytorch_cos_sim(sentence_embedding, kpi_embeddings)[0]
-                top_results = np.argsort(-cos_scores.cpu().numpy())[:3]
-                
-                for idx in top_results:
-                    if cos_scores[idx] > threshold:
-                        kpi_name = all_kpis[idx]
-                        if not any(match['sentence'] == sentence for match in relevant_kpis[kpi_name]):
-                            relevant_kpis[kpi_name].append({
-                                'sentence': sentence,
-                                'score': float(cos_scores[idx])
-                            })
-            except Exception as e:
-                print(f"Erreur traitement phrase: {e}")
-                continue
-    
-    print(f"KPIs pertinents trouvés: {len(relevant_kpis)}")
-    for kpi_name, matches in relevant_kpis.items():
-        print(f"  - {kpi_name}: {len(matches)} correspondances")
-    
-    return relevant_kpis
+def build_system_prompt(context_data=""):
+    """Prompt système du chatbot avec le contexte de données (déjà borné par le retrieval)"""
+    return f"""Tu es un assistant expert en analyse ESG. 
+Contexte: {context_data}
+Réponds en français de façon précise et détaillée."""
 
-# Vérifier la cohérence des valeurs
-def is_value_coherent(kpi_name, value, unit):
-    kpi_lower = kpi_name.lower()
-    
-    high_value_kpis = ['emission', 'ghg', 'co2', 'nox', 'sox', 'energy', 'water', 'waste', 'consumption']
-    percentage_kpis = ['rate', 'ratio', 'percentage', 'coverage', 'compliance', 'approval']
-    
-    if any(term in kpi_lower for term in high_value_kpis) and unit == '%' and value < 1:
-        return False
-        
-    if any(term in kpi_lower for term in percentage_kpis) and unit != '%' and value > 1000:
-        return False
-        
-    return True
+def results_store_version():
+    """Version du magasin de résultats: change à chaque sauvegarde du CSV"""
+    return file_version(OUTPUT_CSV)
 
-# Extraire les valeurs numériques
-def extract_kpi_values(text, kpi_name):
-    patterns = [
-        r"(\d{1,3}(?:,\d{3})*(?:\.\d+)?)\s*(?:tons?|tonnes|t|%|kg|kWh|CO2|CO₂|ppm|ppb|µg/m³|mg/m³|employees|people|€|EUR|USD|\$|m³|MWh|GWh|TJ)",
-        r"(\d{1,3}(?:,\d{3})*(?:\.\d+)?\%)(?:\s|$)",
-        r"(?:is|was|are|were|:|\=)\s*(\d{1,3}(?:,\d{3})*(?:\.\d+)?)",
-        r"(?:value of|rate of|amount of|total|reduction of|approximately|about)\s*(\d{1,3}(?:,\d{3})*(?:\.\d+)?)",
-        r"\b(\d{1,3}(?:,\d{3})*(?:\.\d+)?)\s*(?:million|billion|thousand)?\s*(?:tons?|tonnes|percent|%)?"
-    ]
-    
-    values = []
-    seen_values = set()
-    
-    for pattern in patterns:
-        matches = re.finditer(pattern, text, re.IGNORECASE)
-        for match in matches:
-            value_str = match.group(1).replace(',', '')
-            try:
-                multiplier = 1
-                if re.search(r'million', match.group(0), re.IGNORECASE):
-                    multiplier = 1000000
-                elif re.search(r'billion', match.group(0), re.IGNORECASE):
-                    multiplier = 1000000000
-                elif re.search(r'thousand', match.group(0), re.IGNORECASE):
-                    multiplier = 1000
-                
-                numeric_value = float(value_str) * multiplier if '.' in value_str else int(value_str) * multiplier
-                unit = determine_unit(text, kpi_name)
-                
-                value_id = f"{numeric_value}_{unit}"
-                
-                if (value_id not in seen_values and 
-                    is_value_coherent(kpi_name, numeric_value, unit)):
-                    values.append({
-                        'value': numeric_value,
-                        'unit': unit
-                    })
-                    seen_values.add(value_id)
-            except ValueError:
-                continue
-    
-    return values
-
-# Déterminer l'unité
-def determine_unit(text, kpi_name):
-    unit_patterns = {
-        r'tons?|tonnes|tCO2e|t CO2e': 'tons',
-        r'kg|kilograms': 'kg',
-        r'%|percent|percentage': '%',
-        r'kWh|kilowatt-hours': 'kWh',
-        r'MWh|megawatt-hours': 'MWh',
-        r'GWh|gigawatt-hours': 'GWh',
-        r'CO2|CO₂|carbon dioxide': 'tCO2e',
-        r'ppm|parts per million': 'ppm',
-        r'employees|workers|people': 'people',
-        r'€|EUR|USD|\$|dollars': 'currency',
-        r'm³|cubic meters': 'm³'
-    }
-    
-    for pattern, u in unit_patterns.items():
-        if re.search(pattern, text, re.IGNORECASE):
-            return u
+def fit_prompt(question, context_data="", history="", used_tokens=0, cache_info=None):
+    """(contexte, historique) réduits pour que le prompt et la réponse tiennent dans num_ctx
     
-    kpi_lower = kpi_name.lower()
-    if any(term in kpi_lower for term in ['rate', 'ratio', 'percentage', 'coverage', 'reduction']):
-        return '%'
-    elif any(term in kpi_lower for term in ['emission', 'ghg', 'co2', 'carbon']):
-        return 'tCO2e'
-    elif any(term in kpi_lower for term in ['energy', 'consumption', 'electricity']):
-        return 'kWh'
-    elif any(term in kpi_lower for term in ['water', 'usage']):
-        return 'm³'
-    
-    return 'unknown'
+    La question et l'en-tête système ne sont jamais réduits; les données passent
+    avant l'historique. ``used_tokens``: jetons déjà occupés (contexte de session).
+    """
+    texts, report = assemble([
+        Section('system', build_system_prompt(""), priority=0),
+        Section('question', question, priority=0),
+        Section('data', context_data, priority=1),
+        Section('history', history, priority=2, max_tokens=HISTORY_TOKEN_BUDGET, keep='tail'),
+    ], OLLAMA_CHAT_OPTIONS["num_ctx"] - used_tokens, OLLAMA_CHAT_OPTIONS["num_predict"])
+    if report["truncated"]:
+        logger.info(f"Prompt réduit à {report['prompt_tokens']}/{report['budget']} jetons "
+                    f"(sections: {', '.join(report['truncated'])})")
+    if cache_info is not None:
+        cache_info["prompt_tokens_est"] = report["prompt_tokens"]
+    return texts['data'], texts['history']
 
-# Filtrer les résultats
-def filter_results(results, min_confidence=0.3):
-    filtered = []
-    seen = set()
-    
-    results_sorted = sorted(results, key=lambda x: x['confidence'], reverse=True)
-    
-    for result in results_sorted:
-        identifier = f"{result['kpi_name']}_{result['value']}_{result['unit']}_{result['source_file']}"
-        
-        if (identifier not in seen and 
-            result['confidence'] >= min_confidence):
-            filtered.append(result)
-            seen.add(identifier)
-    
-    kpi_groups = defaultdict(list)
-    for result in filtered:
-        kpi_groups[result['kpi_name']].append(result)
-    
-    final_results = []
-    for kpi_name, occurrences in kpi_groups.items():
-        best_occurrence = max(occurrences, key=lambda x: x['confidence'])
-        final_results.append(best_occurrence)
-    
-    return final_results
+def prepare_llm_query(prompt, context_data="", cache_info=None):
+    """(réponse en cache ou None, génération à faire {"prompt", "system", "key", "data_version"})"""
+    context_data, _ = fit_prompt(prompt, context_data, cache_info=cache_info)
+    system_prompt = build_system_prompt(context_data)
+    key = cache_key(OLLAMA_MODEL, OLLAMA_CHAT_OPTIONS, system_prompt, context_data, prompt)
+    data_version = results_store_version()
+    cached = llm_cache.get(key, data_version)
+    if cache_info is not None:
+        cache_info.update({"hit": cached is not None, "key": key[:16]})
+    call = {"prompt": prompt, "system": system_prompt, "key": key, "data_version": data_version}
+    return (cached[0] if cached is not None else None), call
 
-# Traiter un PDF - CORRIGÉ
-def process_pdf(pdf_path, kpi_embeddings, all_kpis, kpi_df, min_confidence=0.3):
-    logger.info(f"Traitement de {os.path.basename(pdf_path)}...")
-    
-    # Extraire le texte
-    text = extract_text_from_pdf(pdf_path)
-    
-    print(f"=== DEBUG EXTRACTION ===")
-    print(f"Fichier: {os.path.basename(pdf_path)}")
-    print(f"Texte extrait: {len(text)} caractères")
-    
-    if not text or len(text.strip()) < 100:
-        logger.warning(f"Peu de texte extrait de {pdf_path}")
-        print("❌ ERREUR: Texte insuffisant")
-        return []
-    
-    # Sauvegarder le texte extrait pour debug
-    debug_dir = "debug_texts"
-    os.makedirs(debug_dir, exist_ok=True)
-    debug_file = os.path.join(debug_dir, f"debug_{os.path.basename(pdf_path)}.txt")
-    with open(debug_file, 'w', encoding='utf-8') as f:
-        f.write(text[:5000] + "\n[...]")
-    
-    print(f"Texte debug sauvegardé: {debug_file}")
-    
-    # Vérifier si on a des KPIs à chercher
-    if not all_kpis or kpi_embeddings is None:
-        print("❌ AUCUN KPI DISPONIBLE - Vérifiez le fichier KPI")
-        return []
-    
-    # Trouver les KPIs pertinents
-    relevant_kpis = find_relevant_kpis(text, kpi_embeddings, all_kpis, threshold=0.4)
-    
-    results = []
-    
-    # Pour chaque KPI pertinent, extraire les valeurs - CORRECTION ICI
-    for kpi_name, matches in relevant_kpis.items():
-        print(f"Traitement KPI: {kpi_name} ({len(matches)} correspondances)")
-        
-        matches_sorted = sorted(matches, key=lambda x: x['score'], reverse=True)
-        
-        for match in matches_sorted[:3]:
-            sentence = match['sentence']
-            values = extract_kpi_values(sentence, kpi_name)
-            
-            print(f"  Phrase: '{sentence[:100]}...' -> {len(values)} valeurs")
-            
-            for val in values:
-                # CORRECTION : Gestion sécurisée des colonnes du DataFrame KPI
-                topic = "Unknown"
-                topic_fr = "Inconnu"
-                score = "Unknown"
-                
-                try:
-                    # Vérifier si kpi_df est un DataFrame valide
-                    if hasattr(kpi_df, 'columns') and len(kpi_df.columns) > 0:
-                        # Chercher le KPI dans toutes les colonnes de nom
-                        kpi_matches = []
-                        for col_idx in range(min(2, len(kpi_df.columns))):
-                            if kpi_name in kpi_df.iloc[:, col_idx].values:
-                                kpi_matches = kpi_df[kpi_df.iloc[:, col_idx] == kpi_name]
-                                break
-                        
-                        if not kpi_matches.empty:
-                            row = kpi_matches.iloc[0]
-                            # Récupérer les colonnes de manière sécurisée
-                            if len(kpi_df.columns) > 2:
-                                topic = str(row.iloc[2]) if pd.notna(row.iloc[2]) else "Unknown"
-                            if len(kpi_df.columns) > 3:
-                                topic_fr = str(row.iloc[3]) if pd.notna(row.iloc[3]) else "Inconnu"
-                            if len(kpi_df.columns) > 4:
-                                score_val = row.iloc[4]
-                                score = str(score_val) if pd.notna(score_val) else "Unknown"
-                except Exception as e:
-                    print(f"⚠️ Erreur lors de la récupération des métadonnées KPI: {e}")
-                    # Utiliser les valeurs par défaut en cas d'erreur
-                
-                result_item = {
-                    'kpi_name': kpi_name,
-                    'value': val['value'],
-                    'unit': val['unit'],
-                    'source_file': os.path.basename(pdf_path),
-                    'topic': topic,
-                    'topic_fr': topic_fr,
-                    'score': score,
-                    'confidence': match['score'],
-                    'extraction_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                }
-                
-                results.append(result_item)
-                print(f"  ✅ KPI extrait: {kpi_name} = {val['value']} {val['unit']} (confiance: {match['score']:.3f})")
-    
-    # Filtrer les résultats
-    filtered_results = filter_results(results, min_confidence)
-    logger.info(f"{len(filtered_results)} KPIs valides après filtrage")
+def llm_answer(call, result, cache_info=None):
+    """Texte d'une génération terminée, mis en cache"""
+    if cache_info is not None:
+        cache_info["queue_wait_s"] = result.get('queue_wait_s')
+    if not result.get('response'):
+        return 'Désolé, je n\'ai pas pu générer de réponse.'
+    llm_cache.put(call["key"], result['response'], call["data_version"], generation_stats(result))
+    return result['response']
+
+def query_ollama(prompt, context_data="", cache_info=None, priority=PRIORITY_INTERACTIVE, endpoint='chatbot'):
+    """Interroger le modèle Ollama avec des paramètres optimisés
     
-    if filtered_results:
-        print(f"🎉 EXTRACTION RÉUSSIE: {len(filtered_results)} KPIs uniques extraits")
-    else:
-        print("❌ AUCUN KPI EXTRACTÉ - Vérifiez le fichier KPI et le contenu du PDF")
+    Les réponses sont servies depuis le cache tant que les résultats ne changent
+    pas; ``cache_info`` (dict optionnel) reçoit {"hit", "key", "prompt_tokens_est"}
+    et, après une génération, ``queue_wait_s``. ``priority`` fixe le rang dans
+    la file LLM.
+    """
+    cached, call = prepare_llm_query(prompt, context_data, cache_info)
+    if cached is not None:
+        return cached
     
-    return filtered_results
-
-# Fonctions pour le chatbot - CORRIGÉES
-def check_ollama_connection():
-    """Vérifier si Ollama est accessible"""
-    try:
-        response = requests.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=5)
-        return response.status_code == 200
-    except requests.exceptions.RequestException as e:
-        logger.warning(f"Ollama non accessible: {e}")
-        return False
-
-def get_available_models():
-    """Obtenir la liste des modèles disponibles"""
     try:
-        response = requests.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=10)
-        if response.status_code == 200:
-            return response.json().get('models', [])
-        return []
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Erreur lors de la récupération des modèles: {e}")
-        return []
+        # Réponse lue en flux sur une connexion réutilisée; échec immédiat si Ollama est hors ligne
+        result = ollama_client.generate(prompt, system=call["system"], options=OLLAMA_CHAT_OPTIONS,
+                                        endpoint=endpoint, priority=priority)
+        return llm_answer(call, result, cache_info)
+    
+    except Exception as e:
+        return ollama_error_message(e)
 
-def query_ollama(prompt, context_data=""):
-    """Interroger le modèle Ollama avec des paramètres optimisés"""
+async def query_ollama_async(prompt, context_data="", cache_info=None, priority=PRIORITY_INTERACTIVE,
+                             endpoint='chatbot'):
+    """``query_ollama`` pour les routes asynchrones: aucun thread occupé pendant la génération"""
+    cached, call = await async_server.run_sync(prepare_llm_query, prompt, context_data, cache_info)
+    if cached is not None:
+        return cached
+    
     try:
-        # Vérifier d'abord si Ollama est accessible
-        if not check_ollama_connection():
-            return "🔌 Ollama n'est pas accessible. Veuillez démarrer Ollama avec 'ollama serve'."
+        result = await async_ollama.generate(prompt, system=call["system"], options=OLLAMA_CHAT_OPTIONS,
+                                             endpoint=endpoint, priority=priority)
+        return await async_server.run_sync(llm_answer, call, result, cache_info)
+    
+    except Exception as e:
+        return ollama_error_message(e)
 
-        # Préparer un contexte plus court et optimisé
-        system_prompt = f"""Tu es un assistant expert en analyse ESG. 
-Contexte: {context_data[:2000]}  # Augmenter la limite du contexte
-Réponds en français de façon précise et détaillée."""
-        
-        payload = {
-            "model": OLLAMA_MODEL,
-            "prompt": prompt,
-            "system": system_prompt,
-            "stream": False,
-            "options": {
-                "temperature": 0.3,
-                "top_p": 0.9,
-                "top_k": 40,
-                "num_predict": 500,  # Augmenter pour des réponses plus détaillées
-                "num_ctx": 4096      # Contexte augmenté
-            }
-        }
-        
-        # Timeout plus long pour permettre des réponses détaillées
-        response = requests.post(
-            f"{OLLAMA_BASE_URL}/api/generate",
-            json=payload,
-            timeout=120  # 120 secondes pour des réponses détaillées
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result.get('response', 'Désolé, je n\'ai pas pu générer de réponse.')
-        else:
-            logger.error(f"Erreur Ollama: {response.status_code}")
-            return f"Erreur de communication avec Ollama. Code: {response.status_code}"
-            
-    except requests.exceptions.Timeout:
-        logger.error("Timeout Ollama après 120 secondes")
+def ollama_error_message(error):
+    """Message affiché à l'utilisateur pour un échec de génération"""
+    if isinstance(error, OllamaUnavailable):
+        return "🔌 Ollama n'est pas accessible. Veuillez démarrer Ollama avec 'ollama serve'."
+    if isinstance(error, LLMQueueFull):
+        logger.warning("File LLM pleine, requête refusée")
+        return "🚦 Le modèle est saturé. Réessayez dans quelques instants."
+    if isinstance(error, LLMDeadlineExceeded):
+        logger.warning(f"Requête LLM abandonnée: {error}")
+        return "⏰ Le modèle est trop sollicité pour répondre à temps. Réessayez dans quelques instants."
+    if isinstance(error, OllamaHTTPError):
+        logger.error(f"Erreur Ollama: {error}")
+        return f"Erreur de communication avec Ollama. Code: {error.status_code}"
+    if isinstance(error, requests.exceptions.Timeout):
+        logger.error(f"Timeout Ollama: aucun jeton reçu pendant {ollama_client.read_timeout:.0f} secondes")
         return "⏰ Le modèle met trop de temps à répondre. Essayez une question plus courte."
-    
-    except requests.exceptions.ConnectionError:
+    if isinstance(error, requests.exceptions.ConnectionError):
         logger.error("Connexion Ollama refusée")
         return "🔌 Impossible de se connecter à Ollama. Vérifiez qu'il est démarré sur le port 11434."
+    logger.error(f"Erreur inattendue: {error}")
+    return f"❌ Erreur: {str(error)}"
+
+def refresh_results_index(all_results):
+    """Encoder les nouvelles lignes à l'ingestion plutôt qu'à la prochaine question
     
+    Les profils des entreprises dont les lignes ont changé sont aussi replanifiés.
+    """
+    try:
+        results_index.refresh(all_results, results_store_version())
     except Exception as e:
-        logger.error(f"Erreur inattendue: {e}")
-        return f"❌ Erreur: {str(e)}"
+        logger.warning(f"Index des résultats non rafraîchi: {e}")
+    insight_worker.schedule(all_results)
 
-def prepare_chatbot_context():
-    """Préparer un contexte détaillé et structuré pour le chatbot"""
+def company_insight(company, company_df, all_df=None):
+    """Profil précalculé (et synthèse si prête) d'une entreprise"""
+    return insight_worker.ensure(company, company_df, all_df)
+
+def get_results_index():
+    """Index des résultats, reconstruit seulement si le CSV a changé"""
+    return results_index.ensure_fresh(load_existing_results, results_store_version())
+
+def prepare_chatbot_context(question=None):
+    """Préparer un contexte détaillé et structuré pour le chatbot
+    
+    Avec une question, seules les lignes les plus pertinentes sont retenues
+    (dans la limite de CONTEXT_TOKEN_BUDGET jetons).
+    """
+    if question:
+        try:
+            return get_results_index().build_context(question, CONTEXT_TOKEN_BUDGET)
+        except Exception as e:
+            logger.error(f"Erreur retrieval contexte: {e}")
+            return "Données ESG disponibles (erreur de détail)"
+    
     try:
         df = load_existing_results()
         
@@ -643,10 +290,9 @@ def prepare_chatbot_context():
                 for topic, count in topics.head(5).items():
                     context_parts.append(f"  - {topic}: {count} KPIs")
             
-            # Liste des KPIs principaux
+            # Liste des KPIs principaux (valeurs compactées, confiance entre parenthèses)
             top_kpis = company_kpis.nlargest(10, 'confidence')[['kpi_name', 'value', 'unit', 'confidence']]
-            for _, kpi in top_kpis.iterrows():
-                context_parts.append(f"  • {kpi['kpi_name']}: {kpi['value']} {kpi['unit']} (confiance: {kpi['confidence']:.3f})")
+            context_parts.append(compact_table(top_kpis, prefix="  • "))
         
         # Statistiques globales
         context_parts.append("\n📊 STATISTIQUES GLOBALES:")
@@ -672,8 +318,15 @@ def prepare_chatbot_context():
         logger.error(f"Erreur préparation contexte: {e}")
         return "Données ESG disponibles (erreur de détail)"
 
-def get_company_specific_context(company_name):
-    """Préparer un contexte spécifique pour une entreprise"""
+def get_company_specific_context(company_name, question=None):
+    """Préparer un contexte spécifique pour une entreprise (lignes pertinentes si question)"""
+    if question:
+        try:
+            return get_results_index().build_context(question, CONTEXT_TOKEN_BUDGET, company=company_name)
+        except Exception as e:
+            logger.error(f"Erreur retrieval contexte entreprise: {e}")
+            return f"Données disponibles pour {company_name}"
+    
     try:
         df = load_existing_results()
         
@@ -697,10 +350,9 @@ def get_company_specific_context(company_name):
             for topic, count in topics.items():
                 context_parts.append(f"• {topic}: {count} KPIs")
         
-        # Liste complète des KPIs avec valeurs
+        # Liste complète des KPIs avec valeurs (confiance entre parenthèses)
         context_parts.append("\n📊 LISTE DES KPIs EXTRACTÉS:")
-        for _, row in company_df.iterrows():
-            context_parts.append(f"• {row['kpi_name']}: {row['value']} {row['unit']} (confiance: {row['confidence']:.3f})")
+        context_parts.append(compact_table(company_df.sort_values('confidence', ascending=False)))
         
         return "\n".join(context_parts)
         
@@ -716,35 +368,26 @@ def test_ollama():
     try:
         test_prompt = "Réponds uniquement par 'OK' si tu fonctionnes correctement."
         
-        # Test simple sans contexte
-        payload = {
-            "model": OLLAMA_MODEL,
-            "prompt": test_prompt,
-            "stream": False,
-            "options": {
-                "num_predict": 10  # Très courte réponse
-            }
-        }
+        # Le test contourne le coupe-circuit: sonde immédiate si Ollama est marqué hors ligne
+        if not ollama_monitor.available:
+            ollama_monitor.probe()
         
-        response = requests.post(
-            f"{OLLAMA_BASE_URL}/api/generate",
-            json=payload,
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return jsonify({
-                "status": "success",
-                "response": result.get('response', 'No response'),
-                "model": OLLAMA_MODEL
-            })
-        else:
-            return jsonify({
-                "status": "error",
-                "message": f"HTTP {response.status_code}",
-                "details": response.text[:200]
-            }), 500
+        # Test simple sans contexte, réponse très courte
+        result = ollama_client.generate(test_prompt, options={"num_predict": 10}, endpoint='test', timeout=10,
+                                        deadline=deadline_in(30))
+        return jsonify({
+            "status": "success",
+            "response": result.get('response') or 'No response',
+            "model": OLLAMA_MODEL,
+            "generation": generation_stats(result)
+        })
+    
+    except OllamaHTTPError as e:
+        return jsonify({
+            "status": "error",
+            "message": f"HTTP {e.status_code}",
+            "details": e.details
+        }), 500
             
     except requests.exceptions.Timeout:
         return jsonify({
@@ -771,9 +414,21 @@ def health_check():
         "status": "healthy", 
         "message": "ESG KPI Extractor API is running",
         "ollama": ollama_status,
+        "ollama_health": ollama_monitor.status(),
+        "llm_cache": llm_cache.stats(),
+        "llm_queue": llm_scheduler.status(),
+        "chat_sessions": chat_sessions.stats(),
+        "company_insights": insight_store.stats(),
+        "token_counter": token_counter.stats(),
+        "extraction_workers": extraction_workers.stats(),
         "timestamp": datetime.now().isoformat()
     })
 
+@app.route('/api/chatbot/queue', methods=['GET'])
+def get_llm_queue():
+    """État de la file des générations LLM (positions, attente, échéances)"""
+    return jsonify(llm_scheduler.status())
+
 @app.route('/api/chatbot/models', methods=['GET'])
 def get_chatbot_models():
     """Obtenir la liste des modèles disponibles"""
@@ -787,66 +442,387 @@ def get_chatbot_models():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def find_mentioned_companies(question):
+    """Entreprises citées dans la question (automate reconstruit si la liste change)"""
+    index = get_results_index()
+    company_matcher.update(index.companies)
+    return company_matcher.find(question)
+
+def context_for_companies(companies, question):
+    """Contexte d'une ou plusieurs entreprises citées, sinon contexte général"""
+    if len(companies) == 1:
+        return get_company_specific_context(companies[0], question)
+    if companies:
+        # Question multi-entreprises: budget partagé entre les entreprises citées
+        budget = max(CONTEXT_TOKEN_BUDGET // len(companies), 150)
+        index = get_results_index()
+        return "\n\n".join(index.build_context(question, budget, company=company) for company in companies)
+    
+    # Contexte général: lignes les plus proches de la question
+    return prepare_chatbot_context(question)
+
+def safe_mentioned_companies(question):
+    try:
+        return find_mentioned_companies(question)
+    except Exception as e:
+        logger.error(f"Erreur détection entreprises: {e}")
+        return []
+
+def select_chat_context(question):
+    """Contexte spécifique si la question cite une ou plusieurs entreprises, sinon général"""
+    return context_for_companies(safe_mentioned_companies(question), question)
+
+def prepare_conversation_turn(session, question, cache_info=None):
+    """(tour déjà résolu par le cache ou None, génération à faire)
+    
+    Si Ollama a renvoyé un ``context`` au tour précédent, seule la question (et
+    les données des entreprises nouvellement citées) est envoyée par-dessus;
+    sinon le prompt système est construit et l'historique récent rejoué. Le
+    premier tour passe par le cache de réponses comme /api/chatbot/chat.
+    """
+    companies = safe_mentioned_companies(question)
+    new_companies = [company for company in companies if company not in session.companies]
+    extra = {}
+    
+    if session.context:
+        system_prompt = None
+        context_data = context_for_companies(new_companies, question) if new_companies else ""
+        context_data, _ = fit_prompt(question, context_data, used_tokens=len(session.context))
+        prompt = f"Données complémentaires:\n{context_data}\n\nQuestion: {question}" if context_data else question
+        extra["context"] = session.context
+    else:
+        context_data, history = fit_prompt(question, context_for_companies(companies, question),
+                                           session.transcript() if session.history else "")
+        system_prompt = build_system_prompt(context_data)
+        prompt = question
+        if history:
+            prompt = f"Conversation précédente:\n{history}\n\nQuestion: {question}"
+    context_type = "company_specific" if "DONNÉES DÉTAILLÉES" in context_data else "general"
+    call = {"prompt": prompt, "system": system_prompt, "extra": extra, "context_type": context_type,
+            "companies": companies, "key": None, "data_version": None}
+    
+    if not session.history:
+        call["key"] = cache_key(OLLAMA_MODEL, OLLAMA_CHAT_OPTIONS, system_prompt, context_data, prompt)
+        call["data_version"] = results_store_version()
+        cached = llm_cache.get(call["key"], call["data_version"])
+        if cache_info is not None:
+            cache_info.update({"hit": cached is not None, "key": call["key"][:16]})
+        if cached is not None:
+            # Pas de contexte Ollama: le tour suivant rejouera cet échange
+            return (cached[0], context_type, {**cached[1], "cache_hit": True}), call
+    return None, call
+
+def finish_conversation_turn(session, call, result):
+    """(réponse, type de contexte, statistiques du tour) d'une génération terminée"""
+    response = result.get('response')
+    if not response:
+        return "Désolé, je n'ai pas pu générer de réponse.", call["context_type"], {"error": True}
+    if result.get('context'):
+        session.context = result['context']
+        session.companies = list(dict.fromkeys(session.companies + call["companies"]))
+    # Au-delà de la fenêtre du modèle, Ollama tronquerait le début: repartir d'un résumé
+    if session.context and len(session.context) > OLLAMA_CHAT_OPTIONS["num_ctx"] - OLLAMA_CHAT_OPTIONS["num_predict"]:
+        session.reset_context()
+    
+    stats = generation_stats(result)
+    if call["key"] is not None:
+        llm_cache.put(call["key"], response, call["data_version"], stats)
+    stats["follow_up"] = "context" in call["extra"]
+    stats["context_tokens"] = len(session.context) if session.context else 0
+    return response, call["context_type"], stats
+
+def query_ollama_conversation(session, question, cache_info=None):
+    """Tour de conversation: (réponse, type de contexte, statistiques du tour)"""
+    done, call = prepare_conversation_turn(session, question, cache_info)
+    if done is not None:
+        return done
+    
+    try:
+        result = ollama_client.generate(call["prompt"], system=call["system"], options=OLLAMA_CHAT_OPTIONS,
+                                        endpoint='chatbot_session', **call["extra"])
+    except Exception as e:
+        return ollama_error_message(e), call["context_type"], {"error": True}
+    return finish_conversation_turn(session, call, result)
+
+async def query_ollama_conversation_async(session, question, cache_info=None):
+    """``query_ollama_conversation`` pour les routes asynchrones"""
+    done, call = await async_server.run_sync(prepare_conversation_turn, session, question, cache_info)
+    if done is not None:
+        return done
+    
+    try:
+        result = await async_ollama.generate(call["prompt"], system=call["system"], options=OLLAMA_CHAT_OPTIONS,
+                                             endpoint='chatbot_session', **call["extra"])
+    except Exception as e:
+        return ollama_error_message(e), call["context_type"], {"error": True}
+    return await async_server.run_sync(finish_conversation_turn, session, call, result)
+
+OLLAMA_UNAVAILABLE = {
+    "error": "Ollama n'est pas accessible",
+    "message": "Veuillez démarrer Ollama avec 'ollama serve' et vérifier le port 11434"
+}
+
+def chat_payload(question, response, processing_time, context_data, cache_info, route_ms):
+    """Réponse de /api/chatbot/chat pour une question générée par le LLM"""
+    logger.info(f"Réponse {'servie par le cache' if cache_info.get('hit') else 'générée'} "
+                f"en {processing_time:.2f} secondes")
+    return {
+        "question": question,
+        "response": response,
+        "processing_time": processing_time,
+        "timestamp": datetime.now().isoformat(),
+        "context_type": "company_specific" if "DONNÉES DÉTAILLÉES" in context_data else "general",
+        "cache": cache_info,
+        "route": "llm",
+        "route_time_ms": route_ms
+    }
+
+def log_chat_question(question, context_data):
+    logger.info(f"Question reçue: {question}")
+    logger.info(f"Type de contexte: {'Spécifique' if 'DONNÉES DÉTAILLÉES' in context_data else 'Général'}")
+
 @app.route('/api/chatbot/chat', methods=['POST'])
 def chatbot_chat():
     """Endpoint pour discuter avec le chatbot"""
     try:
-        data = request.get_json()
+        data = request.get_json() or {}
         question = data.get('question', '')
         
         if not question:
             return jsonify({"error": "La question est requise"}), 400
         
+        conversation_id = data.get('conversation_id')
+        
+        # Questions factuelles: réponse calculée sur les résultats, même sans Ollama
+        routed, route_ms = route_question(question)
+        if routed is not None:
+            if conversation_id:
+                record_fast_path_turn(conversation_id, question, routed)
+            return jsonify(fast_path_payload(question, routed, route_ms, conversation_id=conversation_id))
+        
         # Vérifier si Ollama est accessible
         if not check_ollama_connection():
-            return jsonify({
-                "error": "Ollama n'est pas accessible",
-                "message": "Veuillez démarrer Ollama avec 'ollama serve' et vérifier le port 11434"
-            }), 503
-        
-        # Détecter le type de question pour adapter le contexte
-        question_lower = question.lower()
-        
-        # Vérifier si la question concerne une entreprise spécifique
-        company_match = re.search(r'(\w+[\w\s]*?)\.pdf', question_lower)
-        if company_match:
-            company_name = company_match.group(1)
-            context_data = get_company_specific_context(company_name + ".pdf")
-        else:
-            # Vérifier les mentions d'entreprises dans la question
-            df = load_existing_results()
-            companies = df['source_file'].unique()
-            for company in companies:
-                company_base = company.replace('.pdf', '').lower()
-                if company_base in question_lower:
-                    context_data = get_company_specific_context(company)
-                    break
-            else:
-                # Contexte général
-                context_data = prepare_chatbot_context()
-        
-        logger.info(f"Question reçue: {question}")
-        logger.info(f"Type de contexte: {'Spécifique' if 'DONNÉES DÉTAILLÉES' in context_data else 'Général'}")
+            return jsonify(OLLAMA_UNAVAILABLE), 503
         
-        # Générer la réponse avec timeout
-        start_time = time.time()
-        response = query_ollama(question, context_data)
-        processing_time = time.time() - start_time
+        if conversation_id:
+            return chatbot_conversation_turn(conversation_id, question, route_ms)
         
-        logger.info(f"Réponse générée en {processing_time:.2f} secondes")
+        context_data = select_chat_context(question)
+        log_chat_question(question, context_data)
         
-        return jsonify({
-            "question": question,
-            "response": response,
-            "processing_time": processing_time,
-            "timestamp": datetime.now().isoformat(),
-            "context_type": "company_specific" if "DONNÉES DÉTAILLÉES" in context_data else "general"
-        })
+        # Générer la réponse avec timeout
+        start_time = time.time()
+        cache_info = {}
+        response = query_ollama(question, context_data, cache_info=cache_info)
+        return jsonify(chat_payload(question, response, time.time() - start_time, context_data, cache_info,
+                                    route_ms))
         
     except Exception as e:
         logger.error(f"Erreur chatbot: {e}")
         return jsonify({"error": str(e)}), 500
 
+def route_question(question):
+    """(réponse directe ou None, durée du routage en ms)"""
+    start = time.perf_counter()
+    try:
+        routed = query_router.route(question, version=results_store_version(), load_df=load_existing_results)
+    except Exception as e:
+        logger.error(f"Erreur routage question: {e}")
+        routed = None
+    return routed, round((time.perf_counter() - start) * 1000, 2)
+
+def record_fast_path_turn(conversation_id, question, routed):
+    session = chat_sessions.get_or_create(conversation_id)
+    with session.lock:
+        session.add_turn(question, routed["answer"], {"route": "fast_path"})
+
+def fast_path_payload(question, routed, route_ms, conversation_id=None):
+    """Réponse d'une question résolue sans LLM"""
+    logger.info(f"Réponse directe ({routed['intent']}) en {route_ms} ms")
+    payload = {
+        "question": question,
+        "response": routed["answer"],
+        "processing_time": route_ms / 1000,
+        "timestamp": datetime.now().isoformat(),
+        "context_type": "structured",
+        "route": "fast_path",
+        "intent": routed["intent"],
+        "route_time_ms": route_ms,
+        "data": {"kpi": routed["kpi"], "companies": routed["companies"], "rows": routed["rows"]}
+    }
+    if conversation_id:
+        payload["conversation_id"] = str(conversation_id)
+    return payload
+
+def conversation_payload(session, question, response, context_type, timings, processing_time, cache_info,
+                         route_ms):
+    """Réponse d'un tour de conversation"""
+    logger.info(f"Conversation {session.id}, tour {session.turns}: "
+                f"{'suite du contexte' if timings.get('follow_up') else 'contexte complet'}, "
+                f"prefill {timings.get('prompt_eval_s')}s, génération {timings.get('eval_s')}s")
+    return {
+        "question": question,
+        "response": response,
+        "processing_time": processing_time,
+        "timestamp": datetime.now().isoformat(),
+        "context_type": context_type,
+        "cache": cache_info,
+        "conversation_id": session.id,
+        "turn": session.turns,
+        "timings": timings,
+        "route": "llm",
+        "route_time_ms": route_ms
+    }
+
+def chatbot_conversation_turn(conversation_id, question, route_ms=None):
+    """Tour d'une conversation suivie côté serveur (contexte Ollama réutilisé)"""
+    session = chat_sessions.get_or_create(conversation_id)
+    with session.lock:
+        start_time = time.time()
+        cache_info = {}
+        response, context_type, timings = query_ollama_conversation(session, question, cache_info)
+        processing_time = time.time() - start_time
+        if not timings.get("error"):
+            session.add_turn(question, response, timings)
+    
+    return jsonify(conversation_payload(session, question, response, context_type, timings, processing_time,
+                                        cache_info, route_ms))
+
+@app.route('/api/chatbot/conversations', methods=['GET'])
+def list_conversations():
+    """Sessions de conversation actives côté serveur"""
+    return jsonify({"conversations": chat_sessions.list(), **chat_sessions.stats()})
+
+@app.route('/api/chatbot/conversations/<conversation_id>', methods=['DELETE'])
+def delete_conversation(conversation_id):
+    """Oublier une conversation (historique et contexte Ollama)"""
+    if not chat_sessions.delete(conversation_id):
+        return jsonify({"error": "Conversation introuvable"}), 404
+    return jsonify({"deleted": conversation_id})
+
+class StreamRelay:
+    """Objets NDJSON d'Ollama -> événements SSE; la réponse complète est mise en cache à la fin"""
+    
+    def __init__(self, key, data_version, start_time, done_extra=None):
+        self.key = key
+        self.data_version = data_version
+        self.start_time = start_time
+        self.done_extra = done_extra or {}
+        self.parts = []
+    
+    def events(self, chunk):
+        if 'queue_position' in chunk:
+            return [sse_event({"position": chunk['queue_position']}, event='queue')]
+        events = []
+        if chunk.get('response'):
+            self.parts.append(chunk['response'])
+            events.append(sse_event({"token": chunk['response']}))
+        if chunk.get('done'):
+            stats = generation_stats(chunk)
+            if self.parts:
+                llm_cache.put(self.key, "".join(self.parts), self.data_version, stats)
+            stats.update(self.done_extra)
+            stats['processing_time'] = time.time() - self.start_time
+            stats['cache_hit'] = False
+            logger.info(f"Réponse en flux: premier jeton en {stats['ttft_s']}s, "
+                        f"totale en {stats['processing_time']:.2f}s")
+            events.append(sse_event(stats, event='done'))
+        return events
+
+def cached_stream_events(cached, start_time, extra=None):
+    """Réponse en cache rejouée comme un flux (un seul jeton puis ``done``)"""
+    return [sse_event({"token": cached[0]}),
+            sse_event({**cached[1], **(extra or {}), "processing_time": time.time() - start_time,
+                       "cache_hit": True}, event='done')]
+
+def chat_stream_error(error):
+    """Événement ``error`` d'un chat en flux"""
+    if isinstance(error, LLMQueueFull):
+        message = "Le modèle est saturé, réessayez dans quelques instants"
+    elif isinstance(error, LLMDeadlineExceeded):
+        message = "Le modèle est trop sollicité pour répondre à temps"
+    elif isinstance(error, requests.exceptions.Timeout):
+        message = "Le modèle met trop de temps à répondre"
+    elif isinstance(error, requests.exceptions.ConnectionError):
+        message = "Impossible de se connecter à Ollama"
+    else:
+        logger.error(f"Erreur chatbot (flux): {error}")
+        message = str(error)
+    return sse_event({"error": message}, event='error')
+
+def fast_path_events(question, routed, route_ms):
+    return [
+        sse_event({"question": question, "context_type": "structured", "route": "fast_path",
+                   "intent": routed["intent"], "route_time_ms": route_ms}, event='meta'),
+        sse_event({"token": routed["answer"]}),
+        sse_event({"processing_time": route_ms / 1000, "route": "fast_path",
+                   "data": {"kpi": routed["kpi"], "companies": routed["companies"],
+                            "rows": routed["rows"]}}, event='done')
+    ]
+
+def prepare_chat_stream(question):
+    """Contexte, prompt système et réponse en cache éventuelle d'un chat en flux"""
+    context_data, _ = fit_prompt(question, select_chat_context(question))
+    logger.info(f"Question reçue (flux): {question}")
+    system_prompt = build_system_prompt(context_data)
+    key = cache_key(OLLAMA_MODEL, OLLAMA_CHAT_OPTIONS, system_prompt, context_data, question)
+    data_version = results_store_version()
+    return {"context_data": context_data, "system": system_prompt, "key": key, "data_version": data_version,
+            "cached": llm_cache.get(key, data_version)}
+
+def chat_stream_meta(question, prepared, route_ms):
+    return sse_event({
+        "question": question,
+        "context_type": "company_specific" if "DONNÉES DÉTAILLÉES" in prepared["context_data"] else "general",
+        "cache": {"hit": prepared["cached"] is not None, "key": prepared["key"][:16]},
+        "route": "llm",
+        "route_time_ms": route_ms
+    }, event='meta')
+
+@app.route('/api/chatbot/chat/stream', methods=['POST'])
+def chatbot_chat_stream():
+    """Chat en flux (Server-Sent Events): les jetons sont transmis dès leur génération
+    
+    Événements: ``meta`` (type de contexte), ``queue`` {"position"} tant que la
+    génération attend son tour, ``data`` {"token"} pour chaque jeton, ``done``
+    (statistiques de génération dont ttft_s et queue_wait_s) ou ``error``.
+    """
+    data = request.get_json() or {}
+    question = data.get('question', '')
+    
+    if not question:
+        return jsonify({"error": "La question est requise"}), 400
+    
+    routed, route_ms = route_question(question)
+    if routed is not None:
+        return Response(fast_path_events(question, routed, route_ms), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
+    
+    if not check_ollama_connection():
+        return jsonify(OLLAMA_UNAVAILABLE), 503
+    
+    prepared = prepare_chat_stream(question)
+    
+    def generate():
+        start_time = time.time()
+        yield chat_stream_meta(question, prepared, route_ms)
+        
+        if prepared["cached"] is not None:
+            yield from cached_stream_events(prepared["cached"], start_time, {"ttft_s": 0.0})
+            return
+        
+        relay = StreamRelay(prepared["key"], prepared["data_version"], start_time)
+        try:
+            for chunk in ollama_client.stream_generate(question, system=prepared["system"],
+                                                       options=OLLAMA_CHAT_OPTIONS, endpoint='chatbot_stream',
+                                                       report_queue=True):
+                yield from relay.events(chunk)
+        except Exception as e:
+            yield chat_stream_error(e)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/chatbot/context', methods=['GET'])
 def get_chatbot_context():
     """Obtenir le contexte actuel du chatbot"""
@@ -932,8 +908,13 @@ def process_pdf_route():
         
         # Traiter le PDF
         print("Traitement du PDF...")
+        job_stats = {}
         try:
-            new_results = process_pdf(pdf_path, kpi_embeddings, all_kpis, kpi_df, min_confidence)
+            new_results = extract_pdf_job(pdf_path, kpi_path, kpi_embeddings, all_kpis, kpi_df, min_confidence,
+                                          job_stats=job_stats)
+        except WorkerError as e:
+            print(f"❌ Extraction du PDF en échec dans le pool: {e}")
+            return jsonify({"error": f"Error processing PDF: {str(e)}"}), 500
         except Exception as e:
             print(f"❌ Erreur lors du traitement du PDF: {e}")
             import traceback
@@ -946,26 +927,20 @@ def process_pdf_route():
             "pdf_name": pdf_filename,
             "kpis_loaded": len(all_kpis),
             "new_kpis_extracted": len(new_results),
-            "results": new_results
+            "results": new_results,
+            "job_stats": job_stats
         }
         
         # Sauvegarder les résultats si nécessaire
         if new_results:
             try:
-                if existing_results.empty:
-                    all_results = pd.DataFrame(new_results)
-                else:
-                    new_df = pd.DataFrame(new_results)
-                    all_results = pd.concat([existing_results, new_df], ignore_index=True)
-                    all_results = all_results.drop_duplicates(
-                        subset=['kpi_name', 'value', 'unit', 'source_file'], 
-                        keep='last'
-                    )
+                all_results = merge_results(existing_results, new_results)
                 
                 save_success = save_results(all_results)
                 if save_success:
                     response_data["total_kpis"] = len(all_results)
                     print(f"💾 Données sauvegardées: {len(all_results)} KPIs au total")
+                    refresh_results_index(all_results)
                 else:
                     print("❌ Erreur sauvegarde")
             except Exception as e:
@@ -1323,300 +1298,349 @@ def export_company_data(company_name):
 # ROUTES SUPPLEMENTAIRES POUR LE CHATBOT AVANCE
 # =========================================================================
 
+def benchmark_request(data):
+    """((entreprises, type de KPI, {entreprise: lignes}, toutes les lignes), None) ou (None, (erreur, code))"""
+    companies = data.get('companies', [])
+    kpi_type = data.get('kpi_type', 'environmental')
+    
+    df = load_existing_results()
+    if df.empty:
+        return None, ({"error": "Aucune donnée disponible pour le benchmarking"}, 404)
+    
+    # Une seule passe sur la table, dans l'ordre demandé
+    groups = dict(tuple(df[df['source_file'].isin(companies)].groupby('source_file', sort=False)))
+    frames = {company: groups[company] for company in companies if company in groups}
+    if not frames:
+        return None, ({"error": "Aucune donnée pour les entreprises sélectionnées"}, 404)
+    return (companies, kpi_type, frames, df), None
+
+def benchmark_profiles(frames, df):
+    return {company: company_insight(company, company_df, df)["profile"] for company, company_df in frames.items()}
+
+NO_BENCHMARK_ANALYSIS = "❌ Aucune analyse par entreprise n'a pu être générée (voir company_analyses)."
+
+def benchmark_payload(companies, kpi_type, benchmark_data, results, analysis, cache_info, start_time, map_time):
+    return {
+        "companies": companies,
+        "kpi_type": kpi_type,
+        "benchmark_data": benchmark_data,
+        "company_analyses": list(results.values()),
+        "analysis": analysis,
+        "cache": cache_info,
+        "timings": {"map_s": round(map_time, 3), "total_s": round(time.time() - start_time, 3),
+                    "cached_companies": sum(r["cached"] for r in results.values())}
+    }
+
 @app.route('/api/chatbot/benchmark', methods=['POST'])
 def esg_benchmark():
-    """Benchmarking entre entreprises"""
+    """Benchmarking entre entreprises (map-reduce)
+    
+    Chaque entreprise est analysée séparément, en parallèle ou depuis le cache,
+    puis un prompt court fusionne les analyses.
+    """
     try:
-        data = request.get_json()
-        companies = data.get('companies', [])
-        kpi_type = data.get('kpi_type', 'environmental')
-        
-        df = load_existing_results()
-        if df.empty:
-            return jsonify({"error": "Aucune donnée disponible pour le benchmarking"}), 404
-        
-        # Filtrer par entreprises sélectionnées
-        comp_df = df[df['source_file'].isin(companies)]
-        if comp_df.empty:
-            return jsonify({"error": "Aucune donnée pour les entreprises sélectionnées"}), 404
-        
-        # Préparer les données pour le benchmark
-        benchmark_data = prepare_benchmark_data(comp_df, kpi_type)
-        
-        # Générer l'analyse avec Ollama
-        analysis_prompt = f"""
-        Analyse les données de benchmarking ESG suivantes:
-        
-        Entreprises comparées: {', '.join(companies)}
-        Type de KPI: {kpi_type}
-        
-        Données:
-        {benchmark_data}
+        parsed, error = benchmark_request(request.get_json() or {})
+        if error:
+            return jsonify(error[0]), error[1]
+        companies, kpi_type, frames, df = parsed
+        start_time = time.time()
         
-        Fournis une analyse comparative:
-        1. Points forts de chaque entreprise
-        2. Points à améliorer
-        3. Recommandations spécifiques
-        4. Meilleures pratiques identifiées
-        """
+        results = {r["company"]: r for r in benchmark_runner.map(kpi_type, frames, benchmark_profiles(frames, df))}
+        map_time = time.time() - start_time
+        results = {company: results[company] for company in frames}
         
-        analysis = query_ollama(analysis_prompt, "Expert en analyse comparative ESG")
+        benchmark_data = benchmark_table(frames, kpi_type)
+        reduce = benchmark_runner.reduce_prompt(kpi_type, results, benchmark_data)
+        cache_info = {}
+        if reduce is None:
+            analysis = NO_BENCHMARK_ANALYSIS
+        else:
+            analysis = query_ollama(reduce, "Expert en analyse comparative ESG", cache_info,
+                                    priority=PRIORITY_ANALYSIS, endpoint='benchmark')
         
-        return jsonify({
-            "companies": companies,
-            "kpi_type": kpi_type,
-            "benchmark_data": benchmark_data,
-            "analysis": analysis
-        })
+        return jsonify(benchmark_payload(companies, kpi_type, benchmark_data, results, analysis, cache_info,
+                                         start_time, map_time))
         
     except Exception as e:
         logger.error(f"Error in ESG benchmark: {e}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/chatbot/compare', methods=['POST'])
-def detailed_comparison():
-    """Comparaison détaillée entre deux entreprises"""
+def prepare_benchmark_reduce(kpi_type, frames, results, benchmark_data):
+    """(prompt de synthèse, prompt système, clé, version, réponse en cache) ou None sans analyse"""
+    reduce = benchmark_runner.reduce_prompt(kpi_type, {c: results[c] for c in frames}, benchmark_data)
+    if reduce is None:
+        return None
+    system_prompt = build_system_prompt("Expert en analyse comparative ESG")
+    key = cache_key(OLLAMA_MODEL, OLLAMA_CHAT_OPTIONS, system_prompt, "Expert en analyse comparative ESG", reduce)
+    data_version = results_store_version()
+    return reduce, system_prompt, key, data_version, llm_cache.get(key, data_version)
+
+@app.route('/api/chatbot/benchmark/stream', methods=['POST'])
+def esg_benchmark_stream():
+    """Benchmarking en flux (Server-Sent Events)
+    
+    Événements: ``meta`` (entreprises), ``company`` à chaque analyse terminée
+    {"company", "analysis", "cached", "completed", "total"}, ``queue``
+    {"position"} pendant l'attente de la synthèse, ``data`` {"token"} pour la
+    synthèse, ``done`` (statistiques) ou ``error``.
+    """
+    parsed, error = benchmark_request(request.get_json() or {})
+    if error:
+        return jsonify(error[0]), error[1]
+    companies, kpi_type, frames, df = parsed
+    if not check_ollama_connection():
+        return jsonify({"error": "Ollama n'est pas accessible"}), 503
+    profiles = benchmark_profiles(frames, df)
+    
+    def generate():
+        start_time = time.time()
+        benchmark_data = benchmark_table(frames, kpi_type)
+        yield sse_event({"companies": list(frames), "kpi_type": kpi_type, "total": len(frames),
+                         "benchmark_data": benchmark_data}, event='meta')
+        
+        results = {}
+        for result in benchmark_runner.map(kpi_type, frames, profiles):
+            results[result["company"]] = result
+            yield sse_event({**result, "completed": len(results), "total": len(frames)}, event='company')
+        map_time = time.time() - start_time
+        
+        prepared = prepare_benchmark_reduce(kpi_type, frames, results, benchmark_data)
+        if prepared is None:
+            yield sse_event({"error": "Aucune analyse par entreprise n'a pu être générée"}, event='error')
+            return
+        reduce, system_prompt, key, data_version, cached = prepared
+        timings = {"map_s": round(map_time, 3), "cached_companies": sum(r["cached"] for r in results.values())}
+        if cached is not None:
+            yield from cached_stream_events(cached, start_time, timings)
+            return
+        
+        relay = StreamRelay(key, data_version, start_time, timings)
+        try:
+            for chunk in ollama_client.stream_generate(reduce, system=system_prompt, options=OLLAMA_CHAT_OPTIONS,
+                                                       endpoint='benchmark', priority=PRIORITY_ANALYSIS,
+                                                       report_queue=True):
+                yield from relay.events(chunk)
+        except Exception as e:
+            logger.error(f"Erreur benchmark (flux): {e}")
+            yield sse_event({"error": ollama_error_message(e)}, event='error')
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def llm_route(job, label):
+    """Route Flask d'une analyse LLM: ``job(data)`` prépare la réponse et le prompt
+    
+    ``job`` retourne ((réponse, génération), None) ou (None, (erreur, code));
+    la génération {"field", "prompt", "role", "priority", "endpoint"} remplit
+    ``réponse[field]``.
+    """
     try:
-        data = request.get_json()
-        company1 = data.get('company1')
-        company2 = data.get('company2')
-        
-        if not company1 or not company2:
-            return jsonify({"error": "Deux entreprises sont requises"}), 400
-        
-        df = load_existing_results()
-        if df.empty:
-            return jsonify({"error": "Aucune donnée disponible"}), 404
-        
-        # Données des deux entreprises
-        comp1_df = df[df['source_file'] == company1]
-        comp2_df = df[df['source_file'] == company2]
-        
-        if comp1_df.empty or comp2_df.empty:
-            return jsonify({"error": "Données manquantes pour une ou plusieurs entreprises"}), 404
-        
-        comparison_data = prepare_detailed_comparison(comp1_df, comp2_df, company1, company2)
-        
-        # Générer l'analyse comparative
-        comparison_prompt = f"""
-        Compare détaillément les performances ESG de {company1} et {company2}:
-        
-        Données de comparaison:
-        {comparison_data}
-        
-        Fournis une analyse structurée:
-        1. Performance globale
-        2. Forces relatives de chaque entreprise
-        3. Écarts significatifs
-        4. Opportunités d'amélioration
-        5. Recommandations croisées
-        """
-        
-        analysis = query_ollama(comparison_prompt, "Expert en analyse comparative ESG")
-        
-        return jsonify({
-            "company1": company1,
-            "company2": company2,
-            "comparison_data": comparison_data,
-            "analysis": analysis
-        })
-        
+        prepared, error = job(request.get_json() or {})
+        if error:
+            return jsonify(error[0]), error[1]
+        payload, llm = prepared
+        payload[llm["field"]] = query_ollama(llm["prompt"], llm["role"], priority=llm["priority"],
+                                             endpoint=llm["endpoint"])
+        return jsonify(payload)
     except Exception as e:
-        logger.error(f"Error in detailed comparison: {e}")
+        logger.error(f"Error in {label}: {e}")
         return jsonify({"error": str(e)}), 500
 
+def comparison_job(data):
+    company1 = data.get('company1')
+    company2 = data.get('company2')
+    
+    if not company1 or not company2:
+        return None, ({"error": "Deux entreprises sont requises"}, 400)
+    
+    df = load_existing_results()
+    if df.empty:
+        return None, ({"error": "Aucune donnée disponible"}, 404)
+    
+    # Données des deux entreprises
+    comp1_df = df[df['source_file'] == company1]
+    comp2_df = df[df['source_file'] == company2]
+    
+    if comp1_df.empty or comp2_df.empty:
+        return None, ({"error": "Données manquantes pour une ou plusieurs entreprises"}, 404)
+    
+    # Profils précalculés à l'ingestion plutôt que concat + groupby à chaque appel
+    comparison_data = "\n\n".join(
+        profile_text(insight["profile"], insight["summary"])
+        for insight in (company_insight(company1, comp1_df, df), company_insight(company2, comp2_df, df))
+    )
+    
+    # Générer l'analyse comparative
+    comparison_prompt = f"""
+    Compare détaillément les performances ESG de {company1} et {company2}:
+    
+    Données de comparaison:
+    {comparison_data}
+    
+    Fournis une analyse structurée:
+    1. Performance globale
+    2. Forces relatives de chaque entreprise
+    3. Écarts significatifs
+    4. Opportunités d'amélioration
+    5. Recommandations croisées
+    """
+    
+    payload = {"company1": company1, "company2": company2, "comparison_data": comparison_data}
+    return (payload, {"field": "analysis", "prompt": comparison_prompt, "role": "Expert en analyse comparative ESG",
+                      "priority": PRIORITY_ANALYSIS, "endpoint": 'compare'}), None
+
+@app.route('/api/chatbot/compare', methods=['POST'])
+def detailed_comparison():
+    """Comparaison détaillée entre deux entreprises"""
+    return llm_route(comparison_job, "detailed comparison")
+
+def recommendations_job(data):
+    company_name = data.get('company_name')
+    focus_area = data.get('focus_area', 'all')
+    
+    if not company_name:
+        return None, ({"error": "Le nom de l'entreprise est requis"}, 400)
+    
+    df = load_existing_results()
+    if df.empty:
+        return None, ({"error": "Aucune donnée disponible"}, 404)
+    
+    comp_df = df[df['source_file'] == company_name]
+    if comp_df.empty:
+        return None, ({"error": "Entreprise non trouvée"}, 404)
+    
+    insight = company_insight(company_name, comp_df, df)
+    company_data = profile_text(insight["profile"], insight["summary"])
+    
+    recommendations_prompt = f"""
+    Génère des recommandations ESG personnalisées pour {company_name}:
+    
+    Données actuelles:
+    {company_data}
+    
+    Domaine de focus: {focus_area}
+    
+    Fournis des recommandations:
+    1. Actions prioritaires
+    2. Objectifs mesurables
+    3. Bonnes pratiques du secteur
+    4. Indicateurs de suivi
+    5. Échéancier recommandé
+    """
+    
+    payload = {"company": company_name, "focus_area": focus_area, "current_data": company_data}
+    return (payload, {"field": "recommendations", "prompt": recommendations_prompt, "role": "Consultant ESG senior",
+                      "priority": PRIORITY_ANALYSIS, "endpoint": 'recommendations'}), None
+
 @app.route('/api/chatbot/recommendations', methods=['POST'])
 def esg_recommendations():
     """Recommandations personnalisées pour une entreprise"""
+    return llm_route(recommendations_job, "ESG recommendations")
+
+@app.route('/api/chatbot/insights/<company_name>', methods=['GET'])
+def get_company_insight(company_name):
+    """Profil précalculé et synthèse ESG d'une entreprise"""
     try:
-        data = request.get_json()
-        company_name = data.get('company_name')
-        focus_area = data.get('focus_area', 'all')
-        
-        if not company_name:
-            return jsonify({"error": "Le nom de l'entreprise est requis"}), 400
-        
         df = load_existing_results()
-        if df.empty:
-            return jsonify({"error": "Aucune donnée disponible"}), 404
-        
-        comp_df = df[df['source_file'] == company_name]
+        comp_df = df[df['source_file'] == company_name] if not df.empty else df
         if comp_df.empty:
             return jsonify({"error": "Entreprise non trouvée"}), 404
-        
-        company_data = prepare_company_recommendations(comp_df, focus_area)
-        
-        recommendations_prompt = f"""
-        Génère des recommandations ESG personnalisées pour {company_name}:
-        
-        Données actuelles:
-        {company_data}
-        
-        Domaine de focus: {focus_area}
-        
-        Fournis des recommandations:
-        1. Actions prioritaires
-        2. Objectifs mesurables
-        3. Bonnes pratiques du secteur
-        4. Indicateurs de suivi
-        5. Échéancier recommandé
-        """
-        
-        recommendations = query_ollama(recommendations_prompt, "Consultant ESG senior")
-        
-        return jsonify({
-            "company": company_name,
-            "focus_area": focus_area,
-            "current_data": company_data,
-            "recommendations": recommendations
-        })
-        
+        return jsonify(company_insight(company_name, comp_df, df))
     except Exception as e:
-        logger.error(f"Error in ESG recommendations: {e}")
+        logger.error(f"Error in company insight: {e}")
         return jsonify({"error": str(e)}), 500
 
+def search_job(data):
+    query = data.get('query', '')
+    top_k = data.get('top_k', 5)
+    
+    if not query:
+        return None, ({"error": "Requête de recherche vide"}, 400)
+    
+    index = get_results_index()
+    if not index.size:
+        return None, ({"error": "Aucune donnée disponible"}, 404)
+    
+    min_confidence = data.get('min_confidence')
+    start = time.perf_counter()
+    results = perform_semantic_search(
+        index, query, int(top_k),
+        company=data.get('company') or None,
+        topic=data.get('topic') or None,
+        min_confidence=float(min_confidence) if min_confidence is not None else None
+    )
+    search_time_ms = round((time.perf_counter() - start) * 1000, 2)
+    
+    search_prompt = f"""
+    Réponds à la question suivante en utilisant les données ESG trouvées:
+    
+    Question: {query}
+    
+    Données pertinentes:
+    {results}
+    
+    Fournis une réponse précise et contextuelle basée uniquement sur les données disponibles.
+    """
+    
+    payload = {"query": query, "results": results, "search_time_ms": search_time_ms}
+    return (payload, {"field": "answer", "prompt": search_prompt, "role": "Assistant de recherche ESG",
+                      "priority": PRIORITY_INTERACTIVE, "endpoint": 'search'}), None
+
 @app.route('/api/chatbot/search', methods=['POST'])
 def semantic_search():
     """Recherche sémantique dans les données ESG"""
-    try:
-        data = request.get_json()
-        query = data.get('query', '')
-        top_k = data.get('top_k', 5)
-        
-        if not query:
-            return jsonify({"error": "Requête de recherche vide"}), 400
-        
-        df = load_existing_results()
-        if df.empty:
-            return jsonify({"error": "Aucune donnée disponible"}), 404
-        
-        # Recherche sémantique simple (à améliorer avec embeddings)
-        results = perform_semantic_search(df, query, top_k)
-        
-        search_prompt = f"""
-        Réponds à la question suivante en utilisant les données ESG trouvées:
-        
-        Question: {query}
-        
-        Données pertinentes:
-        {results}
-        
-        Fournis une réponse précise et contextuelle basée uniquement sur les données disponibles.
-        """
-        
-        answer = query_ollama(search_prompt, "Assistant de recherche ESG")
-        
-        return jsonify({
-            "query": query,
-            "results": results,
-            "answer": answer
-        })
-        
-    except Exception as e:
-        logger.error(f"Error in semantic search: {e}")
-        return jsonify({"error": str(e)}), 500
+    return llm_route(search_job, "semantic search")
+
+def trends_job(data):
+    timeframe = data.get('timeframe', 'all')
+    
+    df = load_existing_results()
+    if df.empty:
+        return None, ({"error": "Aucune donnée disponible"}, 404)
+    
+    trends_data = prepare_trend_analysis(df, timeframe)
+    
+    trends_prompt = f"""
+    Analyse les tendances ESG suivantes:
+    
+    Période d'analyse: {timeframe}
+    
+    Données de tendances:
+    {trends_data}
+    
+    Identifie:
+    1. Tendances émergentes
+    2. Évolutions sectorielles
+    3. Points de vigilance
+    4. Opportunités stratégiques
+    5. Prévisions à court terme
+    """
+    
+    payload = {"timeframe": timeframe, "trends_data": trends_data}
+    return (payload, {"field": "analysis", "prompt": trends_prompt, "role": "Analyste de tendances ESG",
+                      "priority": PRIORITY_ANALYSIS, "endpoint": 'trends'}), None
 
 @app.route('/api/chatbot/trends', methods=['POST'])
 def trend_analysis():
     """Analyse des tendances ESG"""
-    try:
-        data = request.get_json()
-        timeframe = data.get('timeframe', 'all')
-        
-        df = load_existing_results()
-        if df.empty:
-            return jsonify({"error": "Aucune donnée disponible"}), 404
-        
-        trends_data = prepare_trend_analysis(df, timeframe)
-        
-        trends_prompt = f"""
-        Analyse les tendances ESG suivantes:
-        
-        Période d'analyse: {timeframe}
-        
-        Données de tendances:
-        {trends_data}
-        
-        Identifie:
-        1. Tendances émergentes
-        2. Évolutions sectorielles
-        3. Points de vigilance
-        4. Opportunités stratégiques
-        5. Prévisions à court terme
-        """
-        
-        analysis = query_ollama(trends_prompt, "Analyste de tendances ESG")
-        
-        return jsonify({
-            "timeframe": timeframe,
-            "trends_data": trends_data,
-            "analysis": analysis
-        })
-        
-    except Exception as e:
-        logger.error(f"Error in trend analysis: {e}")
-        return jsonify({"error": str(e)}), 500
+    return llm_route(trends_job, "trend analysis")
 
 # Fonctions utilitaires pour le chatbot avancé
-def prepare_benchmark_data(df, kpi_type):
-    """Préparer les données pour le benchmarking"""
-    # Implémentation simplifiée
-    benchmark = df.groupby('source_file').agg({
-        'value': ['mean', 'median', 'count'],
-        'confidence': 'mean'
-    }).round(3)
-    return benchmark.to_string()
-
-def prepare_detailed_comparison(df1, df2, name1, name2):
-    """Préparer la comparaison détaillée"""
-    comparison = f"""
-    {name1}: {len(df1)} KPIs, Confiance moyenne: {df1['confidence'].mean():.3f}
-    {name2}: {len(df2)} KPIs, Confiance moyenne: {df2['confidence'].mean():.3f}
-    
-    Valeurs moyennes par catégorie:
-    {pd.concat([df1, df2]).groupby(['topic_fr', 'source_file'])['value'].mean().unstack().to_string()}
-    """
-    return comparison
-
-def prepare_company_recommendations(df, focus_area):
-    """Préparer les données pour les recommandations"""
-    summary = f"""
-    KPIs totaux: {len(df)}
-    Catégories couvertes: {df['topic_fr'].nunique()}
-    Confiance moyenne: {df['confidence'].mean():.3f}
-    
-    Distribution par catégorie:
-    {df['topic_fr'].value_counts().to_string()}
-    """
-    return summary
-
-def perform_semantic_search(df, query, top_k):
-    """Recherche sémantique simple"""
-    # Recherche par mots-clés dans les noms de KPI et topics
-    query_terms = query.lower().split()
-    results = []
-    
-    for _, row in df.iterrows():
-        score = 0
-        text_to_search = f"{row.get('kpi_name', '')} {row.get('topic_fr', '')} {row.get('topic', '')}".lower()
-        
-        for term in query_terms:
-            if term in text_to_search:
-                score += 1
-        
-        if score > 0:
-            results.append({
-                'score': score,
-                'kpi_name': row.get('kpi_name', ''),
-                'value': row.get('value', ''),
-                'unit': row.get('unit', ''),
-                'company': row.get('source_file', ''),
-                'topic': row.get('topic_fr', '')
-            })
-    
-    # Trier par score et retourner les top_k
-    results.sort(key=lambda x: x['score'], reverse=True)
-    return results[:top_k]
+def perform_semantic_search(index, query, top_k, company=None, topic=None, min_confidence=None):
+    """Recherche hybride (BM25 + embeddings) dans l'index des résultats"""
+    hits = index.search(query, top_k, company=company, topic=topic, min_confidence=min_confidence)
+    return [
+        {
+            'score': record['score'],
+            'kpi_name': record.get('kpi_name', ''),
+            'value': record.get('value', ''),
+            'unit': record.get('unit', ''),
+            'company': record['company'],
+            'topic': record.get('topic_fr', ''),
+            'confidence': record.get('confidence')
+        }
+        for record in index.records(hits)
+    ]
 
 def prepare_trend_analysis(df, timeframe):
     """Préparer l'analyse des tendances"""
@@ -1634,10 +1658,219 @@ def prepare_trend_analysis(df, timeframe):
     """
     return trends
 
+# =========================================================================
+# ROUTES ASYNCHRONES (ESG_ASYNC=1)
+# Mêmes réponses que les routes Flask ci-dessus; la génération Ollama est
+# attendue sans thread, la préparation (retrieval, pandas) passe par run_sync.
+# =========================================================================
+
+@async_server.route('POST', '/api/chatbot/chat')
+async def chatbot_chat_async(request):
+    try:
+        data = await read_json(request)
+        question = data.get('question', '')
+        
+        if not question:
+            return json_response({"error": "La question est requise"}, 400)
+        
+        conversation_id = data.get('conversation_id')
+        routed, route_ms = await async_server.run_sync(route_question, question)
+        if routed is not None:
+            if conversation_id:
+                await async_server.run_sync(record_fast_path_turn, conversation_id, question, routed)
+            return json_response(fast_path_payload(question, routed, route_ms, conversation_id=conversation_id))
+        
+        if not check_ollama_connection():
+            return json_response(OLLAMA_UNAVAILABLE, 503)
+        
+        if conversation_id:
+            return json_response(await chatbot_conversation_turn_async(conversation_id, question, route_ms))
+        
+        context_data = await async_server.run_sync(select_chat_context, question)
+        log_chat_question(question, context_data)
+        
+        start_time = time.time()
+        cache_info = {}
+        response = await query_ollama_async(question, context_data, cache_info=cache_info)
+        return json_response(chat_payload(question, response, time.time() - start_time, context_data, cache_info,
+                                          route_ms))
+    
+    except Exception as e:
+        logger.error(f"Erreur chatbot: {e}")
+        return json_response({"error": str(e)}, 500)
+
+async def chatbot_conversation_turn_async(conversation_id, question, route_ms=None):
+    session = chat_sessions.get_or_create(conversation_id)
+    await async_server.acquire(session.lock)     # un tour à la fois par conversation
+    try:
+        start_time = time.time()
+        cache_info = {}
+        response, context_type, timings = await query_ollama_conversation_async(session, question, cache_info)
+        processing_time = time.time() - start_time
+        if not timings.get("error"):
+            session.add_turn(question, response, timings)
+    finally:
+        session.lock.release()
+    return conversation_payload(session, question, response, context_type, timings, processing_time, cache_info,
+                                route_ms)
+
+@async_server.route('POST', '/api/chatbot/chat/stream')
+async def chatbot_chat_stream_async(request):
+    data = await read_json(request)
+    question = data.get('question', '')
+    
+    if not question:
+        return json_response({"error": "La question est requise"}, 400)
+    
+    routed, route_ms = await async_server.run_sync(route_question, question)
+    if routed is not None:
+        async def fast_path():
+            for event in fast_path_events(question, routed, route_ms):
+                yield event
+        return await sse_response(request, fast_path())
+    
+    if not check_ollama_connection():
+        return json_response(OLLAMA_UNAVAILABLE, 503)
+    
+    prepared = await async_server.run_sync(prepare_chat_stream, question)
+    
+    async def generate():
+        start_time = time.time()
+        yield chat_stream_meta(question, prepared, route_ms)
+        
+        if prepared["cached"] is not None:
+            for event in cached_stream_events(prepared["cached"], start_time, {"ttft_s": 0.0}):
+                yield event
+            return
+        
+        relay = StreamRelay(prepared["key"], prepared["data_version"], start_time)
+        chunks = async_ollama.stream_generate(question, system=prepared["system"], options=OLLAMA_CHAT_OPTIONS,
+                                              endpoint='chatbot_stream', report_queue=True)
+        try:
+            async for chunk in chunks:
+                for event in relay.events(chunk):
+                    yield event
+        except Exception as e:
+            yield chat_stream_error(e)
+        finally:
+            await chunks.aclose()
+    
+    return await sse_response(request, generate())
+
+@async_server.route('POST', '/api/chatbot/benchmark')
+async def esg_benchmark_async(request):
+    try:
+        parsed, error = await async_server.run_sync(benchmark_request, await read_json(request))
+        if error:
+            return json_response(*error)
+        companies, kpi_type, frames, df = parsed
+        start_time = time.time()
+        
+        profiles = await async_server.run_sync(benchmark_profiles, frames, df)
+        results = {}
+        async for result in benchmark_runner.map_async(kpi_type, frames, profiles):
+            results[result["company"]] = result
+        map_time = time.time() - start_time
+        results = {company: results[company] for company in frames}
+        
+        benchmark_data = benchmark_table(frames, kpi_type)
+        reduce = benchmark_runner.reduce_prompt(kpi_type, results, benchmark_data)
+        cache_info = {}
+        if reduce is None:
+            analysis = NO_BENCHMARK_ANALYSIS
+        else:
+            analysis = await query_ollama_async(reduce, "Expert en analyse comparative ESG", cache_info,
+                                                priority=PRIORITY_ANALYSIS, endpoint='benchmark')
+        
+        return json_response(benchmark_payload(companies, kpi_type, benchmark_data, results, analysis, cache_info,
+                                               start_time, map_time))
+    
+    except Exception as e:
+        logger.error(f"Error in ESG benchmark: {e}")
+        return json_response({"error": str(e)}, 500)
+
+@async_server.route('POST', '/api/chatbot/benchmark/stream')
+async def esg_benchmark_stream_async(request):
+    parsed, error = await async_server.run_sync(benchmark_request, await read_json(request))
+    if error:
+        return json_response(*error)
+    companies, kpi_type, frames, df = parsed
+    if not check_ollama_connection():
+        return json_response({"error": "Ollama n'est pas accessible"}, 503)
+    profiles = await async_server.run_sync(benchmark_profiles, frames, df)
+    
+    async def generate():
+        start_time = time.time()
+        benchmark_data = benchmark_table(frames, kpi_type)
+        yield sse_event({"companies": list(frames), "kpi_type": kpi_type, "total": len(frames),
+                         "benchmark_data": benchmark_data}, event='meta')
+        
+        results = {}
+        analyses = benchmark_runner.map_async(kpi_type, frames, profiles)
+        try:
+            async for result in analyses:
+                results[result["company"]] = result
+                yield sse_event({**result, "completed": len(results), "total": len(frames)}, event='company')
+        finally:
+            await analyses.aclose()
+        map_time = time.time() - start_time
+        
+        prepared = await async_server.run_sync(prepare_benchmark_reduce, kpi_type, frames, results, benchmark_data)
+        if prepared is None:
+            yield sse_event({"error": "Aucune analyse par entreprise n'a pu être générée"}, event='error')
+            return
+        reduce, system_prompt, key, data_version, cached = prepared
+        timings = {"map_s": round(map_time, 3), "cached_companies": sum(r["cached"] for r in results.values())}
+        if cached is not None:
+            for event in cached_stream_events(cached, start_time, timings):
+                yield event
+            return
+        
+        relay = StreamRelay(key, data_version, start_time, timings)
+        chunks = async_ollama.stream_generate(reduce, system=system_prompt, options=OLLAMA_CHAT_OPTIONS,
+                                              endpoint='benchmark', priority=PRIORITY_ANALYSIS, report_queue=True)
+        try:
+            async for chunk in chunks:
+                for event in relay.events(chunk):
+                    yield event
+        except Exception as e:
+            logger.error(f"Erreur benchmark (flux): {e}")
+            yield sse_event({"error": ollama_error_message(e)}, event='error')
+        finally:
+            await chunks.aclose()
+    
+    return await sse_response(request, generate())
+
+def async_llm_route(job, label):
+    """Équivalent asynchrone de ``llm_route``"""
+    async def handler(request):
+        try:
+            prepared, error = await async_server.run_sync(job, await read_json(request))
+            if error:
+                return json_response(*error)
+            payload, llm = prepared
+            payload[llm["field"]] = await query_ollama_async(llm["prompt"], llm["role"], priority=llm["priority"],
+                                                             endpoint=llm["endpoint"])
+            return json_response(payload)
+        except Exception as e:
+            logger.error(f"Error in {label}: {e}")
+            return json_response({"error": str(e)}, 500)
+    return handler
+
+ASYNC_LLM_JOBS = (
+    ('/api/chatbot/compare', comparison_job, "detailed comparison"),
+    ('/api/chatbot/recommendations', recommendations_job, "ESG recommendations"),
+    ('/api/chatbot/search', search_job, "semantic search"),
+    ('/api/chatbot/trends', trends_job, "trend analysis"),
+)
+for _path, _job, _label in ASYNC_LLM_JOBS:
+    async_server.route('POST', _path)(async_llm_route(_job, _label))
+
 if __name__ == '__main__':
     print("Starting ESG KPI Extractor API...")
     print("Available endpoints:")
     print("  GET  /api/health - Health check")
+    print("  GET  /api/metrics - Prometheus metrics")
     print("  POST /api/process - Process PDF and extract KPIs")
     print("  GET  /api/statistics - Get overall statistics")
     print("  GET  /api/dashboard - Get dashboard data")
@@ -1648,12 +1881,15 @@ if __name__ == '__main__':
     print("  GET  /api/export/excel - Export all data as Excel")
     print("  GET  /api/export/company/<name> - Export company data")
     print("  GET  /api/chatbot/models - Get available chatbot models")
+    print("  POST /api/chatbot/chat/stream - Streamed chat (Server-Sent Events)")
     print("  POST /api/chatbot/chat - Chat with the ESG assistant")
     print("  GET  /api/chatbot/context - Get chatbot context")
     print("  GET  /api/chatbot/company/<name> - Get company-specific context")
     print("  POST /api/chatbot/benchmark - ESG benchmarking")
+    print("  POST /api/chatbot/benchmark/stream - Streamed ESG benchmarking (Server-Sent Events)")
     print("  POST /api/chatbot/compare - Detailed company comparison")
     print("  POST /api/chatbot/recommendations - ESG recommendations")
+    print("  GET  /api/chatbot/insights/<name> - Precomputed company profile and summary")
     print("  POST /api/chatbot/search - Semantic search")
     print("  POST /api/chatbot/trends - Trend analysis")
     
@@ -1669,4 +1905,11 @@ if __name__ == '__main__':
         print("❌ Ollama n'est pas accessible. Vérifiez qu'il est démarré sur le port 11434")
         print("💡 Commande pour démarrer Ollama: ollama serve")
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    insight_worker.start(load_existing_results)
+    if extraction_workers.enabled:
+        extraction_workers.start()
+        print(f"⚙️ Pool d'extraction: {extraction_workers.workers} processus (ESG_EXTRACTION_WORKERS)")
+    if ASYNC_ENABLED:
+        async_server.serve(host='0.0.0.0', port=5000)
+    else:
+        app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -1,14 +1,9 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
 import os
 import re
 import pandas as pd
-import pdfplumber
-import spacy
-from sentence_transformers import SentenceTransformer, util
-import fitz  # PyMuPDF
 import numpy as np
-from collections import defaultdict
 from datetime import datetime
 import tempfile
 import io
@@ -20,19 +15,48 @@ import hashlib
 import uuid
 from threading import Thread
 import time
+from esg_streaming import StreamStats
+from esg_boilerplate import BoilerplateFilter
+from esg_profiling import finish_job
+from esg_metrics import install_metrics, observe_worker_job
+from esg_extraction import CHAT_WINDOW_PAGES, iter_chat_pdf_kpis, load_kpi_list
+from esg_results import OUTPUT_CSV, OUTPUT_EXCEL, load_existing_results
+from esg_workers import POLL_INTERVAL, ExtractionWorkers, WorkerError
+from esg_llm_cache import LLMResponseCache, cache_key, file_version
+from esg_ollama import (
+    AsyncOllamaClient, OllamaClient, OllamaHealthMonitor, OllamaHTTPError, generation_stats, sse_event
+)
+from esg_scheduler import LLMScheduler, LLMSchedulerError
+from esg_router import QueryRouter
+from esg_insights import CompanyInsightStore, InsightSummarizer, estimate_sector, profile_text
+from esg_prompt import Section, assemble, token_counter
+from esg_sessions import UploadStore
+from esg_async import ASYNC_ENABLED, AsyncServer, json_response, read_json
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+CORS_ORIGINS = ["http://localhost:3000", "http://127.0.0.1:3000"]
+
 app = Flask(__name__)
-CORS(app, origins=["http://localhost:3000", "http://127.0.0.1:3000"])
+CORS(app, origins=CORS_ORIGINS)
+install_metrics(app)  # GET /api/metrics
+# ESG_ASYNC=1: /api/esg-chat servi par asyncio, le reste par Flask dans un pool de threads
+async_server = AsyncServer(app, cors_origins=CORS_ORIGINS)
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'pdf', 'xlsx', 'xls', 'csv'}
-OUTPUT_CSV = "all_extracted_kpis.csv"
-OUTPUT_EXCEL = "all_extracted_kpis.xlsx"
+CHAT_PDF_TIME_BUDGET = float(os.environ.get('ESG_CHAT_PDF_BUDGET', 10))   # secondes avant de rendre la main
+OLLAMA_BASE_URL = "http://localhost:11434"
+INSIGHT_OPTIONS = {
+    "temperature": 0.3,
+    "num_predict": 1500,
+    "num_ctx": 4096,
+    "top_k": 40,
+    "top_p": 0.9
+}
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024  # 200MB max
@@ -40,27 +64,19 @@ app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024  # 200MB max
 # Créer le dossier uploads s'il n'existe pas
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-# Charger les modèles NLP au démarrage
-print("Chargement des modèles NLP...")
-try:
-    nlp = spacy.load("en_core_web_sm")
-    nlp.max_length = 3000000
-except OSError:
-    print("Téléchargement du modèle spaCy...")
-    os.system("python -m spacy download en_core_web_sm")
-    nlp = spacy.load("en_core_web_sm")
-    nlp.max_length = 3000000
-
-kpi_model = SentenceTransformer('all-MiniLM-L6-v2')
-
 # =============================================================================
 # CLASSE CHATBOT ESG INTELLIGENT AVEC OLLAMA MISTRAL
 # =============================================================================
 
 class ESGIntelligentChatbot:
     def __init__(self):
-        self.ollama_available = False
         self.current_model = "mistral"
+        self.ollama = OllamaHealthMonitor(OLLAMA_BASE_URL)
+        self.scheduler = LLMScheduler()
+        self.client = OllamaClient(OLLAMA_BASE_URL, self.current_model, monitor=self.ollama,
+                                   scheduler=self.scheduler)
+        self.async_client = AsyncOllamaClient(self.client)
+        self.cache = LLMResponseCache()
         self.initialize_ollama()
         
         # Contexte ESG spécialisé enrichi
@@ -88,40 +104,115 @@ class ESGIntelligentChatbot:
             }
         }
     
+    @property
+    def ollama_available(self):
+        """État en cache de la sonde d'arrière-plan (aucun appel réseau)"""
+        return self.ollama.available
+    
     def initialize_ollama(self):
-        """Initialise la connexion à Ollama"""
-        try:
-            response = requests.get("http://localhost:11434/api/tags", timeout=10)
-            if response.status_code == 200:
-                self.ollama_available = True
-                logger.info("✅ Ollama disponible pour le chatbot ESG")
-                print("✅ Ollama connecté avec succès!")
-                
-                # Vérifier si Mistral est disponible
-                models = response.json().get('models', [])
-                mistral_available = any('mistral' in model.get('name', '').lower() for model in models)
-                if mistral_available:
-                    print("✅ Modèle Mistral disponible")
-                else:
-                    print("⚠️ Mistral non trouvé, utilisation du modèle par défaut")
-                    
+        """Première sonde d'Ollama puis surveillance en arrière-plan"""
+        self.ollama.start()
+        if self.ollama.available:
+            logger.info("✅ Ollama disponible pour le chatbot ESG")
+            print("✅ Ollama connecté avec succès!")
+            
+            # Vérifier si Mistral est disponible
+            if self.ollama.has_model('mistral'):
+                print("✅ Modèle Mistral disponible")
             else:
-                logger.warning("❌ Ollama non accessible")
-                print("❌ Ollama non accessible")
-        except Exception as e:
-            logger.warning(f"⚠️ Ollama non disponible: {e}")
-            print(f"⚠️ Ollama non disponible: {e}")
+                print("⚠️ Mistral non trouvé, utilisation du modèle par défaut")
+        else:
+            logger.warning(f"⚠️ Ollama non disponible: {self.ollama.last_error}")
+            print(f"⚠️ Ollama non disponible: {self.ollama.last_error}")
     
-    def generate_esg_insight(self, kpi_data, company_data, user_question):
-        """Génère des insights ESG intelligents avec Ollama Mistral"""
+    def generate_esg_insight(self, kpi_data, company_data, user_question, cache_info=None, insight=None):
+        """Génère des insights ESG intelligents avec Ollama Mistral
+        
+        ``cache_info`` (dict optionnel) reçoit {"hit", "key"} du cache de réponses et
+        ``prompt_tokens_est``; le contexte est réduit pour tenir dans ``num_ctx``.
+        ``insight`` est le profil précalculé de l'entreprise (esg_insights), s'il existe.
+        """
+        call = self.insight_call(kpi_data, company_data, user_question)
         try:
-            # Préparer le contexte des données
-            context = self._build_comprehensive_esg_context(kpi_data, company_data, user_question)
-            
-            if not self.ollama_available:
-                return self._generate_enhanced_detailed_insight(kpi_data, company_data, user_question, context)
-            
-            prompt = f"""En tant qu'expert senior en analyse ESG avec plus de 15 ans d'expérience, je vous propose une analyse approfondie basée sur les données disponibles.
+            answer = self.prepare_insight(call, cache_info, insight)
+            if answer is not None:
+                return answer
+            print(f"🔍 Envoi de la requête à Ollama Mistral...")
+            result = self.client.generate(call["prompt"], model=self.current_model, options=INSIGHT_OPTIONS,
+                                          endpoint='esg_insight')
+            return self.finish_insight(call, result)
+        except Exception as e:
+            return self.insight_fallback(call, e)
+    
+    def insight_call(self, kpi_data, company_data, user_question):
+        return {"kpi_data": kpi_data, "company_data": company_data, "question": user_question, "context": ""}
+    
+    def prepare_insight(self, call, cache_info=None, insight=None):
+        """Contexte et prompt de ``call``; retourne la réponse si elle est déjà connue (cache, mode standard)"""
+        # Préparer le contexte des données
+        context = self._build_comprehensive_esg_context(call["kpi_data"], call["company_data"], call["question"],
+                                                        insight)
+        call["context"] = context
+        
+        if not self.ollama_available:
+            return self._generate_enhanced_detailed_insight(call["kpi_data"], call["company_data"],
+                                                            call["question"], context)
+        
+        # Contexte réduit si besoin pour que prompt + réponse tiennent dans num_ctx
+        texts, budget = assemble([
+            Section('instructions', self._insight_prompt("", ""), priority=0),
+            Section('question', call["question"], priority=0),
+            Section('data', context, priority=1),
+        ], INSIGHT_OPTIONS["num_ctx"], INSIGHT_OPTIONS["num_predict"])
+        if budget["truncated"]:
+            print(f"✂️ Contexte réduit à {budget['sections']['data']} jetons")
+        context = texts['data']
+        call["prompt"] = self._insight_prompt(context, call["question"])
+        if cache_info is not None:
+            cache_info["prompt_tokens_est"] = budget["prompt_tokens"]
+        call["key"] = cache_key(self.current_model, INSIGHT_OPTIONS, None, context, call["prompt"])
+        call["data_version"] = file_version(OUTPUT_CSV)
+        cached = self.cache.get(call["key"], call["data_version"])
+        if cache_info is not None:
+            cache_info.update({"hit": cached is not None, "key": call["key"][:16]})
+        if cached is not None:
+            print("♻️ Réponse servie par le cache")
+            return cached[0]
+        return None
+    
+    def finish_insight(self, call, result):
+        """Réponse formatée d'une génération terminée, mise en cache"""
+        ai_response = result.get('response', '')
+        print(f"✅ Réponse reçue de Mistral ({len(ai_response)} caractères, "
+              f"premier jeton en {result.get('ttft_s')}s)")
+        formatted = self._format_detailed_response(ai_response)
+        if formatted:
+            self.cache.put(call["key"], formatted, call["data_version"], generation_stats(result))
+        return formatted
+    
+    def insight_fallback(self, call, error):
+        """Réponse standard quand la génération échoue"""
+        context = call["context"]
+        if isinstance(error, LLMSchedulerError):
+            # File saturée ou échéance dépassée: réponse standard plutôt qu'une attente
+            print(f"🚦 {error}, utilisation du mode fallback")
+        elif isinstance(error, OllamaHTTPError):
+            print(f"❌ Erreur Ollama: {error.status_code}")
+        elif isinstance(error, requests.exceptions.Timeout):
+            print("⏰ Timeout Ollama, utilisation du mode fallback")
+            context = ""
+        elif isinstance(error, requests.exceptions.ConnectionError):
+            # Circuit ouvert: les questions suivantes passent directement au mode standard
+            context = ""
+        else:
+            logger.error(f"Erreur génération insight ESG: {error}")
+            print(f"❌ Erreur avec Ollama: {error}")
+            context = ""
+        return self._generate_enhanced_detailed_insight(call["kpi_data"], call["company_data"], call["question"],
+                                                        context)
+    
+    def _insight_prompt(self, context, user_question):
+        return f"""En tant qu'expert senior en analyse ESG avec plus de 15 ans d'expérience, je vous propose une analyse approfondie basée sur les données disponibles.
 
 CONTEXTE D'ANALYSE:
 {context}
@@ -139,40 +230,6 @@ Veuillez fournir une réponse structurée en paragraphes détaillés qui :
 Évitez les listes à puces et privilégiez des paragraphes fluides et connectés. Utilisez un langage professionnel mais accessible, avec des références aux réglementations pertinentes (CSRD, SFDR, Taxonomie UE).
 
 Analyse experte ESG:"""
-
-            print(f"🔍 Envoi de la requête à Ollama Mistral...")
-            response = requests.post(
-                "http://localhost:11434/api/generate",
-                json={
-                    "model": self.current_model,
-                    "prompt": prompt,
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.3,
-                        "num_predict": 1500,
-                        "top_k": 40,
-                        "top_p": 0.9
-                    }
-                },
-                timeout=120
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                ai_response = result.get('response', '')
-                print(f"✅ Réponse reçue de Mistral ({len(ai_response)} caractères)")
-                return self._format_detailed_response(ai_response)
-            else:
-                print(f"❌ Erreur Ollama: {response.status_code}")
-                return self._generate_enhanced_detailed_insight(kpi_data, company_data, user_question, context)
-                
-        except requests.exceptions.Timeout:
-            print("⏰ Timeout Ollama, utilisation du mode fallback")
-            return self._generate_enhanced_detailed_insight(kpi_data, company_data, user_question, "")
-        except Exception as e:
-            logger.error(f"Erreur génération insight ESG: {e}")
-            print(f"❌ Erreur avec Ollama: {e}")
-            return self._generate_enhanced_detailed_insight(kpi_data, company_data, user_question, "")
     
     def _format_detailed_response(self, response):
         """Formate la réponse pour assurer des paragraphes cohérents"""
@@ -181,8 +238,16 @@ Analyse experte ESG:"""
         formatted_response = '\n\n'.join(paragraphs)
         return formatted_response
     
-    def _build_comprehensive_esg_context(self, kpi_data, company_data, user_question):
-        """Construit un contexte ESG complet et détaillé"""
+    def _build_comprehensive_esg_context(self, kpi_data, company_data, user_question, insight=None):
+        """Construit un contexte ESG complet et détaillé (à partir du profil précalculé s'il est fourni)"""
+        if insight is not None:
+            profile = insight["profile"]
+            return "\n".join([
+                profile_text(profile, insight.get("summary")),
+                "\nPERSPECTIVE SECTORIELLE:",
+                self._get_sector_insights(profile["sector"])
+            ])
+        
         context_parts = []
         
         # Analyse quantitative détaillée
@@ -251,24 +316,7 @@ Analyse experte ESG:"""
     
     def _estimate_company_sector(self, kpi_data):
         """Estime le secteur d'activité basé sur les KPIs"""
-        if kpi_data.empty:
-            return "non déterminé"
-            
-        environmental_count = len(kpi_data[kpi_data['topic_fr'].str.contains('environnement|émis|énergie', na=False, case=False)]) if 'topic_fr' in kpi_data.columns else 0
-        social_count = len(kpi_data[kpi_data['topic_fr'].str.contains('social|diversité|employé', na=False, case=False)]) if 'topic_fr' in kpi_data.columns else 0
-        total_count = len(kpi_data)
-        
-        env_ratio = environmental_count / total_count if total_count > 0 else 0
-        social_ratio = social_count / total_count if total_count > 0 else 0
-        
-        if env_ratio > 0.6:
-            return "industriel ou énergétique"
-        elif social_ratio > 0.5:
-            return "services ou technologies"
-        elif env_ratio > 0.3 and social_ratio > 0.3:
-            return "manufacturier diversifié"
-        else:
-            return "général"
+        return estimate_sector(kpi_data)
     
     def _get_sector_insights(self, sector):
         """Retourne des insights spécifiques au secteur"""
@@ -508,6 +556,12 @@ Analyse experte ESG:"""
 
 # Initialisation du chatbot
 esg_chatbot = ESGIntelligentChatbot()
+query_router = QueryRouter()   # questions factuelles résolues sans LLM
+# Profils d'entreprise partagés avec l'API principale (même base SQLite)
+insight_store = CompanyInsightStore()
+insight_worker = InsightSummarizer(insight_store, esg_chatbot.client)
+chat_uploads = UploadStore()   # upload_id -> KPIs extraits d'un PDF déposé dans le chat
+extraction_workers = ExtractionWorkers()   # même pool que l'API principale (ESG_EXTRACTION_WORKERS)
 
 # =============================================================================
 # FONCTIONS UTILITAIRES
@@ -516,408 +570,119 @@ esg_chatbot = ESGIntelligentChatbot()
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def safe_read_csv(file_path):
-    try:
-        return pd.read_csv(file_path)
-    except pd.errors.ParserError:
-        try:
-            return pd.read_csv(file_path, on_bad_lines='skip', engine='python')
-        except TypeError:
-            return pd.read_csv(file_path, error_bad_lines=False, engine='python')
-    except Exception as e:
-        logger.error(f"Error reading CSV: {e}")
-        return pd.DataFrame()
-
-def load_existing_results():
-    if os.path.exists(OUTPUT_CSV):
-        try:
-            existing_df = safe_read_csv(OUTPUT_CSV)
-            logger.info(f"Chargement de {len(existing_df)} KPIs existants")
-            return existing_df
-        except Exception as e:
-            logger.error(f"Erreur lors du chargement des résultats existants: {e}")
-            return pd.DataFrame()
-    return pd.DataFrame()
-
-def save_results(all_results):
-    if not all_results.empty:
-        try:
-            all_results.to_csv(OUTPUT_CSV, index=False, encoding='utf-8-sig')
-            all_results.to_excel(OUTPUT_EXCEL, index=False)
-            logger.info(f"Résultats sauvegardés: {len(all_results)} KPIs")
-            return True
-        except Exception as e:
-            logger.error(f"Erreur lors de la sauvegarde: {e}")
-            return False
-    return False
-
-def load_kpi_list(file_path):
-    file_extension = os.path.splitext(file_path)[1].lower()
-    
-    if file_extension == '.csv':
-        encodings = ['utf-8', 'latin-1', 'iso-8859-1', 'windows-1252']
-        for encoding in encodings:
-            try:
-                df = pd.read_csv(file_path, sep=';', encoding=encoding)
-                break
-            except UnicodeDecodeError:
-                continue
-        else:
-            raise ValueError("Impossible de décoder le fichier CSV")
-    
-    elif file_extension in ['.xlsx', '.xls']:
-        df = pd.read_excel(file_path)
-    
-    else:
-        raise ValueError("Format de fichier non supporté")
-    
-    print(f"Colonnes disponibles: {list(df.columns)}")
-    print(f"Shape du DataFrame: {df.shape}")
-    
-    if 'kpi_name' in df.columns and 'value' in df.columns:
-        print("Fichier de résultats existant détecté")
-        kpi_list = df['kpi_name'].dropna().unique().tolist()
-        kpi_list_fr = []
-    else:
-        kpi_name_col = None
-        kpi_name_fr_col = None
-        
-        for col in df.columns:
-            col_lower = col.lower()
-            if 'kpi' in col_lower and 'name' in col_lower and 'fr' not in col_lower:
-                kpi_name_col = col
-            elif 'kpi' in col_lower and 'name' in col_lower and 'fr' in col_lower:
-                kpi_name_fr_col = col
-            elif 'name' in col_lower and kpi_name_col is None:
-                kpi_name_col = col
-            elif 'nom' in col_lower and kpi_name_fr_col is None:
-                kpi_name_fr_col = col
-        
-        if kpi_name_col is None and len(df.columns) > 0:
-            kpi_name_col = df.columns[0]
-        if kpi_name_fr_col is None and len(df.columns) > 1:
-            kpi_name_fr_col = df.columns[1]
-        
-        print(f"Colonne KPI anglais: {kpi_name_col}")
-        print(f"Colonne KPI français: {kpi_name_fr_col}")
-        
-        kpi_list = df[kpi_name_col].dropna().unique().tolist() if kpi_name_col else []
-        kpi_list_fr = df[kpi_name_fr_col].dropna().unique().tolist() if kpi_name_fr_col else []
-    
-    print(f"KPIs anglais chargés: {len(kpi_list)}")
-    print(f"KPIs français chargés: {len(kpi_list_fr)}")
-    
-    all_kpis = kpi_list + kpi_list_fr
-    if all_kpis:
-        kpi_embeddings = kpi_model.encode(all_kpis, convert_to_tensor=True)
-    else:
-        kpi_embeddings = None
-    
-    return df, kpi_list, kpi_list_fr, kpi_embeddings, all_kpis
-
-def extract_text_from_pdf(pdf_path):
-    text_content = ""
+class ChatPdfExtraction:
+    """Extraction progressive d'un PDF déposé dans le chat, rattachée à une UploadSession
     
-    try:
-        with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                text = page.extract_text()
-                if text:
-                    text_content += text + "\n"
-                
-                tables = page.extract_tables()
-                for table in tables:
-                    for row in table:
-                        text_content += " | ".join(str(cell) for cell in row if cell is not None) + "\n"
-                    text_content += "\n"
-    except Exception as e:
-        logger.error(f"Erreur avec pdfplumber: {e}")
+    ``run`` produit les KPIs trouvés jusqu'à la fin du budget de temps; la suite
+    de l'extraction continue alors dans un thread et enrichit la session.
+    Avec le pool d'extraction (ESG_EXTRACTION_WORKERS > 0), le PDF est lu dans
+    un processus de travail (tâche ``extract_chat_pdf``) et ce thread ne fait
+    que suivre son fichier de progression.
+    """
     
-    if len(text_content.strip()) < 100:
-        try:
-            doc = fitz.open(pdf_path)
-            for page in doc:
-                text_content += page.get_text("text") + "\n"
-        except Exception as e:
-            logger.error(f"Erreur avec PyMuPDF: {e}")
-    
-    return text_content
-
-def clean_text(text):
-    lines = text.split('\n')
-    cleaned_lines = []
-    
-    for line in lines:
-        if re.match(r'^\s*\d+\s*$', line):
-            continue
-        if re.match(r'^.*www\.\w+\.com.*$', line):
-            continue
-        if len(line.strip()) < 5:
-            continue
-        cleaned_lines.append(line)
-    
-    return '\n'.join(cleaned_lines)
-
-def split_text_into_chunks(text, max_chars=500000):
-    if len(text) <= max_chars:
-        return [text]
-    
-    chunks = []
-    paragraphs = text.split('\n\n')
-    
-    current_chunk = ""
-    for paragraph in paragraphs:
-        if len(current_chunk) + len(paragraph) < max_chars:
-            current_chunk += paragraph + "\n\n"
+    def __init__(self, upload, pdf_path, kpi_path, kpi_embeddings, all_kpis, kpi_df, min_confidence=0.3,
+                 pdf_name=None, cleanup=()):
+        self.upload = upload
+        self.pdf_path = pdf_path
+        self.cleanup = cleanup
+        self.stats = StreamStats()
+        self.boilerplate = BoilerplateFilter()
+        self.job_stats = {}
+        self.record = None      # profil du job renvoyé par le processus de travail
+        if extraction_workers.enabled:
+            self.batches = self._worker_batches(kpi_path, min_confidence)
         else:
-            if current_chunk:
-                chunks.append(current_chunk)
-            current_chunk = paragraph + "\n\n"
-    
-    if current_chunk:
-        chunks.append(current_chunk)
-    
-    if any(len(chunk) > max_chars for chunk in chunks):
-        refined_chunks = []
-        for chunk in chunks:
-            if len(chunk) <= max_chars:
-                refined_chunks.append(chunk)
-            else:
-                sentences = re.split(r'[.!?]+', chunk)
-                current_refined = ""
-                for sentence in sentences:
-                    if len(current_refined) + len(sentence) < max_chars:
-                        current_refined += sentence + ". "
-                    else:
-                        if current_refined:
-                            refined_chunks.append(current_refined)
-                        current_refined = sentence + ". "
-                if current_refined:
-                    refined_chunks.append(current_refined)
-        chunks = refined_chunks
-    
-    return chunks
-
-def find_relevant_kpis(text, kpi_embeddings, all_kpis, threshold=0.4):
-    if not all_kpis or kpi_embeddings is None:
-        return {}
-        
-    cleaned_text = clean_text(text)
+            self.batches = iter_chat_pdf_kpis(pdf_path, kpi_embeddings, all_kpis, kpi_df, min_confidence,
+                                              stats=self.stats, boilerplate=self.boilerplate)
+        upload.add_kpis([], pdf_name=pdf_name or os.path.basename(pdf_path))
+        upload.set_status('processing')
     
-    print(f"Texte nettoyé: {len(cleaned_text)} caractères")
-    
-    if len(cleaned_text) > 1000000:
-        chunks = split_text_into_chunks(cleaned_text)
-        print(f"Texte divisé en {len(chunks)} chunks")
-    else:
-        chunks = [cleaned_text]
-    
-    relevant_kpis = defaultdict(list)
+    def _worker_batches(self, kpi_path, min_confidence):
+        """Lots de KPIs lus dans le fichier de progression de la tâche (une ligne JSON par fenêtre)"""
+        progress_path = os.path.abspath(f"{self.pdf_path}.progress")
+        open(progress_path, 'w').close()
+        task_id = extraction_workers.submit('extract_chat_pdf', os.path.abspath(self.pdf_path),
+                                            os.path.abspath(kpi_path), progress_path, min_confidence)
+        offset, done = 0, False
+        try:
+            while True:
+                try:
+                    finished, record = extraction_workers.poll(task_id)
+                except WorkerError:
+                    done = True     # tâche en échec ou déjà abandonnée par poll
+                    raise
+                with open(progress_path, encoding='utf-8') as progress:
+                    progress.seek(offset)
+                    lines = progress.read()
+                # Lignes complètes seulement: la dernière peut être en cours d'écriture
+                complete = lines[:lines.rfind('\n') + 1]
+                offset += len(complete.encode('utf-8'))
+                for line in complete.splitlines():
+                    batch = json.loads(line)
+                    self.stats.pages = batch['pages']
+                    yield batch['kpis']
+                if finished:
+                    done, self.record = True, record
+                    return
+                time.sleep(POLL_INTERVAL)
+        finally:
+            if not done:
+                # Abandon: la tâche s'arrête à sa prochaine fenêtre en trouvant le fichier supprimé
+                extraction_workers.abandon(task_id)
+            try:
+                os.remove(progress_path)
+            except OSError:
+                pass
     
-    for chunk_idx, chunk in enumerate(chunks):
-        print(f"Traitement du chunk {chunk_idx + 1}/{len(chunks)}")
-        
+    def run(self, time_budget=CHAT_PDF_TIME_BUDGET, background=True):
+        """Générateur: lots de KPIs (une liste par fenêtre de pages) jusqu'à ``time_budget`` secondes"""
+        deadline = time.monotonic() + time_budget
+        exhausted = False
         try:
-            if len(chunk) > 10000:
-                sentences = re.split(r'[.!?]+', chunk)
-                sentences = [s.strip() for s in sentences if len(s.strip()) > 20]
+            for found in self.batches:
+                self.upload.add_kpis(found)
+                yield found
+                if time.monotonic() >= deadline:
+                    break
             else:
-                doc = nlp(chunk)
-                sentences = [sent.text for sent in doc.sents if len(sent.text) > 20]
+                exhausted = True
         except Exception as e:
-            print(f"Erreur segmentation: {e}")
-            sentences = re.split(r'[.!?]+', chunk)
-            sentences = [s.strip() for s in sentences if len(s.strip()) > 20]
-        
-        print(f"Chunk {chunk_idx + 1}: {len(sentences)} phrases à traiter")
-        
-        for i, sentence in enumerate(sentences):
-            if i % 50 == 0 and i > 0:
-                print(f"  Traité {i}/{len(sentences)} phrases...")
-                
-            try:
-                sentence_embedding = kpi_model.encode(sentence, convert_to_tensor=True)
-                cos_scores = util.pytorch_cos_sim(sentence_embedding, kpi_embeddings)[0]
-                top_results = np.argsort(-cos_scores.cpu().numpy())[:3]
-                
-                for idx in top_results:
-                    if cos_scores[idx] > threshold:
-                        kpi_name = all_kpis[idx]
-                        if not any(match['sentence'] == sentence for match in relevant_kpis[kpi_name]):
-                            relevant_kpis[kpi_name].append({
-                                'sentence': sentence,
-                                'score': float(cos_scores[idx])
-                            })
-            except Exception as e:
-                print(f"Erreur traitement phrase: {e}")
-                continue
-    
-    print(f"KPIs pertinents trouvés: {len(relevant_kpis)}")
-    for kpi_name, matches in relevant_kpis.items():
-        print(f"  - {kpi_name}: {len(matches)} correspondances")
-    
-    return relevant_kpis
-
-def extract_kpi_values(text, kpi_name):
-    patterns = [
-        r"(\d{1,3}(?:,\d{3})*(?:\.\d+)?)\s*(?:tons?|tonnes|t|%|kg|kWh|CO2|CO₂|ppm|ppb|µg/m³|mg/m³|employees|people|€|EUR|USD|\$|m³|MWh|GWh|TJ)",
-        r"(\d{1,3}(?:,\d{3})*(?:\.\d+)?\%)(?:\s|$)",
-        r"(?:is|was|are|were|:|\=)\s*(\d{1,3}(?:,\d{3})*(?:\.\d+)?)",
-        r"(?:value of|rate of|amount of|total|reduction of|approximately|about)\s*(\d{1,3}(?:,\d{3})*(?:\.\d+)?)",
-        r"\b(\d{1,3}(?:,\d{3})*(?:\.\d+)?)\s*(?:million|billion|thousand)?\s*(?:tons?|tonnes|percent|%)?"
-    ]
+            logger.error(f"Erreur extraction PDF chat: {e}")
+            self._close('error')
+            raise
+        finally:
+            if self.upload.status == 'processing':
+                if exhausted or not background:
+                    self._close('done' if exhausted else 'partial')
+                else:
+                    Thread(target=self._finish, daemon=True, name='chat-pdf-extraction').start()
     
-    values = []
-    seen_values = set()
+    def _finish(self):
+        try:
+            for found in self.batches:
+                self.upload.add_kpis(found)
+            self._close('done')
+        except Exception as e:
+            logger.error(f"Erreur extraction PDF chat (tâche de fond): {e}")
+            self._close('error')
     
-    for pattern in patterns:
-        matches = re.finditer(pattern, text, re.IGNORECASE)
-        for match in matches:
-            value_str = match.group(1).replace(',', '')
+    def _close(self, status):
+        self.batches.close()
+        if self.record is not None:
+            # Métriques et profil restés dans le processus de travail
+            observe_worker_job(self.record)
+            self.job_stats.update(self.record)
+        elif not extraction_workers.enabled:
+            finish_job(self.stats, 'process_pdf_for_chat', os.path.basename(self.pdf_path), self.job_stats,
+                       self.boilerplate, window_pages=CHAT_WINDOW_PAGES, kpis_extracted=len(self.upload.kpis),
+                       status=status)
+        for path in self.cleanup:
             try:
-                multiplier = 1
-                if re.search(r'million', match.group(0), re.IGNORECASE):
-                    multiplier = 1000000
-                elif re.search(r'billion', match.group(0), re.IGNORECASE):
-                    multiplier = 1000000000
-                elif re.search(r'thousand', match.group(0), re.IGNORECASE):
-                    multiplier = 1000
-                
-                numeric_value = float(value_str) * multiplier if '.' in value_str else int(value_str) * multiplier
-                unit = determine_unit(text, kpi_name)
-                
-                value_id = f"{numeric_value}_{unit}"
-                
-                if (value_id not in seen_values):
-                    values.append({
-                        'value': numeric_value,
-                        'unit': unit
-                    })
-                    seen_values.add(value_id)
-            except ValueError:
-                continue
-    
-    return values
-
-def determine_unit(text, kpi_name):
-    unit_patterns = {
-        r'tons?|tonnes|tCO2e|t CO2e': 'tons',
-        r'kg|kilograms': 'kg',
-        r'%|percent|percentage': '%',
-        r'kWh|kilowatt-hours': 'kWh',
-        r'MWh|megawatt-hours': 'MWh',
-        r'GWh|gigawatt-hours': 'GWh',
-        r'CO2|CO₂|carbon dioxide': 'tCO2e',
-        r'ppm|parts per million': 'ppm',
-        r'employees|workers|people': 'people',
-        r'€|EUR|USD|\$|dollars': 'currency',
-        r'm³|cubic meters': 'm³'
-    }
-    
-    for pattern, u in unit_patterns.items():
-        if re.search(pattern, text, re.IGNORECASE):
-            return u
-    
-    kpi_lower = kpi_name.lower()
-    if any(term in kpi_lower for term in ['rate', 'ratio', 'percentage', 'coverage', 'reduction']):
-        return '%'
-    elif any(term in kpi_lower for term in ['emission', 'ghg', 'co2', 'carbon']):
-        return 'tCO2e'
-    elif any(term in kpi_lower for term in ['energy', 'consumption', 'electricity']):
-        return 'kWh'
-    elif any(term in kpi_lower for term in ['water', 'usage']):
-        return 'm³'
-    
-    return 'unknown'
-
-def filter_results(results, min_confidence=0.3):
-    filtered = []
-    seen = set()
-    
-    results_sorted = sorted(results, key=lambda x: x['confidence'], reverse=True)
-    
-    for result in results_sorted:
-        identifier = f"{result['kpi_name']}_{result['value']}_{result['unit']}_{result['source_file']}"
-        
-        if (identifier not in seen and 
-            result['confidence'] >= min_confidence):
-            filtered.append(result)
-            seen.add(identifier)
-    
-    kpi_groups = defaultdict(list)
-    for result in filtered:
-        kpi_groups[result['kpi_name']].append(result)
-    
-    final_results = []
-    for kpi_name, occurrences in kpi_groups.items():
-        best_occurrence = max(occurrences, key=lambda x: x['confidence'])
-        final_results.append(best_occurrence)
-    
-    return final_results
-
-def process_pdf_for_chat(pdf_path, kpi_embeddings, all_kpis, kpi_df, min_confidence=0.3):
-    """Version simplifiée pour le traitement rapide de PDF dans le chat"""
-    logger.info(f"Traitement rapide du PDF pour le chat: {os.path.basename(pdf_path)}")
-    
-    text = extract_text_from_pdf(pdf_path)
-    
-    if not text or len(text.strip()) < 100:
-        logger.warning(f"Peu de texte extrait du PDF pour le chat")
-        return []
-    
-    if not all_kpis or kpi_embeddings is None:
-        return []
-    
-    # Traitement accéléré avec seuil de confiance réduit
-    relevant_kpis = find_relevant_kpis(text, kpi_embeddings, all_kpis, threshold=0.3)
-    
-    results = []
-    
-    for kpi_name, matches in relevant_kpis.items():
-        matches_sorted = sorted(matches, key=lambda x: x['score'], reverse=True)
-        
-        for match in matches_sorted[:2]:  # Limiter à 2 meilleures correspondances
-            sentence = match['sentence']
-            values = extract_kpi_values(sentence, kpi_name)
-            
-            for val in values[:1]:  # Prendre seulement la première valeur
-                topic = "Unknown"
-                topic_fr = "Inconnu"
-                
-                try:
-                    if hasattr(kpi_df, 'columns') and len(kpi_df.columns) > 0:
-                        kpi_matches = []
-                        for col_idx in range(min(2, len(kpi_df.columns))):
-                            if kpi_name in kpi_df.iloc[:, col_idx].values:
-                                kpi_matches = kpi_df[kpi_df.iloc[:, col_idx] == kpi_name]
-                                break
-                        
-                        if not kpi_matches.empty:
-                            row = kpi_matches.iloc[0]
-                            if len(kpi_df.columns) > 2:
-                                topic = str(row.iloc[2]) if pd.notna(row.iloc[2]) else "Unknown"
-                            if len(kpi_df.columns) > 3:
-                                topic_fr = str(row.iloc[3]) if pd.notna(row.iloc[3]) else "Inconnu"
-                except Exception as e:
-                    print(f"⚠️ Erreur métadonnées KPI: {e}")
-                
-                result_item = {
-                    'kpi_name': kpi_name,
-                    'value': val['value'],
-                    'unit': val['unit'],
-                    'source_file': os.path.basename(pdf_path),
-                    'topic': topic,
-                    'topic_fr': topic_fr,
-                    'confidence': match['score'],
-                    'extraction_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                }
-                
-                results.append(result_item)
-    
-    filtered_results = filter_results(results, min_confidence)
-    logger.info(f"{len(filtered_results)} KPIs extraits pour le chat")
-    
-    return filtered_results
+                os.remove(path)
+            except OSError:
+                pass
+        self.upload.set_status(status)
+        print(f"📄 Extraction chat {status}: {len(self.upload.kpis)} KPIs ({self.stats.pages} pages)")
 
 # =============================================================================
 # ROUTES API
@@ -929,7 +694,12 @@ def health_check():
         "status": "healthy", 
         "message": "ESG KPI Extractor API is running",
         "ollama_available": esg_chatbot.ollama_available,
-        "ollama_model": esg_chatbot.current_model
+        "ollama_model": esg_chatbot.current_model,
+        "ollama_health": esg_chatbot.ollama.status(),
+        "llm_queue": esg_chatbot.scheduler.status(),
+        "token_counter": token_counter.stats(),
+        "chat_uploads": chat_uploads.stats(),
+        "extraction_workers": extraction_workers.stats()
     })
 
 @app.route('/api/chatbot-status', methods=['GET'])
@@ -940,22 +710,37 @@ def chatbot_status():
         "status": "ready"
     })
 
-@app.route('/api/esg-chat', methods=['POST'])
-def esg_chat():
-    """Endpoint pour le chatbot ESG intelligent avec support des PDF uploadés"""
-    try:
-        data = request.get_json() or {}
-        user_message = data.get('message', '').strip()
-        company_name = data.get('company_name', '')
-        pdf_data = data.get('pdf_data')  # Données PDF extraites
-        
-        if not user_message:
-            return jsonify({"error": "Message vide"}), 400
-        
-        print(f"💬 Requête chat reçue: {user_message[:100]}...")
-        print(f"🏢 Entreprise: {company_name}")
-        print(f"📄 Données PDF: {len(pdf_data) if pdf_data else 0} KPIs")
-        
+def esg_chat_request(data):
+    """Préparation d'une question /api/esg-chat: (réponse immédiate (corps, code), None) ou (None, à générer)
+    
+    Les questions factuelles (routeur) et les erreurs sont résolues ici; sinon
+    le dict retourné porte les données et le profil à passer au modèle.
+    """
+    user_message = data.get('message', '').strip()
+    company_name = data.get('company_name', '')
+    upload_id = data.get('upload_id')
+    pdf_data = data.get('pdf_data')  # Données PDF extraites (ancien format)
+    
+    if not user_message:
+        return ({"error": "Message vide"}, 400), None
+    
+    upload = None
+    if upload_id:
+        upload = chat_uploads.get(upload_id)
+        if upload is None:
+            return ({"error": "Document expiré ou inconnu, veuillez le déposer à nouveau",
+                     "upload_id": upload_id}, 404), None
+    
+    print(f"💬 Requête chat reçue: {user_message[:100]}...")
+    print(f"🏢 Entreprise: {company_name}")
+    print(f"📄 Données PDF: {len(upload.kpis) if upload else len(pdf_data) if pdf_data else 0} KPIs")
+    
+    df = None
+    if upload is not None:
+        # KPIs du document déposé, table construite une fois par état de la session
+        company_data = upload.frame()
+        company_name = company_name or upload.pdf_name
+    else:
         # Charger les données existantes
         df = load_existing_results()
         
@@ -971,37 +756,102 @@ def esg_chat():
             company_data = df[df['source_file'] == company_name]
         else:
             company_data = df
-        
-        # Préparer les données pour l'analyse
-        company_info = {}
-        if company_name:
-            company_info = {
-                'entreprise': company_name,
-                'total_kpis': len(company_data),
-                'domaine_principal': company_data['topic_fr'].mode().iloc[0] if not company_data.empty and 'topic_fr' in company_data.columns else 'Non spécifié'
-            }
-        elif pdf_data:
-            # Utiliser les données du PDF comme contexte
-            company_info = {
-                'entreprise': 'Document PDF uploadé',
-                'total_kpis': len(pdf_data),
-                'domaine_principal': 'Analyse en temps réel'
-            }
-        
-        # Générer la réponse intelligente et détaillée
-        print("🧠 Génération de la réponse avec Mistral...")
-        ai_response = esg_chatbot.generate_esg_insight(company_data, company_info, user_message)
-        
-        response_data = {
-            "response": ai_response,
-            "company": company_name or "PDF Uploadé",
-            "ai_used": esg_chatbot.ollama_available,
-            "pdf_data_included": pdf_data is not None,
-            "timestamp": datetime.now().isoformat()
+    
+    # Préparer les données pour l'analyse
+    company_info = {}
+    if upload is not None:
+        company_info = {
+            'entreprise': upload.pdf_name or 'Document PDF uploadé',
+            'total_kpis': len(company_data),
+            'domaine_principal': company_data['topic_fr'].mode().iloc[0]
+            if not company_data.empty and 'topic_fr' in company_data.columns else 'Non spécifié'
+        }
+    elif company_name:
+        company_info = {
+            'entreprise': company_name,
+            'total_kpis': len(company_data),
+            'domaine_principal': company_data['topic_fr'].mode().iloc[0] if not company_data.empty and 'topic_fr' in company_data.columns else 'Non spécifié'
         }
+    elif pdf_data:
+        # Utiliser les données du PDF comme contexte
+        company_info = {
+            'entreprise': 'Document PDF uploadé',
+            'total_kpis': len(pdf_data),
+            'domaine_principal': 'Analyse en temps réel'
+        }
+    
+    reply = {
+        "company": company_name or "PDF Uploadé",
+        "pdf_data_included": pdf_data is not None or upload is not None,
+        "upload_id": upload.id if upload else None,
+    }
+    
+    # Questions factuelles: réponse calculée sur les données, sans Mistral
+    route_start = time.perf_counter()
+    try:
+        if upload is not None:
+            version = upload.version
+        else:
+            version = None if pdf_data else f"{file_version(OUTPUT_CSV)}:{company_name}"
+        routed = query_router.route(user_message, df=company_data, version=version,
+                                    companies=[company_name] if company_name else None)
+    except Exception as e:
+        logger.error(f"Erreur routage question: {e}")
+        routed = None
+    route_ms = round((time.perf_counter() - route_start) * 1000, 2)
+    
+    if routed is not None:
+        print(f"⚡ Réponse directe ({routed['intent']}) en {route_ms} ms")
+        return ({
+            "response": routed["answer"],
+            **reply,
+            "ai_used": False,
+            "route": "fast_path",
+            "intent": routed["intent"],
+            "route_time_ms": route_ms,
+            "data": {"kpi": routed["kpi"], "companies": routed["companies"], "rows": routed["rows"]},
+            "timestamp": datetime.now().isoformat()
+        }, 200), None
+    
+    # Générer la réponse intelligente et détaillée
+    print("🧠 Génération de la réponse avec Mistral...")
+    insight = None
+    if company_name and upload is None and not pdf_data and not company_data.empty:
+        insight = insight_worker.ensure(company_name, company_data, df)
+    return None, {"message": user_message, "company_data": company_data, "company_info": company_info,
+                  "insight": insight, "reply": reply, "route_ms": route_ms}
+
+def esg_chat_payload(pending, ai_response, cache_info):
+    print(f"✅ Réponse générée avec succès ({len(ai_response)} caractères)")
+    return {
+        "response": ai_response,
+        **pending["reply"],
+        "ai_used": esg_chatbot.ollama_available,
+        "cache": cache_info,
+        "route": "llm",
+        "route_time_ms": pending["route_ms"],
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.route('/api/esg-chat', methods=['POST'])
+def esg_chat():
+    """Endpoint pour le chatbot ESG intelligent avec support des PDF uploadés
+    
+    Un PDF déposé via /api/chat-upload-pdf est désigné par ``upload_id``: ses
+    KPIs sont lus dans le magasin de session, sans renvoyer ni reconcaténer les
+    données. ``pdf_data`` (liste complète de KPIs) reste accepté pour les
+    anciens clients.
+    """
+    try:
+        reply, pending = esg_chat_request(request.get_json() or {})
+        if reply is not None:
+            return jsonify(reply[0]), reply[1]
         
-        print(f"✅ Réponse générée avec succès ({len(ai_response)} caractères)")
-        return jsonify(response_data)
+        cache_info = {}
+        ai_response = esg_chatbot.generate_esg_insight(pending["company_data"], pending["company_info"],
+                                                       pending["message"], cache_info=cache_info,
+                                                       insight=pending["insight"])
+        return jsonify(esg_chat_payload(pending, ai_response, cache_info))
         
     except Exception as e:
         logger.error(f"Erreur chat ESG: {e}")
@@ -1013,81 +863,168 @@ def esg_chat():
 # NOUVELLE ROUTE POUR UPLOAD DE PDF DANS LE CHAT
 # =============================================================================
 
+def start_chat_pdf_extraction():
+    """Sauvegarde des fichiers du formulaire et préparation de l'extraction progressive
+    
+    Retourne (extraction, None) ou (None, réponse d'erreur Flask).
+    """
+    if 'pdf_file' not in request.files or 'kpi_file' not in request.files:
+        return None, (jsonify({"error": "Fichier PDF et fichier KPI requis"}), 400)
+    
+    pdf_file = request.files['pdf_file']
+    kpi_file = request.files['kpi_file']
+    
+    if pdf_file.filename == '' or kpi_file.filename == '':
+        return None, (jsonify({"error": "Aucun fichier sélectionné"}), 400)
+    
+    if not (allowed_file(pdf_file.filename) and allowed_file(kpi_file.filename)):
+        return None, (jsonify({"error": "Type de fichier non autorisé"}), 400)
+    
+    # Sauvegarder les fichiers temporairement (supprimés à la fin de l'extraction)
+    pdf_filename = secure_filename(f"chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{pdf_file.filename}")
+    kpi_filename = secure_filename(f"chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{kpi_file.filename}")
+    
+    pdf_path = os.path.join(app.config['UPLOAD_FOLDER'], pdf_filename)
+    kpi_path = os.path.join(app.config['UPLOAD_FOLDER'], kpi_filename)
+    
+    pdf_file.save(pdf_path)
+    kpi_file.save(kpi_path)
+    
+    print(f"=== UPLOAD PDF CHAT ===")
+    print(f"PDF: {pdf_filename}")
+    print(f"KPI: {kpi_filename}")
+    
+    # Charger les KPIs
+    try:
+        kpi_df, kpi_list, kpi_list_fr, kpi_embeddings, all_kpis = load_kpi_list(kpi_path)
+    except Exception as e:
+        print(f"❌ Erreur chargement fichier KPI: {e}")
+        all_kpis, error = [], (jsonify({"error": f"Erreur chargement fichier KPI: {str(e)}"}), 400)
+    else:
+        error = (jsonify({"error": "Aucun KPI trouvé dans le fichier"}), 400)
+    
+    if len(all_kpis) == 0:
+        for path in (pdf_path, kpi_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return None, error
+    
+    # KPIs gardés côté serveur: les messages suivants n'envoient que l'upload_id
+    upload = chat_uploads.get_or_create(request.form.get('upload_id'))
+    extraction = ChatPdfExtraction(upload, pdf_path, kpi_path, kpi_embeddings, all_kpis, kpi_df, min_confidence=0.3,
+                                   pdf_name=pdf_file.filename, cleanup=(pdf_path, kpi_path))
+    return extraction, None
+
+def chat_pdf_options():
+    """Budget de temps (secondes) et poursuite en tâche de fond demandés par le client"""
+    try:
+        time_budget = float(request.form.get('time_budget', CHAT_PDF_TIME_BUDGET))
+    except ValueError:
+        time_budget = CHAT_PDF_TIME_BUDGET
+    background = request.form.get('background', 'true').lower() not in ('0', 'false', 'no')
+    return max(time_budget, 0.0), background
+
 @app.route('/api/chat-upload-pdf', methods=['POST'])
 def chat_upload_pdf():
-    """Endpoint pour uploader un PDF directement dans le chat"""
+    """Endpoint pour uploader un PDF directement dans le chat
+    
+    Les KPIs trouvés dans le budget de temps (``time_budget``, secondes) sont
+    renvoyés; si le PDF n'est pas entièrement lu, l'extraction continue en
+    tâche de fond (``background``, par défaut) et ``status`` vaut "processing":
+    GET /api/chat-uploads/<upload_id> suit l'avancement.
+    """
     try:
-        if 'pdf_file' not in request.files or 'kpi_file' not in request.files:
-            return jsonify({"error": "Fichier PDF et fichier KPI requis"}), 400
-        
-        pdf_file = request.files['pdf_file']
-        kpi_file = request.files['kpi_file']
-        
-        if pdf_file.filename == '' or kpi_file.filename == '':
-            return jsonify({"error": "Aucun fichier sélectionné"}), 400
-        
-        if not (allowed_file(pdf_file.filename) and allowed_file(kpi_file.filename)):
-            return jsonify({"error": "Type de fichier non autorisé"}), 400
-        
-        # Sauvegarder les fichiers temporairement
-        pdf_filename = secure_filename(f"chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{pdf_file.filename}")
-        kpi_filename = secure_filename(f"chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{kpi_file.filename}")
-        
-        pdf_path = os.path.join(app.config['UPLOAD_FOLDER'], pdf_filename)
-        kpi_path = os.path.join(app.config['UPLOAD_FOLDER'], kpi_filename)
-        
-        pdf_file.save(pdf_path)
-        kpi_file.save(kpi_path)
-        
-        print(f"=== UPLOAD PDF CHAT ===")
-        print(f"PDF: {pdf_filename}")
-        print(f"KPI: {kpi_filename}")
-        
-        # Charger les KPIs
-        try:
-            kpi_df, kpi_list, kpi_list_fr, kpi_embeddings, all_kpis = load_kpi_list(kpi_path)
-            
-            if len(all_kpis) == 0:
-                return jsonify({"error": "Aucun KPI trouvé dans le fichier"}), 400
-                
-        except Exception as e:
-            print(f"❌ Erreur chargement fichier KPI: {e}")
-            return jsonify({"error": f"Erreur chargement fichier KPI: {str(e)}"}), 400
+        extraction, error = start_chat_pdf_extraction()
+        if error:
+            return error
+        time_budget, background = chat_pdf_options()
+        upload = extraction.upload
         
-        # Traitement rapide du PDF
         try:
-            extracted_kpis = process_pdf_for_chat(pdf_path, kpi_embeddings, all_kpis, kpi_df, min_confidence=0.3)
+            for _ in extraction.run(time_budget, background):
+                pass
         except Exception as e:
             print(f"❌ Erreur traitement PDF: {e}")
             return jsonify({"error": f"Erreur traitement PDF: {str(e)}"}), 500
         
-        # Nettoyer les fichiers temporaires
-        try:
-            os.remove(pdf_path)
-            os.remove(kpi_path)
-        except:
-            pass
+        extracted_kpis = list(upload.kpis)
         
         # Préparer la réponse
         response_data = {
             "success": True,
-            "pdf_name": pdf_filename,
+            "upload_id": upload.id,
+            "pdf_name": upload.pdf_name,
+            "status": upload.status,
             "kpis_extracted": len(extracted_kpis),
             "extracted_data": extracted_kpis,
+            "pages_processed": extraction.stats.pages,
+            "job_stats": extraction.job_stats,
             "summary": {
                 "total_kpis": len(extracted_kpis),
                 "high_confidence": len([k for k in extracted_kpis if k.get('confidence', 0) > 0.7]),
                 "domains": list(set(k.get('topic_fr', 'Inconnu') for k in extracted_kpis))
-            }
+            },
+            "expires_in_s": chat_uploads.idle_ttl
         }
         
-        print(f"✅ PDF traité pour le chat: {len(extracted_kpis)} KPIs extraits")
+        print(f"✅ PDF traité pour le chat ({upload.status}): {len(extracted_kpis)} KPIs extraits")
         return jsonify(response_data), 200
         
     except Exception as e:
         logger.error(f"Erreur upload PDF chat: {e}")
         return jsonify({"error": "Erreur lors du traitement du PDF"}), 500
 
+@app.route('/api/chat-upload-pdf/stream', methods=['POST'])
+def chat_upload_pdf_stream():
+    """Upload de PDF dans le chat en flux (Server-Sent Events)
+    
+    Événements: ``kpis`` {"kpis", "total"} dès qu'une fenêtre de pages apporte
+    des KPIs nouveaux ou plus fiables, ``progress`` {"pages", "elapsed_s"} après
+    chaque fenêtre, ``done`` {"upload_id", "status", "total"} ou ``error``.
+    """
+    extraction, error = start_chat_pdf_extraction()
+    if error:
+        return error
+    time_budget, background = chat_pdf_options()
+    upload = extraction.upload
+    
+    def generate():
+        start_time = time.time()
+        yield sse_event({"upload_id": upload.id, "pdf_name": upload.pdf_name, "time_budget_s": time_budget},
+                        event='meta')
+        try:
+            for found in extraction.run(time_budget, background):
+                if found:
+                    yield sse_event({"kpis": found, "total": len(upload.kpis)}, event='kpis')
+                yield sse_event({"pages": extraction.stats.pages,
+                                 "elapsed_s": round(time.time() - start_time, 3)}, event='progress')
+        except Exception as e:
+            yield sse_event({"error": f"Erreur traitement PDF: {str(e)}"}, event='error')
+            return
+        yield sse_event({"upload_id": upload.id, "status": upload.status, "total": len(upload.kpis),
+                         "pages_processed": extraction.stats.pages,
+                         "expires_in_s": chat_uploads.idle_ttl}, event='done')
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/chat-uploads/<upload_id>', methods=['GET'])
+def get_chat_upload(upload_id):
+    """Résumé d'un PDF déposé dans le chat (KPIs gardés côté serveur)"""
+    upload = chat_uploads.get(upload_id)
+    if upload is None:
+        return jsonify({"error": "Document expiré ou inconnu"}), 404
+    return jsonify(upload.summary())
+
+@app.route('/api/chat-uploads/<upload_id>', methods=['DELETE'])
+def delete_chat_upload(upload_id):
+    """Oublier un PDF déposé dans le chat"""
+    if not chat_uploads.delete(upload_id):
+        return jsonify({"error": "Document expiré ou inconnu"}), 404
+    return jsonify({"deleted": upload_id})
+
 # =============================================================================
 # ROUTES EXISTANTES (simplifiées pour l'exemple)
 # =============================================================================
@@ -1139,13 +1076,50 @@ def export_excel():
 # DÉMARRAGE DE L'APPLICATION
 # =============================================================================
 
+# =============================================================================
+# ROUTE ASYNCHRONE (ESG_ASYNC=1): la génération Mistral n'occupe aucun thread
+# =============================================================================
+
+async def generate_esg_insight_async(kpi_data, company_data, user_question, cache_info=None, insight=None):
+    """``esg_chatbot.generate_esg_insight`` sous asyncio (préparation dans le pool de run_sync)"""
+    call = esg_chatbot.insight_call(kpi_data, company_data, user_question)
+    try:
+        answer = await async_server.run_sync(esg_chatbot.prepare_insight, call, cache_info, insight)
+        if answer is not None:
+            return answer
+        print(f"🔍 Envoi de la requête à Ollama Mistral...")
+        result = await esg_chatbot.async_client.generate(call["prompt"], model=esg_chatbot.current_model,
+                                                         options=INSIGHT_OPTIONS, endpoint='esg_insight')
+        return await async_server.run_sync(esg_chatbot.finish_insight, call, result)
+    except Exception as e:
+        return await async_server.run_sync(esg_chatbot.insight_fallback, call, e)
+
+@async_server.route('POST', '/api/esg-chat')
+async def esg_chat_async(request):
+    try:
+        reply, pending = await async_server.run_sync(esg_chat_request, await read_json(request))
+        if reply is not None:
+            return json_response(*reply)
+        
+        cache_info = {}
+        ai_response = await generate_esg_insight_async(pending["company_data"], pending["company_info"],
+                                                       pending["message"], cache_info=cache_info,
+                                                       insight=pending["insight"])
+        return json_response(esg_chat_payload(pending, ai_response, cache_info))
+    
+    except Exception as e:
+        logger.error(f"Erreur chat ESG: {e}")
+        return json_response({"error": "Erreur lors du traitement de votre requête"}, 500)
+
+async_server.on_cleanup.append(esg_chatbot.async_client.close)
+
 if __name__ == '__main__':
     print("🚀 Démarrage de l'API ESG Analytics avec Chatbot Intelligent...")
     print("=" * 60)
     print("📊 Fonctionnalités ESG Avancées:")
     print("  ✅ Extraction automatique de KPIs ESG")
     print(f"  🤖 Chatbot expert avec Ollama Mistral: {'✅ CONNECTÉ' if esg_chatbot.ollama_available else '⚠️ HORS LIGNE'}")
-    print("  📄 Upload de PDF directement dans le chat")
+    print("  📄 Upload de PDF directement dans le chat (résultats progressifs)")
     print("  📈 Benchmarking approfondi entre entreprises")
     print("  💡 Recommandations stratégiques personnalisées")
     print("=" * 60)
@@ -1153,4 +1127,11 @@ if __name__ == '__main__':
     print(f"🌐 URL: http://localhost:5001")
     print("=" * 60)
     
-    app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
+    insight_worker.start()
+    if extraction_workers.enabled:
+        extraction_workers.start()
+        print(f"⚙️ Pool d'extraction: {extraction_workers.workers} processus (ESG_EXTRACTION_WORKERS)")
+    if ASYNC_ENABLED:
+        async_server.serve(host='0.0.0.0', port=5001)
+    else:
+        app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
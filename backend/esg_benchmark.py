@@ -0,0 +1,197 @@
+"""Benchmarking multi-entreprises en map-reduce.
+
+Un seul prompt contenant toutes les entreprises dépasse ``num_ctx`` dès une
+dizaine d'entreprises. Ici chaque entreprise est analysée séparément (map) à
+partir de son profil précalculé et de ses KPIs du type demandé; les analyses
+sont générées en parallèle (au plus ``BENCHMARK_WORKERS`` requêtes dans la file
+LLM, l'ordonnanceur bornant les générations simultanées) ou lues dans un cache
+indexé par l'empreinte des données de l'entreprise: ajouter une entreprise ne
+recalcule pas les autres. Un prompt de synthèse court (reduce), dont la taille
+est bornée par ``REDUCE_TOKEN_BUDGET``, fusionne les analyses.
+
+``map_async`` fait la même chose sous asyncio (``AsyncOllamaClient``), sans
+thread par analyse.
+"""
+import os
+import re
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from esg_llm_cache import LLMResponseCache, cache_key
+from esg_insights import data_hash, profile_text
+from esg_ollama import generation_stats
+from esg_prompt import compact_table, token_counter
+from esg_scheduler import PRIORITY_ANALYSIS
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_CACHE_PATH = os.environ.get('ESG_BENCHMARK_CACHE', 'benchmark_cache.sqlite')
+BENCHMARK_WORKERS = int(os.environ.get('ESG_BENCHMARK_WORKERS', 4))   # analyses d'un benchmark en file à la fois
+MAP_KPIS = 12               # KPIs du type demandé montrés au modèle par entreprise
+REDUCE_TOKEN_BUDGET = 1500  # jetons d'analyses dans le prompt de synthèse, quel que soit le nombre d'entreprises
+MIN_ANALYSIS_TOKENS = 60
+
+MAP_OPTIONS = {"temperature": 0.2, "num_predict": 250, "num_ctx": 2048}
+MAP_SYSTEM = "Expert en analyse ESG. Réponds en français, de façon concise et factuelle."
+
+KPI_TYPE_TOPICS = {
+    'environmental': re.compile(r"environ|émis|emission|énergie|energy|eau|water|déchet|waste|climat|climate|"
+                                r"carbon|ghg|biodivers", re.IGNORECASE),
+    'social': re.compile(r"social|diversit|employ|salari|santé|health|sécurité|safety|formation|training|"
+                         r"droits|human", re.IGNORECASE),
+    'governance': re.compile(r"gouvernance|governance|éthique|ethic|conseil|board|corruption|conformité|"
+                             r"compliance|rémunération", re.IGNORECASE),
+}
+
+
+def kpi_type_rows(company_df, kpi_type):
+    """Lignes du type de KPI demandé (toutes si le type est inconnu ou absent)"""
+    pattern = KPI_TYPE_TOPICS.get(str(kpi_type).lower())
+    if pattern is None:
+        return company_df
+    topics = company_df.get('topic_fr', company_df.get('topic'))
+    if topics is None:
+        return company_df
+    return company_df[topics.astype(str).str.contains(pattern, na=False)]
+
+
+def benchmark_table(frames, kpi_type):
+    """Tableau compact: KPIs du type demandé et confiance moyenne par entreprise"""
+    lines = ["Entreprise | KPIs (total) | KPIs du type | Confiance moyenne"]
+    for company, company_df in frames.items():
+        rows = kpi_type_rows(company_df, kpi_type)
+        confidence = company_df['confidence'].mean() if 'confidence' in company_df.columns else float('nan')
+        lines.append(f"{company} | {len(company_df)} | {len(rows)} | {confidence:.2f}")
+    return "\n".join(lines)
+
+
+def map_prompt(company, kpi_type, company_df, profile=None):
+    rows = kpi_type_rows(company_df, kpi_type)
+    if 'confidence' in rows.columns:
+        rows = rows.sort_values('confidence', ascending=False)
+    kpis = compact_table(rows.head(MAP_KPIS), columns=('kpi_name', 'value', 'unit'), prefix="- ") \
+        or "- aucun KPI de ce type extrait"
+    header = profile_text(profile) if profile else f"ENTREPRISE: {company}"
+    return (f"Analyse la performance ESG ({kpi_type}) de {company} en 4 phrases au plus: points forts, "
+            f"points faibles, données manquantes. N'invente aucun chiffre.\n\n{header}\n\n"
+            f"KPIs {kpi_type} ({len(rows)} extraits):\n{kpis}")
+
+
+def _clip(text, max_tokens):
+    """Texte réduit à ``max_tokens`` jetons, de préférence en fin de phrase"""
+    text = " ".join(str(text).split())
+    if token_counter.count(text) <= max_tokens:
+        return text
+    cut = token_counter.truncate(text, max_tokens)
+    end = cut.rfind('. ')
+    return cut[:end + 1] if end > len(cut) // 2 else cut.rstrip() + "…"
+
+
+def reduce_prompt(kpi_type, analyses, table):
+    """Prompt de synthèse: analyses par entreprise tronquées pour tenir dans REDUCE_TOKEN_BUDGET"""
+    limit = max(MIN_ANALYSIS_TOKENS, REDUCE_TOKEN_BUDGET // max(len(analyses), 1))
+    sections = "\n".join(f"[{company}] {_clip(analysis, limit)}" for company, analysis in analyses.items())
+    return (f"Voici les analyses ESG ({kpi_type}) de {len(analyses)} entreprises et leurs statistiques.\n\n"
+            f"{table}\n\n{sections}\n\n"
+            "Fournis une analyse comparative:\n1. Points forts de chaque entreprise\n2. Points à améliorer\n"
+            "3. Recommandations spécifiques\n4. Meilleures pratiques identifiées")
+
+
+class BenchmarkRunner:
+    """Analyses par entreprise en parallèle (map) puis synthèse (reduce)"""
+
+    def __init__(self, client, cache=None, max_workers=BENCHMARK_WORKERS, async_client=None):
+        self.client = client
+        self.async_client = async_client
+        self.cache = cache if cache is not None else LLMResponseCache(BENCHMARK_CACHE_PATH, name='benchmark')
+        self.max_workers = max_workers
+
+    def _prepare(self, company, kpi_type, company_df, profile):
+        """(résultat, clé de cache, prompt); résultat déjà rempli si l'analyse est en cache"""
+        prompt = map_prompt(company, kpi_type, company_df, profile)
+        # Clé liée aux données de l'entreprise seule (pas à la version globale du CSV)
+        key = cache_key(self.client.model, MAP_OPTIONS, MAP_SYSTEM, data_hash(company_df), prompt)
+        result = {"company": company, "analysis": None, "cached": False, "queue_wait_s": None, "error": None}
+        cached = self.cache.get(key)
+        if cached is not None:
+            result.update(analysis=cached[0], cached=True)
+        return result, key, prompt
+
+    def _store(self, result, key, generated):
+        analysis = generated.get('response', '').strip()
+        result["queue_wait_s"] = generated.get('queue_wait_s')
+        if analysis:
+            self.cache.put(key, analysis, meta=generation_stats(generated))
+            result["analysis"] = analysis
+        else:
+            result["error"] = "réponse vide"
+
+    def analyze_company(self, company, kpi_type, company_df, profile=None):
+        """Analyse d'une entreprise: {"company", "analysis", "cached", "time_s", "queue_wait_s", "error"}"""
+        start = time.time()
+        result, key, prompt = self._prepare(company, kpi_type, company_df, profile)
+        if not result["cached"]:
+            try:
+                self._store(result, key, self.client.generate(prompt, system=MAP_SYSTEM, options=MAP_OPTIONS,
+                                                              endpoint='benchmark_map',
+                                                              priority=PRIORITY_ANALYSIS))
+            except Exception as e:
+                logger.warning(f"Analyse benchmark non générée pour {company}: {e}")
+                result["error"] = str(e)
+        result["time_s"] = round(time.time() - start, 3)
+        return result
+
+    async def analyze_company_async(self, company, kpi_type, company_df, profile=None):
+        """Comme ``analyze_company``, avec ``async_client``"""
+        start = time.time()
+        result, key, prompt = self._prepare(company, kpi_type, company_df, profile)
+        if not result["cached"]:
+            try:
+                self._store(result, key, await self.async_client.generate(
+                    prompt, system=MAP_SYSTEM, options=MAP_OPTIONS, endpoint='benchmark_map',
+                    priority=PRIORITY_ANALYSIS))
+            except Exception as e:
+                logger.warning(f"Analyse benchmark non générée pour {company}: {e}")
+                result["error"] = str(e)
+        result["time_s"] = round(time.time() - start, 3)
+        return result
+
+    def map(self, kpi_type, frames, profiles=None):
+        """Générateur: résultat de chaque entreprise dès qu'il est prêt"""
+        profiles = profiles or {}
+        pool = ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(frames))),
+                                  thread_name_prefix='benchmark-map')
+        try:
+            futures = [pool.submit(self.analyze_company, company, kpi_type, company_df, profiles.get(company))
+                       for company, company_df in frames.items()]
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # Client parti en cours de route: les analyses pas encore lancées sont annulées
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    async def map_async(self, kpi_type, frames, profiles=None):
+        """Générateur asynchrone: comme ``map``, au plus ``max_workers`` analyses dans la file LLM"""
+        profiles = profiles or {}
+        slots = asyncio.Semaphore(max(1, self.max_workers))
+
+        async def analyze(company, company_df):
+            async with slots:
+                return await self.analyze_company_async(company, kpi_type, company_df, profiles.get(company))
+
+        tasks = [asyncio.ensure_future(analyze(company, company_df)) for company, company_df in frames.items()]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                yield await next_result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def reduce_prompt(self, kpi_type, results, table):
+        """Prompt de synthèse (None si aucune analyse n'a abouti); ``results``: entreprise -> résultat"""
+        analyses = {company: r["analysis"] for company, r in results.items() if r["analysis"]}
+        if not analyses:
+            return None
+        return reduce_prompt(kpi_type, analyses, table)
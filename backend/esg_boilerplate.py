@@ -0,0 +1,196 @@
+"""Détection du boilerplate avant l'encodage.
+
+Deux filtres travaillent en flux, sans relire le document:
+- les lignes répétées sur au moins HEADER_MIN_PAGES pages (en-têtes, pieds de
+  page, mentions légales) sont retirées à partir de cette page-là: les
+  premières apparitions, déjà émises, restent;
+- les phrases identiques ou quasi identiques (MinHash sur des bardeaux de mots)
+  à une phrase déjà vue restent dans le document mais ne sont pas encodées.
+"""
+import re
+import zlib
+import hashlib
+import logging
+
+import numpy as np
+
+from esg_streaming import TABLE_CELL_SEPARATOR, MIN_SENTENCE_CHARS, profile_stage
+
+logger = logging.getLogger(__name__)
+
+SHINGLE_WORDS = 3
+NUM_PERM = 32
+LSH_BANDS = 8
+NEAR_DUPLICATE_THRESHOLD = 0.8
+MAX_HEADER_WORDS = 12
+HEADER_MIN_PAGES = 3        # pages où une ligne doit apparaître pour être un en-tête / pied de page
+MAX_PAGE_NUMBER_DIGITS = 3   # au-delà: année, valeur
+
+_MINHASH_PRIME = np.uint64(4294967311)  # premier > 2**32
+_rng = np.random.RandomState(42)
+_PERM_A = _rng.randint(1, 2 ** 31 - 1, NUM_PERM).astype(np.uint64)
+_PERM_B = _rng.randint(0, 2 ** 31 - 1, NUM_PERM).astype(np.uint64)
+
+_WHITESPACE = re.compile(r'\s+')
+_WORD = re.compile(r'\w+')
+# Une ligne qui porte une valeur chiffrée ne doit jamais être fusionnée avec une autre
+_VALUE_WITH_UNIT = re.compile(
+    r'\d\s*(?:%|tons?|tonnes|t\b|kg|kWh|MWh|GWh|TJ|tCO2e?|CO2|m³|€|EUR|USD|\$|employees|people)',
+    re.IGNORECASE
+)
+
+
+def _normalize(text):
+    return _WHITESPACE.sub(' ', text.strip().lower())
+
+
+def _digest(text):
+    """Clé 128 bits d'un texte normalisé: avec crc32 (32 bits), une collision retirait une phrase distincte"""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+def _is_page_number(token):
+    return token.isdigit() and len(token) <= MAX_PAGE_NUMBER_DIGITS
+
+
+def _line_key(line, page_number):
+    """Clé d'une ligne; dans une ligne courte, le numéro de page est neutralisé
+
+    Seul un nombre isolé après « page », sinon en fin ou en début de ligne,
+    compte comme numéro de page. Il est remplacé par son écart au numéro de la page,
+    constant d'une page à l'autre pour un pied de page: une ligne de KPI dont
+    la valeur change garde une clé différente.
+    """
+    normalized = _normalize(line)
+    tokens = normalized.split(' ')
+    if (TABLE_CELL_SEPARATOR.strip() not in normalized
+            and not _VALUE_WITH_UNIT.search(line)
+            and len(tokens) <= MAX_HEADER_WORDS):
+        after_page = [i for i in range(1, len(tokens)) if tokens[i - 1] in ('page', 'p.')]
+        for i in after_page + [len(tokens) - 1, 0]:
+            if _is_page_number(tokens[i]):
+                tokens[i] = f"#{int(tokens[i]) - page_number:+d}"
+                break
+        normalized = ' '.join(tokens)
+    return _digest(normalized)
+
+
+def minhash_signature(text):
+    """Signature MinHash (NUM_PERM valeurs) des bardeaux de SHINGLE_WORDS mots, ou None"""
+    words = _WORD.findall(text.lower())
+    if len(words) < SHINGLE_WORDS:
+        return None
+
+    shingles = {' '.join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles),
+                         dtype=np.uint64, count=len(shingles))
+    permuted = (hashes[:, None] * _PERM_A + _PERM_B) % _MINHASH_PRIME
+    return permuted.min(axis=0)
+
+
+class BoilerplateFilter:
+    """État de déduplication d'un document (lignes répétées + quasi-doublons)"""
+
+    def __init__(self, near_duplicate_threshold=NEAR_DUPLICATE_THRESHOLD):
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self._line_pages = {}           # clé de ligne -> (dernière page, nombre de pages)
+        self._sentence_keys = set()
+        self._signatures = []
+        self._buckets = {}              # (bande, valeurs) -> indice de signature
+        self.lines_removed = 0
+        self.chars_removed = 0
+        self.sentence_lines_removed = 0
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+        self.sentences_encoded = 0
+
+    # ---------------------------------------------------------------- lignes
+    def filter_page(self, page_number, text):
+        """Retirer les lignes vues sur au moins HEADER_MIN_PAGES pages, celle-ci comprise"""
+        kept = []
+        for line in text.split('\n'):
+            if len(line.strip()) < 5:
+                kept.append(line)
+                continue
+
+            key = _line_key(line, page_number)
+            last_page, pages = self._line_pages.get(key, (None, 0))
+            if last_page != page_number:
+                pages += 1
+                self._line_pages[key] = (page_number, pages)
+            if pages < HEADER_MIN_PAGES:
+                kept.append(line)
+            else:
+                self.lines_removed += 1
+                self.chars_removed += len(line)
+                if len(line.strip()) > MIN_SENTENCE_CHARS:
+                    self.sentence_lines_removed += 1
+        return '\n'.join(kept)
+
+    def iter_pages(self, pages, stats=None):
+        """Étape de flux: (numéro de page, texte) -> (numéro de page, texte filtré)"""
+        for page_number, text in pages:
+            with profile_stage(stats, 'boilerplate'):
+                text = self.filter_page(page_number, text)
+            yield page_number, text
+
+    # --------------------------------------------------------------- phrases
+    def _is_near_duplicate(self, signature):
+        rows = NUM_PERM // LSH_BANDS
+        candidates = set()
+        band_keys = []
+        for band in range(LSH_BANDS):
+            band_key = (band, signature[band * rows:(band + 1) * rows].tobytes())
+            band_keys.append(band_key)
+            if band_key in self._buckets:
+                candidates.add(self._buckets[band_key])
+
+        for candidate in candidates:
+            if np.mean(self._signatures[candidate] == signature) >= self.near_duplicate_threshold:
+                return True
+
+        sig_idx = len(self._signatures)
+        self._signatures.append(signature)
+        for band_key in band_keys:
+            self._buckets.setdefault(band_key, sig_idx)
+        return False
+
+    def select_sentences(self, indices, sentences):
+        """Ne garder que la copie canonique (première vue) de chaque phrase"""
+        kept_indices = []
+        kept_sentences = []
+
+        for idx, sentence in zip(indices, sentences):
+            key = _digest(_normalize(sentence))
+            if key in self._sentence_keys:
+                self.exact_duplicates += 1
+                continue
+            self._sentence_keys.add(key)
+
+            # Une phrase chiffrée n'est jamais fusionnée: elle peut porter une autre valeur
+            signature = None if _VALUE_WITH_UNIT.search(sentence) else minhash_signature(sentence)
+            if signature is not None and self._is_near_duplicate(signature):
+                self.near_duplicates += 1
+                continue
+
+            kept_indices.append(idx)
+            kept_sentences.append(sentence)
+
+        self.sentences_encoded += len(kept_sentences)
+        return np.asarray(kept_indices, dtype=np.int32), kept_sentences
+
+    # ------------------------------------------------------------------ bilan
+    @property
+    def encode_calls_saved(self):
+        # Les lignes retirées assez longues auraient chacune produit au moins une phrase
+        return self.exact_duplicates + self.near_duplicates + self.sentence_lines_removed
+
+    def as_dict(self):
+        return {
+            'lines_removed': self.lines_removed,
+            'chars_removed': self.chars_removed,
+            'exact_duplicate_sentences': self.exact_duplicates,
+            'near_duplicate_sentences': self.near_duplicates,
+            'sentences_encoded': self.sentences_encoded,
+            'encode_calls_saved': self.encode_calls_saved
+        }
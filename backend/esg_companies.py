@@ -0,0 +1,167 @@
+"""Détection des entreprises citées dans une question (automate Aho-Corasick).
+
+Les motifs sont dérivés des noms de fichiers du magasin de résultats
+(``ACCO_Brands_Corp_2023.pdf`` -> "acco brands corp 2023", "acco brands corp",
+"acco brands") et d'alias optionnels (fichier JSON ``COMPANY_ALIASES_PATH``:
+{"ACCO_Brands_Corp_2023.pdf": ["ACCO", "Five Star"]}). L'automate n'est
+reconstruit que si l'ensemble des entreprises change; une question est parcourue
+une seule fois quel que soit le nombre d'entreprises.
+"""
+import os
+import re
+import json
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+COMPANY_ALIASES_PATH = os.environ.get('ESG_COMPANY_ALIASES', 'company_aliases.json')
+MIN_ALIAS_LENGTH = 3
+
+# Mots retirés en fin de nom pour obtenir des alias plus courts
+GENERIC_SUFFIXES = {
+    'inc', 'corp', 'corporation', 'co', 'company', 'ltd', 'limited', 'the', 'sa', 'nv', 'plc', 'lp',
+    'llc', 'ag', 'se', 'spa', 'group', 'holding', 'holdings', 'report', 'esg', 'sustainability',
+    'annual', 'rapport', 'pdf'
+}
+_YEAR = re.compile(r'^(19|20)\d{2}$')
+_SEPARATORS = re.compile(r'[\W_]+')
+
+
+def normalize(text):
+    """Minuscules, séparateurs (espaces, _, -, ponctuation) réduits à un espace"""
+    return _SEPARATORS.sub(' ', str(text).lower()).strip()
+
+
+def company_aliases(company):
+    """Motifs normalisés désignant un fichier d'entreprise"""
+    stem = normalize(re.sub(r'\.pdf$', '', company, flags=re.IGNORECASE))
+    aliases = {stem}
+    words = [word for word in stem.split() if not _YEAR.match(word)]
+    aliases.add(' '.join(words))
+    while words and words[-1] in GENERIC_SUFFIXES:
+        words.pop()
+        aliases.add(' '.join(words))
+    return {alias for alias in aliases if len(alias) >= MIN_ALIAS_LENGTH}
+
+
+def load_alias_file(path=None):
+    path = path or COMPANY_ALIASES_PATH
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Fichier d'alias illisible ({path}): {e}")
+        return {}
+
+
+class AhoCorasick:
+    """Automate multi-motifs: tous les motifs trouvés en un seul passage"""
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for pattern_id, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                nxt = self._goto[state].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][char] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = nxt
+            self._out[state].append(pattern_id)
+
+        # Liens d'échec en largeur; les sorties héritent de celles du suffixe
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def iter_matches(self, text):
+        """(début, fin, id du motif) pour chaque occurrence"""
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for pattern_id in self._out[state]:
+                yield end - len(self.patterns[pattern_id]), end, pattern_id
+
+
+class CompanyMatcher:
+    """Entreprises mentionnées dans un texte, automate reconstruit à la demande"""
+
+    def __init__(self, alias_path=None):
+        self.alias_path = alias_path
+        self._lock = threading.Lock()
+        self._companies = None
+        self._automaton = None
+        self._targets = []          # id de motif -> entreprises désignées
+
+    def update(self, companies, aliases=None):
+        """Reconstruire l'automate si l'ensemble des entreprises a changé"""
+        companies = frozenset(companies)
+        if companies == self._companies:
+            return False
+        extra = aliases if aliases is not None else load_alias_file(self.alias_path)
+
+        targets = {}
+        for company in sorted(companies):
+            names = company_aliases(company)
+            names.update(normalize(alias) for alias in extra.get(company, ()))
+            for name in names:
+                if name:
+                    targets.setdefault(name, []).append(company)
+
+        patterns = list(targets)
+        automaton = AhoCorasick(patterns)
+        with self._lock:
+            self._automaton = automaton
+            self._targets = [targets[pattern] for pattern in patterns]
+            self._companies = companies
+        logger.info(f"Automate entreprises: {len(companies)} entreprises, {len(patterns)} motifs")
+        return True
+
+    def find(self, text):
+        """Entreprises citées, dans l'ordre de première mention
+
+        Seules les occurrences alignées sur des mots sont retenues; en cas de
+        chevauchement, le motif le plus à gauche puis le plus long l'emporte
+        ("accor sa 2021" désigne un seul rapport, "accor" tous ceux d'Accor).
+        """
+        with self._lock:
+            automaton, targets = self._automaton, self._targets
+        if automaton is None:
+            return []
+
+        text = f" {normalize(text)} "
+        matches = [
+            (start, end, pattern_id) for start, end, pattern_id in automaton.iter_matches(text)
+            if text[start - 1] == ' ' and text[end] == ' '
+        ]
+        matches.sort(key=lambda m: (m[0], -(m[1] - m[0])))
+
+        found = []
+        covered_until = 0
+        for start, end, pattern_id in matches:
+            if start < covered_until:
+                continue
+            covered_until = end
+            for company in targets[pattern_id]:
+                if company not in found:
+                    found.append(company)
+        return found
@@ -0,0 +1,379 @@
+"""Extraction du corpus SASB (sasb_esg_reports_full.csv) par plusieurs machines.
+
+Le coordinateur (``corpus_extract.py enqueue``) met une tâche par rapport dans
+la file partagée des processus d'extraction (esg_workers), sous l'identifiant
+du rapport: remettre le corpus en file ne crée pas de doublon. Chaque tâche
+(``process_report``) télécharge le rapport si besoin, extrait ses KPIs et
+écrit ``<results_dir>/<report_id>.json`` par renommage atomique: une tâche
+reprise après expiration de son bail réécrit le même fichier, sans doublon.
+``corpus_extract.py collect`` fusionne ces fichiers dans les résultats de l'API.
+
+``corpus_extract.py run`` traite le corpus sur une seule machine en flux
+(esg_pipeline): téléchargement, texte, segmentation, encodage, association,
+valeurs et écriture sont des étapes distinctes, chacune avec ses exécutants,
+et produisent les mêmes fichiers résultats.
+
+Le fichier KPI, le dossier des rapports et celui des résultats doivent être
+accessibles sous le même chemin depuis toutes les machines.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+
+import numpy as np
+import pandas as pd
+import requests
+
+from esg_boilerplate import BoilerplateFilter
+from esg_document import CompactDocument, iter_document_windows
+from esg_manifest import stage_fingerprints
+from esg_metrics import observe_encode
+from esg_profiling import finish_job
+from esg_streaming import MIN_DOCUMENT_CHARS, StreamStats, iter_pdf_page_windows
+
+logger = logging.getLogger(__name__)
+
+REPORTS_CSV = os.environ.get('ESG_REPORTS_CSV', 'sasb_esg_reports_full.csv')
+REPORTS_DIR = os.environ.get('ESG_REPORTS_DIR', 'reports')
+CORPUS_RESULTS_DIR = os.environ.get('ESG_CORPUS_RESULTS', 'corpus_results')
+DOWNLOAD_TIMEOUT = 60
+MERGED_STATE = '.merged'   # dans le dossier des résultats: versions déjà fusionnées par collect
+
+
+def report_id(report):
+    """Identifiant stable d'un rapport (lien, entreprise, année)"""
+    key = f"{report['url']}|{report['company']}|{report['year']}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:24]
+
+
+def load_reports(csv_path=REPORTS_CSV):
+    """Rapports ayant un lien: dictionnaires company, sector, industry, year, url, id"""
+    df = pd.read_csv(csv_path, sep=None, engine='python', encoding='utf-8', on_bad_lines='skip')
+    df = df[df['Report Link'].notna() & (df['Report Link'].astype(str).str.strip() != "")]
+    reports = []
+    for _, row in df.iterrows():
+        report = {
+            'company': str(row['Company']).strip().replace("/", "-"),
+            'sector': str(row['Sector']).strip().replace("/", "-"),
+            'industry': str(row['Industry']).strip().replace("/", "-"),
+            'year': str(row['Report Year']).strip(),
+            'url': str(row['Report Link']).strip(),
+        }
+        report['id'] = report_id(report)
+        reports.append(report)
+    return reports
+
+
+def report_path(report, reports_dir=REPORTS_DIR, ext='pdf'):
+    """Emplacement du rapport, rangé comme download_reports.py"""
+    return os.path.join(reports_dir, report['sector'], report['industry'],
+                        f"{report['company']}_{report['year']}.{ext}")
+
+
+def fetch_report(report, reports_dir=REPORTS_DIR):
+    """Chemin local du rapport, téléchargé s'il n'est pas déjà présent (type déduit du contenu)"""
+    for ext in ('pdf', 'html'):
+        path = report_path(report, reports_dir, ext)
+        if os.path.exists(path):
+            return path
+    response = requests.get(report['url'], timeout=DOWNLOAD_TIMEOUT)
+    response.raise_for_status()
+    path = report_path(report, reports_dir, 'pdf' if response.content[:5] == b'%PDF-' else 'html')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.part"
+    with open(tmp, 'wb') as f:
+        f.write(response.content)
+    os.replace(tmp, path)
+    return path
+
+
+def result_path(rid, results_dir=CORPUS_RESULTS_DIR):
+    return os.path.join(results_dir, f"{rid}.json")
+
+
+def completed_reports(results_dir=CORPUS_RESULTS_DIR):
+    """Identifiants des rapports dont le résultat est écrit"""
+    if not os.path.isdir(results_dir):
+        return set()
+    return {name[:-5] for name in os.listdir(results_dir) if name.endswith('.json')}
+
+
+def load_result(rid, results_dir=CORPUS_RESULTS_DIR):
+    with open(result_path(rid, results_dir), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def result_version(rid, results_dir=CORPUS_RESULTS_DIR):
+    """Version d'un fichier résultat: change quand le rapport est retraité"""
+    st = os.stat(result_path(rid, results_dir))
+    return f"{st.st_mtime_ns}:{st.st_size}"
+
+
+def load_merged(results_dir=CORPUS_RESULTS_DIR):
+    """{rapport: version du résultat déjà fusionnée dans all_extracted_kpis.csv}"""
+    try:
+        with open(os.path.join(results_dir, MERGED_STATE), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_merged(merged, results_dir=CORPUS_RESULTS_DIR):
+    path = os.path.join(results_dir, MERGED_STATE)
+    tmp = f"{path}.{os.getpid()}.part"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(merged, f)
+    os.replace(tmp, path)
+
+
+def _write_result(record, results_dir):
+    os.makedirs(results_dir, exist_ok=True)
+    path = result_path(record['report_id'], results_dir)
+    tmp = f"{path}.{os.getpid()}.part"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(record, f, ensure_ascii=False, default=str)
+    os.replace(tmp, path)
+
+
+def _kpis(kpi_file):
+    """(kpi_df, embeddings, all_kpis), chargés une fois par processus de travail"""
+    from esg_extraction import cached_kpi_list   # modèles chargés par l'hôte (préchargement), pas par le coordinateur
+    kpi_df, _, _, kpi_embeddings, all_kpis = cached_kpi_list(kpi_file)
+    return kpi_df, kpi_embeddings, all_kpis
+
+
+def process_report(report, kpi_file, min_confidence=0.3, reports_dir=REPORTS_DIR,
+                   results_dir=CORPUS_RESULTS_DIR):
+    """Tâche du pool: télécharger, extraire, écrire le résultat; retourne un résumé"""
+    from esg_extraction import extract_pdf
+    started = time.time()
+    record = {'report_id': report['id'], 'company': report['company'], 'year': report['year'],
+              'url': report['url'], 'source_file': None, 'status': 'done', 'results': [], 'job_stats': {}}
+    path = fetch_report(report, reports_dir)
+    record['source_file'] = os.path.basename(path)
+    if path.endswith('.pdf'):
+        record['results'], record['job_stats'] = extract_pdf(path, kpi_file, min_confidence)
+    else:
+        record['status'] = 'skipped'   # page HTML: pas d'extraction
+    record['time_s'] = round(time.time() - started, 3)
+    _write_result(record, results_dir)
+    return {'report_id': record['report_id'], 'source_file': record['source_file'], 'status': record['status'],
+            'kpis': len(record['results']), 'time_s': record['time_s']}
+
+
+# --------------------------------------------------------------- pipeline en flux
+# Étapes de esg_pipeline pour un document du corpus. Le document circule sous
+# forme de dictionnaire; chaque étape ajoute sa sortie et retire ce dont les
+# suivantes n'ont plus besoin (pages, embeddings) pour limiter ce qui passe
+# d'un processus à l'autre. Un document écarté (page HTML, texte vide) traverse
+# les étapes suivantes sans traitement jusqu'à l'écriture. Comme pour
+# process_report, esg_extraction (modèles) n'est importé que par les étapes.
+
+def load_kpis(kpi_file):
+    """(kpi_df, embeddings numpy normalisés, all_kpis); à appeler dans un processus d'encodage"""
+    kpi_df, kpi_embeddings, all_kpis = _kpis(os.path.abspath(kpi_file))
+    if kpi_embeddings is None:
+        return kpi_df, None, all_kpis
+    embeddings = kpi_embeddings.cpu().numpy().astype('float32')
+    return kpi_df, embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True).clip(1e-12), all_kpis
+
+
+def init_encoder_process(torch_threads):
+    """Initialisation d'un processus d'encodage: threads torch répartis entre processus"""
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(max(1, torch_threads))
+
+
+def new_item(report):
+    return {'report': report, 'status': 'pending', 'path': None, 'stats': StreamStats()}
+
+
+def stage_fetch(item, reports_dir=REPORTS_DIR):
+    with item['stats'].stage('fetch'):
+        item['path'] = fetch_report(item['report'], reports_dir)
+    if not item['path'].endswith('.pdf'):
+        item['status'] = 'skipped'   # page HTML: pas d'extraction
+    return item
+
+
+def stage_text(item, window_pages=None):
+    """Texte nettoyé du PDF, en fenêtres de pages (pages d'index en tête)"""
+    from esg_extraction import PRIORITIZE_INDEX_PAGES, STREAM_WINDOW_PAGES
+    if item['status'] != 'pending':
+        return item
+    stats = item['stats']
+    item['boilerplate'] = BoilerplateFilter()
+    item['windows'] = list(iter_pdf_page_windows(item['path'], window_pages or STREAM_WINDOW_PAGES, stats,
+                                                 item['boilerplate'], prioritize=PRIORITIZE_INDEX_PAGES))
+    if stats.chars < MIN_DOCUMENT_CHARS:
+        item['status'] = 'empty'
+    return item
+
+
+def stage_segment(item):
+    """Phrases (spaCy) dans un CompactDocument; lots (indices, phrases) à encoder, doublons retirés"""
+    from esg_extraction import nlp
+    windows = item.pop('windows', None)
+    if item['status'] != 'pending':
+        return item
+    document = CompactDocument(os.path.basename(item['path']))
+    item['batches'] = list(iter_document_windows(document, windows, nlp, item['stats'], item['boilerplate']))
+    item['document'] = document
+    return item
+
+
+def stage_embed(item, batch_size=None):
+    """Embeddings normalisés de chaque lot de phrases; les phrases ne sont plus transportées"""
+    from esg_extraction import ENCODE_BATCH_SIZE, kpi_model
+    if item['status'] != 'pending':
+        return item
+    batch_size = batch_size or ENCODE_BATCH_SIZE
+    stats = item['stats']
+    batches = []
+    for indices, sentences in item.pop('batches'):
+        started = time.perf_counter()
+        with stats.stage('encode'):
+            embeddings = kpi_model.encode(sentences, batch_size=batch_size, convert_to_numpy=True,
+                                          normalize_embeddings=True)
+        observe_encode(len(sentences), time.perf_counter() - started)
+        stats.record_encode(len(sentences), batch_size)
+        batches.append((indices, embeddings.astype('float32', copy=False)))
+    item['embeddings'] = batches
+    return item
+
+
+def stage_match(item, kpis, threshold=None):
+    """Meilleures phrases par KPI (``kpis``: dictionnaire rempli par ``load_kpis``)"""
+    from esg_extraction import MATCH_THRESHOLD, MATCH_TOP_K
+    threshold = MATCH_THRESHOLD if threshold is None else threshold
+    from esg_matching import HIGH_CONFIDENCE_SCORE, SaturatingMatcher, top_matches
+    if item['status'] != 'pending':
+        return item
+    stats = item['stats']
+    document = item['document']
+    matcher = SaturatingMatcher(len(kpis['all_kpis']), MATCH_TOP_K, HIGH_CONFIDENCE_SCORE)
+    for indices, embeddings in item.pop('embeddings'):
+        with stats.stage('similarity'):
+            cos_scores = embeddings @ kpis['embeddings'].T
+        with stats.stage('matching'):
+            matcher.add(top_matches(indices, cos_scores, threshold), document.sentence_key)
+        if matcher.saturated:
+            stats.early_exit = True
+            break
+    stats.candidates += matcher.candidates
+    item['relevant'] = {kpis['all_kpis'][kpi_idx]: matches for kpi_idx, matches in matcher.results().items()}
+    return item
+
+
+def stage_values(item, kpis, min_confidence=0.3):
+    """Valeurs des phrases retenues, filtrées comme process_pdf"""
+    from esg_extraction import extract_values, filter_results
+    if item['status'] != 'pending':
+        return item
+    stats = item['stats']
+    results = extract_values(item.pop('document'), item.pop('relevant'), kpis['kpi_df'],
+                             os.path.basename(item['path']), stats)
+    with stats.stage('filter'):
+        item['results'] = filter_results(results, min_confidence)
+    item['status'] = 'done'
+    return item
+
+
+def stage_persist(item, results_dir=CORPUS_RESULTS_DIR):
+    """Profil du document (journal de performance) et fichier résultat, comme ``process_report``"""
+    stats = item['stats']
+    report = item['report']
+    source_file = os.path.basename(item['path']) if item['path'] else None
+    results = item.get('results', [])
+    # Étapes réparties entre processus: le temps CPU du document est la somme de celui des étapes
+    cpu_s = round(sum(entry['cpu_s'] for entry in stats.stages.values()), 3)
+    job_stats = finish_job(stats, 'corpus_pipeline', source_file, None, item.get('boilerplate'),
+                           cpu_s=cpu_s, kpis_extracted=len(results))
+    record = {'report_id': report['id'], 'company': report['company'], 'year': report['year'],
+              'url': report['url'], 'source_file': source_file, 'content_hash': item.get('doc'),
+              'status': 'skipped' if item['status'] in ('skipped', 'empty') else item['status'],
+              'results': results, 'job_stats': job_stats, 'time_s': job_stats['wall_s']}
+    _write_result(record, results_dir)
+    return {'report_id': report['id'], 'doc': item.get('doc'), 'source_file': source_file,
+            'status': record['status'], 'kpis': len(results), 'time_s': record['time_s']}
+
+
+# ------------------------------------------------------------------- reprise
+# Sorties conservées par étape dans le manifeste de run (pas les embeddings, trop
+# volumineux: une reprise après l'encodage refait l'encodage), et étapes à
+# recharger pour reprendre après chacune.
+CHECKPOINT_FIELDS = {'text': ('windows', 'boilerplate'), 'segment': ('document', 'boilerplate', 'batch_indices'),
+                     'match': ('relevant',), 'values': ('results',)}
+RESUME_LOADS = {'text': ('text',), 'segment': ('segment',), 'match': ('segment', 'match'), 'values': ('values',)}
+
+
+def pipeline_fingerprints(kpi_file, min_confidence=0.3):
+    """Empreintes des étapes du pipeline en flux, dans l'ordre"""
+    from esg_extraction import stage_configs
+    return stage_fingerprints([('fetch', {})] + stage_configs(kpi_file, min_confidence) + [('persist', {})])
+
+
+def source_key(report):
+    return f"report:{report['id']}"
+
+
+def is_report_done(manifest, report, fingerprints, results_dir=CORPUS_RESULTS_DIR):
+    """Rapport déjà traité sous la configuration courante, sans le relire"""
+    doc = manifest.known_document(source_key(report))
+    return (doc is not None and manifest.is_done(doc, 'persist', fingerprints['persist'])
+            and os.path.exists(result_path(report['id'], results_dir)))
+
+
+def resume_item(manifest, item, fingerprints, results_dir=CORPUS_RESULTS_DIR):
+    """Après le téléchargement: empreinte du contenu, puis reprise après la dernière étape à jour conservée"""
+    item['doc'] = manifest.document_hash(item['path'], key=source_key(item['report']))
+    if item['status'] != 'pending':
+        return item
+    stages = list(fingerprints)
+    current = manifest.up_to_date(item['doc'], fingerprints)
+    if 'persist' in current and os.path.exists(result_path(item['report']['id'], results_dir)):
+        item['status'] = 'unchanged'
+        item['done_stages'] = set(stages)
+        return item
+
+    for stage in reversed(current):
+        if stage not in RESUME_LOADS:
+            continue
+        outputs = [manifest.load(item['doc'], name) for name in RESUME_LOADS[stage]]
+        if any(output is None for output in outputs):
+            continue
+        for output in outputs:
+            item.update(output)
+        batch_indices = item.pop('batch_indices', None)
+        if stage == 'segment':
+            item['batches'] = [(indices, item['document'].sentences(indices)) for indices in batch_indices]
+        if stage == 'values':
+            item['status'] = 'done'
+        item['done_stages'] = set(stages[:stages.index(stage) + 1])
+        break
+    return item
+
+
+def checkpoint_stage(manifest, fingerprints, run=None):
+    """``on_stage_done`` du pipeline: enregistrer chaque étape terminée et sa sortie conservée"""
+    def record(stage, item):
+        doc = item.get('doc')
+        if doc is None:
+            return
+        if stage == 'persist':
+            manifest.complete(doc, stage, fingerprints[stage], item.get('source_file'), run=run)
+            return
+        if item['status'] not in ('pending', 'done'):
+            return   # document écarté: seule l'écriture finale est enregistrée
+        output = None
+        if stage in CHECKPOINT_FIELDS:
+            output = {field: item[field] for field in CHECKPOINT_FIELDS[stage] if field in item}
+            if stage == 'segment':
+                output['batch_indices'] = [indices for indices, _ in item['batches']]
+        manifest.complete(doc, stage, fingerprints[stage], os.path.basename(item['path']), output, run)
+    return record
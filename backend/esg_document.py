@@ -0,0 +1,163 @@
+"""Représentation compacte d'un document extrait.
+
+Tout le texte nettoyé d'un document tient dans un seul tampon UTF-8. Les pages,
+phrases et lignes de tableau ne sont que des plages d'octets dans ce tampon,
+stockées dans des tableaux typés (exposés en NumPy), ce qui évite de garder des
+milliers d'objets ``str`` vivants pendant le matching.
+"""
+import re
+from array import array
+
+import numpy as np
+
+from esg_streaming import TABLE_CELL_SEPARATOR, profile_stage, segment_window
+
+_TABLE_ROW = re.compile(r'^[^\n]*' + re.escape(TABLE_CELL_SEPARATOR) + r'[^\n]*$', re.MULTILINE)
+
+
+def _as_numpy(values, dtype, columns=None):
+    # Copie: une vue frombuffer bloquerait l'agrandissement du tableau source
+    arr = np.frombuffer(values, dtype=dtype).copy() if len(values) else np.empty(0, dtype=dtype)
+    return arr.reshape(-1, columns) if columns else arr
+
+
+def _char_to_byte_offsets(text):
+    """Table de correspondance indice de caractère -> position en octets UTF-8"""
+    codepoints = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    widths = 1 + (codepoints >= 0x80) + (codepoints >= 0x800) + (codepoints >= 0x10000)
+    offsets = np.zeros(len(codepoints) + 1, dtype=np.int64)
+    np.cumsum(widths, out=offsets[1:])
+    return offsets
+
+
+class CompactDocument:
+    """Tampon UTF-8 unique + tableaux d'offsets pour pages, phrases et lignes de tableau"""
+
+    def __init__(self, name=""):
+        self.name = name
+        self._buffer = bytearray()
+        self._page_numbers = array('i')
+        self._page_bounds = array('q')        # (début, fin) en octets
+        self._page_sentences = array('q')     # premier indice de phrase de chaque page
+        self._sentence_bounds = array('q')    # (début, fin) en octets
+        self._sentence_pages = array('i')
+        self._sentence_keys = array('q')      # hash du texte, pour la déduplication
+        self._row_bounds = array('q')         # (début, fin) en octets
+
+    # ------------------------------------------------------------------ build
+    def add_page(self, page_number, text, spans):
+        """Ajouter une page nettoyée et ses phrases [(début, fin)] en caractères"""
+        encoded = text.encode('utf-8')
+        base = len(self._buffer)
+        self._buffer.extend(encoded)
+
+        self._page_numbers.append(page_number)
+        self._page_bounds.extend((base, base + len(encoded)))
+        self._page_sentences.append(self.sentence_count)
+
+        ascii_only = len(encoded) == len(text)
+        byte_offsets = None if ascii_only else _char_to_byte_offsets(text)
+
+        def to_bytes(pos):
+            return base + (pos if ascii_only else int(byte_offsets[pos]))
+
+        for start, end in spans:
+            byte_start, byte_end = to_bytes(start), to_bytes(end)
+            self._sentence_bounds.extend((byte_start, byte_end))
+            self._sentence_pages.append(page_number)
+            self._sentence_keys.append(hash(bytes(self._buffer[byte_start:byte_end])))
+
+        for match in _TABLE_ROW.finditer(text):
+            self._row_bounds.extend((to_bytes(match.start()), to_bytes(match.end())))
+
+    # ----------------------------------------------------------------- access
+    @property
+    def sentence_count(self):
+        return len(self._sentence_pages)
+
+    @property
+    def page_count(self):
+        return len(self._page_numbers)
+
+    @property
+    def nbytes(self):
+        return len(self._buffer) + sum(
+            a.itemsize * len(a) for a in (
+                self._page_numbers, self._page_bounds, self._page_sentences,
+                self._sentence_bounds, self._sentence_pages, self._sentence_keys, self._row_bounds
+            )
+        )
+
+    @property
+    def page_numbers(self):
+        return _as_numpy(self._page_numbers, np.int32)
+
+    @property
+    def page_offsets(self):
+        return _as_numpy(self._page_bounds, np.int64, 2)
+
+    @property
+    def page_sentence_starts(self):
+        return _as_numpy(self._page_sentences, np.int64)
+
+    @property
+    def sentence_offsets(self):
+        return _as_numpy(self._sentence_bounds, np.int64, 2)
+
+    @property
+    def sentence_pages(self):
+        return _as_numpy(self._sentence_pages, np.int32)
+
+    @property
+    def sentence_keys(self):
+        return _as_numpy(self._sentence_keys, np.int64)
+
+    @property
+    def table_row_offsets(self):
+        return _as_numpy(self._row_bounds, np.int64, 2)
+
+    def _slice(self, bounds, idx):
+        start, end = bounds[2 * idx], bounds[2 * idx + 1]
+        return self._buffer[start:end].decode('utf-8')
+
+    def sentence_key(self, idx):
+        return self._sentence_keys[int(idx)]
+
+    def sentence(self, idx):
+        return self._slice(self._sentence_bounds, int(idx))
+
+    def sentences(self, indices):
+        return [self._slice(self._sentence_bounds, int(idx)) for idx in indices]
+
+    def page_text(self, idx):
+        return self._slice(self._page_bounds, int(idx))
+
+    def table_row(self, idx):
+        return self._slice(self._row_bounds, int(idx))
+
+
+def iter_document_windows(document, page_windows, nlp=None, stats=None, boilerplate=None):
+    """Ajouter chaque fenêtre au document et générer (indices, phrases) à encoder
+
+    Les phrases ``str`` ne vivent que le temps d'une fenêtre; seuls les offsets
+    restent dans le document. Avec un ``BoilerplateFilter``, les doublons restent
+    dans le document mais ne sont pas renvoyés à l'encodage.
+    """
+    for window in page_windows:
+        first = document.sentence_count
+        with profile_stage(stats, 'segmentation'):
+            segmented = segment_window(window, nlp)
+        with profile_stage(stats, 'document'):
+            for page_number, text, spans in segmented:
+                document.add_page(page_number, text, spans)
+
+        indices = np.arange(first, document.sentence_count, dtype=np.int32)
+        if stats is not None:
+            stats.sentences += len(indices)
+        if boilerplate is not None and len(indices):
+            with profile_stage(stats, 'boilerplate'):
+                indices, sentences = boilerplate.select_sentences(indices, document.sentences(indices))
+        else:
+            sentences = document.sentences(indices)
+        if len(indices):
+            yield indices, sentences
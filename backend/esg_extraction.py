@@ -0,0 +1,551 @@
+"""Extraction des KPIs ESG d'un rapport PDF: modèles NLP et pipeline de process_pdf.
+
+Module sans Flask ni Ollama: l'API l'importe, et les processus du pool
+d'extraction (esg_workers) le préchargent avant de se dupliquer, ce qui leur
+fait partager les modèles chargés.
+"""
+import os
+import re
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime
+from functools import lru_cache
+
+import pandas as pd
+import spacy
+from sentence_transformers import SentenceTransformer
+
+from esg_streaming import (
+    DEFAULT_WINDOW_PAGES, SPACY_MAX_CHARS, StreamStats, iter_pdf_pages, profile_stage,
+    iter_pdf_page_windows, iter_text_page_windows
+)
+from esg_document import CompactDocument, iter_document_windows
+from esg_matching import (
+    DEFAULT_TOP_K, HIGH_CONFIDENCE_SCORE, SaturatingMatcher, match_sentence_windows, score_sentences, top_matches
+)
+from esg_boilerplate import BoilerplateFilter
+from esg_profiling import finish_job, log_event
+from esg_manifest import file_hash
+
+logger = logging.getLogger(__name__)
+
+STREAM_WINDOW_PAGES = DEFAULT_WINDOW_PAGES  # Pages gardées en mémoire à la fois
+ENCODE_BATCH_SIZE = 64
+MATCH_TOP_K = 3                  # Phrases gardées par KPI pour l'extraction de valeurs
+MATCH_THRESHOLD = 0.4            # Similarité minimale phrase / KPI
+PRIORITIZE_INDEX_PAGES = True    # Pages "SASB Index", "GRI Content Index"... en premier
+CHAT_WINDOW_PAGES = 2            # Fenêtres courtes: premiers KPIs du chat plus tôt
+# Chat: candidats gardés dès 0.3, le seuil de confiance minimal des valeurs affichées. Un PDF
+# déposé dans le chat est lu une fois, en fenêtres courtes: on préfère montrer une valeur peu
+# sûre (sa confiance est affichée) plutôt que rien; le corpus garde MATCH_THRESHOLD.
+CHAT_MATCH_THRESHOLD = 0.3
+
+# Charger les modèles NLP au démarrage
+print("Chargement des modèles NLP...")
+try:
+    nlp = spacy.load("en_core_web_sm")
+    nlp.max_length = 3000000  # Augmenter la limite de texte
+except OSError:
+    print("Téléchargement du modèle spaCy...")
+    os.system("python -m spacy download en_core_web_sm")
+    nlp = spacy.load("en_core_web_sm")
+    nlp.max_length = 3000000
+
+KPI_MODEL_NAME = 'all-MiniLM-L6-v2'
+kpi_model = SentenceTransformer(KPI_MODEL_NAME)
+
+# Charger la liste des KPIs - CORRIGÉ
+def load_kpi_list(file_path):
+    file_extension = os.path.splitext(file_path)[1].lower()
+    
+    if file_extension == '.csv':
+        encodings = ['utf-8', 'latin-1', 'iso-8859-1', 'windows-1252']
+        for encoding in encodings:
+            try:
+                df = pd.read_csv(file_path, sep=';', encoding=encoding)
+                break
+            except UnicodeDecodeError:
+                continue
+        else:
+            raise ValueError("Impossible de décoder le fichier CSV")
+    
+    elif file_extension in ['.xlsx', '.xls']:
+        df = pd.read_excel(file_path)
+    
+    else:
+        raise ValueError("Format de fichier non supporté")
+    
+    print(f"Colonnes disponibles: {list(df.columns)}")
+    print(f"Shape du DataFrame: {df.shape}")
+    
+    # Vérifier si le fichier est le fichier de résultats existant ou un nouveau fichier KPI
+    if 'kpi_name' in df.columns and 'value' in df.columns:
+        # C'est un fichier de résultats existant, on le traite différemment
+        print("Fichier de résultats existant détecté")
+        kpi_list = df['kpi_name'].dropna().unique().tolist()
+        kpi_list_fr = []
+    else:
+        # C'est un nouveau fichier KPI
+        kpi_name_col = None
+        kpi_name_fr_col = None
+        
+        for col in df.columns:
+            col_lower = col.lower()
+            if 'kpi' in col_lower and 'name' in col_lower and 'fr' not in col_lower:
+                kpi_name_col = col
+            elif 'kpi' in col_lower and 'name' in col_lower and 'fr' in col_lower:
+                kpi_name_fr_col = col
+            elif 'name' in col_lower and kpi_name_col is None:
+                kpi_name_col = col
+            elif 'nom' in col_lower and kpi_name_fr_col is None:
+                kpi_name_fr_col = col
+        
+        # Fallback: utiliser les premières colonnes
+        if kpi_name_col is None and len(df.columns) > 0:
+            kpi_name_col = df.columns[0]
+        if kpi_name_fr_col is None and len(df.columns) > 1:
+            kpi_name_fr_col = df.columns[1]
+        
+        print(f"Colonne KPI anglais: {kpi_name_col}")
+        print(f"Colonne KPI français: {kpi_name_fr_col}")
+        
+        kpi_list = df[kpi_name_col].dropna().unique().tolist() if kpi_name_col else []
+        kpi_list_fr = df[kpi_name_fr_col].dropna().unique().tolist() if kpi_name_fr_col else []
+    
+    print(f"KPIs anglais chargés: {len(kpi_list)}")
+    print(f"KPIs français chargés: {len(kpi_list_fr)}")
+    
+    all_kpis = kpi_list + kpi_list_fr
+    if all_kpis:
+        kpi_embeddings = kpi_model.encode(all_kpis, convert_to_tensor=True)
+    else:
+        kpi_embeddings = None
+    
+    return df, kpi_list, kpi_list_fr, kpi_embeddings, all_kpis
+
+# Extraire le texte d'un PDF (texte complet, pour les petits documents)
+def extract_text_from_pdf(pdf_path):
+    return "".join(text for _, text in iter_pdf_pages(pdf_path))
+
+# Trouver les KPIs pertinents
+def find_relevant_kpis(document, page_windows, kpi_embeddings, all_kpis, threshold=MATCH_THRESHOLD, boilerplate=None,
+                       top_k=MATCH_TOP_K, high_confidence=HIGH_CONFIDENCE_SCORE, stats=None):
+    """Associer les phrases du document aux KPIs, fenêtre par fenêtre.
+
+    ``page_windows`` vient de esg_streaming (un texte brut est aussi accepté).
+    Chaque KPI garde ses ``top_k`` meilleures phrases; la lecture s'arrête dès que
+    tous les KPIs en ont ``top_k`` au-dessus de ``high_confidence``.
+    Retourne {kpi_name: enregistrements (sentence_idx, kpi_idx, score) triés par score}.
+    """
+    if not all_kpis or kpi_embeddings is None:
+        return {}
+
+    if isinstance(page_windows, str):
+        page_windows = iter_text_page_windows(page_windows)
+
+    matcher = SaturatingMatcher(len(all_kpis), top_k, high_confidence)
+    windows = iter_document_windows(document, page_windows, nlp, stats=stats, boilerplate=boilerplate)
+    early_exit = match_sentence_windows(kpi_model, kpi_embeddings, windows, matcher, document.sentence_key,
+                                        threshold, batch_size=ENCODE_BATCH_SIZE, stats=stats)
+    relevant_kpis = {all_kpis[kpi_idx]: matches
+                     for kpi_idx, matches in matcher.results().items()}
+
+    if stats is not None:
+        stats.candidates += matcher.candidates
+        stats.early_exit = early_exit
+
+    print(f"{document.sentence_count} phrases, {matcher.candidates} correspondances candidates "
+          f"({document.nbytes / 1024:.0f} Ko en mémoire)")
+    print(f"KPIs pertinents trouvés: {len(relevant_kpis)}")
+    for kpi_name, matches in relevant_kpis.items():
+        log_event(logger, 'kpi_matches', kpi=kpi_name, matches=len(matches),
+                  best_score=round(float(matches['score'][0]), 3))
+
+    return relevant_kpis
+
+# Vérifier la cohérence des valeurs
+def is_value_coherent(kpi_name, value, unit):
+    kpi_lower = kpi_name.lower()
+    
+    high_value_kpis = ['emission', 'ghg', 'co2', 'nox', 'sox', 'energy', 'water', 'waste', 'consumption']
+    percentage_kpis = ['rate', 'ratio', 'percentage', 'coverage', 'compliance', 'approval']
+    
+    if any(term in kpi_lower for term in high_value_kpis) and unit == '%' and value < 1:
+        return False
+        
+    if any(term in kpi_lower for term in percentage_kpis) and unit != '%' and value > 1000:
+        return False
+        
+    return True
+
+# Extraire les valeurs numériques
+def extract_kpi_values(text, kpi_name):
+    patterns = [
+        r"(\d{1,3}(?:,\d{3})*(?:\.\d+)?)\s*(?:tons?|tonnes|t|%|kg|kWh|CO2|CO₂|ppm|ppb|µg/m³|mg/m³|employees|people|€|EUR|USD|\$|m³|MWh|GWh|TJ)",
+        r"(\d{1,3}(?:,\d{3})*(?:\.\d+)?\%)(?:\s|$)",
+        r"(?:is|was|are|were|:|\=)\s*(\d{1,3}(?:,\d{3})*(?:\.\d+)?)",
+        r"(?:value of|rate of|amount of|total|reduction of|approximately|about)\s*(\d{1,3}(?:,\d{3})*(?:\.\d+)?)",
+        r"\b(\d{1,3}(?:,\d{3})*(?:\.\d+)?)\s*(?:million|billion|thousand)?\s*(?:tons?|tonnes|percent|%)?"
+    ]
+    
+    values = []
+    seen_values = set()
+    
+    for pattern in patterns:
+        matches = re.finditer(pattern, text, re.IGNORECASE)
+        for match in matches:
+            value_str = match.group(1).replace(',', '')
+            try:
+                multiplier = 1
+                if re.search(r'million', match.group(0), re.IGNORECASE):
+                    multiplier = 1000000
+                elif re.search(r'billion', match.group(0), re.IGNORECASE):
+                    multiplier = 1000000000
+                elif re.search(r'thousand', match.group(0), re.IGNORECASE):
+                    multiplier = 1000
+                
+                numeric_value = float(value_str) * multiplier if '.' in value_str else int(value_str) * multiplier
+                unit = determine_unit(text, kpi_name)
+                
+                value_id = f"{numeric_value}_{unit}"
+                
+                if (value_id not in seen_values and 
+                    is_value_coherent(kpi_name, numeric_value, unit)):
+                    values.append({
+                        'value': numeric_value,
+                        'unit': unit
+                    })
+                    seen_values.add(value_id)
+            except ValueError:
+                continue
+    
+    return values
+
+# Déterminer l'unité
+def determine_unit(text, kpi_name):
+    unit_patterns = {
+        r'tons?|tonnes|tCO2e|t CO2e': 'tons',
+        r'kg|kilograms': 'kg',
+        r'%|percent|percentage': '%',
+        r'kWh|kilowatt-hours': 'kWh',
+        r'MWh|megawatt-hours': 'MWh',
+        r'GWh|gigawatt-hours': 'GWh',
+        r'CO2|CO₂|carbon dioxide': 'tCO2e',
+        r'ppm|parts per million': 'ppm',
+        r'employees|workers|people': 'people',
+        r'€|EUR|USD|\$|dollars': 'currency',
+        r'm³|cubic meters': 'm³'
+    }
+    
+    for pattern, u in unit_patterns.items():
+        if re.search(pattern, text, re.IGNORECASE):
+            return u
+    
+    kpi_lower = kpi_name.lower()
+    if any(term in kpi_lower for term in ['rate', 'ratio', 'percentage', 'coverage', 'reduction']):
+        return '%'
+    elif any(term in kpi_lower for term in ['emission', 'ghg', 'co2', 'carbon']):
+        return 'tCO2e'
+    elif any(term in kpi_lower for term in ['energy', 'consumption', 'electricity']):
+        return 'kWh'
+    elif any(term in kpi_lower for term in ['water', 'usage']):
+        return 'm³'
+    
+    return 'unknown'
+
+# Filtrer les résultats
+def filter_results(results, min_confidence=0.3):
+    filtered = []
+    seen = set()
+    
+    results_sorted = sorted(results, key=lambda x: x['confidence'], reverse=True)
+    
+    for result in results_sorted:
+        identifier = f"{result['kpi_name']}_{result['value']}_{result['unit']}_{result['source_file']}"
+        
+        if (identifier not in seen and 
+            result['confidence'] >= min_confidence):
+            filtered.append(result)
+            seen.add(identifier)
+    
+    kpi_groups = defaultdict(list)
+    for result in filtered:
+        kpi_groups[result['kpi_name']].append(result)
+    
+    final_results = []
+    for kpi_name, occurrences in kpi_groups.items():
+        best_occurrence = max(occurrences, key=lambda x: x['confidence'])
+        final_results.append(best_occurrence)
+    
+    return final_results
+
+# Extraire les valeurs des phrases retenues pour chaque KPI
+def extract_values(document, relevant_kpis, kpi_df, source_file, stats=None):
+    """Résultats (non filtrés) des phrases associées à chaque KPI par find_relevant_kpis"""
+    results = []
+    # Pour chaque KPI pertinent, extraire les valeurs - CORRECTION ICI
+    for kpi_name, matches in relevant_kpis.items():
+        log_event(logger, 'kpi_processing', kpi=kpi_name, matches=len(matches))
+        
+        for match in matches:
+            sentence = document.sentence(match['sentence_idx'])
+            confidence = float(match['score'])
+            with profile_stage(stats, 'value_extraction'):
+                values = extract_kpi_values(sentence, kpi_name)
+            
+            log_event(logger, 'sentence_values', kpi=kpi_name, sentence=sentence[:100], values=len(values))
+            
+            for val in values:
+                # CORRECTION : Gestion sécurisée des colonnes du DataFrame KPI
+                topic = "Unknown"
+                topic_fr = "Inconnu"
+                score = "Unknown"
+                
+                with profile_stage(stats, 'kpi_metadata'):
+                    try:
+                        # Vérifier si kpi_df est un DataFrame valide
+                        if hasattr(kpi_df, 'columns') and len(kpi_df.columns) > 0:
+                            # Chercher le KPI dans toutes les colonnes de nom
+                            kpi_matches = []
+                            for col_idx in range(min(2, len(kpi_df.columns))):
+                                if kpi_name in kpi_df.iloc[:, col_idx].values:
+                                    kpi_matches = kpi_df[kpi_df.iloc[:, col_idx] == kpi_name]
+                                    break
+                        
+                            if not kpi_matches.empty:
+                                row = kpi_matches.iloc[0]
+                                # Récupérer les colonnes de manière sécurisée
+                                if len(kpi_df.columns) > 2:
+                                    topic = str(row.iloc[2]) if pd.notna(row.iloc[2]) else "Unknown"
+                                if len(kpi_df.columns) > 3:
+                                    topic_fr = str(row.iloc[3]) if pd.notna(row.iloc[3]) else "Inconnu"
+                                if len(kpi_df.columns) > 4:
+                                    score_val = row.iloc[4]
+                                    score = str(score_val) if pd.notna(score_val) else "Unknown"
+                    except Exception as e:
+                        logger.warning(f"Erreur lors de la récupération des métadonnées KPI: {e}")
+                        # Utiliser les valeurs par défaut en cas d'erreur
+                
+                result_item = {
+                    'kpi_name': kpi_name,
+                    'value': val['value'],
+                    'unit': val['unit'],
+                    'source_file': source_file,
+                    'topic': topic,
+                    'topic_fr': topic_fr,
+                    'score': score,
+                    'confidence': confidence,
+                    'extraction_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                }
+                
+                results.append(result_item)
+                log_event(logger, 'kpi_value', kpi=kpi_name, value=val['value'], unit=val['unit'],
+                          confidence=round(confidence, 3))
+    
+    return results
+
+# Traiter un PDF - CORRIGÉ
+def process_pdf(pdf_path, kpi_embeddings, all_kpis, kpi_df, min_confidence=0.3,
+                window_pages=STREAM_WINDOW_PAGES, job_stats=None):
+    logger.info(f"Traitement de {os.path.basename(pdf_path)}...")
+    
+    # Vérifier si on a des KPIs à chercher
+    if not all_kpis or kpi_embeddings is None:
+        print("❌ AUCUN KPI DISPONIBLE - Vérifiez le fichier KPI")
+        return []
+    
+    # Extraire le texte en flux et trouver les KPIs pertinents
+    stats = StreamStats()
+    document = CompactDocument(os.path.basename(pdf_path))
+    boilerplate = BoilerplateFilter()
+    page_windows = iter_pdf_page_windows(pdf_path, window_pages, stats, boilerplate,
+                                         prioritize=PRIORITIZE_INDEX_PAGES)
+    relevant_kpis = find_relevant_kpis(document, page_windows, kpi_embeddings, all_kpis,
+                                       threshold=MATCH_THRESHOLD, boilerplate=boilerplate, stats=stats)
+    stats.sample_memory()
+    logger.info(f"Boilerplate {os.path.basename(pdf_path)}: {boilerplate.encode_calls_saved} encodages évités "
+                f"({boilerplate.lines_removed} lignes répétées, {boilerplate.exact_duplicates} doublons, "
+                f"{boilerplate.near_duplicates} quasi-doublons)")
+    
+    print(f"=== DEBUG EXTRACTION ===")
+    print(f"Fichier: {os.path.basename(pdf_path)}")
+    print(f"Texte extrait: {stats.chars} caractères sur {stats.pages} pages")
+    
+    if stats.chars < 100:
+        logger.warning(f"Peu de texte extrait de {pdf_path}")
+        print("❌ ERREUR: Texte insuffisant")
+        finish_job(stats, 'process_pdf', os.path.basename(pdf_path), job_stats, boilerplate,
+                   window_pages=window_pages, kpis_extracted=0)
+        return []
+    
+    # Sauvegarder le début du texte extrait pour debug
+    debug_dir = "debug_texts"
+    os.makedirs(debug_dir, exist_ok=True)
+    debug_file = os.path.join(debug_dir, f"debug_{os.path.basename(pdf_path)}.txt")
+    with open(debug_file, 'w', encoding='utf-8') as f:
+        f.write(stats.preview + "\n[...]")
+    
+    print(f"Texte debug sauvegardé: {debug_file}")
+    
+    results = extract_values(document, relevant_kpis, kpi_df, os.path.basename(pdf_path), stats)
+    
+    # Filtrer les résultats
+    with stats.stage('filter'):
+        filtered_results = filter_results(results, min_confidence)
+    logger.info(f"{len(filtered_results)} KPIs valides après filtrage")
+    finish_job(stats, 'process_pdf', os.path.basename(pdf_path), job_stats, boilerplate,
+               window_pages=window_pages, kpis_extracted=len(filtered_results))
+    
+    if filtered_results:
+        print(f"🎉 EXTRACTION RÉUSSIE: {len(filtered_results)} KPIs uniques extraits")
+    else:
+        print("❌ AUCUN KPI EXTRACTÉ - Vérifiez le fichier KPI et le contenu du PDF")
+    
+    return filtered_results
+
+
+# Extraction progressive d'un PDF déposé dans le chat
+def kpi_topic_lookup(kpi_df):
+    """{nom de KPI: (topic, topic_fr)} d'après le fichier KPI (colonnes 1-2: noms, 3-4: thèmes)"""
+    lookup = {}
+    if not hasattr(kpi_df, 'columns') or len(kpi_df.columns) == 0:
+        return lookup
+    rows = list(kpi_df.itertuples(index=False))
+    for col_idx in range(min(2, len(kpi_df.columns))):
+        for row in rows:
+            name = row[col_idx]
+            if pd.isna(name) or name in lookup:
+                continue
+            topic = str(row[2]) if len(row) > 2 and pd.notna(row[2]) else "Unknown"
+            topic_fr = str(row[3]) if len(row) > 3 and pd.notna(row[3]) else "Inconnu"
+            lookup[name] = (topic, topic_fr)
+    return lookup
+
+
+def iter_chat_pdf_kpis(pdf_path, kpi_embeddings, all_kpis, kpi_df, min_confidence=0.3,
+                       window_pages=CHAT_WINDOW_PAGES, stats=None, boilerplate=None,
+                       threshold=CHAT_MATCH_THRESHOLD):
+    """Extraction progressive pour le chat: une liste de KPIs nouveaux ou améliorés par fenêtre
+    
+    Les pages d'index puis les pages de tableaux sont lues en premier. Chaque KPI
+    garde la valeur de sa phrase la mieux notée qui en contient une; une liste
+    (éventuellement vide) est produite après chaque fenêtre, ce qui laisse
+    l'appelant s'arrêter à tout moment. ``threshold``: similarité minimale
+    phrase / KPI (``CHAT_MATCH_THRESHOLD``, plus permissif que ``MATCH_THRESHOLD``).
+    """
+    stats = stats if stats is not None else StreamStats()
+    source_file = os.path.basename(pdf_path)
+    topics = kpi_topic_lookup(kpi_df)
+    document = CompactDocument(source_file)
+    matcher = SaturatingMatcher(len(all_kpis), DEFAULT_TOP_K, HIGH_CONFIDENCE_SCORE)
+    best = {}       # kpi_name -> score de la valeur déjà produite
+    
+    page_windows = iter_pdf_page_windows(pdf_path, window_pages, stats, boilerplate,
+                                         prioritize=PRIORITIZE_INDEX_PAGES, rank_tables=True)
+    windows = iter_document_windows(document, page_windows, nlp, stats=stats, boilerplate=boilerplate)
+    try:
+        for indices, sentences in windows:
+            cos_scores = score_sentences(kpi_model, sentences, kpi_embeddings, ENCODE_BATCH_SIZE, stats)
+            with stats.stage('matching'):
+                changed = matcher.add(top_matches(indices, cos_scores, threshold), document.sentence_key)
+            
+            found = []
+            for kpi_idx in changed:
+                kpi_name = all_kpis[kpi_idx]
+                for score, sentence_idx in matcher.top(kpi_idx):
+                    if score < min_confidence or score <= best.get(kpi_name, -1.0):
+                        break
+                    with stats.stage('value_extraction'):
+                        values = extract_kpi_values(document.sentence(sentence_idx), kpi_name)
+                    if not values:
+                        continue
+                    topic, topic_fr = topics.get(kpi_name, ("Unknown", "Inconnu"))
+                    found.append({
+                        'kpi_name': kpi_name,
+                        'value': values[0]['value'],
+                        'unit': values[0]['unit'],
+                        'source_file': source_file,
+                        'topic': topic,
+                        'topic_fr': topic_fr,
+                        'confidence': float(score),
+                        'extraction_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    })
+                    best[kpi_name] = score
+                    break
+            yield found
+            
+            if matcher.saturated:
+                stats.early_exit = True
+                break
+    finally:
+        windows.close()
+        stats.candidates += matcher.candidates
+
+
+@lru_cache(maxsize=4)
+def _cached_kpi_list(path, mtime, size):
+    return load_kpi_list(path)
+
+
+def cached_kpi_list(kpi_file):
+    """``load_kpi_list`` une fois par processus et par version du fichier KPI"""
+    path = os.path.abspath(kpi_file)
+    st = os.stat(path)
+    return _cached_kpi_list(path, st.st_mtime, st.st_size)
+
+
+def extract_pdf(pdf_path, kpi_file, min_confidence=0.3):
+    """Tâche ``extract_pdf`` du pool d'extraction: (résultats, profil du job)
+
+    Les KPIs sont relus depuis ``kpi_file`` dans le processus de travail: la
+    file ne transporte que des chemins et des nombres (JSON).
+    """
+    kpi_df, _, _, kpi_embeddings, all_kpis = cached_kpi_list(kpi_file)
+    job_stats = {}
+    results = process_pdf(pdf_path, kpi_embeddings, all_kpis, kpi_df, min_confidence, job_stats=job_stats)
+    return results, job_stats
+
+
+def extract_chat_pdf(pdf_path, kpi_file, progress_path, min_confidence=0.3, window_pages=CHAT_WINDOW_PAGES):
+    """Tâche ``extract_chat_pdf`` du pool: extraction progressive d'un PDF déposé dans le chat
+
+    Après chaque fenêtre, une ligne JSON {"kpis", "pages"} est ajoutée à
+    ``progress_path`` (créé par l'API, qui le lit au fil de l'eau). L'API
+    abandonne l'extraction en supprimant ce fichier. Retourne le profil du job.
+    """
+    kpi_df, _, _, kpi_embeddings, all_kpis = cached_kpi_list(kpi_file)
+    stats = StreamStats()
+    boilerplate = BoilerplateFilter()
+    job_stats = {}
+    kpis, status = set(), 'done'
+    batches = iter_chat_pdf_kpis(pdf_path, kpi_embeddings, all_kpis, kpi_df, min_confidence, window_pages,
+                                 stats, boilerplate)
+    try:
+        for found in batches:
+            kpis.update(kpi['kpi_name'] for kpi in found)
+            try:
+                # r+ plutôt que a: un fichier supprimé par l'API n'est pas recréé
+                with open(progress_path, 'r+', encoding='utf-8') as progress:
+                    progress.seek(0, os.SEEK_END)
+                    progress.write(json.dumps({'kpis': found, 'pages': stats.pages}) + "\n")
+            except FileNotFoundError:
+                status = 'partial'
+                break
+    finally:
+        batches.close()
+    finish_job(stats, 'process_pdf_for_chat', os.path.basename(pdf_path), job_stats, boilerplate,
+               window_pages=window_pages, kpis_extracted=len(kpis), status=status)
+    return job_stats
+
+
+def stage_configs(kpi_file, min_confidence=0.3):
+    """[(étape, paramètres)] dont dépendent les résultats, pour le manifeste de run (esg_manifest)"""
+    return [
+        ('text', {'window_pages': STREAM_WINDOW_PAGES, 'prioritize': PRIORITIZE_INDEX_PAGES}),
+        ('segment', {'spacy': f"{nlp.meta.get('name')}-{nlp.meta.get('version')}", 'max_chars': SPACY_MAX_CHARS}),
+        ('embed', {'model': KPI_MODEL_NAME}),
+        ('match', {'kpis': file_hash(kpi_file), 'threshold': MATCH_THRESHOLD, 'top_k': MATCH_TOP_K,
+                   'high_confidence': HIGH_CONFIDENCE_SCORE}),
+        ('values', {'min_confidence': min_confidence}),
+    ]
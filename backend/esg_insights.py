@@ -0,0 +1,268 @@
+"""Profils d'entreprise précalculés après l'ingestion.
+
+Pour chaque entreprise (``source_file``), un profil structuré (statistiques de
+confiance, couverture par domaine, secteur estimé, forces et lacunes, KPIs les
+plus et les moins fiables) puis un résumé rédigé par le LLM sont stockés dans
+SQLite, versionnés par l'empreinte des lignes de l'entreprise. Les endpoints de
+chat composent leurs prompts à partir de ces profils au lieu de tout recalculer
+à chaque question; le ``InsightSummarizer`` les met à jour en tâche de fond.
+"""
+import os
+import json
+import time
+import queue
+import sqlite3
+import hashlib
+import logging
+import threading
+
+import pandas as pd
+
+from esg_prompt import compact_number
+from esg_scheduler import PRIORITY_BATCH
+
+logger = logging.getLogger(__name__)
+
+INSIGHTS_DB_PATH = os.environ.get('ESG_INSIGHTS_DB', 'company_insights.sqlite')
+SUMMARY_OPTIONS = {"temperature": 0.2, "num_predict": 350}
+PROFILE_COLUMNS = ['kpi_name', 'value', 'unit', 'topic_fr', 'confidence']
+PEER_TOPIC_SHARE = 0.5      # domaine "attendu" s'il est couvert par au moins la moitié des entreprises
+
+
+def data_hash(company_df):
+    """Empreinte des lignes d'une entreprise (indépendante de leur ordre)"""
+    columns = [c for c in PROFILE_COLUMNS if c in company_df.columns]
+    rows = company_df[columns].astype(str).apply('|'.join, axis=1).sort_values()
+    return hashlib.sha256("\n".join(rows).encode('utf-8')).hexdigest()[:32]
+
+
+def estimate_sector(kpi_data):
+    """Secteur d'activité probable d'après les domaines des KPIs"""
+    if kpi_data.empty or 'topic_fr' not in kpi_data.columns:
+        return "non déterminé"
+    topics = kpi_data['topic_fr']
+    env_ratio = topics.str.contains('environnement|émis|énergie', na=False, case=False).mean()
+    social_ratio = topics.str.contains('social|diversité|employé', na=False, case=False).mean()
+    if env_ratio > 0.6:
+        return "industriel ou énergétique"
+    elif social_ratio > 0.5:
+        return "services ou technologies"
+    elif env_ratio > 0.3 and social_ratio > 0.3:
+        return "manufacturier diversifié"
+    return "général"
+
+
+def peer_topics(df):
+    """Domaines couverts par au moins PEER_TOPIC_SHARE des entreprises"""
+    if df.empty or 'topic_fr' not in df.columns:
+        return []
+    share = df.groupby('topic_fr')['source_file'].nunique() / df['source_file'].nunique()
+    return sorted(share[share >= PEER_TOPIC_SHARE].index)
+
+
+def _kpi_records(rows):
+    return [{"kpi_name": r.kpi_name, "value": r.value if not hasattr(r.value, 'item') else r.value.item(),
+             "unit": r.unit, "confidence": round(float(r.confidence), 3)} for r in rows.itertuples()]
+
+
+def build_profile(company, company_df, expected_topics=()):
+    """Profil structuré d'une entreprise (dict sérialisable en JSON)"""
+    confidence = pd.to_numeric(company_df.get('confidence', pd.Series(0.5, index=company_df.index)),
+                               errors='coerce').fillna(0.0)
+    kpis = company_df.assign(confidence=confidence)
+    domains = kpis.groupby('topic_fr')['confidence'].agg(['count', 'mean']).sort_values('count', ascending=False) \
+        if 'topic_fr' in kpis.columns else pd.DataFrame(columns=['count', 'mean'])
+
+    strengths = [{"domain": d, "kpis": int(r['count']), "avg_confidence": round(float(r['mean']), 3)}
+                 for d, r in domains.iterrows() if r['count'] >= 3 and r['mean'] >= 0.6][:5]
+    weak = [{"domain": d, "kpis": int(r['count']), "avg_confidence": round(float(r['mean']), 3)}
+            for d, r in domains.iterrows() if r['count'] == 1 or r['mean'] < 0.4][:5]
+    missing = [topic for topic in expected_topics if topic not in domains.index]
+
+    return {
+        "company": company,
+        "stats": {
+            "total_kpis": int(len(kpis)),
+            "avg_confidence": round(float(confidence.mean()), 3) if len(kpis) else 0.0,
+            "high_confidence": int((confidence > 0.7).sum()),
+            "medium_confidence": int(((confidence > 0.4) & (confidence <= 0.7)).sum()),
+            "low_confidence": int((confidence <= 0.4).sum()),
+        },
+        "domains": {d: int(r['count']) for d, r in domains.iterrows()},
+        "sector": estimate_sector(kpis),
+        "strengths": strengths,
+        "gaps": {"weak_domains": weak, "missing_domains": missing[:10]},
+        "top_kpis": _kpi_records(kpis.nlargest(5, 'confidence')),
+        "low_confidence_kpis": _kpi_records(kpis.nsmallest(3, 'confidence')),
+    }
+
+
+def profile_text(profile, summary=None):
+    """Profil compact pour un prompt"""
+    stats = profile["stats"]
+    lines = [
+        f"ENTREPRISE: {profile['company']} (secteur estimé: {profile['sector']})",
+        f"• {stats['total_kpis']} KPIs, confiance moyenne {stats['avg_confidence']:.0%} "
+        f"({stats['high_confidence']} fiables, {stats['medium_confidence']} moyens, {stats['low_confidence']} faibles)",
+        "• Domaines: " + ", ".join(f"{d} ({n})" for d, n in list(profile["domains"].items())[:8]),
+    ]
+    if profile["strengths"]:
+        lines.append("• Forces: " + ", ".join(f"{s['domain']} ({s['kpis']} KPIs)" for s in profile["strengths"]))
+    gaps = [g['domain'] for g in profile["gaps"]["weak_domains"]] + profile["gaps"]["missing_domains"]
+    if gaps:
+        lines.append("• Lacunes: " + ", ".join(gaps[:8]))
+    lines.append("• KPIs clés: " + "; ".join(
+        f"{k['kpi_name']} = {compact_number(k['value'])} {k['unit'] or ''}".strip() for k in profile["top_kpis"]))
+    if summary:
+        lines.append(f"SYNTHÈSE: {summary}")
+    return "\n".join(lines)
+
+
+def summary_prompt(profile):
+    return (f"Rédige en français une synthèse ESG de 4 à 6 phrases pour {profile['company']}: positionnement, "
+            f"forces, lacunes et priorités. Reste factuel et n'invente aucun chiffre.\n\n{profile_text(profile)}")
+
+
+class CompanyInsightStore:
+    """Profils et résumés par entreprise, dans SQLite"""
+
+    def __init__(self, path=INSIGHTS_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS company_insights (
+                    company TEXT PRIMARY KEY,
+                    data_hash TEXT NOT NULL,
+                    profile TEXT NOT NULL,
+                    summary TEXT,
+                    summary_model TEXT,
+                    updated REAL NOT NULL
+                )""")
+
+    def get(self, company):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data_hash, profile, summary, summary_model, updated FROM company_insights WHERE company = ?",
+                (company,)).fetchone()
+        if row is None:
+            return None
+        return {"company": company, "data_hash": row[0], "profile": json.loads(row[1]), "summary": row[2],
+                "summary_model": row[3], "updated": row[4]}
+
+    def put_profile(self, company, digest, profile):
+        """Enregistrer un profil; le résumé est effacé si les données ont changé"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO company_insights (company, data_hash, profile, updated) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(company) DO UPDATE SET profile = excluded.profile, updated = excluded.updated, "
+                "summary = CASE WHEN data_hash = excluded.data_hash THEN summary END, "
+                "summary_model = CASE WHEN data_hash = excluded.data_hash THEN summary_model END, "
+                "data_hash = excluded.data_hash",
+                (company, digest, json.dumps(profile, ensure_ascii=False, default=str), time.time()))
+
+    def put_summary(self, company, digest, summary, model=None):
+        """Enregistrer un résumé s'il porte sur la version courante des données"""
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "UPDATE company_insights SET summary = ?, summary_model = ?, updated = ? "
+                "WHERE company = ? AND data_hash = ?",
+                (summary, model, time.time(), company, digest)).rowcount > 0
+
+    def stats(self):
+        with self._lock:
+            total, summarized = self._conn.execute(
+                "SELECT COUNT(*), COUNT(summary) FROM company_insights").fetchone()
+        return {"companies": total, "summarized": summarized}
+
+
+class InsightSummarizer:
+    """Mise à jour des profils et résumés en tâche de fond après chaque ingestion"""
+
+    def __init__(self, store, client=None):
+        self.store = store
+        self.client = client
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, load_df=None):
+        """Démarrer le thread; ``load_df`` planifie les entreprises déjà présentes"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(load_df,), daemon=True,
+                                            name='insight-summarizer')
+            self._thread.start()
+        return self
+
+    def schedule(self, df, companies=None):
+        """Planifier (re)profilage et résumé; les entreprises inchangées sont ignorées au traitement"""
+        if df is None or df.empty:
+            return 0
+        expected = peer_topics(df)
+        companies = companies if companies is not None else df['source_file'].unique()
+        scheduled = 0
+        for company in companies:
+            with self._lock:
+                if company in self._pending:
+                    continue
+                self._pending.add(company)
+            self._queue.put((company, df[df['source_file'] == company], expected))
+            scheduled += 1
+        return scheduled
+
+    def ensure(self, company, company_df, all_df=None):
+        """Profil à jour pour ``company`` (calculé tout de suite s'il manque, résumé planifié)
+
+        ``all_df`` (toutes les entreprises) ne sert qu'au calcul des domaines manquants.
+        """
+        digest = data_hash(company_df)
+        record = self.store.get(company)
+        if record is not None and record["data_hash"] == digest:
+            return record
+        expected_topics = peer_topics(all_df) if all_df is not None else []
+        profile = build_profile(company, company_df, expected_topics)
+        self.store.put_profile(company, digest, profile)
+        if self.client is not None:
+            with self._lock:
+                if company not in self._pending:
+                    self._pending.add(company)
+                    self._queue.put((company, company_df, expected_topics))
+        return {"company": company, "data_hash": digest, "profile": profile, "summary": None}
+
+    def _process(self, company, company_df, expected_topics):
+        digest = data_hash(company_df)
+        record = self.store.get(company)
+        if record is None or record["data_hash"] != digest:
+            profile = build_profile(company, company_df, expected_topics)
+            self.store.put_profile(company, digest, profile)
+        elif record["summary"]:
+            return
+        else:
+            profile = record["profile"]
+        if self.client is None:
+            return
+        result = self.client.generate(summary_prompt(profile), options=SUMMARY_OPTIONS,
+                                      endpoint='insight_summary', priority=PRIORITY_BATCH)
+        summary = (result.get('response') or "").strip()
+        if summary and self.store.put_summary(company, digest, summary, self.client.model):
+            logger.info(f"Synthèse ESG enregistrée pour {company}")
+
+    def _run(self, load_df):
+        if load_df is not None:
+            try:
+                self.schedule(load_df())
+            except Exception as e:
+                logger.warning(f"Profils d'entreprise non planifiés au démarrage: {e}")
+        while True:
+            company, company_df, expected_topics = self._queue.get()
+            try:
+                self._process(company, company_df, expected_topics)
+            except Exception as e:
+                # Ollama indisponible ou saturé: le profil reste utilisable, le résumé sera refait plus tard
+                logger.warning(f"Synthèse ESG non générée pour {company}: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(company)
@@ -0,0 +1,123 @@
+"""Cache SQLite des réponses du LLM.
+
+La clé est un SHA-256 du modèle, des options, du prompt système, du contexte et
+de la question. Chaque entrée porte la version du magasin de résultats
+(all_extracted_kpis.csv) au moment de la génération: dès que cette version
+change, les entrées plus anciennes sont supprimées. Les entrées expirent après
+``ttl`` secondes et les moins récemment lues sont évincées au-delà de
+``max_entries``.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from esg_metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_PATH = os.environ.get('ESG_LLM_CACHE', 'llm_cache.sqlite')
+LLM_CACHE_MAX_ENTRIES = 2000
+LLM_CACHE_TTL = 7 * 24 * 3600
+
+
+def cache_key(model, options, system, context, prompt):
+    payload = json.dumps({'model': model, 'options': options or {}, 'system': system or "",
+                          'context': context or "", 'prompt': prompt},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def file_version(*paths):
+    """Version d'un ou plusieurs fichiers (date de modification + taille), sans lecture"""
+    parts = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            parts.append(f"{st.st_mtime_ns}-{st.st_size}")
+        except OSError:
+            parts.append("absent")
+    return "|".join(parts)
+
+
+class LLMResponseCache:
+    """Réponses LLM persistées dans SQLite, avec TTL, LRU et version des données"""
+
+    def __init__(self, path=LLM_CACHE_PATH, max_entries=LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL,
+                 name='llm'):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.name = name
+        self._lock = threading.Lock()
+        self._data_version = None
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    meta TEXT,
+                    data_version TEXT,
+                    created REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache(last_access)")
+
+    def _check_version(self, data_version):
+        # Appelé sous verrou: purge les réponses calculées sur d'anciennes données
+        if data_version is None or data_version == self._data_version:
+            return
+        removed = self._conn.execute("DELETE FROM llm_cache WHERE data_version IS NOT ?",
+                                     (data_version,)).rowcount
+        if removed:
+            logger.info(f"Cache LLM: {removed} réponses invalidées (nouvelle version des résultats)")
+        self._data_version = data_version
+
+    def get(self, key, data_version=None):
+        """(réponse, méta) ou None; compte un hit ou un miss"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._check_version(data_version)
+            row = self._conn.execute("SELECT response, meta, created FROM llm_cache WHERE key = ?",
+                                     (key,)).fetchone()
+            if row is not None and now - row[2] > self.ttl:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                row = None
+            if row is not None:
+                self._conn.execute("UPDATE llm_cache SET last_access = ?, hits = hits + 1 WHERE key = ?",
+                                   (now, key))
+        record_cache(self.name, row is not None)
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]) if row[1] else {}
+
+    def put(self, key, response, data_version=None, meta=None):
+        now = time.time()
+        with self._lock, self._conn:
+            self._check_version(data_version)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, response, meta, data_version, created, last_access, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                (key, response, json.dumps(meta or {}, default=str), data_version, now, now)
+            )
+            self._conn.execute("DELETE FROM llm_cache WHERE created < ?", (now - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_access DESC "
+                "LIMIT -1 OFFSET ?)", (self.max_entries,)
+            )
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM llm_cache")
+
+    def stats(self):
+        with self._lock:
+            entries, hits = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM llm_cache").fetchone()
+        return {'entries': entries, 'hits_on_stored_entries': hits, 'max_entries': self.max_entries,
+                'ttl_s': self.ttl, 'data_version': self._data_version}
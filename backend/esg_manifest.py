@@ -0,0 +1,202 @@
+"""Manifeste des runs d'extraction: reprendre un run là où il s'est arrêté.
+
+Un document est identifié par l'empreinte de son contenu (SHA-256), pas par
+son nom. Pour chaque étape terminée, le manifeste (SQLite) garde l'empreinte de
+configuration de l'étape: version du pipeline, paramètres de l'étape et
+empreinte de l'étape précédente (``stage_fingerprints``). Un document dont la
+dernière étape porte l'empreinte courante est sauté; sinon le run reprend après
+la dernière étape à jour dont la sortie a été conservée (point de reprise sur
+disque). Changer les paramètres d'une étape ne refait que cette étape et les
+suivantes.
+"""
+import os
+import json
+import time
+import uuid
+import pickle
+import sqlite3
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_VERSION = '1'   # à incrémenter quand une modification du code d'extraction change les résultats
+RUN_MANIFEST_PATH = os.environ.get('ESG_RUN_MANIFEST', 'run_manifest.sqlite')
+CHECKPOINT_DIR = os.environ.get('ESG_CHECKPOINT_DIR', 'checkpoints')
+HASH_CHUNK = 1024 * 1024
+
+
+def file_hash(path):
+    """SHA-256 du contenu d'un fichier"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stage_fingerprints(stages, version=PIPELINE_VERSION):
+    """{étape: empreinte} pour [(étape, paramètres)] dans l'ordre du pipeline
+
+    L'empreinte d'une étape inclut celle de la précédente: changer une étape
+    invalide aussi toutes les suivantes.
+    """
+    fingerprints, previous = {}, ""
+    for name, config in stages:
+        payload = json.dumps([version, name, config, previous], sort_keys=True, default=str)
+        previous = fingerprints[name] = hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+    return fingerprints
+
+
+class RunManifest:
+    """Étapes terminées par document, points de reprise et historique des runs"""
+
+    def __init__(self, path=RUN_MANIFEST_PATH, checkpoint_dir=CHECKPOINT_DIR):
+        self.path = path
+        self.checkpoint_dir = checkpoint_dir
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS stages (
+                    doc TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    source TEXT,
+                    checkpoint TEXT,
+                    run TEXT,
+                    finished REAL NOT NULL,
+                    merged INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (doc, stage)
+                )""")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS sources (
+                    key TEXT PRIMARY KEY,
+                    doc TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL
+                )""")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    config TEXT,
+                    started REAL NOT NULL,
+                    finished REAL,
+                    documents INTEGER,
+                    status TEXT NOT NULL
+                )""")
+
+    # --------------------------------------------------------------- documents
+    def document_hash(self, path, key=None):
+        """Empreinte du contenu, recalculée seulement si la taille ou la date du fichier ont changé
+
+        ``key`` (par défaut le chemin absolu) permet de retrouver l'empreinte
+        d'un document avant de l'ouvrir (``known_document``).
+        """
+        key = key or os.path.abspath(path)
+        st = os.stat(path)
+        with self._lock:
+            row = self._conn.execute("SELECT doc, size, mtime FROM sources WHERE key = ?", (key,)).fetchone()
+        if row is not None and row[1] == st.st_size and row[2] == st.st_mtime:
+            return row[0]
+        doc = file_hash(path)
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO sources (key, doc, size, mtime) VALUES (?, ?, ?, ?)",
+                               (key, doc, st.st_size, st.st_mtime))
+        return doc
+
+    def known_document(self, key):
+        """Empreinte déjà calculée pour ``key``, ou None"""
+        with self._lock:
+            row = self._conn.execute("SELECT doc FROM sources WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    # ------------------------------------------------------------------ étapes
+    def stage_state(self, doc):
+        """{étape: (empreinte, point de reprise)} des étapes terminées du document"""
+        with self._lock:
+            rows = self._conn.execute("SELECT stage, fingerprint, checkpoint FROM stages WHERE doc = ?",
+                                      (doc,)).fetchall()
+        return {stage: (fingerprint, checkpoint) for stage, fingerprint, checkpoint in rows}
+
+    def is_done(self, doc, stage, fingerprint):
+        with self._lock:
+            row = self._conn.execute("SELECT fingerprint FROM stages WHERE doc = ? AND stage = ?",
+                                     (doc, stage)).fetchone()
+        return row is not None and row[0] == fingerprint
+
+    def up_to_date(self, doc, fingerprints):
+        """Étapes à jour depuis le début du pipeline (``fingerprints`` dans l'ordre)"""
+        state = self.stage_state(doc)
+        current = []
+        for stage, fingerprint in fingerprints.items():
+            if state.get(stage, (None, None))[0] != fingerprint:
+                break
+            current.append(stage)
+        return current
+
+    def complete(self, doc, stage, fingerprint, source=None, output=None, run=None):
+        """Enregistrer une étape terminée; ``output`` (picklable) est conservé comme point de reprise"""
+        checkpoint = self._save(doc, stage, output) if output is not None else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO stages (doc, stage, fingerprint, source, checkpoint, run, finished, merged) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0)", (doc, stage, fingerprint, source, checkpoint, run, time.time()))
+
+    def load(self, doc, stage):
+        """Sortie conservée de l'étape, ou None (pas de point de reprise, fichier illisible)"""
+        checkpoint = self.stage_state(doc).get(stage, (None, None))[1]
+        if checkpoint is None:
+            return None
+        try:
+            with open(checkpoint, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+            logger.warning(f"Point de reprise illisible {checkpoint}: {e}")
+            return None
+
+    def _save(self, doc, stage, output):
+        folder = os.path.join(self.checkpoint_dir, doc[:2])
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{doc}.{stage}.pkl")
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        with open(tmp, 'wb') as f:
+            pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        return path
+
+    def unmerged(self, stage, fingerprint):
+        """[(doc, source, sortie)] des documents terminés sous ``fingerprint`` pas encore fusionnés"""
+        with self._lock:
+            rows = self._conn.execute("SELECT doc, source FROM stages WHERE stage = ? AND fingerprint = ? "
+                                      "AND merged = 0 AND checkpoint IS NOT NULL", (stage, fingerprint)).fetchall()
+        return [(doc, source, self.load(doc, stage)) for doc, source in rows]
+
+    def mark_merged(self, docs, stage):
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE stages SET merged = 1 WHERE doc = ? AND stage = ?",
+                                   [(doc, stage) for doc in docs])
+
+    # -------------------------------------------------------------------- runs
+    def start_run(self, kind, config=None):
+        run = uuid.uuid4().hex[:12]
+        with self._lock, self._conn:
+            self._conn.execute("INSERT INTO runs (id, kind, version, config, started, status) "
+                               "VALUES (?, ?, ?, ?, ?, 'running')",
+                               (run, kind, PIPELINE_VERSION, json.dumps(config, default=str), time.time()))
+        return run
+
+    def finish_run(self, run, documents, status='finished'):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE runs SET finished = ?, documents = ?, status = ? WHERE id = ?",
+                               (time.time(), documents, status, run))
+
+    def summary(self):
+        """{étape: documents terminés} toutes configurations confondues"""
+        with self._lock:
+            rows = self._conn.execute("SELECT stage, COUNT(*) FROM stages GROUP BY stage").fetchall()
+        return dict(rows)
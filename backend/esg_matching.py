@@ -0,0 +1,163 @@
+"""Matching phrases -> KPIs sur indices.
+
+Les correspondances sont des enregistrements NumPy structurés
+(sentence_idx, kpi_idx, score) au lieu de listes de dictionnaires. Chaque KPI
+ne garde que ses k meilleures phrases (tas borné) et le matching s'arrête dès
+que tous les KPIs ont k correspondances au-dessus du seuil de haute confiance.
+"""
+import time
+import heapq
+import logging
+
+import numpy as np
+from sentence_transformers import util
+
+from esg_metrics import observe_encode
+from esg_profiling import log_event
+from esg_streaming import profile_stage
+
+logger = logging.getLogger(__name__)
+
+MATCH_DTYPE = np.dtype([
+    ('sentence_idx', np.int32),
+    ('kpi_idx', np.int32),
+    ('score', np.float32)
+])
+TOP_KPIS_PER_SENTENCE = 3
+DEFAULT_TOP_K = 3
+HIGH_CONFIDENCE_SCORE = 0.75
+
+
+def score_sentences(model, sentences, kpi_embeddings, batch_size=64, stats=None):
+    """Matrice de similarité cosinus (phrases x KPIs) pour une fenêtre"""
+    start = time.perf_counter()
+    with profile_stage(stats, 'encode'):
+        sentence_embeddings = model.encode(sentences, convert_to_tensor=True, batch_size=batch_size)
+    observe_encode(len(sentences), time.perf_counter() - start)
+    if stats is not None:
+        stats.record_encode(len(sentences), batch_size)
+    with profile_stage(stats, 'similarity'):
+        return util.pytorch_cos_sim(sentence_embeddings, kpi_embeddings).cpu().numpy()
+
+
+def top_matches(sentence_indices, cos_scores, threshold, top_n=TOP_KPIS_PER_SENTENCE):
+    """Garder, pour chaque phrase, les ``top_n`` KPIs au-dessus du seuil"""
+    top_n = min(top_n, cos_scores.shape[1])
+    top_kpis = np.argsort(-cos_scores, axis=1)[:, :top_n]
+    top_scores = np.take_along_axis(cos_scores, top_kpis, axis=1)
+
+    keep = top_scores > threshold
+    records = np.empty(int(keep.sum()), dtype=MATCH_DTYPE)
+    records['sentence_idx'] = np.broadcast_to(np.asarray(sentence_indices)[:, None], keep.shape)[keep]
+    records['kpi_idx'] = top_kpis[keep]
+    records['score'] = top_scores[keep]
+    return records
+
+
+class SaturatingMatcher:
+    """Tas borné (k meilleures phrases) par KPI, avec détection de saturation"""
+
+    def __init__(self, n_kpis, k=DEFAULT_TOP_K, high_confidence=HIGH_CONFIDENCE_SCORE):
+        self.n_kpis = n_kpis
+        self.k = k
+        self.high_confidence = high_confidence
+        self._heaps = {}            # kpi_idx -> [(score, sentence_idx, sentence_key)]
+        self._keys = {}             # kpi_idx -> clés de phrase présentes dans le tas
+        self._confident = np.zeros(n_kpis, dtype=np.int32)
+        self.candidates = 0
+
+    def add(self, records, sentence_key):
+        """Intégrer les enregistrements d'une fenêtre; ``sentence_key(idx)`` sert à dédupliquer
+
+        Retourne les indices des KPIs dont les meilleures phrases ont changé.
+        """
+        self.candidates += len(records)
+        changed = set()
+
+        for sentence_idx, kpi_idx, score in records[np.argsort(-records['score'])].tolist():
+            heap = self._heaps.setdefault(kpi_idx, [])
+            if len(heap) >= self.k and score <= heap[0][0]:
+                continue
+
+            key = sentence_key(sentence_idx)
+            keys = self._keys.setdefault(kpi_idx, set())
+            if key in keys:
+                continue
+
+            keys.add(key)
+            if len(heap) < self.k:
+                heapq.heappush(heap, (score, sentence_idx, key))
+            else:
+                evicted = heapq.heapreplace(heap, (score, sentence_idx, key))
+                keys.discard(evicted[2])
+            changed.add(kpi_idx)
+
+            self._confident[kpi_idx] = sum(1 for entry in heap if entry[0] >= self.high_confidence)
+        return changed
+
+    def top(self, kpi_idx):
+        """[(score, sentence_idx)] du KPI, par score décroissant"""
+        return [(score, sentence_idx) for score, sentence_idx, _ in sorted(self._heaps.get(kpi_idx, ()), reverse=True)]
+
+    @property
+    def saturated_kpis(self):
+        return int((self._confident >= self.k).sum())
+
+    @property
+    def saturated(self):
+        return self.n_kpis > 0 and self.saturated_kpis == self.n_kpis
+
+    def results(self):
+        """{kpi_idx: enregistrements triés par score décroissant}"""
+        entries = [(score, sentence_idx, kpi_idx)
+                   for kpi_idx, heap in self._heaps.items() for score, sentence_idx, _ in heap]
+        records = np.empty(len(entries), dtype=MATCH_DTYPE)
+        if entries:
+            records['score'], records['sentence_idx'], records['kpi_idx'] = zip(*entries)
+        return group_matches_by_kpi(records)
+
+
+def match_sentence_windows(model, kpi_embeddings, windows, matcher, sentence_key, threshold, batch_size=64,
+                           stats=None):
+    """Encoder chaque fenêtre (indices, phrases) jusqu'à saturation du ``matcher``
+
+    Retourne True si le document a été abandonné avant la fin (saturation).
+    """
+    processed = 0
+
+    try:
+        for window_idx, (indices, sentences) in enumerate(windows):
+            try:
+                cos_scores = score_sentences(model, sentences, kpi_embeddings, batch_size, stats)
+            except Exception as e:
+                logger.error(f"Erreur traitement fenêtre {window_idx + 1}: {e}")
+                continue
+
+            with profile_stage(stats, 'matching'):
+                matcher.add(top_matches(indices, cos_scores, threshold), sentence_key)
+            processed += len(indices)
+            log_event(logger, 'window_matched', window=window_idx + 1, sentences=processed,
+                      saturated_kpis=matcher.saturated_kpis, n_kpis=matcher.n_kpis)
+
+            if matcher.saturated:
+                logger.info(f"Tous les KPIs ont {matcher.k} correspondances >= {matcher.high_confidence}: arrêt anticipé")
+                return True
+    finally:
+        # Ferme la chaîne de générateurs (et le PDF) même en cas d'arrêt anticipé
+        close = getattr(windows, 'close', None)
+        if close is not None:
+            close()
+
+    return False
+
+
+def group_matches_by_kpi(records):
+    """{kpi_idx: enregistrements triés par score décroissant}"""
+    if len(records) == 0:
+        return {}
+
+    order = np.lexsort((-records['score'], records['kpi_idx']))
+    records = records[order]
+    kpi_ids, starts = np.unique(records['kpi_idx'], return_index=True)
+    bounds = list(starts) + [len(records)]
+    return {int(kpi_idx): records[bounds[i]:bounds[i + 1]] for i, kpi_idx in enumerate(kpi_ids)}
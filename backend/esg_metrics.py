@@ -0,0 +1,246 @@
+"""Métriques en mémoire exposées au format texte Prometheus (/api/metrics).
+
+Compteurs, jauges et histogrammes minimalistes, sans dépendance externe et sûrs
+entre threads Flask. ``install_metrics(app)`` mesure chaque route et ajoute
+l'endpoint; les jobs d'extraction, l'encodage et les appels Ollama alimentent
+les métriques via les fonctions ``observe_*``.
+"""
+import time
+import threading
+from bisect import bisect_left
+
+from flask import Response, g, request
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+BATCH_BUCKETS = (1, 8, 16, 32, 64, 128, 256, 512, 1024)
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 200)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((key, ([*state[0]], state[1], state[2])) for key, state in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+REGISTRY = []
+
+HTTP_REQUESTS = Counter('esg_http_requests_total', "Requêtes HTTP par route, méthode et statut",
+                        ('route', 'method', 'status'))
+HTTP_LATENCY = Histogram('esg_http_request_duration_seconds', "Latence des requêtes HTTP",
+                         ('route', 'method'))
+HTTP_IN_FLIGHT = Gauge('esg_http_requests_in_flight', "Requêtes HTTP en cours de traitement")
+
+DOCUMENTS_PROCESSED = Counter('esg_documents_processed_total', "Documents traités par job et résultat",
+                              ('job', 'result'))
+PAGES_PROCESSED = Counter('esg_pages_processed_total', "Pages lues par les jobs d'extraction", ('job',))
+JOB_DURATION = Histogram('esg_job_duration_seconds', "Durée totale d'un job d'extraction", ('job',),
+                         STAGE_BUCKETS)
+STAGE_DURATION = Histogram('esg_stage_duration_seconds', "Durée cumulée d'une étape par document",
+                           ('job', 'stage'), STAGE_BUCKETS)
+JOB_PEAK_RSS = Gauge('esg_job_peak_rss_bytes', "Pic de mémoire résidente du dernier job", ('job',))
+
+ENCODE_BATCH = Histogram('esg_encode_batch_sentences', "Phrases par appel d'encodage", (), BATCH_BUCKETS)
+ENCODE_SENTENCES = Counter('esg_encode_sentences_total', "Phrases encodées")
+ENCODE_SECONDS = Counter('esg_encode_seconds_total', "Temps passé dans l'encodage des phrases")
+
+LLM_REQUESTS = Counter('esg_llm_requests_total', "Appels au LLM par usage et résultat", ('endpoint', 'status'))
+LLM_DURATION = Histogram('esg_llm_request_duration_seconds', "Durée des appels au LLM", ('endpoint',))
+LLM_TOKENS = Counter('esg_llm_tokens_total', "Jetons traités par le LLM (prompt / generated)",
+                     ('endpoint', 'kind'))
+LLM_TIME_TO_FIRST_TOKEN = Histogram('esg_llm_time_to_first_token_seconds', "Délai avant le premier jeton généré",
+                                    ('endpoint',))
+LLM_TOKENS_PER_SECOND = Histogram('esg_llm_generation_tokens_per_second', "Débit de génération du LLM",
+                                  ('endpoint',), TOKENS_PER_SECOND_BUCKETS)
+
+CACHE_REQUESTS = Counter('esg_cache_requests_total', "Consultations de cache par résultat (hit / miss)",
+                         ('cache', 'result'))
+
+
+def _render_cache_ratios():
+    caches = sorted({key[0] for key in CACHE_REQUESTS._values})
+    lines = ["# HELP esg_cache_hit_ratio Part des consultations servies par le cache",
+             "# TYPE esg_cache_hit_ratio gauge"]
+    for cache in caches:
+        hits = CACHE_REQUESTS.value(cache=cache, result='hit')
+        total = hits + CACHE_REQUESTS.value(cache=cache, result='miss')
+        lines.append(f'esg_cache_hit_ratio{{cache="{_escape(cache)}"}} {hits / total if total else 0.0!r}')
+    return lines
+
+
+def render_metrics():
+    """Toutes les métriques au format texte Prometheus 0.0.4"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    lines.extend(_render_cache_ratios())
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------------------- observations
+def observe_job(record):
+    """Enregistrer un profil de job (esg_profiling.finish_job)"""
+    job = record.get('job', 'unknown')
+    DOCUMENTS_PROCESSED.inc(job=job, result='extracted' if record.get('kpis_extracted') else 'empty')
+    PAGES_PROCESSED.inc(record.get('pages', 0), job=job)
+    JOB_DURATION.observe(record.get('wall_s', 0.0), job=job)
+    JOB_PEAK_RSS.set(int(record.get('peak_rss_mb', 0) * 1024 * 1024), job=job)
+    for stage, entry in record.get('stages', {}).items():
+        STAGE_DURATION.observe(entry['wall_s'], job=job, stage=stage)
+
+
+def observe_worker_job(record):
+    """Profil d'un job du pool d'extraction: ses métriques sont restées dans le processus de travail"""
+    observe_job(record)
+    ENCODE_SENTENCES.inc(record.get('encode', {}).get('sentences', 0))
+    ENCODE_SECONDS.inc(record.get('stages', {}).get('encode', {}).get('wall_s', 0.0))
+
+
+def observe_encode(n_sentences, seconds):
+    ENCODE_BATCH.observe(n_sentences)
+    ENCODE_SENTENCES.inc(n_sentences)
+    ENCODE_SECONDS.inc(seconds)
+
+
+def observe_llm(endpoint, elapsed, status='ok', result=None, ttft=None):
+    """Enregistrer un appel Ollama; ``result`` est la réponse JSON (finale) de /api/generate"""
+    LLM_REQUESTS.inc(endpoint=endpoint, status=status)
+    LLM_DURATION.observe(elapsed, endpoint=endpoint)
+    if ttft is not None:
+        LLM_TIME_TO_FIRST_TOKEN.observe(ttft, endpoint=endpoint)
+    if not result:
+        return
+    LLM_TOKENS.inc(result.get('prompt_eval_count') or 0, endpoint=endpoint, kind='prompt')
+    generated = result.get('eval_count') or 0
+    LLM_TOKENS.inc(generated, endpoint=endpoint, kind='generated')
+    eval_duration = (result.get('eval_duration') or 0) / 1e9   # nanosecondes
+    if generated and eval_duration > 0:
+        LLM_TOKENS_PER_SECOND.observe(generated / eval_duration, endpoint=endpoint)
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+# ----------------------------------------------------------------------- Flask
+def install_metrics(app, path='/api/metrics'):
+    """Mesurer toutes les routes de ``app`` et exposer ``path``"""
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_start = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            # Gabarit de route (/api/company/<company_name>) pour borner la cardinalité
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            HTTP_LATENCY.observe(time.perf_counter() - start, route=route, method=request.method)
+            HTTP_REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+        return response
+
+    @app.teardown_request
+    def _end_request(exc):
+        HTTP_IN_FLIGHT.dec()
+
+    @app.route(path, methods=['GET'])
+    def metrics():
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    return app
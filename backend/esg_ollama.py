@@ -0,0 +1,488 @@
+"""Accès partagé à Ollama.
+
+``OllamaHealthMonitor`` sonde ``/api/tags`` en arrière-plan (intervalle fixe
+quand Ollama répond, attente exponentielle quand il ne répond plus) et garde
+en cache l'état et la liste des modèles. Les endpoints lisent cet état sans
+appel réseau, et les appels de génération échouent immédiatement tant que le
+circuit est ouvert (Ollama injoignable). Une fois l'attente écoulée, le circuit
+est semi-ouvert: une seule requête d'essai passe, son succès le referme et son
+échec le rouvre pour une attente plus longue.
+
+``OllamaClient`` réutilise les connexions HTTP (session à pool keep-alive) et
+lit la génération en flux NDJSON, jeton par jeton. Avec un ``LLMScheduler``,
+chaque génération attend son tour dans la file à priorités et est interrompue
+à son échéance.
+
+``AsyncOllamaClient`` (aiohttp, optionnel) fait de même pour les routes servies
+par asyncio: une génération en attente n'occupe aucun thread.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from esg_metrics import Gauge, observe_llm
+from esg_profiling import log_event
+from esg_prompt import token_counter as default_token_counter
+from esg_scheduler import PRIORITY_INTERACTIVE, LLMDeadlineExceeded, LLM_REJECTED, remaining
+
+logger = logging.getLogger(__name__)
+
+HEALTH_INTERVAL = 15        # secondes entre deux sondes quand Ollama répond
+HEALTH_MAX_BACKOFF = 120    # attente maximale entre deux sondes en échec
+HEALTH_TIMEOUT = 3
+CONNECT_TIMEOUT = float(os.environ.get('OLLAMA_CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = float(os.environ.get('OLLAMA_READ_TIMEOUT', 120))   # délai maximal entre deux jetons
+POOL_SIZE = int(os.environ.get('OLLAMA_POOL_SIZE', 8))
+
+OLLAMA_UP = Gauge('esg_ollama_up', "1 si la dernière sonde Ollama a réussi")
+
+
+class OllamaHealthMonitor:
+    """État d'Ollama sondé en tâche de fond, avec coupe-circuit"""
+
+    def __init__(self, base_url, interval=HEALTH_INTERVAL, max_backoff=HEALTH_MAX_BACKOFF,
+                 timeout=HEALTH_TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.available = False
+        self.models = []
+        self.consecutive_failures = 0
+        self.last_check = None
+        self.last_success = None
+        self.last_error = None
+        self._next_probe = 0.0
+        self._trial = False     # requête d'essai en cours (circuit semi-ouvert)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._session = requests.Session()
+
+    # ----------------------------------------------------------------- sondes
+    def probe(self):
+        """Interroger /api/tags maintenant et mettre l'état à jour"""
+        try:
+            response = self._session.get(f"{self.base_url}/api/tags", timeout=self.timeout)
+            if response.status_code != 200:
+                raise requests.exceptions.RequestException(f"HTTP {response.status_code}")
+            self._mark_up(response.json().get('models', []))
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.report_failure(e)
+        return self.available
+
+    def _mark_up(self, models=None):
+        with self._lock:
+            if not self.available:
+                logger.info(f"Ollama disponible ({self.base_url})")
+            self.available = True
+            self._trial = False
+            if models is not None:
+                self.models = models
+            self.consecutive_failures = 0
+            self.last_error = None
+            self.last_check = self.last_success = time.time()
+            self._next_probe = time.monotonic() + self.interval
+        OLLAMA_UP.set(1)
+
+    def report_success(self):
+        """Un appel de génération a abouti: le circuit reste (ou redevient) fermé"""
+        if not self.available:
+            self._mark_up()
+
+    def report_failure(self, error):
+        """Ollama injoignable: ouvrir le circuit et espacer les sondes"""
+        with self._lock:
+            if self.available:
+                logger.warning(f"Ollama non accessible: {error}")
+            self.available = False
+            self._trial = False
+            self.consecutive_failures += 1
+            self.last_error = str(error)
+            self.last_check = time.time()
+            self._next_probe = time.monotonic() + self.backoff
+        OLLAMA_UP.set(0)
+
+    @property
+    def backoff(self):
+        if not self.consecutive_failures:
+            return self.interval
+        return min(self.interval * 2 ** (self.consecutive_failures - 1), self.max_backoff)
+
+    # --------------------------------------------------------- coupe-circuit
+    def allow_request(self):
+        """True si le circuit est fermé, 'trial' pour la requête d'essai, sinon False (échec immédiat)
+
+        Circuit ouvert, une seule requête passe une fois l'attente (``backoff``)
+        écoulée: ``report_success`` ferme le circuit, ``report_failure`` le rouvre.
+        """
+        if self.available:
+            return True
+        with self._lock:
+            if self.available:
+                return True
+            if self._trial or time.monotonic() < self._next_probe:
+                return False
+            self._trial = True
+        return 'trial'
+
+    def end_trial(self):
+        """Requête d'essai terminée sans verdict (annulée, erreur HTTP): une autre pourra passer"""
+        with self._lock:
+            self._trial = False
+
+    def has_model(self, name):
+        return any(name.lower() in model.get('name', '').lower() for model in self.models)
+
+    # ------------------------------------------------------------ tâche de fond
+    def start(self):
+        """Première sonde synchrone puis sondes périodiques (idempotent)"""
+        if self._thread is not None:
+            return self
+        self.probe()
+        self._thread = threading.Thread(target=self._run, name="ollama-health", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            # _next_probe peut être repoussé entre-temps par report_failure / report_success
+            time.sleep(max(0.5, self._next_probe - time.monotonic()))
+            if time.monotonic() >= self._next_probe:
+                self.probe()
+
+    def status(self):
+        return {
+            'available': self.available,
+            'models': [model.get('name') for model in self.models],
+            'consecutive_failures': self.consecutive_failures,
+            'last_check': self.last_check,
+            'last_success': self.last_success,
+            'last_error': self.last_error,
+            'trial_in_flight': self._trial,
+            'next_probe_in_s': round(max(0.0, self._next_probe - time.monotonic()), 1)
+        }
+
+
+class OllamaUnavailable(requests.exceptions.ConnectionError):
+    """Appel refusé sans contacter Ollama: le coupe-circuit est ouvert"""
+
+
+class OllamaHTTPError(requests.exceptions.HTTPError):
+    def __init__(self, status_code, details=""):
+        super().__init__(f"HTTP {status_code}: {details}")
+        self.status_code = status_code
+        self.details = details
+
+
+class OllamaClient:
+    """Client /api/generate partagé: pool de connexions et lecture en flux"""
+
+    def __init__(self, base_url, model, monitor=None, scheduler=None, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, pool_size=POOL_SIZE, token_counter=None):
+        self.base_url = base_url.rstrip('/')
+        self.model = model
+        self.monitor = monitor
+        self.scheduler = scheduler
+        self.token_counter = token_counter or default_token_counter
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def stream_generate(self, prompt, system=None, options=None, model=None, endpoint='generate',
+                        timeout=None, priority=PRIORITY_INTERACTIVE, deadline=None, report_queue=False,
+                        **extra):
+        """Générer en flux: chaque élément est un objet NDJSON d'Ollama
+
+        Le dernier (``done``) porte les statistiques d'Ollama, ``ttft_s`` (délai
+        avant le premier jeton) et ``queue_wait_s``. ``timeout`` borne l'attente
+        entre deux jetons, ``deadline`` (horloge monotone) la durée totale. Avec
+        ``report_queue``, des éléments {"queue_position": n} précèdent la génération.
+        """
+        allowed = self.monitor.allow_request() if self.monitor is not None else True
+        if not allowed:
+            observe_llm(endpoint, 0.0, 'circuit_open')
+            raise OllamaUnavailable("Ollama hors ligne (coupe-circuit ouvert)")
+
+        ticket = None
+        try:
+            if self.scheduler is not None:
+                ticket = self.scheduler.enqueue(priority, endpoint, deadline)
+                deadline = ticket.deadline
+            if ticket is not None:
+                for position in self.scheduler.wait(ticket):
+                    if report_queue:
+                        yield {"queue_position": position, "done": False}
+            yield from self._stream(prompt, system, options, model, endpoint, timeout, deadline,
+                                    ticket.wait_s if ticket is not None else 0.0, extra)
+        finally:
+            if ticket is not None:
+                self.scheduler.release(ticket)
+            if allowed == 'trial':
+                self.monitor.end_trial()
+
+    def _payload(self, prompt, system, options, model, extra):
+        payload = {"model": model or self.model, "prompt": prompt, "stream": True}
+        if system is not None:
+            payload["system"] = system
+        if options:
+            payload["options"] = options
+        payload.update(extra)
+        return payload
+
+    def _read_timeout(self, timeout, deadline):
+        read_timeout = timeout or self.read_timeout
+        left = remaining(deadline)
+        if left is not None:
+            read_timeout = max(min(read_timeout, left), 0.1)
+        return read_timeout
+
+    def _stream(self, prompt, system, options, model, endpoint, timeout, deadline, queue_wait, extra):
+        payload = self._payload(prompt, system, options, model, extra)
+        read_timeout = self._read_timeout(timeout, deadline)
+
+        start = time.perf_counter()
+        status, final, ttft = 'ok', None, None
+        try:
+            with self.session.post(f"{self.base_url}/api/generate", json=payload, stream=True,
+                                   timeout=(self.connect_timeout, read_timeout)) as response:
+                if response.status_code != 200:
+                    raise OllamaHTTPError(response.status_code, response.text[:200])
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if 'error' in chunk:
+                        raise OllamaHTTPError(500, chunk['error'])
+                    if ttft is None and chunk.get('response'):
+                        ttft = time.perf_counter() - start
+                    if chunk.get('done'):
+                        chunk['ttft_s'] = round(ttft if ttft is not None else time.perf_counter() - start, 3)
+                        chunk['queue_wait_s'] = round(queue_wait, 3)
+                        self._record_tokens(endpoint, payload, chunk)
+                        final = chunk
+                    elif deadline is not None and time.monotonic() > deadline:
+                        # Fermer la connexion interrompt la génération côté Ollama
+                        LLM_REJECTED.inc(endpoint=endpoint, reason='deadline_generating')
+                        raise LLMDeadlineExceeded("Échéance dépassée pendant la génération")
+                    yield chunk
+        except OllamaHTTPError as e:
+            status = f"http_{e.status_code}"
+            raise
+        except LLMDeadlineExceeded:
+            status = 'deadline'
+            raise
+        except requests.exceptions.Timeout:
+            status = 'timeout'
+            raise
+        except requests.exceptions.ConnectionError as e:
+            status = 'connection_error'
+            if self.monitor is not None:
+                self.monitor.report_failure(e)
+            raise
+        except GeneratorExit:
+            status = 'cancelled'    # client HTTP parti avant la fin du flux
+            raise
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            observe_llm(endpoint, time.perf_counter() - start, status, final, ttft)
+
+        if self.monitor is not None:
+            self.monitor.report_success()
+
+    def _record_tokens(self, endpoint, payload, final):
+        """Jetons de prompt (estimés et comptés par Ollama) et générés; recale l'estimation"""
+        text = "\n".join(part for part in (payload.get("system"), payload["prompt"]) if part)
+        estimated = self.token_counter.count(text)
+        final['prompt_tokens_est'] = estimated
+        if "context" not in payload:
+            # Avec un contexte de session, Ollama ne compte que les jetons ajoutés
+            self.token_counter.calibrate(text, final.get('prompt_eval_count'))
+        log_event(logger, 'llm_tokens', level=logging.INFO, endpoint=endpoint,
+                  prompt_tokens=final.get('prompt_eval_count'), prompt_tokens_est=estimated,
+                  generated_tokens=final.get('eval_count'),
+                  num_ctx=(payload.get("options") or {}).get("num_ctx"))
+
+    def generate(self, prompt, system=None, options=None, model=None, endpoint='generate', timeout=None,
+                 priority=PRIORITY_INTERACTIVE, deadline=None, **extra):
+        """Réponse complète (lue en flux): dict final d'Ollama avec ``response`` concaténée"""
+        parts = []
+        final = {}
+        for chunk in self.stream_generate(prompt, system, options, model, endpoint, timeout,
+                                          priority=priority, deadline=deadline, **extra):
+            parts.append(chunk.get('response', ''))
+            if chunk.get('done'):
+                final = chunk
+        result = dict(final)
+        result['response'] = "".join(parts)
+        return result
+
+
+class AsyncOllamaClient:
+    """Client /api/generate pour asyncio, avec la configuration d'un ``OllamaClient``
+
+    Même file (``LLMScheduler.wait_async``), même coupe-circuit, mêmes métriques
+    et mêmes exceptions que le client synchrone (Timeout et ConnectionError de
+    ``requests``), pour que les routes partagent leur gestion d'erreurs. La
+    session aiohttp est créée dans la boucle qui l'utilise.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._session = None
+
+    @property
+    def model(self):
+        return self.client.model
+
+    @property
+    def read_timeout(self):
+        return self.client.read_timeout
+
+    def _get_session(self):
+        if aiohttp is None:
+            raise RuntimeError("Le paquet 'aiohttp' est requis pour le mode asynchrone")
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=POOL_SIZE)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def stream_generate(self, prompt, system=None, options=None, model=None, endpoint='generate',
+                              timeout=None, priority=PRIORITY_INTERACTIVE, deadline=None, report_queue=False,
+                              **extra):
+        """Générateur asynchrone: mêmes éléments que ``OllamaClient.stream_generate``"""
+        client = self.client
+        allowed = client.monitor.allow_request() if client.monitor is not None else True
+        if not allowed:
+            observe_llm(endpoint, 0.0, 'circuit_open')
+            raise OllamaUnavailable("Ollama hors ligne (coupe-circuit ouvert)")
+
+        ticket = None
+        try:
+            if client.scheduler is not None:
+                ticket = client.scheduler.enqueue(priority, endpoint, deadline)
+                deadline = ticket.deadline
+            if ticket is not None:
+                async for position in client.scheduler.wait_async(ticket):
+                    if report_queue:
+                        yield {"queue_position": position, "done": False}
+            async for chunk in self._stream(prompt, system, options, model, endpoint, timeout, deadline,
+                                            ticket.wait_s if ticket is not None else 0.0, extra):
+                yield chunk
+        finally:
+            if ticket is not None:
+                client.scheduler.release(ticket)
+            if allowed == 'trial':
+                client.monitor.end_trial()
+
+    async def _stream(self, prompt, system, options, model, endpoint, timeout, deadline, queue_wait, extra):
+        client = self.client
+        payload = client._payload(prompt, system, options, model, extra)
+        timeouts = aiohttp.ClientTimeout(sock_connect=client.connect_timeout,
+                                         sock_read=client._read_timeout(timeout, deadline))
+
+        start = time.perf_counter()
+        status, final, ttft = 'ok', None, None
+        try:
+            async with self._get_session().post(f"{client.base_url}/api/generate", json=payload,
+                                                timeout=timeouts) as response:
+                if response.status != 200:
+                    raise OllamaHTTPError(response.status, (await response.text())[:200])
+                async for line in response.content:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if 'error' in chunk:
+                        raise OllamaHTTPError(500, chunk['error'])
+                    if ttft is None and chunk.get('response'):
+                        ttft = time.perf_counter() - start
+                    if chunk.get('done'):
+                        chunk['ttft_s'] = round(ttft if ttft is not None else time.perf_counter() - start, 3)
+                        chunk['queue_wait_s'] = round(queue_wait, 3)
+                        client._record_tokens(endpoint, payload, chunk)
+                        final = chunk
+                    elif deadline is not None and time.monotonic() > deadline:
+                        LLM_REJECTED.inc(endpoint=endpoint, reason='deadline_generating')
+                        raise LLMDeadlineExceeded("Échéance dépassée pendant la génération")
+                    yield chunk
+        except OllamaHTTPError as e:
+            status = f"http_{e.status_code}"
+            raise
+        except LLMDeadlineExceeded:
+            status = 'deadline'
+            raise
+        except (asyncio.TimeoutError, aiohttp.ServerTimeoutError) as e:
+            status = 'timeout'
+            raise requests.exceptions.Timeout(str(e) or "Délai de lecture Ollama dépassé") from e
+        except aiohttp.ClientConnectionError as e:
+            status = 'connection_error'
+            if client.monitor is not None:
+                client.monitor.report_failure(e)
+            raise requests.exceptions.ConnectionError(str(e)) from e
+        except (GeneratorExit, asyncio.CancelledError):
+            status = 'cancelled'
+            raise
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            observe_llm(endpoint, time.perf_counter() - start, status, final, ttft)
+
+        if client.monitor is not None:
+            client.monitor.report_success()
+
+    async def generate(self, prompt, system=None, options=None, model=None, endpoint='generate', timeout=None,
+                       priority=PRIORITY_INTERACTIVE, deadline=None, **extra):
+        """Réponse complète: dict final d'Ollama avec ``response`` concaténée"""
+        parts = []
+        final = {}
+        async for chunk in self.stream_generate(prompt, system, options, model, endpoint, timeout,
+                                                priority=priority, deadline=deadline, **extra):
+            parts.append(chunk.get('response', ''))
+            if chunk.get('done'):
+                final = chunk
+        result = dict(final)
+        result['response'] = "".join(parts)
+        return result
+
+
+def generation_stats(final):
+    """Statistiques utiles d'un objet ``done`` d'Ollama (durées en secondes)"""
+    eval_duration = (final.get('eval_duration') or 0) / 1e9
+    return {
+        'ttft_s': final.get('ttft_s'),
+        'queue_wait_s': final.get('queue_wait_s'),
+        'prompt_tokens': final.get('prompt_eval_count'),
+        'prompt_tokens_est': final.get('prompt_tokens_est'),
+        'generated_tokens': final.get('eval_count'),
+        'prompt_eval_s': round((final.get('prompt_eval_duration') or 0) / 1e9, 3),
+        'eval_s': round(eval_duration, 3),
+        'tokens_per_second': round(final['eval_count'] / eval_duration, 1)
+        if final.get('eval_count') and eval_duration else None
+    }
+
+
+def sse_event(data, event=None):
+    """Événement Server-Sent Events (données JSON)"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
@@ -0,0 +1,275 @@
+"""Pipeline en flux: étapes reliées par des files bornées.
+
+Chaque étape (``Stage``) a ses propres exécutants: des threads pour les E/S
+(téléchargement, écriture), un pool de processus pour le calcul (texte,
+segmentation, encodage). Un exécutant dont l'étape suivante est en retard se
+bloque sur la file pleine: l'étape la plus lente impose son rythme aux
+précédentes (contre-pression) et le nombre de documents en mémoire reste
+borné. ``Pipeline.report`` résume le débit de chaque étape pendant le run.
+
+Reprise (esg_manifest): un document dont ``item['done_stages']`` contient le
+nom d'une étape la traverse sans traitement, et ``on_stage_done(étape, item)``
+est appelé après chaque étape exécutée avec succès (points de reprise).
+
+Les pools de processus sont créés par ``Pipeline.start``, avant le lancement
+des threads: fork depuis un processus encore sans threads ni calcul torch.
+
+    pipeline = Pipeline([Stage('fetch', fetch, workers=8),
+                         Stage('text', extract_text, workers=6, processes=True), ...])
+    pipeline.start()
+    for item in pipeline.run(documents):
+        ...
+"""
+import os
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from esg_metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_QUEUE_SIZE = int(os.environ.get('ESG_PIPELINE_QUEUE_SIZE', 8))   # documents en attente par étape
+REPORT_INTERVAL = 10
+
+PIPELINE_ITEMS = Counter('esg_pipeline_items_total', "Documents traités par étape du pipeline et résultat",
+                         ('stage', 'result'))
+PIPELINE_BACKLOG = Gauge('esg_pipeline_queue_items', "Documents en attente à l'entrée d'une étape", ('stage',))
+PIPELINE_BUSY = Gauge('esg_pipeline_busy_workers', "Exécutants occupés par étape", ('stage',))
+
+_END = object()   # fin du flux, une par exécutant
+
+
+def _warm_up():
+    return os.getpid()
+
+
+class Stage:
+    """Étape du pipeline: ``fn(item) -> item`` (None retire le document du flux)
+
+    Avec ``processes=True``, ``fn`` (fonction de module ou ``functools.partial``
+    picklable) s'exécute dans un pool de ``workers`` processus, ``initializer``
+    y étant appelé une fois.
+    """
+
+    def __init__(self, name, fn, workers=1, processes=False, queue_size=PIPELINE_QUEUE_SIZE,
+                 initializer=None, initargs=()):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.processes = processes
+        self.initializer = initializer
+        self.initargs = initargs
+        self.inbox = queue.Queue(maxsize=max(1, queue_size))
+        self.done = 0
+        self.errors = 0
+        self.resumed = 0
+        self.busy = 0
+        self.busy_s = 0.0
+        self._pool = None
+        self._ctx = None
+        self._alive = 0
+        self._lock = threading.Lock()
+
+    def start_pool(self, ctx):
+        """Créer le pool de processus et démarrer tous ses processus"""
+        if not self.processes or self._pool is not None:
+            return
+        self._ctx = ctx
+        self._pool = ProcessPoolExecutor(self.workers, mp_context=ctx, initializer=self.initializer,
+                                         initargs=self.initargs)
+        # Soumissions simultanées: un processus lancé par tâche tant qu'aucun n'est libre
+        futures = [self._pool.submit(_warm_up) for _ in range(self.workers)]
+        for future in futures:
+            future.result()
+
+    def call(self, fn, *args, **kwargs):
+        """``fn(*args, **kwargs)`` dans un exécutant de l'étape (processus si l'étape en a)
+
+        Les tâches en cours quand un processus du pool meurt échouent toutes: chacune
+        est relancée une fois dans le nouveau pool, seule celle qui le tue à nouveau échoue.
+        """
+        for attempt in range(2):
+            pool = self._pool
+            if pool is None:
+                return fn(*args, **kwargs)
+            try:
+                return pool.submit(fn, *args, **kwargs).result()
+            except BrokenProcessPool:
+                self._restart_pool(pool)
+                if attempt:
+                    raise
+
+    def _restart_pool(self, broken):
+        """Un processus est mort (plantage, mémoire): nouveau pool pour les documents suivants"""
+        with self._lock:
+            if self._pool is not broken:
+                return   # déjà remplacé par un autre exécutant
+            logger.error(f"Étape {self.name}: pool de processus interrompu, redémarrage")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=self._ctx, initializer=self.initializer,
+                                             initargs=self.initargs)
+
+    def stop_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def _track(self, delta, elapsed=0.0, result=None):
+        with self._lock:
+            self.busy += delta
+            self.busy_s += elapsed
+            if result == 'ok':
+                self.done += 1
+            elif result == 'error':
+                self.errors += 1
+            elif result == 'resumed':
+                self.resumed += 1
+        PIPELINE_BUSY.set(self.busy, stage=self.name)
+        if result is not None:
+            PIPELINE_ITEMS.inc(stage=self.name, result=result)
+
+
+class Pipeline:
+    """Étapes exécutées en flux, chacune alimentant la suivante par une file bornée"""
+
+    def __init__(self, stages, report_interval=REPORT_INTERVAL, on_error=None, on_stage_done=None):
+        self.stages = list(stages)
+        self.report_interval = report_interval
+        self.on_error = on_error
+        self.on_stage_done = on_stage_done
+        self.failures = []        # (étape, document, message), si ``on_error`` n'est pas fourni
+        self.fed = 0
+        self._output = queue.Queue(maxsize=max(1, PIPELINE_QUEUE_SIZE))
+        self._started = None
+        self._report_stop = threading.Event()
+        self._report_last = None
+
+    def stage(self, name):
+        return next(stage for stage in self.stages if stage.name == name)
+
+    def start(self):
+        """Créer les pools de processus (fork sous Linux: modèles déjà chargés partagés)"""
+        method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+        ctx = multiprocessing.get_context(method)
+        for stage in self.stages:
+            stage.start_pool(ctx)
+        return self
+
+    def stop(self):
+        for stage in self.stages:
+            stage.stop_pool()
+
+    def _fail(self, stage, item, error):
+        message = f"{type(error).__name__}: {error}"
+        logger.error(f"Étape {stage.name} en échec: {message}")
+        if self.on_error is not None:
+            self.on_error(stage.name, item, message)
+        else:
+            self.failures.append((stage.name, item, message))
+
+    def _work(self, index):
+        stage = self.stages[index]
+        output = self.stages[index + 1].inbox if index + 1 < len(self.stages) else self._output
+        while True:
+            item = stage.inbox.get()
+            if item is _END:
+                break
+            PIPELINE_BACKLOG.set(stage.inbox.qsize(), stage=stage.name)
+            if stage.name in item.get('done_stages', ()):
+                stage._track(0, result='resumed')
+                output.put(item)
+                continue
+            stage._track(1)
+            started = time.perf_counter()
+            try:
+                item = stage.call(stage.fn, item)
+                result = 'ok'
+            except Exception as e:
+                self._fail(stage, item, e)
+                item, result = None, 'error'
+            stage._track(-1, time.perf_counter() - started, result)
+            if item is not None and self.on_stage_done is not None:
+                try:
+                    self.on_stage_done(stage.name, item)
+                except Exception as e:
+                    logger.warning(f"Point de reprise non enregistré ({stage.name}): {e}")
+            if item is not None:
+                output.put(item)   # bloque tant que l'étape suivante est en retard
+
+        # Dernier exécutant de l'étape: fin du flux pour l'étape suivante
+        with stage._lock:
+            stage._alive -= 1
+            last = stage._alive == 0
+        if last:
+            following = self.stages[index + 1].workers if index + 1 < len(self.stages) else 1
+            for _ in range(following):
+                output.put(_END)
+
+    def _feed(self, items):
+        first = self.stages[0]
+        try:
+            for item in items:
+                first.inbox.put(item)
+                self.fed += 1
+        except Exception as e:
+            logger.error(f"Source du pipeline interrompue: {e}")
+        finally:
+            for _ in range(first.workers):
+                first.inbox.put(_END)
+
+    def _report_loop(self):
+        while not self._report_stop.wait(self.report_interval):
+            print(self.report(), flush=True)
+
+    def run(self, items):
+        """Générateur: documents sortis de la dernière étape, au fil de l'eau"""
+        self.start()
+        self._started = time.perf_counter()
+        self._report_last = (self._started, {stage.name: 0 for stage in self.stages})
+        threads = [threading.Thread(target=self._feed, args=(items,), daemon=True, name='pipeline-source')]
+        for index, stage in enumerate(self.stages):
+            stage._alive = stage.workers
+            threads.extend(threading.Thread(target=self._work, args=(index,), daemon=True,
+                                            name=f"pipeline-{stage.name}-{i}") for i in range(stage.workers))
+        if self.report_interval:
+            threads.append(threading.Thread(target=self._report_loop, daemon=True, name='pipeline-report'))
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self._output.get()
+                if item is _END:
+                    break
+                yield item
+        finally:
+            self._report_stop.set()
+            self.stop()
+
+    def report(self):
+        """Débit de chaque étape depuis le dernier rapport et depuis le début"""
+        now = time.perf_counter()
+        elapsed = now - self._started if self._started is not None else 0.0
+        last_time, last_done = self._report_last or (now, {})
+        interval = max(now - last_time, 1e-9)
+        lines = [f"--- pipeline {elapsed:.0f}s, {self.fed} documents entrés ---",
+                 f"{'Étape':<14}{'Faits':>8}{'Repris':>8}{'Erreurs':>9}{'Débit/s':>10}{'Moy./s':>9}{'s/doc':>8}"
+                 f"{'Actifs':>9}{'File':>8}"]
+        for stage in self.stages:
+            rate = (stage.done - last_done.get(stage.name, 0)) / interval
+            mean_rate = stage.done / elapsed if elapsed else 0.0
+            per_doc = stage.busy_s / max(stage.done + stage.errors, 1)
+            lines.append(f"{stage.name:<14}{stage.done:>8}{stage.resumed:>8}{stage.errors:>9}{rate:>10.2f}{mean_rate:>9.2f}"
+                         f"{per_doc:>8.2f}{f'{stage.busy}/{stage.workers}':>9}"
+                         f"{f'{stage.inbox.qsize()}/{stage.inbox.maxsize}':>8}")
+        self._report_last = (now, {stage.name: stage.done for stage in self.stages})
+        return "\n".join(lines)
+
+    def stats(self):
+        return {stage.name: {"done": stage.done, "errors": stage.errors, "resumed": stage.resumed,
+                             "busy": stage.busy, "workers": stage.workers, "queued": stage.inbox.qsize(),
+                             "busy_s": round(stage.busy_s, 3)} for stage in self.stages}
@@ -0,0 +1,91 @@
+"""Profil de performance des jobs d'extraction.
+
+Chaque appel à process_pdf / process_pdf_for_chat produit un enregistrement
+(temps mur et CPU par étape, pic mémoire, compteurs de pages, phrases et
+candidats, statistiques d'encodage) renvoyé par l'API et ajouté au journal
+JSONL ``PERF_LOG_PATH``. Les événements détaillés des boucles internes passent
+par ``log_event`` et ne sont formatés que si le niveau de log l'autorise.
+"""
+import os
+import json
+import logging
+import threading
+from datetime import datetime
+
+from esg_metrics import observe_job
+
+logger = logging.getLogger(__name__)
+
+PERF_LOG_PATH = os.environ.get('ESG_PERF_LOG', 'perf_log.jsonl')
+
+_perf_log_lock = threading.Lock()
+
+
+def log_event(log, event, level=logging.DEBUG, **fields):
+    """Événement structuré (une ligne JSON), ignoré sans coût si le niveau est filtré"""
+    if log.isEnabledFor(level):
+        log.log(level, json.dumps({'event': event, **fields}, ensure_ascii=False, default=str))
+
+
+def write_perf_record(record, path=None):
+    """Ajouter un enregistrement au journal JSONL (écriture sérialisée entre threads)"""
+    path = PERF_LOG_PATH if path is None else path
+    if not path:
+        return
+    try:
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with _perf_log_lock:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+    except Exception as e:
+        logger.warning(f"Écriture du journal de performance impossible: {e}")
+
+
+def finish_job(stats, job, source_file, job_stats=None, boilerplate=None, **extra):
+    """Clore le profil d'un job: journal JSONL, résumé dans les logs et ``job_stats``"""
+    record = {'timestamp': datetime.now().isoformat(), 'job': job, 'source_file': source_file}
+    record.update(stats.as_dict())
+    if boilerplate is not None:
+        record['boilerplate'] = boilerplate.as_dict()
+    record.update(extra)
+
+    write_perf_record(record)
+    observe_job(record)
+    logger.info(format_perf_summary(record))
+    if job_stats is not None:
+        job_stats.update(record)
+    return record
+
+
+def format_perf_summary(record):
+    """Résumé d'une ligne d'un enregistrement de performance"""
+    stages = sorted(record.get('stages', {}).items(), key=lambda item: -item[1]['wall_s'])
+    top = ", ".join(f"{name} {entry['wall_s']:.2f}s" for name, entry in stages[:4])
+    return (f"[{record.get('job')}] {record.get('source_file')}: {record.get('wall_s', 0):.2f}s "
+            f"(CPU {record.get('cpu_s', 0):.2f}s), {record.get('pages', 0)} pages, "
+            f"{record.get('sentences', 0)} phrases, {record.get('candidates', 0)} candidats, "
+            f"pic {record.get('peak_rss_mb', 0)} Mo | {top}")
+
+
+def aggregate_stages(records):
+    """Cumuler les étapes de plusieurs enregistrements: {étape: {calls, wall_s, cpu_s}}"""
+    totals = {}
+    for record in records:
+        for name, entry in record.get('stages', {}).items():
+            total = totals.setdefault(name, {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0})
+            total['calls'] += entry['calls']
+            total['wall_s'] += entry['wall_s']
+            total['cpu_s'] += entry['cpu_s']
+    return totals
+
+
+def format_stage_table(records):
+    """Tableau texte des étapes cumulées, triées par temps mur décroissant"""
+    totals = aggregate_stages(records)
+    wall_total = sum(record.get('wall_s', 0) for record in records) or 1.0
+
+    lines = [f"{'Étape':<20}{'Appels':>10}{'Mur (s)':>12}{'CPU (s)':>12}{'% mur':>8}"]
+    for name, total in sorted(totals.items(), key=lambda item: -item[1]['wall_s']):
+        lines.append(f"{name:<20}{total['calls']:>10}{total['wall_s']:>12.2f}{total['cpu_s']:>12.2f}"
+                     f"{100 * total['wall_s'] / wall_total:>7.1f}%")
+    return "\n".join(lines)
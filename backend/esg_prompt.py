@@ -0,0 +1,185 @@
+"""Assemblage des prompts sous budget de jetons.
+
+Ollama tronque silencieusement un prompt qui dépasse ``num_ctx``, et sur CPU le
+temps de prefill croît avec la longueur du prompt. Les prompts sont donc
+découpés en sections (système, données, question, historique) dotées d'une
+priorité et d'un budget: ``assemble`` réduit les sections les moins
+prioritaires pour que prompt + réponse tiennent dans la fenêtre du modèle.
+
+Les jetons sont comptés avec le tokenizer du modèle (fichier ``tokenizer.json``
+désigné par ``ESG_TOKENIZER``, paquet ``tokenizers``) ou, hors ligne, estimés:
+un jeton par chiffre (Mistral et Llama découpent les nombres chiffre par
+chiffre) plus un ratio caractères/jeton recalé sur le ``prompt_eval_count``
+renvoyé par Ollama à chaque génération.
+"""
+import os
+import re
+import math
+import logging
+import threading
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:
+    Tokenizer = None
+
+logger = logging.getLogger(__name__)
+
+TOKENIZER_PATH = os.environ.get('ESG_TOKENIZER')
+DEFAULT_CHARS_PER_TOKEN = 3.2      # texte hors chiffres, français / anglais, tokenizer Mistral
+MIN_CHARS_PER_TOKEN = 2.0
+MAX_CHARS_PER_TOKEN = 6.0
+CALIBRATION_WEIGHT = 0.1           # poids d'une nouvelle mesure dans la moyenne mobile
+PROMPT_TEMPLATE_OVERHEAD = 16      # jetons du gabarit de chat ([INST], BOS...) ajoutés par Ollama
+
+_DIGIT = re.compile(r'\d')
+_MISSING_UNITS = {'', 'nan', 'none', 'unknown'}
+
+
+class TokenCounter:
+    """Nombre de jetons d'un texte: tokenizer du modèle, sinon estimation calibrée"""
+
+    def __init__(self, tokenizer_path=TOKENIZER_PATH, chars_per_token=DEFAULT_CHARS_PER_TOKEN):
+        self.chars_per_token = chars_per_token
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._tokenizer = None
+        if tokenizer_path:
+            if Tokenizer is None:
+                logger.warning("ESG_TOKENIZER défini mais le paquet 'tokenizers' est absent: estimation utilisée")
+            else:
+                try:
+                    self._tokenizer = Tokenizer.from_file(tokenizer_path)
+                except Exception as e:
+                    logger.warning(f"Tokenizer illisible ({tokenizer_path}): {e}")
+
+    @property
+    def exact(self):
+        return self._tokenizer is not None
+
+    def count(self, text):
+        if not text:
+            return 0
+        if self._tokenizer is not None:
+            return len(self._tokenizer.encode(text, add_special_tokens=False).ids)
+        digits = len(_DIGIT.findall(text))
+        return digits + math.ceil((len(text) - digits) / self.chars_per_token)
+
+    def calibrate(self, text, prompt_tokens):
+        """Recaler l'estimation sur le nombre de jetons compté par Ollama pour ``text``"""
+        if self._tokenizer is not None or not text or not prompt_tokens:
+            return
+        digits = len(_DIGIT.findall(text))
+        observed = prompt_tokens - PROMPT_TEMPLATE_OVERHEAD - digits
+        if observed <= 0:
+            return
+        ratio = (len(text) - digits) / observed
+        if not MIN_CHARS_PER_TOKEN <= ratio <= MAX_CHARS_PER_TOKEN:
+            return      # prompt en partie servi par le cache KV d'Ollama: mesure inexploitable
+        with self._lock:
+            self.chars_per_token += CALIBRATION_WEIGHT * (ratio - self.chars_per_token)
+            self.samples += 1
+
+    def truncate(self, text, max_tokens, keep='head'):
+        """Texte réduit à ``max_tokens`` jetons, coupé entre deux lignes si possible
+
+        ``keep='tail'`` garde la fin (historique de conversation).
+        """
+        if max_tokens <= 0 or not text:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        lines = text.split('\n')
+        if keep == 'tail':
+            lines.reverse()
+        kept, used = [], 0
+        for line in lines:
+            cost = self.count(line) + 1
+            if used + cost > max_tokens:
+                break
+            kept.append(line)
+            used += cost
+        if not kept:
+            # Première ligne trop longue à elle seule: coupe au caractère
+            chars = int(max_tokens * self.chars_per_token * 0.8)
+            kept = [lines[0][:chars] if keep == 'head' else lines[0][-chars:]]
+        if keep == 'tail':
+            kept.reverse()
+        return "\n".join(kept)
+
+    def stats(self):
+        return {"tokenizer": "model" if self.exact else "estimate",
+                "chars_per_token": round(self.chars_per_token, 3), "calibration_samples": self.samples}
+
+
+token_counter = TokenCounter()      # partagé: calibré par toutes les générations du processus
+
+
+def compact_number(value):
+    """Nombre court pour un prompt: 12500000.0 -> 12.5M, 0.123456 -> 0.1235, 42.0 -> 42"""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return str(value)
+    if not math.isfinite(number):
+        return str(value)
+    # Les nombres à 4 chiffres (années, pourcentages x100) restent tels quels
+    for suffix, threshold, scale in (('G', 1e9, 1e9), ('M', 1e6, 1e6), ('k', 1e4, 1e3)):
+        if abs(number) >= threshold:
+            return f"{number / scale:.4g}{suffix}"
+    return str(int(number)) if number.is_integer() else f"{number:.4g}"
+
+
+def compact_table(df, columns=('kpi_name', 'value', 'unit', 'confidence'), prefix="• "):
+    """Lignes « kpi: valeur unité (conf) » sans en-têtes répétés ni décimales inutiles"""
+    lines = []
+    for row in df.itertuples(index=False):
+        fields = row._asdict()
+        unit = str(fields.get('unit', '') or '')
+        unit = "" if unit.lower() in _MISSING_UNITS else f" {unit}"
+        line = f"{prefix}{fields.get('kpi_name', '')}: {compact_number(fields.get('value', ''))}{unit}"
+        if 'confidence' in columns and 'confidence' in fields:
+            line += f" ({float(fields['confidence']):.2f})"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+class Section:
+    """Partie d'un prompt: priorité 0 = jamais réduite, sinon réduite par priorité décroissante"""
+
+    __slots__ = ('name', 'text', 'priority', 'max_tokens', 'keep')
+
+    def __init__(self, name, text, priority=0, max_tokens=None, keep='head'):
+        self.name = name
+        self.text = text or ""
+        self.priority = priority
+        self.max_tokens = max_tokens
+        self.keep = keep
+
+
+def assemble(sections, num_ctx, num_predict, counter=None):
+    """Sections réduites pour que prompt + ``num_predict`` tiennent dans ``num_ctx``
+
+    Retourne ({nom: texte}, rapport {"budget", "prompt_tokens", "sections", "truncated"}).
+    """
+    counter = counter or token_counter
+    budget = num_ctx - num_predict - PROMPT_TEMPLATE_OVERHEAD
+    left = budget
+    texts, tokens, truncated = {}, {}, []
+    for section in sorted(sections, key=lambda s: s.priority):
+        text = section.text
+        cost = counter.count(text)
+        if section.priority > 0:
+            limit = max(left, 0) if section.max_tokens is None else min(section.max_tokens, max(left, 0))
+            if cost > limit:
+                text = counter.truncate(text, limit, section.keep)
+                cost = counter.count(text)
+                truncated.append(section.name)
+        texts[section.name] = text
+        tokens[section.name] = cost
+        left -= cost
+    report = {"budget": budget, "prompt_tokens": budget - left, "sections": tokens, "truncated": truncated}
+    if left < 0:
+        logger.warning(f"Prompt au-delà de la fenêtre du modèle ({budget - left} > {budget} jetons) "
+                       f"malgré la réduction des sections")
+    return texts, report
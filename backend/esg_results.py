@@ -0,0 +1,64 @@
+"""Table des KPIs extraits (all_extracted_kpis.csv / .xlsx): lecture, fusion, sauvegarde.
+
+Module sans effet de bord à l'import (ni modèles, ni Ollama, ni threads):
+l'API et les outils en ligne de commande (batch_extract, corpus_extract
+collect) l'utilisent tous les deux. L'API reconstruit son index et ses profils
+d'entreprise quand le CSV change (``file_version``), y compris après une
+fusion faite par un outil en ligne de commande.
+"""
+import os
+import logging
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_CSV = "all_extracted_kpis.csv"
+OUTPUT_EXCEL = "all_extracted_kpis.xlsx"
+
+
+def safe_read_csv(file_path):
+    """Safely read CSV with error handling for inconsistent columns"""
+    try:
+        return pd.read_csv(file_path)
+    except pd.errors.ParserError:
+        try:
+            return pd.read_csv(file_path, on_bad_lines='skip', engine='python')
+        except TypeError:
+            return pd.read_csv(file_path, error_bad_lines=False, engine='python')
+    except Exception as e:
+        logger.error(f"Error reading CSV: {e}")
+        return pd.DataFrame()
+
+
+def load_existing_results():
+    if os.path.exists(OUTPUT_CSV):
+        try:
+            existing_df = safe_read_csv(OUTPUT_CSV)
+            logger.info(f"Chargement de {len(existing_df)} KPIs existants")
+            return existing_df
+        except Exception as e:
+            logger.error(f"Erreur lors du chargement des résultats existants: {e}")
+            return pd.DataFrame()
+    return pd.DataFrame()
+
+
+def save_results(all_results):
+    if not all_results.empty:
+        try:
+            all_results.to_csv(OUTPUT_CSV, index=False, encoding='utf-8-sig')
+            all_results.to_excel(OUTPUT_EXCEL, index=False)
+            logger.info(f"Résultats sauvegardés: {len(all_results)} KPIs")
+            return True
+        except Exception as e:
+            logger.error(f"Erreur lors de la sauvegarde: {e}")
+            return False
+    return False
+
+
+def merge_results(existing_results, new_results):
+    """Ajouter de nouveaux résultats aux existants (la dernière extraction l'emporte)"""
+    if existing_results.empty:
+        return pd.DataFrame(new_results)
+    all_results = pd.concat([existing_results, pd.DataFrame(new_results)], ignore_index=True)
+    return all_results.drop_duplicates(subset=['kpi_name', 'value', 'unit', 'source_file'], keep='last')
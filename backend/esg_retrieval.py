@@ -0,0 +1,313 @@
+"""Index des résultats pour le contexte du chatbot et la recherche.
+
+Chaque ligne de résultat (KPI, thème, valeur, entreprise) est encodée une seule
+fois; les vecteurs sont gardés en mémoire et persistés dans ``RESULTS_INDEX_PATH``
+(seules les lignes nouvelles sont encodées au rafraîchissement). Un index BM25
+(listes inversées NumPy) couvre kpi_name / topic / topic_fr; la recherche
+combine les deux scores et applique les filtres (entreprise, thème, confiance)
+par masques booléens calculés une fois par valeur.
+
+Pour une question, les lignes les plus pertinentes sont sélectionnées jusqu'à
+épuisement d'un budget de jetons au lieu d'envoyer tout le jeu de données.
+"""
+import os
+import re
+import math
+import logging
+import threading
+from collections import Counter, defaultdict
+
+import numpy as np
+import pandas as pd
+
+from esg_prompt import token_counter
+
+logger = logging.getLogger(__name__)
+
+RESULTS_INDEX_PATH = os.environ.get('ESG_RESULTS_INDEX', 'results_index.npz')
+CONTEXT_TOKEN_BUDGET = 700
+ENCODE_BATCH_SIZE = 256
+INDEX_COLUMNS = ('kpi_name', 'value', 'unit', 'source_file', 'topic', 'topic_fr', 'confidence')
+BM25_K1 = 1.2
+BM25_B = 0.75
+DENSE_WEIGHT = 0.6           # part de la similarité d'embedding dans le score hybride
+
+_TOKEN = re.compile(r'\w+')
+
+
+def estimate_tokens(text):
+    return token_counter.count(text)
+
+
+def _column(df, name, default=""):
+    return df[name].fillna(default).astype(str) if name in df.columns else np.full(len(df), default)
+
+
+def row_texts(df):
+    """Texte encodé pour chaque ligne: « KPI (thème / topic): valeur unité — entreprise »"""
+    kpi = _column(df, 'kpi_name')
+    topic_fr = _column(df, 'topic_fr')
+    topic = _column(df, 'topic')
+    value = _column(df, 'value')
+    unit = _column(df, 'unit')
+    company = _column(df, 'source_file')
+    return [f"{k} ({tf} / {t}): {v} {u} — {c}"
+            for k, tf, t, v, u, c in zip(kpi, topic_fr, topic, value, unit, company)]
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower())
+
+
+def _as_float(series):
+    return np.nan_to_num(pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float32), nan=0.0)
+
+
+class BM25Index:
+    """BM25 sur listes inversées: terme -> (indices de lignes, poids précalculés)"""
+
+    def __init__(self, documents, k1=BM25_K1, b=BM25_B):
+        self.size = len(documents)
+        term_docs = defaultdict(list)
+        term_freqs = defaultdict(list)
+        lengths = np.zeros(self.size, dtype=np.float32)
+        for doc_idx, tokens in enumerate(documents):
+            lengths[doc_idx] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                term_docs[term].append(doc_idx)
+                term_freqs[term].append(tf)
+
+        avg_length = float(lengths.mean()) if self.size else 0.0
+        norm = k1 * (1 - b + b * lengths / avg_length) if avg_length else np.full(self.size, k1, np.float32)
+        self.postings = {}
+        for term, docs in term_docs.items():
+            docs = np.asarray(docs, dtype=np.int32)
+            tf = np.asarray(term_freqs[term], dtype=np.float32)
+            idf = math.log(1 + (self.size - len(docs) + 0.5) / (len(docs) + 0.5))
+            self.postings[term] = (docs, (idf * tf * (k1 + 1) / (tf + norm[docs])).astype(np.float32))
+
+    def scores(self, query):
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is not None:
+                scores[posting[0]] += posting[1]    # indices uniques par terme
+        return scores
+
+
+class _IndexState:
+    """Instantané immuable de l'index (remplacé d'un bloc au rafraîchissement)"""
+
+    def __init__(self, rows, texts, embeddings, version):
+        self.rows = rows
+        self.texts = texts
+        self.embeddings = embeddings
+        self.version = version
+        self.companies = _column(rows, 'source_file').to_numpy() if len(rows) else np.array([], dtype=object)
+        self.confidence = _as_float(rows['confidence']) if 'confidence' in rows.columns \
+            else np.ones(len(rows), dtype=np.float32)
+        # Codes de catégories: un masque de filtre = une comparaison vectorisée, mise en cache
+        self.company_codes, self.company_values = pd.factorize(self.companies)
+        self._company_lookup = {value: code for code, value in enumerate(self.company_values)}
+        topics = pd.Series(_column(rows, 'topic')).str.lower() if len(rows) else pd.Series([], dtype=str)
+        topics_fr = pd.Series(_column(rows, 'topic_fr')).str.lower() if len(rows) else pd.Series([], dtype=str)
+        self.topic_codes, topic_values = pd.factorize(pd.concat([topics, topics_fr], ignore_index=True))
+        self._topic_lookup = {value: code for code, value in enumerate(topic_values)}
+        self._masks = {}
+        self.bm25 = BM25Index([
+            tokenize(f"{k} {t} {tf}")
+            for k, t, tf in zip(_column(rows, 'kpi_name'), _column(rows, 'topic'), _column(rows, 'topic_fr'))
+        ])
+        self.summary = self._summary()
+
+    def _summary(self):
+        if not len(self.rows):
+            return "Aucune donnée ESG disponible."
+        companies = list(self.company_values)
+        listed = ", ".join(companies[:15]) + (f" (+{len(companies) - 15})" if len(companies) > 15 else "")
+        return (f"📊 DONNÉES ESG: {len(self.rows)} KPIs extraits, {len(companies)} entreprises "
+                f"({listed}), {self.rows['kpi_name'].nunique()} types de KPIs")
+
+    def mask(self, company=None, topic=None, min_confidence=None):
+        """Masque booléen des lignes retenues (None si aucun filtre)"""
+        masks = []
+        if company is not None:
+            key = ('company', company)
+            if key not in self._masks:
+                code = self._company_lookup.get(company, -2)
+                self._masks[key] = self.company_codes == code
+            masks.append(self._masks[key])
+        if topic is not None:
+            key = ('topic', topic.lower())
+            if key not in self._masks:
+                code = self._topic_lookup.get(topic.lower(), -2)
+                n = len(self.texts)
+                self._masks[key] = (self.topic_codes[:n] == code) | (self.topic_codes[n:] == code)
+            masks.append(self._masks[key])
+        if min_confidence is not None:
+            masks.append(self.confidence >= min_confidence)
+        if not masks:
+            return None
+        return np.logical_and.reduce(masks) if len(masks) > 1 else masks[0]
+
+
+class ResultsIndex:
+    """Vecteurs normalisés des lignes de résultats + recherche top-k"""
+
+    def __init__(self, model, path=RESULTS_INDEX_PATH):
+        self.model = model
+        self.path = path
+        self._lock = threading.Lock()
+        self._known = {}            # texte de ligne -> vecteur
+        self._known_mtime = None
+        self._state = None
+
+    # ---------------------------------------------------------- construction
+    def _load_known(self):
+        # Recharger les vecteurs persistés s'ils ont été écrits par un autre processus
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._known_mtime:
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                self._known.update(zip(data['texts'].tolist(), data['embeddings']))
+            self._known_mtime = mtime
+        except Exception as e:
+            logger.warning(f"Index des résultats illisible ({self.path}): {e}")
+
+    def _save_known(self, texts):
+        if not self.path:
+            return
+        try:
+            unique = list(dict.fromkeys(texts))
+            embeddings = np.stack([self._known[t] for t in unique]) if unique else np.empty((0, 0), np.float32)
+            tmp_path = self.path + '.tmp.npz'
+            np.savez(tmp_path, texts=np.array(unique), embeddings=embeddings)
+            os.replace(tmp_path, self.path)
+            self._known_mtime = os.stat(self.path).st_mtime_ns
+        except Exception as e:
+            logger.warning(f"Sauvegarde de l'index des résultats impossible: {e}")
+
+    def refresh(self, df, version=None):
+        """(Re)construire l'index; seules les lignes jamais vues sont encodées"""
+        with self._lock:
+            if self._state is not None and version is not None and version == self._state.version:
+                return False
+
+            rows = df[[c for c in INDEX_COLUMNS if c in df.columns]].reset_index(drop=True)
+            texts = row_texts(rows)
+            self._load_known()
+            missing = [t for t in dict.fromkeys(texts) if t not in self._known]
+            if missing:
+                vectors = self.model.encode(missing, batch_size=ENCODE_BATCH_SIZE, convert_to_numpy=True,
+                                            normalize_embeddings=True, show_progress_bar=False)
+                self._known.update(zip(missing, np.asarray(vectors, dtype=np.float32)))
+
+            if texts:
+                embeddings = np.stack([self._known[t] for t in texts]).astype(np.float32, copy=False)
+            else:
+                embeddings = np.empty((0, 0), dtype=np.float32)
+            # Oublier les lignes disparues du magasin de résultats
+            current = set(texts)
+            self._known = {t: v for t, v in self._known.items() if t in current}
+            if missing or not os.path.exists(self.path):
+                self._save_known(texts)
+
+            self._state = _IndexState(rows, texts, embeddings, version)
+            logger.info(f"Index des résultats: {len(texts)} lignes ({len(missing)} encodées)")
+            return True
+
+    def ensure_fresh(self, load_df, version):
+        """Rafraîchir si le magasin de résultats a changé (``load_df`` n'est appelé qu'alors)"""
+        state = self._state
+        if state is None or state.version != version:
+            self.refresh(load_df(), version)
+        return self
+
+    @property
+    def size(self):
+        return len(self._state.texts) if self._state is not None else 0
+
+    @property
+    def companies(self):
+        return list(self._state.company_values) if self._state is not None else []
+
+    # -------------------------------------------------------------- recherche
+    def encode_query(self, query):
+        return np.asarray(self.model.encode([query], convert_to_numpy=True, normalize_embeddings=True,
+                                            show_progress_bar=False)[0], dtype=np.float32)
+
+    def search(self, query, k=20, company=None, topic=None, min_confidence=None, dense_weight=DENSE_WEIGHT):
+        """[(indice de ligne, score hybride)] des ``k`` meilleures lignes après filtres
+
+        Score = dense_weight * cosinus + (1 - dense_weight) * BM25 normalisé par son maximum.
+        """
+        state = self._state
+        if state is None or not len(state.texts):
+            return []
+
+        # Filtres d'abord: le produit scalaire ne porte que sur les lignes retenues
+        mask = state.mask(company, topic, min_confidence)
+        candidates = np.flatnonzero(mask) if mask is not None else None
+        if candidates is not None and not len(candidates):
+            return []
+
+        embeddings = state.embeddings if candidates is None else state.embeddings[candidates]
+        scores = np.zeros(len(embeddings), dtype=np.float32)
+        if dense_weight > 0:
+            scores += dense_weight * (embeddings @ self.encode_query(query))
+        if dense_weight < 1:
+            keyword = state.bm25.scores(query)
+            if candidates is not None:
+                keyword = keyword[candidates]
+            peak = keyword.max()
+            if peak > 0:
+                scores += (1 - dense_weight) * keyword / peak
+
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        rows = top if candidates is None else candidates[top]
+        return [(int(i), float(s)) for i, s in zip(rows, scores[top])]
+
+    def records(self, hits):
+        """Lignes de résultats (dict) pour une liste de (indice, score)"""
+        state = self._state
+        records = []
+        for idx, score in hits:
+            record = {key: (value.item() if hasattr(value, 'item') else value)
+                      for key, value in state.rows.iloc[idx].items()}
+            record['company'] = record.get('source_file', '')
+            record['score'] = round(score, 4)
+            records.append(record)
+        return records
+
+    def build_context(self, query, token_budget=CONTEXT_TOKEN_BUDGET, company=None, k=50):
+        """Contexte compact: résumé + lignes pertinentes tant que le budget le permet"""
+        state = self._state
+        if state is None or not len(state.texts):
+            return "Aucune donnée ESG disponible."
+
+        if company is not None:
+            company_rows = int(state.mask(company=company).sum())
+            if not company_rows:
+                return f"Aucune donnée trouvée pour l'entreprise {company}"
+            lines = [f"📋 DONNÉES DÉTAILLÉES POUR {company.upper()} ({company_rows} KPIs)"]
+        else:
+            lines = [state.summary]
+        lines.append("Lignes les plus pertinentes pour la question:")
+        used = sum(estimate_tokens(line) for line in lines)
+
+        for idx, _ in self.search(query, k, company):
+            line = f"• {state.texts[idx]} (confiance: {state.confidence[idx]:.2f})"
+            cost = estimate_tokens(line)
+            if used + cost > token_budget:
+                break
+            lines.append(line)
+            used += cost
+        return "\n".join(lines)
@@ -0,0 +1,235 @@
+"""Réponses directes aux questions factuelles, sans passer par le LLM.
+
+Les questions de consultation ("quel est le taux de non-conformité majeure
+d'ACCO Brands ?", "quelle entreprise a la plus forte consommation d'eau ?")
+se résolvent sur la table des résultats: le ``QueryRouter`` reconnaît
+l'intention (valeur, classement, moyenne, comptage, liste des entreprises) et
+les entités (KPI du catalogue, entreprises citées) puis calcule la réponse.
+Toute question ouverte (pourquoi, comment, analyse, recommandations...)
+retourne ``None`` et part vers le LLM.
+"""
+import re
+import logging
+import threading
+from collections import defaultdict
+
+import pandas as pd
+
+from esg_companies import CompanyMatcher
+
+logger = logging.getLogger(__name__)
+
+KPI_MIN_COVERAGE = 0.6      # part des mots du KPI présents dans la question
+MAX_LISTED = 10
+
+OPEN_ENDED = re.compile(
+    r"\b(pourquoi|comment|expliqu|analys(?!ée?s?\b)|recommand|conseil|strat[ée]g|am[ée]lior|risque|opportunit|impact|"
+    r"compar|r[ée]sum|tendance|[ée]volution|why|how|explain|analy[sz]e\b|analysis|recommend|suggest|improv|"
+    r"strateg|risk|summar|trend)", re.IGNORECASE)
+HIGHEST = re.compile(r"(plus (?:[ée]lev|haut|grand|fort|important)|maxim|\bmax\b|highest|largest|biggest|"
+                     r"\bmost\b|\btop\b)", re.IGNORECASE)
+LOWEST = re.compile(r"(plus (?:faible|bas|petit)|minim|\bmin\b|lowest|smallest|\bleast\b)", re.IGNORECASE)
+AVERAGE = re.compile(r"\b(moyenne?|average|mean)\b", re.IGNORECASE)
+COUNT = re.compile(r"\b(combien|nombre de|how many)\b", re.IGNORECASE)
+LIST_COMPANIES = re.compile(r"(quelles? (?:sont les )?entreprises|liste des entreprises|which companies|"
+                            r"list (?:of |the |all )*companies)", re.IGNORECASE)
+
+STOPWORDS = {
+    'the', 'of', 'in', 'and', 'for', 'to', 'a', 'an', 'by', 'on', 'per', 'with', 'is', 'what', 'which',
+    'de', 'la', 'le', 'les', 'des', 'du', 'd', 'l', 'et', 'en', 'un', 'une', 'par', 'pour', 'quel', 'quelle',
+    'est'
+}
+_WORD = re.compile(r'\w+')
+_THOUSANDS = re.compile(r'-?\d{1,3}(?:,\d{3})+(?:\.\d+)?')
+
+
+def _terms(text):
+    """Mots significatifs (minuscules, pluriel simple retiré)"""
+    terms = set()
+    for word in _WORD.findall(str(text).lower()):
+        if word in STOPWORDS:
+            continue
+        terms.add(word[:-1] if len(word) > 3 and word.endswith('s') else word)
+    return terms
+
+
+def _numeric(values):
+    """Valeurs numériques; séparateurs de milliers anglais ("12,500") retirés, le reste en NaN"""
+    text = values.astype(str).str.strip()
+    thousands = text.str.fullmatch(_THOUSANDS)
+    return pd.to_numeric(text.where(~thousands, text.str.replace(',', '', regex=False)), errors='coerce')
+
+
+def _format_value(value, unit):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    unit = "" if not unit or str(unit).lower() in ('unknown', 'nan') else f" {unit}"
+    return f"{value}{unit}"
+
+
+class _Catalog:
+    """Table des résultats et index des noms de KPI pour une version des données"""
+
+    def __init__(self, df):
+        columns = [c for c in ('kpi_name', 'value', 'unit', 'source_file', 'topic_fr', 'confidence') if c in df.columns]
+        self.df = df[columns].copy()
+        self.df['value'] = _numeric(self.df['value'])
+        if 'confidence' not in self.df.columns:
+            self.df['confidence'] = 1.0
+        self.kpis = sorted(self.df['kpi_name'].dropna().unique())
+        self.kpi_terms = [_terms(kpi) for kpi in self.kpis]
+        self.postings = defaultdict(list)       # mot -> indices de KPI
+        for i, terms in enumerate(self.kpi_terms):
+            for term in terms:
+                self.postings[term].append(i)
+        self.companies = sorted(self.df['source_file'].dropna().unique())
+
+    def match_kpi(self, question):
+        """KPI du catalogue le mieux couvert par la question, ou None"""
+        overlaps = defaultdict(int)
+        for term in _terms(question):
+            for i in self.postings.get(term, ()):
+                overlaps[i] += 1
+        best, best_key = None, None
+        for i, overlap in overlaps.items():
+            size = len(self.kpi_terms[i])
+            coverage = overlap / size
+            if coverage < KPI_MIN_COVERAGE or overlap < min(2, size):
+                continue
+            key = (coverage, overlap, -len(self.kpis[i]))
+            if best_key is None or key > best_key:
+                best, best_key = self.kpis[i], key
+        return best
+
+
+class QueryRouter:
+    """Aiguillage: réponse calculée sur les résultats, ou None pour le LLM"""
+
+    def __init__(self, company_matcher=None):
+        self.company_matcher = company_matcher or CompanyMatcher()
+        self._lock = threading.Lock()
+        self._catalogs = {}         # version -> _Catalog (une seule gardée)
+
+    def _catalog(self, df, version, load_df):
+        with self._lock:
+            if version is not None and version in self._catalogs:
+                return self._catalogs[version]
+        if df is None:
+            df = load_df()
+        catalog = _Catalog(df)
+        if version is not None:
+            with self._lock:
+                self._catalogs = {version: catalog}
+        return catalog
+
+    def route(self, question, df=None, version=None, companies=None, load_df=None):
+        """Réponse structurée {"answer", "intent", "kpi", "companies", "rows"} ou None
+
+        La table (``df``, ou ``load_df()`` appelé seulement si besoin) est
+        indexée une fois par ``version`` des données. ``companies`` sert
+        d'entreprises par défaut quand la question n'en cite aucune.
+        """
+        if OPEN_ENDED.search(question):
+            return None
+        catalog = self._catalog(df, version, load_df)
+        if catalog.df.empty:
+            return None
+
+        self.company_matcher.update(catalog.companies)
+        known = set(catalog.companies)
+        mentioned = [c for c in self.company_matcher.find(question) if c in known] or list(companies or [])
+        kpi = catalog.match_kpi(question)
+
+        if kpi is None:
+            if COUNT.search(question) and mentioned:
+                return self._count(catalog, mentioned)
+            if LIST_COMPANIES.search(question) and not mentioned:
+                return self._list_companies(catalog)
+            return None
+
+        rows = catalog.df[catalog.df['kpi_name'] == kpi]
+        if mentioned:
+            rows = rows[rows['source_file'].isin(mentioned)]
+        if rows.empty:
+            return {"intent": "kpi_value", "kpi": kpi, "companies": mentioned, "rows": [],
+                    "answer": f"Aucune valeur extraite pour « {kpi} »"
+                              + (f" chez {', '.join(mentioned)}." if mentioned else ".")}
+        # Valeurs non numériques (texte, format non reconnu): le LLM les lira dans le contexte
+        rows = rows.dropna(subset=['value'])
+        if rows.empty:
+            return None
+        # Une valeur par entreprise: la plus fiable
+        rows = rows.sort_values('confidence', ascending=False).drop_duplicates('source_file')
+
+        highest, lowest = HIGHEST.search(question), LOWEST.search(question)
+        if (highest or lowest) and len(rows) > 1:
+            return self._ranking(kpi, rows, mentioned, descending=bool(highest))
+        if AVERAGE.search(question) and len(rows) > 1:
+            return self._average(kpi, rows, mentioned)
+        return self._values(kpi, rows, mentioned)
+
+    # -------------------------------------------------------------- réponses
+    @staticmethod
+    def _records(rows):
+        return [
+            {"company": r.source_file, "kpi_name": r.kpi_name,
+             "value": None if pd.isna(r.value) else r.value.item() if hasattr(r.value, 'item') else r.value,
+             "unit": r.unit, "confidence": round(float(r.confidence), 3)}
+            for r in rows.itertuples()
+        ]
+
+    @staticmethod
+    def _common_unit(rows):
+        """Unité commune des lignes, ou None si elles en ont plusieurs (non comparables)"""
+        units = set(rows['unit'].fillna('unknown').astype(str).str.strip().str.lower())
+        if len(units) != 1:
+            return None
+        return rows['unit'].iloc[0]
+
+    def _values(self, kpi, rows, mentioned):
+        lines = [f"📊 {kpi}:"]
+        for r in rows.head(MAX_LISTED).itertuples():
+            lines.append(f"• {r.source_file}: {_format_value(r.value, r.unit)} (confiance {r.confidence:.2f})")
+        if len(rows) > MAX_LISTED:
+            lines.append(f"… et {len(rows) - MAX_LISTED} autres entreprises")
+        return {"intent": "kpi_value", "kpi": kpi, "companies": mentioned, "rows": self._records(rows),
+                "answer": "\n".join(lines)}
+
+    def _ranking(self, kpi, rows, mentioned, descending):
+        unit = self._common_unit(rows)
+        if unit is None:
+            return None     # unités différentes (GJ, MWh...): le LLM répond sur les valeurs brutes
+        rows = rows.sort_values('value', ascending=not descending)
+        top = rows.iloc[0]
+        label = "la plus élevée" if descending else "la plus faible"
+        lines = [f"🏆 Valeur {label} pour « {kpi} »: {top.source_file} avec {_format_value(top.value, unit)} "
+                 f"(confiance {top.confidence:.2f})", "Classement:"]
+        for rank, r in enumerate(rows.head(5).itertuples(), 1):
+            lines.append(f"{rank}. {r.source_file}: {_format_value(r.value, unit)}")
+        return {"intent": "kpi_ranking", "kpi": kpi, "companies": mentioned, "rows": self._records(rows.head(5)),
+                "answer": "\n".join(lines)}
+
+    def _average(self, kpi, rows, mentioned):
+        unit = self._common_unit(rows)
+        if unit is None:
+            return None
+        values = rows['value']
+        answer = (f"📈 « {kpi} »: moyenne {_format_value(round(values.mean(), 2), unit)} sur {len(rows)} entreprises "
+                  f"(min {_format_value(values.min(), unit)}, max {_format_value(values.max(), unit)})")
+        return {"intent": "kpi_average", "kpi": kpi, "companies": mentioned, "rows": self._records(rows),
+                "answer": answer}
+
+    def _count(self, catalog, mentioned):
+        lines = []
+        for company in mentioned:
+            rows = catalog.df[catalog.df['source_file'] == company]
+            topics = rows['topic_fr'].nunique() if 'topic_fr' in rows.columns else 0
+            lines.append(f"• {company}: {len(rows)} KPIs extraits ({topics} thèmes)")
+        return {"intent": "kpi_count", "kpi": None, "companies": mentioned, "rows": [], "answer": "\n".join(lines)}
+
+    def _list_companies(self, catalog):
+        counts = catalog.df['source_file'].value_counts()
+        lines = [f"🏢 {len(counts)} entreprises analysées:"]
+        lines.extend(f"• {company} ({count} KPIs)" for company, count in counts.items())
+        return {"intent": "list_companies", "kpi": None, "companies": list(counts.index), "rows": [],
+                "answer": "\n".join(lines)}
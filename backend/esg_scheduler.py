@@ -0,0 +1,234 @@
+"""Ordonnancement des générations Ollama.
+
+Ollama sur CPU ne sert qu'une ou deux générations à la fois: au-delà, les
+requêtes se partagent le processeur et expirent toutes ensemble. Le
+``LLMScheduler`` borne le nombre de générations en cours
+(``LLM_MAX_IN_FLIGHT``) et fait patienter les autres dans une file à priorités
+(le chat interactif passe avant les analyses). Chaque requête porte une
+échéance: elle est abandonnée si elle attend ou génère au-delà.
+
+Les requêtes servies par asyncio (esg_async) attendent leur tour avec
+``wait_async`` dans la même file, sans bloquer de thread.
+"""
+import os
+import time
+import asyncio
+import heapq
+import logging
+import itertools
+import threading
+
+from esg_metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0     # chat
+PRIORITY_ANALYSIS = 1        # benchmark, comparaison, recommandations, tendances
+PRIORITY_BATCH = 2
+
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_ANALYSIS: 'analysis', PRIORITY_BATCH: 'batch'}
+
+LLM_MAX_IN_FLIGHT = int(os.environ.get('OLLAMA_MAX_IN_FLIGHT', 1))
+LLM_MAX_QUEUE = int(os.environ.get('OLLAMA_MAX_QUEUE', 32))
+# Échéance par défaut (attente + génération), en secondes
+DEFAULT_DEADLINES = {
+    PRIORITY_INTERACTIVE: float(os.environ.get('OLLAMA_CHAT_DEADLINE', 180)),
+    PRIORITY_ANALYSIS: float(os.environ.get('OLLAMA_ANALYSIS_DEADLINE', 600)),
+    PRIORITY_BATCH: float(os.environ.get('OLLAMA_BATCH_DEADLINE', 1800)),
+}
+
+QUEUE_WAIT_BUCKETS = (0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+LLM_QUEUE_WAIT = Histogram('esg_llm_queue_wait_seconds', "Attente dans la file avant génération",
+                           ('endpoint', 'priority'), QUEUE_WAIT_BUCKETS)
+LLM_QUEUE_DEPTH = Gauge('esg_llm_queue_depth', "Requêtes LLM en attente")
+LLM_IN_FLIGHT = Gauge('esg_llm_in_flight', "Générations LLM en cours")
+LLM_REJECTED = Counter('esg_llm_rejected_total', "Requêtes LLM abandonnées par l'ordonnanceur",
+                       ('endpoint', 'reason'))
+
+
+class LLMSchedulerError(Exception):
+    pass
+
+
+class LLMQueueFull(LLMSchedulerError):
+    pass
+
+
+class LLMDeadlineExceeded(LLMSchedulerError, TimeoutError):
+    pass
+
+
+def deadline_in(seconds):
+    """Échéance absolue (horloge monotone) dans ``seconds`` secondes"""
+    return time.monotonic() + seconds if seconds else None
+
+
+def remaining(deadline):
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class Ticket:
+    """Place d'une requête dans la file"""
+
+    __slots__ = ('priority', 'seq', 'endpoint', 'deadline', 'enqueued', 'started', 'state')
+
+    def __init__(self, priority, seq, endpoint, deadline):
+        self.priority = priority
+        self.seq = seq
+        self.endpoint = endpoint
+        self.deadline = deadline
+        self.enqueued = time.monotonic()
+        self.started = None
+        self.state = 'waiting'
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    @property
+    def wait_s(self):
+        return (self.started or time.monotonic()) - self.enqueued
+
+
+class LLMScheduler:
+    """File à priorités devant Ollama, au plus ``max_in_flight`` générations simultanées"""
+
+    def __init__(self, max_in_flight=LLM_MAX_IN_FLIGHT, max_queue=LLM_MAX_QUEUE):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._waiting = []              # tas de Ticket
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._async_waiters = set()     # (boucle, asyncio.Event) des requêtes asynchrones en attente
+
+    def enqueue(self, priority=PRIORITY_INTERACTIVE, endpoint='llm', deadline=None):
+        if deadline is None:
+            deadline = deadline_in(DEFAULT_DEADLINES.get(priority))
+        with self._cond:
+            if len(self._waiting) >= self.max_queue:
+                LLM_REJECTED.inc(endpoint=endpoint, reason='queue_full')
+                raise LLMQueueFull(f"File LLM pleine ({len(self._waiting)} requêtes en attente)")
+            ticket = Ticket(priority, next(self._seq), endpoint, deadline)
+            heapq.heappush(self._waiting, ticket)
+            LLM_QUEUE_DEPTH.set(len(self._waiting))
+            self._notify()              # les positions des autres requêtes peuvent changer
+        return ticket
+
+    def _position(self, ticket):
+        return 1 + sum(1 for other in self._waiting if other < ticket)
+
+    def _notify(self):
+        # Appelé sous verrou: réveille les threads et les coroutines en attente
+        self._cond.notify_all()
+        for loop, event in self._async_waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def _try_start(self, ticket):
+        """Sous verrou: attribuer un créneau à ``ticket`` s'il est en tête de file"""
+        if self.in_flight >= self.max_in_flight or self._waiting[0] is not ticket:
+            return False
+        heapq.heappop(self._waiting)
+        self.in_flight += 1
+        ticket.state = 'running'
+        ticket.started = time.monotonic()
+        LLM_QUEUE_DEPTH.set(len(self._waiting))
+        LLM_IN_FLIGHT.set(self.in_flight)
+        LLM_QUEUE_WAIT.observe(ticket.wait_s, endpoint=ticket.endpoint,
+                               priority=PRIORITY_NAMES.get(ticket.priority, ticket.priority))
+        return True
+
+    def _expire(self, ticket):
+        # Sous verrou
+        self._discard(ticket)
+        LLM_REJECTED.inc(endpoint=ticket.endpoint, reason='deadline_queued')
+        raise LLMDeadlineExceeded(f"Échéance dépassée après {ticket.wait_s:.1f}s dans la file")
+
+    def wait(self, ticket):
+        """Générateur: produit la position (1 = prochaine) à chaque changement
+
+        Se termine quand la requête obtient un créneau; lève LLMDeadlineExceeded
+        si l'échéance passe avant.
+        """
+        reported = None
+        while True:
+            with self._cond:
+                while True:
+                    if self._try_start(ticket):
+                        return
+                    position = self._position(ticket)
+                    if position != reported:
+                        break
+                    left = remaining(ticket.deadline)
+                    if left is not None and left <= 0:
+                        self._expire(ticket)
+                    self._cond.wait(left)
+            reported = position
+            yield position
+
+    async def wait_async(self, ticket):
+        """Équivalent asynchrone de ``wait`` (générateur asynchrone des positions)"""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        waiter = (loop, event)
+        reported = None
+        try:
+            while True:
+                with self._cond:
+                    if self._try_start(ticket):
+                        return
+                    position = self._position(ticket)
+                    left = remaining(ticket.deadline)
+                    if position == reported and left is not None and left <= 0:
+                        self._expire(ticket)
+                    # Inscrit sous verrou: aucune libération ne peut passer inaperçue
+                    event.clear()
+                    self._async_waiters.add(waiter)
+                if position != reported:
+                    reported = position
+                    yield position
+                    continue
+                try:
+                    await asyncio.wait_for(event.wait(), left)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._cond:
+                self._async_waiters.discard(waiter)
+
+    def _discard(self, ticket):
+        # Appelé sous verrou
+        self._waiting.remove(ticket)
+        heapq.heapify(self._waiting)
+        ticket.state = 'done'
+        LLM_QUEUE_DEPTH.set(len(self._waiting))
+        self._notify()
+
+    def release(self, ticket):
+        """Libérer le créneau (ou retirer la requête de la file si elle attendait encore)"""
+        with self._cond:
+            if ticket.state == 'waiting':
+                self._discard(ticket)
+            elif ticket.state == 'running':
+                ticket.state = 'done'
+                self.in_flight -= 1
+                LLM_IN_FLIGHT.set(self.in_flight)
+                self._notify()
+
+    def status(self):
+        with self._cond:
+            waiting = sorted(self._waiting)
+            now = time.monotonic()
+            return {
+                'max_in_flight': self.max_in_flight,
+                'max_queue': self.max_queue,
+                'in_flight': self.in_flight,
+                'queued': len(waiting),
+                'queue': [
+                    {'position': i, 'endpoint': t.endpoint,
+                     'priority': PRIORITY_NAMES.get(t.priority, t.priority),
+                     'waiting_s': round(now - t.enqueued, 2),
+                     'deadline_in_s': round(t.deadline - now, 1) if t.deadline is not None else None}
+                    for i, t in enumerate(waiting, 1)
+                ]
+            }
@@ -0,0 +1,205 @@
+"""Sessions de conversation du chatbot.
+
+Une session garde l'historique, les entreprises dont les données ont déjà été
+fournies au modèle et le tableau ``context`` renvoyé par /api/generate
+d'Ollama (l'état du dialogue encodé en jetons). Les tours suivants n'envoient
+que la nouvelle question sur ce contexte: le prompt système et les données ne
+sont pas ré-encodés (prefill). Les sessions inactives sont évincées (LRU).
+
+Les KPIs extraits d'un PDF déposé dans le chat sont gardés de la même façon
+dans une ``UploadSession``: les messages suivants ne portent que son
+identifiant, et la table n'est construite qu'une fois par état des données.
+L'extraction pouvant se poursuivre en tâche de fond, la session s'enrichit au
+fil des pages traitées (``status`` = processing puis done).
+"""
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+SESSION_MAX = int(os.environ.get('ESG_CHAT_SESSIONS', 200))
+SESSION_IDLE_TTL = float(os.environ.get('ESG_CHAT_SESSION_TTL', 3600))
+TRANSCRIPT_TURNS = 4        # tours rejoués quand le contexte Ollama doit être reconstruit
+UPLOAD_MAX = int(os.environ.get('ESG_CHAT_UPLOADS', 50))
+UPLOAD_IDLE_TTL = float(os.environ.get('ESG_CHAT_UPLOAD_TTL', 3600))
+
+
+class ConversationSession:
+    """État d'une conversation côté serveur"""
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.history = []           # {"role", "content", "timestamp", ...}
+        self.companies = []         # entreprises déjà présentes dans le contexte du modèle
+        self.context = None         # jetons de contexte d'Ollama (dernier tour)
+        self.created = time.time()
+        self.last_used = self.created
+        self.lock = threading.Lock()    # un tour à la fois par conversation
+
+    @property
+    def turns(self):
+        return sum(1 for message in self.history if message['role'] == 'user')
+
+    def add_turn(self, question, response, timings=None):
+        now = time.time()
+        self.history.append({"role": "user", "content": question, "timestamp": now})
+        self.history.append({"role": "assistant", "content": response, "timestamp": now,
+                             "timings": timings or {}})
+
+    def reset_context(self):
+        """Oublier le contexte Ollama (le prochain tour rejoue un résumé de l'historique)"""
+        self.context = None
+        self.companies = []
+
+    def transcript(self, turns=TRANSCRIPT_TURNS):
+        """Derniers échanges, pour reconstruire la conversation sans contexte Ollama"""
+        lines = []
+        for message in self.history[-2 * turns:]:
+            speaker = "Utilisateur" if message['role'] == 'user' else "Assistant"
+            lines.append(f"{speaker}: {message['content']}")
+        return "\n".join(lines)
+
+    def summary(self):
+        return {
+            "conversation_id": self.id,
+            "turns": self.turns,
+            "companies": self.companies,
+            "context_tokens": len(self.context) if self.context else 0,
+            "created": self.created,
+            "last_used": self.last_used
+        }
+
+
+class UploadSession:
+    """KPIs extraits d'un PDF déposé dans le chat"""
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.pdf_name = None
+        self.kpis = []              # dicts de résultats, dans l'ordre d'extraction
+        self.status = 'ready'       # processing tant que l'extraction se poursuit, puis done / partial / error
+        self.revision = 0
+        self.created = time.time()
+        self.last_used = self.created
+        self.lock = threading.Lock()
+        self._positions = {}        # kpi_name -> position dans self.kpis
+        self._frame = None
+
+    def add_kpis(self, kpis, pdf_name=None):
+        """Ajouter des KPIs; un KPI déjà présent n'est remplacé que par une valeur plus fiable"""
+        with self.lock:
+            if pdf_name:
+                self.pdf_name = pdf_name
+            for kpi in kpis:
+                position = self._positions.get(kpi.get('kpi_name'))
+                if position is None:
+                    self._positions[kpi.get('kpi_name')] = len(self.kpis)
+                    self.kpis.append(kpi)
+                elif (kpi.get('confidence') or 0) > (self.kpis[position].get('confidence') or 0):
+                    self.kpis[position] = kpi
+                else:
+                    continue
+                self.revision += 1
+                self._frame = None
+
+    def set_status(self, status):
+        with self.lock:
+            self.status = status
+
+    @property
+    def version(self):
+        """Change à chaque ajout de KPIs (clé du cache du routeur)"""
+        return f"upload:{self.id}:{self.revision}"
+
+    def frame(self):
+        """Table des KPIs (``source_file`` = nom du PDF), construite une fois par état"""
+        with self.lock:
+            if self._frame is None:
+                frame = pd.DataFrame(self.kpis)
+                if not frame.empty and self.pdf_name:
+                    frame['source_file'] = self.pdf_name
+                self._frame = frame
+            return self._frame
+
+    def summary(self):
+        return {
+            "upload_id": self.id,
+            "pdf_name": self.pdf_name,
+            "status": self.status,
+            "kpis": len(self.kpis),
+            "high_confidence": sum(1 for k in self.kpis if (k.get('confidence') or 0) > 0.7),
+            "domains": sorted({k.get('topic_fr') or 'Inconnu' for k in self.kpis}),
+            "created": self.created,
+            "last_used": self.last_used
+        }
+
+
+class SessionStore:
+    """Sessions en mémoire, évincées par inactivité puis par ancienneté d'usage"""
+
+    session_class = ConversationSession
+
+    def __init__(self, max_sessions=SESSION_MAX, idle_ttl=SESSION_IDLE_TTL):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self, now):
+        # Appelé sous verrou; l'OrderedDict est trié du moins au plus récemment utilisé
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if len(self._sessions) <= self.max_sessions and now - oldest.last_used <= self.idle_ttl:
+                break
+            self._sessions.popitem(last=False)
+
+    def get_or_create(self, session_id=None):
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            session_id = str(session_id) if session_id else uuid.uuid4().hex
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = self.session_class(session_id)
+            else:
+                self._sessions.move_to_end(session_id)
+            session.last_used = now
+            self._evict(now)
+            return session
+
+    def get(self, session_id):
+        """Session existante (rafraîchie, comme un accès) ou None si inconnue ou expirée"""
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            session = self._sessions.get(str(session_id))
+            if session is not None:
+                self._sessions.move_to_end(session.id)
+                session.last_used = now
+            return session
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(str(session_id), None) is not None
+
+    def list(self):
+        with self._lock:
+            self._evict(time.time())
+            return [session.summary() for session in reversed(self._sessions.values())]
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._sessions), "max_sessions": self.max_sessions,
+                    "idle_ttl_s": self.idle_ttl}
+
+
+class UploadStore(SessionStore):
+    """PDF déposés dans le chat: upload_id -> KPIs extraits"""
+
+    session_class = UploadSession
+
+    def __init__(self, max_sessions=UPLOAD_MAX, idle_ttl=UPLOAD_IDLE_TTL):
+        super().__init__(max_sessions, idle_ttl)
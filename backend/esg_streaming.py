@@ -0,0 +1,359 @@
+"""Pipeline d'extraction en flux pour les gros rapports PDF.
+
+Le texte est produit page par page, regroupé en fenêtres d'au plus
+``window_pages`` pages puis découpé en phrases. La mémoire de pointe dépend
+donc de la taille de la fenêtre et non de celle du document.
+"""
+import os
+import re
+import sys
+import math
+import time
+import logging
+from contextlib import contextmanager, nullcontext
+
+import pdfplumber
+import fitz  # PyMuPDF
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW_PAGES = 8
+SPACY_MAX_CHARS = 10000     # Au-delà, segmentation par regex (comme avant)
+MIN_SENTENCE_CHARS = 20
+MIN_DOCUMENT_CHARS = 100
+PREVIEW_CHARS = 5000
+TABLE_CELL_SEPARATOR = " | "
+# Pages d'index / de données traitées en premier (recherche insensible à la casse)
+PRIORITY_PAGE_KEYWORDS = (
+    'sasb index', 'sasb content index', 'gri content index', 'gri index', 'tcfd index',
+    'esg data', 'performance data', 'data table', 'key performance indicators',
+    'sustainability metrics', 'esg metrics'
+)
+TABLE_PAGE_DIGIT_RATIO = 0.12   # part de chiffres au-delà de laquelle une page est vue comme un tableau
+TABLE_PAGE_MIN_CHARS = 200
+
+_PAGE_NUMBER_LINE = re.compile(r'^\s*\d+\s*$')
+_URL_LINE = re.compile(r'^.*www\.\w+\.com.*$')
+_SENTENCE_RUN = re.compile(r'[^.!?]+')
+
+
+def current_rss_bytes():
+    """Mémoire résidente actuelle du processus (0 si inconnue)"""
+    if psutil is not None:
+        try:
+            return psutil.Process().memory_info().rss
+        except Exception:
+            pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        # ru_maxrss est en Ko sous Linux, en octets sous macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    return 0
+
+
+class StreamStats:
+    """Compteurs, temps par étape et pic mémoire d'un job d'extraction
+
+    Les étapes rejouées à chaque page ou fenêtre (pdf_text, segmentation,
+    encode...) sont cumulées. Le temps CPU est celui du processus entier
+    (les threads torch de l'encodage y sont inclus).
+    """
+
+    def __init__(self):
+        self.pages = 0
+        self.chars = 0
+        self.windows = 0
+        self.sentences = 0
+        self.candidates = 0
+        self.early_exit = False
+        self.stages = {}
+        self.encode = {'calls': 0, 'sentences': 0, 'batches': 0, 'max_call_size': 0}
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        self.start_rss = current_rss_bytes()
+        self.peak_rss = self.start_rss
+        self._preview = []
+        self._preview_len = 0
+
+    def add_page(self, text):
+        self.pages += 1
+        self.chars += len(text)
+        if self._preview_len < PREVIEW_CHARS:
+            self._preview.append(text[:PREVIEW_CHARS - self._preview_len])
+            self._preview_len += len(self._preview[-1])
+
+    @property
+    def preview(self):
+        """Début du texte extrait (pour le fichier de debug)"""
+        return "".join(self._preview)
+
+    def sample_memory(self):
+        self.peak_rss = max(self.peak_rss, current_rss_bytes())
+        return self.peak_rss
+
+    @contextmanager
+    def stage(self, name):
+        """Mesurer une étape: temps mur, temps CPU et RSS en sortie d'étape"""
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            entry = self.stages.setdefault(name, {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'peak_rss': 0})
+            entry['calls'] += 1
+            entry['wall_s'] += time.perf_counter() - wall
+            entry['cpu_s'] += time.process_time() - cpu
+            entry['peak_rss'] = max(entry['peak_rss'], self.sample_memory())
+
+    def record_encode(self, n_sentences, batch_size):
+        self.encode['calls'] += 1
+        self.encode['sentences'] += n_sentences
+        self.encode['batches'] += math.ceil(n_sentences / batch_size) if batch_size else 1
+        self.encode['max_call_size'] = max(self.encode['max_call_size'], n_sentences)
+
+    def as_dict(self):
+        mb = 1024 * 1024
+        encode = dict(self.encode)
+        encode['mean_call_size'] = round(encode['sentences'] / encode['calls'], 1) if encode['calls'] else 0
+        return {
+            'pages': self.pages,
+            'chars': self.chars,
+            'windows': self.windows,
+            'sentences': self.sentences,
+            'candidates': self.candidates,
+            'early_exit': self.early_exit,
+            'wall_s': round(time.perf_counter() - self.started, 3),
+            'cpu_s': round(time.process_time() - self.cpu_started, 3),
+            'peak_rss_mb': round(self.peak_rss / mb, 1),
+            'rss_growth_mb': round((self.peak_rss - self.start_rss) / mb, 1),
+            'encode': encode,
+            'stages': {
+                name: {
+                    'calls': entry['calls'],
+                    'wall_s': round(entry['wall_s'], 3),
+                    'cpu_s': round(entry['cpu_s'], 3),
+                    'peak_rss_mb': round(entry['peak_rss'] / mb, 1)
+                }
+                for name, entry in self.stages.items()
+            }
+        }
+
+
+def profile_stage(stats, name):
+    """``stats.stage(name)`` ou un contexte vide si aucun job n'est suivi"""
+    return stats.stage(name) if stats is not None else nullcontext()
+
+
+def clean_text(text):
+    """Supprimer numéros de page, lignes d'URL et lignes trop courtes"""
+    cleaned_lines = []
+
+    for line in text.split('\n'):
+        if _PAGE_NUMBER_LINE.match(line):
+            continue
+        if _URL_LINE.match(line):
+            continue
+        if len(line.strip()) < 5:
+            continue
+        cleaned_lines.append(line)
+
+    return '\n'.join(cleaned_lines)
+
+
+def _page_text(page):
+    parts = []
+    text = page.extract_text()
+    if text:
+        parts.append(text)
+
+    for table in page.extract_tables():
+        for row in table:
+            parts.append(TABLE_CELL_SEPARATOR.join(str(cell) for cell in row if cell is not None))
+        parts.append("")
+
+    return "\n".join(parts) + "\n" if parts else ""
+
+
+def _release_page(page):
+    # pdfplumber >= 0.10 expose close(), les versions antérieures flush_cache()
+    release = getattr(page, 'close', None) or getattr(page, 'flush_cache', None)
+    if release is not None:
+        release()
+
+
+def find_priority_pages(pdf_path, keywords=PRIORITY_PAGE_KEYWORDS, follow_pages=1, rank_tables=False):
+    """Indices (base 0) des pages d'index ou de tableaux de données, et nombre de pages
+
+    Balayage rapide avec PyMuPDF; la page qui suit une page détectée est incluse
+    car les index s'étendent souvent sur plusieurs pages. Avec ``rank_tables``,
+    les pages riches en chiffres suivent les pages d'index, les plus denses d'abord.
+    """
+    hits = set()
+    tables = []
+    try:
+        doc = fitz.open(pdf_path)
+        try:
+            page_count = doc.page_count
+            for idx, page in enumerate(doc):
+                text = page.get_text("text")
+                lower = text.lower()
+                if any(keyword in lower for keyword in keywords):
+                    hits.update(range(idx, min(idx + 1 + follow_pages, page_count)))
+                elif rank_tables and len(text) >= TABLE_PAGE_MIN_CHARS:
+                    density = sum(char.isdigit() for char in text) / len(text)
+                    if density >= TABLE_PAGE_DIGIT_RATIO:
+                        tables.append((density, idx))
+        finally:
+            doc.close()
+    except Exception as e:
+        logger.warning(f"Détection des pages prioritaires impossible: {e}")
+        return [], 0
+    return sorted(hits) + [idx for _, idx in sorted(tables, reverse=True) if idx not in hits], page_count
+
+
+def prioritized_page_order(pdf_path, keywords=PRIORITY_PAGE_KEYWORDS, rank_tables=False):
+    """Ordre de lecture: pages prioritaires d'abord, puis le reste (None si aucune)"""
+    priority, page_count = find_priority_pages(pdf_path, keywords, rank_tables=rank_tables)
+    if not priority:
+        return None
+    logger.info(f"{len(priority)} pages prioritaires sur {page_count}: {[i + 1 for i in priority][:20]}")
+    priority_set = set(priority)
+    return priority + [i for i in range(page_count) if i not in priority_set]
+
+
+def iter_pdf_pages(pdf_path, stats=None, page_order=None):
+    """Générer (numéro de page, texte) en libérant le cache pdfplumber de chaque page
+
+    ``page_order`` (indices base 0) permet de traiter certaines pages en premier.
+    """
+    extracted = 0
+
+    try:
+        with pdfplumber.open(pdf_path) as pdf:
+            pages = pdf.pages
+            for idx in (page_order if page_order is not None else range(len(pages))):
+                page = pages[idx]
+                with profile_stage(stats, 'pdf_text'):
+                    try:
+                        text = _page_text(page)
+                    finally:
+                        _release_page(page)
+
+                extracted += len(text.strip())
+                if stats is not None:
+                    stats.add_page(text)
+                yield idx + 1, text
+    except Exception as e:
+        logger.error(f"Erreur avec pdfplumber: {e}")
+
+    if extracted < MIN_DOCUMENT_CHARS:
+        try:
+            doc = fitz.open(pdf_path)
+            try:
+                for idx in (page_order if page_order is not None else range(doc.page_count)):
+                    with profile_stage(stats, 'pdf_text_fallback'):
+                        text = doc[idx].get_text("text") + "\n"
+                    if stats is not None:
+                        stats.add_page(text)
+                    yield idx + 1, text
+            finally:
+                doc.close()
+        except Exception as e:
+            logger.error(f"Erreur avec PyMuPDF: {e}")
+
+
+def iter_page_windows(pages, window_pages=DEFAULT_WINDOW_PAGES, stats=None):
+    """Regrouper les pages nettoyées en fenêtres de ``window_pages`` pages"""
+    window_pages = max(1, int(window_pages))
+    window = []
+
+    for page_number, text in pages:
+        with profile_stage(stats, 'clean'):
+            cleaned = clean_text(text)
+        if cleaned:
+            window.append((page_number, cleaned))
+        if len(window) >= window_pages:
+            if stats is not None:
+                stats.windows += 1
+                stats.sample_memory()
+            yield window
+            window = []
+
+    if window:
+        if stats is not None:
+            stats.windows += 1
+            stats.sample_memory()
+        yield window
+
+
+def _regex_spans(text):
+    # Équivalent à re.split(r'[.!?]+', text) suivi d'un strip(), en conservant les positions
+    spans = []
+    for match in _SENTENCE_RUN.finditer(text):
+        segment = match.group()
+        stripped = segment.strip()
+        if len(stripped) > MIN_SENTENCE_CHARS:
+            start = match.start() + len(segment) - len(segment.lstrip())
+            spans.append((start, start + len(stripped)))
+    return spans
+
+
+def segment_window(window, nlp=None):
+    """Découper une fenêtre de pages en [(numéro de page, texte, [(début, fin)])]
+
+    Les positions sont des indices de caractères dans le texte nettoyé de la page.
+    """
+    total_chars = sum(len(text) for _, text in window)
+
+    if nlp is not None and total_chars <= SPACY_MAX_CHARS:
+        try:
+            segmented = []
+            for (page_number, text), doc in zip(window, nlp.pipe(text for _, text in window)):
+                spans = [(sent.start_char, sent.end_char) for sent in doc.sents
+                         if len(sent.text) > MIN_SENTENCE_CHARS]
+                segmented.append((page_number, text, spans))
+            return segmented
+        except Exception as e:
+            logger.warning(f"Erreur segmentation: {e}")
+
+    return [(page_number, text, _regex_spans(text)) for page_number, text in window]
+
+
+def iter_pdf_page_windows(pdf_path, window_pages=DEFAULT_WINDOW_PAGES, stats=None, boilerplate=None,
+                          prioritize=False, rank_tables=False):
+    """Pipeline page -> fenêtre de pages nettoyées pour un fichier PDF
+
+    ``boilerplate`` (esg_boilerplate.BoilerplateFilter) retire au passage les
+    lignes répétées d'une page à l'autre; ``prioritize`` place les pages d'index
+    et de tableaux de données en tête (``rank_tables``: puis les pages les plus
+    chargées en chiffres).
+    """
+    page_order = None
+    if prioritize:
+        with profile_stage(stats, 'page_priority'):
+            page_order = prioritized_page_order(pdf_path, rank_tables=rank_tables)
+    pages = iter_pdf_pages(pdf_path, stats, page_order)
+    if boilerplate is not None:
+        pages = boilerplate.iter_pages(pages, stats)
+    return iter_page_windows(pages, window_pages, stats)
+
+
+def iter_text_page_windows(text, stats=None):
+    """Adapter un texte déjà extrait au format du pipeline (une seule page)"""
+    if stats is not None:
+        stats.add_page(text)
+    return iter_page_windows([(1, text)], 1, stats)
@@ -0,0 +1,801 @@
+"""Pool de processus pour l'extraction des PDF (pdfplumber, spaCy, encodage).
+
+Dans le thread de la requête Flask, l'extraction se dispute le GIL et les
+threads torch avec toutes les autres routes, et un plantage (PDF malformé,
+mémoire épuisée) emporte l'API. Ici les tâches passent par une file SQLite
+(``TaskQueue``) et sont exécutées hors de l'API par un processus hôte
+(``python esg_workers.py``, lancé par ``ExtractionWorkers.start``). L'hôte
+précharge les modèles (esg_extraction) puis duplique ses processus de travail
+avec fork: les poids restent partagés en copie à l'écriture. Sous Windows, sans
+fork, chaque processus charge ses propres modèles.
+
+Un processus de travail traite au plus ``WORKER_MAX_TASKS`` tâches puis est
+remplacé (fuites de pdfplumber / PyMuPDF). Il est arrêté si une tâche fait
+croître sa mémoire de plus de ``WORKER_TASK_MEMORY_MB`` ou dure plus de
+``WORKER_TASK_TIMEOUT``: la tâche passe en échec et l'hôte relance un
+processus. La file SQLite tient lieu de file distribuée: tout processus qui
+l'ouvre peut soumettre des tâches (API, extraction en lot). Une tâche est
+désignée par son nom (``TASK_REGISTRY``) avec des arguments JSON, son résultat
+relu depuis JSON: la file ne transporte ni code ni objet sérialisé avec pickle.
+
+Plusieurs machines: une tâche prise est tenue par un bail de ``TASK_LEASE``
+secondes, renouvelé par le processus de travail tant qu'elle s'exécute; si la
+machine tombe, le bail expire et un autre hôte la reprend (au plus
+``TASK_MAX_ATTEMPTS`` fois). SQLite n'étant pas fiable sur un partage réseau,
+les hôtes de plusieurs machines partagent une file ``dir:`` (``DirectoryTaskQueue``,
+renommages atomiques dans un dossier NFS/SMB):
+
+    python esg_workers.py --queue extraction_tasks.sqlite --workers 4
+    python esg_workers.py --queue dir:/mnt/esg/queue --workers 8   # sur chaque machine
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import atexit
+import signal
+import socket
+import sqlite3
+import logging
+import argparse
+import importlib
+import threading
+import subprocess
+import multiprocessing
+
+from esg_metrics import Counter
+from esg_streaming import current_rss_bytes
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_WORKERS = int(os.environ.get('ESG_EXTRACTION_WORKERS', 2))   # 0: extraction dans le processus API
+WORKER_MAX_TASKS = int(os.environ.get('ESG_WORKER_MAX_TASKS', 20))       # tâches avant recyclage d'un processus
+WORKER_TASK_MEMORY_MB = int(os.environ.get('ESG_WORKER_TASK_MEMORY_MB', 2048))   # croissance RSS tolérée par tâche
+WORKER_TASK_TIMEOUT = float(os.environ.get('ESG_WORKER_TASK_TIMEOUT', 1800))
+WORKER_TORCH_THREADS = int(os.environ.get('ESG_WORKER_TORCH_THREADS', 0))   # 0: cœurs répartis entre processus
+WORKER_PRELOAD = os.environ.get('ESG_WORKER_PRELOAD', 'esg_extraction')    # modules chargés avant fork
+TASK_QUEUE_PATH = os.environ.get('ESG_TASK_QUEUE', 'extraction_tasks.sqlite')   # chemin SQLite ou "dir:/partage"
+TASK_LEASE = float(os.environ.get('ESG_TASK_LEASE', 60))   # secondes sans nouvelles avant reprise d'une tâche
+TASK_MAX_ATTEMPTS = 3       # tâche orpheline (hôte arrêté, bail expiré) reprise, puis en échec
+TASK_RESULT_TTL = 24 * 3600  # résultats jamais relevés supprimés après ce délai
+POLL_INTERVAL = 0.2
+SUPERVISE_INTERVAL = 0.5
+MEMORY_CHECK_INTERVAL = 0.5
+MEMORY_EXIT_CODE = 86       # sortie d'un processus arrêté pour dépassement mémoire
+
+# Tâches que les processus de travail acceptent d'exécuter: nom -> "module:fonction". La file ne
+# transporte que ce nom et des arguments JSON: pouvoir écrire dans la file (dossier partagé)
+# ne permet pas d'exécuter autre chose. ESG_WORKER_TASKS="nom=module:fonction,..." en ajoute,
+# dans la configuration de l'hôte.
+TASK_REGISTRY = {
+    'extract_pdf': 'esg_extraction:extract_pdf',
+    'process_report': 'esg_corpus:process_report',
+    'extract_chat_pdf': 'esg_extraction:extract_chat_pdf',
+}
+TASK_REGISTRY.update(entry.strip().split('=', 1) for entry in os.environ.get('ESG_WORKER_TASKS', '').split(',')
+                     if '=' in entry)
+
+WORKER_TASKS = Counter('esg_worker_tasks_total', "Tâches du pool d'extraction par résultat", ('result',))
+
+
+class WorkerError(Exception):
+    """Tâche du pool non aboutie (exception, processus arrêté, délai)"""
+
+
+def _json_default(value):
+    if hasattr(value, 'tolist'):
+        return value.tolist()   # scalaires et tableaux numpy
+    return str(value)
+
+
+def encode_task(task, args=(), kwargs=None):
+    """Contenu d'une tâche en file: nom enregistré et arguments JSON"""
+    if task not in TASK_REGISTRY:
+        raise WorkerError(f"tâche non enregistrée: {task}")
+    return json.dumps({'task': task, 'args': list(args), 'kwargs': kwargs or {}}).encode('utf-8')
+
+
+def resolve_task(payload):
+    """(fonction, args, kwargs) d'une tâche lue dans la file; seules les tâches de TASK_REGISTRY s'exécutent"""
+    task = json.loads(payload)
+    target = TASK_REGISTRY.get(task.get('task'))
+    if target is None:
+        raise WorkerError(f"tâche non enregistrée: {task.get('task')}")
+    module, _, name = target.partition(':')
+    return getattr(importlib.import_module(module), name), task.get('args', []), task.get('kwargs', {})
+
+
+def encode_result(value):
+    return json.dumps(value, default=_json_default).encode('utf-8')
+
+
+def decode_result(data):
+    return json.loads(data) if data is not None else None
+
+
+def worker_name(pid=None):
+    return f"{socket.gethostname()}:{pid or os.getpid()}"
+
+
+def _pid_alive(pid):
+    """Le processus ``pid`` de cette machine existe-t-il encore (zombies exclus)?"""
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+        except psutil.NoSuchProcess:
+            return False
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+    except OSError:
+        pass
+    if os.name == 'nt':
+        return True   # os.kill(pid, 0) terminerait le processus sous Windows
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        pass
+    return True
+
+
+class TaskQueue:
+    """File de tâches dans SQLite: nom de tâche et arguments (JSON), résultat (JSON) ou erreur
+
+    Une tâche prise porte un bail (``lease_until``) que le processus de travail
+    prolonge par ``heartbeat``; une tâche dont le bail expire est reprise par
+    un autre processus. Le fichier doit être sur un disque local: le
+    verrouillage SQLite n'est pas fiable sur un partage réseau (voir
+    ``DirectoryTaskQueue``).
+    """
+
+    def __init__(self, path=TASK_QUEUE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        # isolation_level=None: transactions explicites (BEGIN IMMEDIATE pour prendre une tâche)
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    payload BLOB NOT NULL,
+                    status TEXT NOT NULL,
+                    worker TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result BLOB,
+                    error TEXT,
+                    submitted REAL NOT NULL,
+                    started REAL,
+                    finished REAL,
+                    lease_until REAL
+                )""")
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(tasks)")}
+            if 'lease_until' not in columns:
+                self._conn.execute("ALTER TABLE tasks ADD COLUMN lease_until REAL")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, submitted)")
+
+    def put(self, task_id, task, *args, **kwargs):
+        """Mettre en file la tâche ``task`` (nom de TASK_REGISTRY) sous ``task_id``
+
+        Les arguments doivent être sérialisables en JSON. Retourne False si une
+        tâche de même identifiant est déjà en file ou non relevée.
+        """
+        payload = encode_task(task, args, kwargs)
+        with self._lock:
+            return self._conn.execute(
+                "INSERT OR IGNORE INTO tasks (id, kind, payload, status, submitted) VALUES (?, ?, ?, 'queued', ?)",
+                (task_id, task, payload, time.time())).rowcount > 0
+
+    def submit(self, task, *args, **kwargs):
+        """Comme ``put`` sous un identifiant aléatoire, retourné"""
+        task_id = uuid.uuid4().hex
+        self.put(task_id, task, *args, **kwargs)
+        return task_id
+
+    def claim(self, worker, lease=TASK_LEASE):
+        """Prendre la plus ancienne tâche en attente ou au bail expiré: (id, payload) ou None"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                while True:
+                    row = self._conn.execute(
+                        "SELECT id, payload, attempts FROM tasks WHERE status = 'queued' "
+                        "OR (status = 'running' AND lease_until < ?) ORDER BY submitted LIMIT 1", (now,)).fetchone()
+                    if row is None or row[2] < TASK_MAX_ATTEMPTS:
+                        break
+                    self._conn.execute("UPDATE tasks SET status = 'failed', error = ?, finished = ? WHERE id = ?",
+                                       (f"abandonnée après {row[2]} tentatives", now, row[0]))
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE tasks SET status = 'running', worker = ?, started = ?, lease_until = ?, "
+                        "attempts = attempts + 1 WHERE id = ?", (worker, now, now + lease, row[0]))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return row[:2] if row is not None else None
+
+    def heartbeat(self, task_id, worker, lease=TASK_LEASE):
+        """Prolonger le bail de ``worker`` sur sa tâche; False s'il l'a perdu"""
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE tasks SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time() + lease, task_id, worker)).rowcount > 0
+
+    def finish(self, task_id, result=None, error=None):
+        """Enregistrer le résultat (JSON, ``encode_result``) ou l'erreur d'une tâche en cours (le premier arrivé l'emporte)"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE tasks SET status = ?, result = ?, error = ?, finished = ? WHERE id = ? AND status = 'running'",
+                ('failed' if error is not None else 'done', result, error, time.time(), task_id))
+
+    def running(self, worker):
+        """(id, début) de la tâche en cours de ``worker``, ou None"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, started FROM tasks WHERE status = 'running' AND worker = ?", (worker,)).fetchone()
+
+    def take(self, task_id):
+        """(statut, résultat, erreur); une tâche terminée est supprimée de la file une fois relevée"""
+        with self._lock:
+            row = self._conn.execute("SELECT status, result, error FROM tasks WHERE id = ?", (task_id,)).fetchone()
+            if row is not None and row[0] in ('done', 'failed'):
+                self._conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+        return row if row is not None else (None, None, None)
+
+    def finished(self):
+        """(id, statut, résultat, erreur) des tâches terminées pas encore relevées"""
+        with self._lock:
+            return self._conn.execute("SELECT id, status, result, error FROM tasks "
+                                      "WHERE status IN ('done', 'failed') ORDER BY finished").fetchall()
+
+    def cancel(self, task_id):
+        """Retirer une tâche qui n'a pas encore commencé"""
+        with self._lock:
+            return self._conn.execute("DELETE FROM tasks WHERE id = ? AND status = 'queued'",
+                                      (task_id,)).rowcount > 0
+
+    def recover(self, host=None):
+        """Reprendre sans attendre l'expiration du bail les tâches des processus disparus de cette machine"""
+        host = host or socket.gethostname()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, worker, attempts FROM tasks WHERE status = 'running' AND worker LIKE ?",
+                (f"{host}:%",)).fetchall()
+        recovered = 0
+        for task_id, worker, attempts in rows:
+            if _pid_alive(int(worker.rsplit(':', 1)[1])):
+                continue
+            with self._lock:
+                if attempts < TASK_MAX_ATTEMPTS:
+                    self._conn.execute("UPDATE tasks SET status = 'queued', worker = NULL WHERE id = ? "
+                                       "AND status = 'running'", (task_id,))
+                else:
+                    self._conn.execute("UPDATE tasks SET status = 'failed', error = ?, finished = ? WHERE id = ? "
+                                       "AND status = 'running'",
+                                       ("processus de travail disparu pendant la tâche", time.time(), task_id))
+            recovered += 1
+        return recovered
+
+    def purge(self, max_age=TASK_RESULT_TTL):
+        """Supprimer les résultats jamais relevés"""
+        with self._lock:
+            return self._conn.execute("DELETE FROM tasks WHERE status IN ('done', 'failed') AND finished < ?",
+                                      (time.time() - max_age,)).rowcount
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+class DirectoryTaskQueue:
+    """File de tâches dans un dossier partagé entre machines (NFS, SMB)
+
+    Chaque tâche est un fichier (JSON) qui passe de ``queued/`` à
+    ``running/`` par renommage atomique: un seul processus gagne la prise. Son
+    nom porte l'ordre de soumission, l'identifiant, le nombre de tentatives, le
+    début et le processus qui la tient; sa date de modification sert de bail,
+    repoussée par ``heartbeat``. Le résultat est écrit dans ``done/`` par
+    renommage d'un fichier temporaire, et ``tasks/`` garde un marqueur par
+    identifiant pour ``put``. Les horloges des machines doivent être
+    synchronisées (NTP).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        for folder in ('tasks', 'queued', 'running', 'done'):
+            os.makedirs(os.path.join(path, folder), exist_ok=True)
+
+    def _path(self, folder, name):
+        return os.path.join(self.path, folder, name)
+
+    def _list(self, folder):
+        return sorted(name for name in os.listdir(os.path.join(self.path, folder)) if not name.startswith('.'))
+
+    def _write(self, folder, name, data):
+        tmp = self._path(folder, f".{name}.{uuid.uuid4().hex}")
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, self._path(folder, name))
+
+    def _remove(self, folder, name):
+        try:
+            os.remove(self._path(folder, name))
+            return True
+        except FileNotFoundError:
+            return False
+
+    @staticmethod
+    def _token(worker):
+        return worker.replace(':', '+')   # ':' interdit dans les noms de fichier sous Windows
+
+    def _held(self, task_id=None, worker=None):
+        """(nom, champs) des fichiers running/ d'une tâche et/ou d'un processus"""
+        for name in self._list('running'):
+            fields = name.split('~')
+            if (task_id is None or fields[1] == task_id) and (worker is None or fields[4] == self._token(worker)):
+                yield name, fields
+
+    def _result(self, task_id):
+        for status in ('done', 'failed'):
+            if os.path.exists(self._path('done', f"{task_id}.{status}")):
+                return status
+        return None
+
+    def _fail(self, folder, name, task_id, error):
+        if self._remove(folder, name):
+            self._write_result(task_id, 'failed', None, error)
+
+    def _write_result(self, task_id, status, result, error):
+        if isinstance(result, bytes):
+            result = result.decode('utf-8')
+        self._write('done', f"{task_id}.{status}", json.dumps({'result': result, 'error': error}).encode('utf-8'))
+
+    def _read_result(self, name):
+        with open(self._path('done', name), 'rb') as f:
+            data = json.load(f)
+        return data.get('result'), data.get('error')
+
+    def put(self, task_id, task, *args, **kwargs):
+        """Comme ``TaskQueue.put``"""
+        payload = encode_task(task, args, kwargs)
+        try:
+            os.close(os.open(self._path('tasks', task_id), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return False
+        self._write('queued', f"{time.time_ns() // 1000:017d}~{task_id}~0", payload)
+        return True
+
+    def submit(self, task, *args, **kwargs):
+        task_id = uuid.uuid4().hex
+        self.put(task_id, task, *args, **kwargs)
+        return task_id
+
+    def claim(self, worker, lease=TASK_LEASE):
+        """Comme ``TaskQueue.claim``: baux expirés d'abord, puis tâches en attente"""
+        now = time.time()
+        candidates = []
+        for name, fields in self._held():
+            try:
+                # Début inscrit dans le nom: un fichier tout juste renommé garde l'ancienne date de modification
+                beat = max(os.stat(self._path('running', name)).st_mtime, int(fields[3]) / 1000)
+            except FileNotFoundError:
+                continue
+            if now - beat > lease:
+                candidates.append(('running', name))
+        candidates.extend(('queued', name) for name in self._list('queued'))
+
+        for folder, name in candidates:
+            seq, task_id, attempts = name.split('~')[:3]
+            attempts = int(attempts)
+            if attempts >= TASK_MAX_ATTEMPTS:
+                self._fail(folder, name, task_id, f"abandonnée après {attempts} tentatives")
+                continue
+            target = f"{seq}~{task_id}~{attempts + 1}~{int(now * 1000)}~{self._token(worker)}"
+            try:
+                os.rename(self._path(folder, name), self._path('running', target))
+            except FileNotFoundError:
+                continue   # prise par un autre processus
+            os.utime(self._path('running', target))
+            with open(self._path('running', target), 'rb') as f:
+                return task_id, f.read()
+        return None
+
+    def heartbeat(self, task_id, worker, lease=TASK_LEASE):
+        for name, _ in self._held(task_id, worker):
+            try:
+                os.utime(self._path('running', name))
+                return True
+            except FileNotFoundError:
+                pass
+        return False
+
+    def finish(self, task_id, result=None, error=None):
+        if os.path.exists(self._path('tasks', task_id)) and self._result(task_id) is None:
+            self._write_result(task_id, 'failed' if error is not None else 'done', result, error)
+        for name, _ in list(self._held(task_id)):
+            self._remove('running', name)
+
+    def running(self, worker):
+        for _, fields in self._held(worker=worker):
+            return fields[1], int(fields[3]) / 1000
+        return None
+
+    def take(self, task_id):
+        """Comme ``TaskQueue.take``; 'queued' désigne aussi une tâche en cours"""
+        status = self._result(task_id)
+        if status is None:
+            return ('queued', None, None) if os.path.exists(self._path('tasks', task_id)) else (None, None, None)
+        try:
+            result, error = self._read_result(f"{task_id}.{status}")
+        except FileNotFoundError:
+            return None, None, None   # relevée entre-temps par un autre processus
+        self._remove('done', f"{task_id}.{status}")
+        self._remove('tasks', task_id)
+        return status, result, error
+
+    def finished(self):
+        rows = []
+        for name in self._list('done'):
+            task_id, status = name.rsplit('.', 1)
+            try:
+                result, error = self._read_result(name)
+            except FileNotFoundError:
+                continue
+            rows.append((task_id, status, result, error))
+        return rows
+
+    def cancel(self, task_id):
+        for name in self._list('queued'):
+            if name.split('~')[1] == task_id and self._remove('queued', name):
+                self._remove('tasks', task_id)
+                return True
+        return False
+
+    def recover(self, host=None):
+        prefix = self._token(f"{host or socket.gethostname()}:")
+        recovered = 0
+        for name, (seq, task_id, attempts, _, token) in list(self._held()):
+            if not token.startswith(prefix) or _pid_alive(int(token[len(prefix):])):
+                continue
+            if int(attempts) >= TASK_MAX_ATTEMPTS:
+                self._fail('running', name, task_id, "processus de travail disparu pendant la tâche")
+            else:
+                try:
+                    os.rename(self._path('running', name), self._path('queued', f"{seq}~{task_id}~{attempts}"))
+                except FileNotFoundError:
+                    continue
+            recovered += 1
+        return recovered
+
+    def purge(self, max_age=TASK_RESULT_TTL):
+        limit = time.time() - max_age
+        purged = 0
+        for name in self._list('done'):
+            try:
+                expired = os.stat(self._path('done', name)).st_mtime < limit
+            except FileNotFoundError:
+                continue
+            if expired and self._remove('done', name):
+                self._remove('tasks', name.rsplit('.', 1)[0])
+                purged += 1
+        return purged
+
+    def counts(self):
+        done = self._list('done')
+        counts = {'queued': len(self._list('queued')), 'running': len(self._list('running')),
+                  'done': sum(name.endswith('.done') for name in done),
+                  'failed': sum(name.endswith('.failed') for name in done)}
+        return {status: count for status, count in counts.items() if count}
+
+
+# Préfixe "schéma:" de ESG_TASK_QUEUE -> classe de file; un module préchargé peut en ajouter
+QUEUE_BACKENDS = {'sqlite': TaskQueue, 'dir': DirectoryTaskQueue}
+
+
+def open_queue(spec=TASK_QUEUE_PATH):
+    """File désignée par ``spec``: "dir:/mnt/partage/file", "sqlite:taches.sqlite" ou un chemin SQLite"""
+    scheme, sep, location = spec.partition(':')
+    if sep and scheme in QUEUE_BACKENDS:
+        return QUEUE_BACKENDS[scheme](location)
+    return TaskQueue(spec)
+
+
+# ------------------------------------------------------------ processus de travail
+def _limit_torch_threads(threads):
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
+
+
+def _watch_memory(limit_bytes, state):
+    """Arrêt immédiat du processus si la tâche en cours dépasse sa limite mémoire"""
+    while True:
+        time.sleep(MEMORY_CHECK_INTERVAL)
+        baseline = state.get('baseline')
+        if baseline is not None and current_rss_bytes() - baseline > limit_bytes:
+            logger.error(f"Limite mémoire dépassée ({limit_bytes // (1024 * 1024)} Mo par tâche): arrêt du processus")
+            os._exit(MEMORY_EXIT_CODE)
+
+
+def _keep_lease(queue, task_id, worker, lease, stop):
+    """Renouveler le bail de la tâche en cours jusqu'à ``stop``"""
+    while not stop.wait(lease / 3):
+        try:
+            if not queue.heartbeat(task_id, worker, lease):
+                logger.warning(f"Bail perdu sur la tâche {task_id}: reprise par un autre processus")
+                return
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Renouvellement du bail impossible ({task_id}): {e}")
+
+
+def worker_main(queue_path, host_pid, max_tasks, task_memory_mb, torch_threads, preload, lease=TASK_LEASE):
+    """Boucle d'un processus de travail: prendre, exécuter, enregistrer, puis sortir après ``max_tasks``"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   # Ctrl+C: c'est l'hôte qui arrête ses processus
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)  # gestionnaire de l'hôte hérité par fork
+    for module in preload:
+        importlib.import_module(module)   # déjà chargés par l'hôte avant fork
+    _limit_torch_threads(torch_threads)
+    queue = open_queue(queue_path)
+    name = worker_name()
+    state = {}
+    threading.Thread(target=_watch_memory, args=(task_memory_mb * 1024 * 1024, state), daemon=True,
+                     name='memory-watch').start()
+
+    done = 0
+    while done < max_tasks:
+        task = queue.claim(name, lease)
+        if task is None:
+            if os.getppid() != host_pid:
+                return   # hôte disparu
+            time.sleep(POLL_INTERVAL)
+            continue
+        task_id, payload = task
+        state['baseline'] = current_rss_bytes()
+        stop_lease = threading.Event()
+        threading.Thread(target=_keep_lease, args=(queue, task_id, name, lease, stop_lease), daemon=True,
+                         name='lease').start()
+        try:
+            fn, args, kwargs = resolve_task(payload)
+            result, error = encode_result(fn(*args, **kwargs)), None
+        except Exception as e:
+            logger.exception(f"Tâche {task_id} en échec")
+            result, error = None, f"{type(e).__name__}: {e}"
+        stop_lease.set()
+        state.pop('baseline', None)
+        queue.finish(task_id, result, error)
+        done += 1
+
+
+def _exit_reason(exitcode, task_memory_mb):
+    if exitcode == MEMORY_EXIT_CODE:
+        return f"limite mémoire dépassée ({task_memory_mb} Mo par tâche)"
+    if exitcode is not None and exitcode < 0:
+        try:
+            return f"processus de travail arrêté par {signal.Signals(-exitcode).name}"
+        except ValueError:
+            pass
+    return f"processus de travail arrêté (code {exitcode})"
+
+
+class WorkerHost:
+    """Processus hôte: précharge les modèles puis maintient ``workers`` processus de travail"""
+
+    def __init__(self, queue_path=TASK_QUEUE_PATH, workers=EXTRACTION_WORKERS, max_tasks=WORKER_MAX_TASKS,
+                 task_memory_mb=WORKER_TASK_MEMORY_MB, task_timeout=WORKER_TASK_TIMEOUT,
+                 torch_threads=WORKER_TORCH_THREADS, preload=WORKER_PRELOAD, parent_pid=None, lease=TASK_LEASE):
+        self.queue_path = queue_path
+        self.lease = lease
+        self.workers = max(1, workers)
+        self.max_tasks = max_tasks
+        self.task_memory_mb = task_memory_mb
+        self.task_timeout = task_timeout
+        self.torch_threads = torch_threads or max(1, (os.cpu_count() or 1) // self.workers)
+        self.preload = [module for module in preload.split(',') if module] if isinstance(preload, str) \
+            else list(preload)
+        self.parent_pid = parent_pid
+        self._stopping = False
+        self._timed_out = set()
+
+    def _spawn(self, ctx):
+        process = ctx.Process(target=worker_main, name='extraction-worker', daemon=True,
+                              args=(self.queue_path, os.getpid(), self.max_tasks, self.task_memory_mb,
+                                    self.torch_threads, self.preload, self.lease))
+        process.start()
+        return process
+
+    def _reap(self, queue, process):
+        """Processus terminé: la tâche qu'il tenait passe en échec"""
+        name = worker_name(process.pid)
+        running = queue.running(name)
+        if process.exitcode == 0 and running is None:
+            return   # recyclé après max_tasks
+        if process.pid in self._timed_out:
+            reason = f"délai dépassé ({self.task_timeout:.0f} s)"
+            self._timed_out.discard(process.pid)
+        else:
+            reason = _exit_reason(process.exitcode, self.task_memory_mb)
+        logger.error(f"{name}: {reason}")
+        if running is not None:
+            queue.finish(running[0], error=reason)
+
+    def _check_timeout(self, queue, process):
+        running = queue.running(worker_name(process.pid))
+        if running is not None and time.time() - running[1] > self.task_timeout:
+            self._timed_out.add(process.pid)
+            process.kill()
+
+    def stop(self, *_):
+        self._stopping = True
+
+    def run(self):
+        started = time.time()
+        for module in self.preload:
+            importlib.import_module(module)
+        logger.info(f"Modèles préchargés en {time.time() - started:.1f}s ({', '.join(self.preload) or 'aucun'})")
+        queue = open_queue(self.queue_path)
+        recovered = queue.recover()
+        if recovered:
+            logger.warning(f"{recovered} tâches interrompues reprises")
+        queue.purge()
+
+        method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+        ctx = multiprocessing.get_context(method)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        logger.info(f"Pool d'extraction: {self.workers} processus ({method}), {self.torch_threads} threads torch "
+                    f"chacun, {self.max_tasks} tâches max, {self.task_memory_mb} Mo par tâche")
+
+        processes = [self._spawn(ctx) for _ in range(self.workers)]
+        last_purge = time.time()
+        try:
+            while not self._stopping:
+                for i, process in enumerate(processes):
+                    if process.is_alive():
+                        self._check_timeout(queue, process)
+                    else:
+                        process.join()
+                        self._reap(queue, process)
+                        processes[i] = self._spawn(ctx)
+                if self.parent_pid and os.getppid() != self.parent_pid:
+                    logger.warning("Processus API disparu: arrêt du pool d'extraction")
+                    break
+                if time.time() - last_purge > 3600:
+                    queue.purge()
+                    last_purge = time.time()
+                time.sleep(SUPERVISE_INTERVAL)
+        finally:
+            # Tâches interrompues laissées 'running': reprises par recover() au prochain démarrage
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join(5)
+                if process.is_alive():
+                    process.kill()
+
+
+# --------------------------------------------------------------------- côté API
+class ExtractionWorkers:
+    """Côté API: lancer l'hôte, soumettre des tâches et attendre leurs résultats"""
+
+    def __init__(self, workers=EXTRACTION_WORKERS, queue_path=TASK_QUEUE_PATH):
+        self.workers = workers
+        self.queue_path = queue_path
+        self.queue = None
+        self._host = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    @property
+    def available(self):
+        return self._host is not None and self._host.poll() is None
+
+    def start(self):
+        """Lancer (ou relancer) le processus hôte; sans effet si le pool est désactivé"""
+        if not self.enabled:
+            return self
+        with self._lock:
+            if self.available:
+                return self
+            if self._host is not None:
+                logger.warning(f"Pool d'extraction arrêté (code {self._host.returncode}): redémarrage")
+            if self.queue is None:
+                self.queue = open_queue(self.queue_path)
+                atexit.register(self.stop)
+            self._host = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--queue', self.queue_path,
+                                           '--workers', str(self.workers), '--parent-pid', str(os.getpid())])
+        return self
+
+    def stop(self):
+        if self._host is None or self._host.poll() is not None:
+            return
+        self._host.terminate()
+        try:
+            self._host.wait(10)
+        except subprocess.TimeoutExpired:
+            self._host.kill()
+
+    def submit(self, task, *args, **kwargs):
+        """Mettre en file la tâche ``task`` (nom de TASK_REGISTRY, arguments JSON)"""
+        self.start()
+        return self.queue.submit(task, *args, **kwargs)
+
+    def poll(self, task_id):
+        """(terminée, résultat) sans attendre; ``WorkerError`` si la tâche échoue ou si le pool s'arrête"""
+        status, result, error = self.queue.take(task_id)
+        if status == 'done':
+            WORKER_TASKS.inc(result='done')
+            return True, decode_result(result)
+        if status == 'failed':
+            WORKER_TASKS.inc(result='failed')
+            raise WorkerError(error)
+        if status is None:
+            raise WorkerError(f"tâche {task_id} inconnue")
+        if not self.available:
+            self.abandon(task_id)
+            raise WorkerError("pool d'extraction arrêté")
+        return False, None
+
+    def abandon(self, task_id):
+        """Ne plus attendre une tâche: retirée de la file si elle n'a pas commencé"""
+        self.queue.cancel(task_id)
+        WORKER_TASKS.inc(result='lost')
+
+    def result(self, task_id, timeout=None):
+        """Attendre le résultat d'une tâche; ``WorkerError`` si elle échoue ou si le pool s'arrête"""
+        deadline = time.time() + timeout if timeout is not None else None
+        while True:
+            done, result = self.poll(task_id)
+            if done:
+                return result
+            if deadline is not None and time.time() > deadline:
+                self.abandon(task_id)
+                raise WorkerError("délai d'attente dépassé")
+            time.sleep(POLL_INTERVAL)
+
+    def run(self, task, *args, **kwargs):
+        """Tâche ``task`` exécutée dans un processus de travail; son résultat (relu depuis JSON)"""
+        return self.result(self.submit(task, *args, **kwargs))
+
+    def stats(self):
+        return {"workers": self.workers, "available": self.available,
+                "tasks": self.queue.counts() if self.queue is not None else {}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hôte du pool d'extraction")
+    parser.add_argument('--queue', default=TASK_QUEUE_PATH, help="Fichier SQLite ou dir:/dossier/partagé")
+    parser.add_argument('--workers', type=int, default=EXTRACTION_WORKERS)
+    parser.add_argument('--max-tasks', type=int, default=WORKER_MAX_TASKS, help="Tâches avant recyclage")
+    parser.add_argument('--task-memory-mb', type=int, default=WORKER_TASK_MEMORY_MB)
+    parser.add_argument('--task-timeout', type=float, default=WORKER_TASK_TIMEOUT)
+    parser.add_argument('--torch-threads', type=int, default=WORKER_TORCH_THREADS)
+    parser.add_argument('--preload', default=WORKER_PRELOAD, help="Modules chargés avant fork (séparés par des virgules)")
+    parser.add_argument('--parent-pid', type=int, default=None, help="Arrêt quand ce processus disparaît")
+    parser.add_argument('--lease', type=float, default=TASK_LEASE, help="Bail d'une tâche (secondes)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    WorkerHost(args.queue, args.workers, args.max_tasks, args.task_memory_mb, args.task_timeout,
+               args.torch_threads, args.preload, args.parent_pid, args.lease).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""Test de charge: latence du tableau de bord pendant des chats LLM en cours.
+
+Mesure la latence d'une route légère (par défaut /api/statistics) seule, puis
+pendant que ``--chats`` requêtes /api/chatbot/chat attendent Ollama. Sous WSGI
+(``app.run``) les chats occupent les threads et la latence du tableau de bord
+explose; avec ``ESG_ASYNC=1`` elle doit rester plate.
+
+    ESG_ASYNC=1 OLLAMA_MAX_QUEUE=256 OLLAMA_CHAT_DEADLINE=600 python esg_banchmarking.py &
+    python load_test.py --url http://localhost:5000 --chats 200 --duration 20
+
+Les chats doivent tous attendre Ollama pendant la mesure: la file du serveur
+(``OLLAMA_MAX_QUEUE`` + ``OLLAMA_MAX_IN_FLIGHT``) doit accepter ``--chats``
+requêtes, ce que le test vérifie avant de commencer (``/api/chatbot/queue``), et
+l'échéance des chats (``OLLAMA_CHAT_DEADLINE``) dépasser la durée du test. Une
+réponse de saturation ou d'échéance (HTTP 200 avec un message d'erreur) compte
+comme un échec.
+
+Le code de sortie est 1 si le p95 sous charge dépasse ``--max-ratio`` fois le p95 de référence
+(ou ``--min-p95-ms`` s'il est plus grand), si un chat se termine en échec ou si
+moins de ``--chats`` chats sont encore en cours à la fin des mesures; 2 si la
+file du serveur est trop petite.
+"""
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+import aiohttp
+
+# Débuts des réponses du serveur quand la génération n'a pas eu lieu (ollama_error_message)
+LLM_FAILURE_PREFIXES = ("🚦", "⏰", "🔌", "❌", "Erreur de communication avec Ollama",
+                        "Désolé, je n'ai pas pu générer")
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def summarize(name, latencies, errors):
+    ms = [v * 1000 for v in latencies]
+    print(f"{name:<22} n={len(ms):<5} erreurs={errors:<4} p50={percentile(ms, 0.5):8.1f} ms  "
+          f"p95={percentile(ms, 0.95):8.1f} ms  max={max(ms, default=float('nan')):8.1f} ms  "
+          f"moy={statistics.fmean(ms) if ms else float('nan'):8.1f} ms")
+    return percentile(ms, 0.95)
+
+
+async def probe_dashboard(session, url, duration, interval, timeout):
+    """Appels séquentiels de la route légère pendant ``duration`` secondes"""
+    latencies, errors = [], 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        start = time.perf_counter()
+        try:
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                await response.read()
+                if response.status >= 500:
+                    errors += 1
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(interval)
+    return latencies, errors
+
+
+def is_llm_answer(payload):
+    """Réponse réellement générée par le LLM (ni erreur, ni saturation, ni réponse directe)"""
+    if not isinstance(payload, dict) or 'error' in payload or payload.get('route') != 'llm':
+        return False
+    return not str(payload.get('response', '')).lstrip().startswith(LLM_FAILURE_PREFIXES)
+
+
+async def check_queue_capacity(session, url, chats):
+    """False si la file LLM du serveur refuserait une partie des ``chats``"""
+    try:
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+            status = await response.json(content_type=None)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        print(f"⚠️ État de la file LLM illisible ({url}): {e}")
+        return True
+    capacity = status.get('max_queue', 0) + status.get('max_in_flight', 0)
+    if 'max_queue' in status and capacity < chats:
+        print(f"❌ La file LLM du serveur accepte {capacity} requêtes pour {chats} chats: "
+              f"relancer le serveur avec OLLAMA_MAX_QUEUE>={chats}")
+        return False
+    return True
+
+
+async def chat(session, url, question, results):
+    start = time.perf_counter()
+    try:
+        async with session.post(url, json={"question": question}) as response:
+            payload = await response.json(content_type=None)
+            ok = response.status == 200 and is_llm_answer(payload)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        ok = False
+    results.append((ok, time.perf_counter() - start))
+
+
+async def run(args):
+    dashboard_url = args.url.rstrip('/') + args.dashboard_path
+    chat_url = args.url.rstrip('/') + args.chat_path
+    connector = aiohttp.TCPConnector(limit=0)       # pas de limite côté client: la charge arrive d'un coup
+    async with aiohttp.ClientSession(connector=connector,
+                                     timeout=aiohttp.ClientTimeout(total=args.chat_timeout)) as session:
+        if not await check_queue_capacity(session, args.url.rstrip('/') + args.queue_path, args.chats):
+            return 2
+        print(f"Référence: {dashboard_url} pendant {args.baseline}s sans chat")
+        baseline, baseline_errors = await probe_dashboard(session, dashboard_url, args.baseline, args.interval,
+                                                          args.probe_timeout)
+
+        print(f"Charge: {args.chats} chats en cours sur {chat_url}, {dashboard_url} pendant {args.duration}s")
+        results = []
+        chats = [asyncio.ensure_future(chat(session, chat_url, f"{args.question} (requête {i})", results))
+                 for i in range(args.chats)]
+        await asyncio.sleep(args.ramp)
+        loaded, loaded_errors = await probe_dashboard(session, dashboard_url, args.duration, args.interval,
+                                                      args.probe_timeout)
+        in_flight = sum(1 for task in chats if not task.done())
+        if args.wait_chats:
+            await asyncio.gather(*chats)
+        else:
+            for task in chats:
+                task.cancel()
+            await asyncio.gather(*chats, return_exceptions=True)
+
+    print()
+    base_p95 = summarize("tableau de bord seul", baseline, baseline_errors)
+    load_p95 = summarize("tableau de bord chargé", loaded, loaded_errors)
+    ok = sum(1 for success, _ in results if success)
+    failed = len(results) - ok
+    print(f"chats: {len(results)} terminés ({ok} réussis, {failed} en échec), "
+          f"{in_flight} encore en cours à la fin des mesures")
+
+    limit = max(base_p95 * args.max_ratio, args.min_p95_ms)
+    flat = load_p95 <= limit and loaded_errors == 0
+    # Sans chats en attente d'Ollama pendant toute la mesure, le test n'a pas chargé le serveur
+    loaded_ok = in_flight >= args.chats and failed == 0
+    if not loaded_ok:
+        print(f"❌ Charge non tenue: {in_flight}/{args.chats} chats en cours à la fin des mesures, "
+              f"{failed} en échec (file saturée, échéance ou Ollama indisponible)")
+    print(f"{'✅' if flat and loaded_ok else '❌'} p95 chargé {load_p95:.1f} ms (limite {limit:.1f} ms)")
+    return 0 if flat and loaded_ok else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latence du tableau de bord pendant des chats LLM")
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--dashboard-path', default='/api/statistics')
+    parser.add_argument('--chat-path', default='/api/chatbot/chat')
+    parser.add_argument('--queue-path', default='/api/chatbot/queue')
+    parser.add_argument('--question', default="Analyse la stratégie climat des entreprises")
+    parser.add_argument('--chats', type=int, default=200, help="Chats lancés simultanément")
+    parser.add_argument('--baseline', type=float, default=5, help="Secondes de mesure sans charge")
+    parser.add_argument('--duration', type=float, default=20, help="Secondes de mesure sous charge")
+    parser.add_argument('--ramp', type=float, default=1, help="Délai entre le lancement des chats et la mesure")
+    parser.add_argument('--interval', type=float, default=0.1, help="Pause entre deux appels du tableau de bord")
+    parser.add_argument('--probe-timeout', type=float, default=30)
+    parser.add_argument('--chat-timeout', type=float, default=600)
+    parser.add_argument('--wait-chats', action='store_true', help="Attendre la fin des chats avant de conclure")
+    parser.add_argument('--max-ratio', type=float, default=3.0)
+    parser.add_argument('--min-p95-ms', type=float, default=50.0)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == '__main__':
+    main()
@@ -104,6 +104,54 @@ export const apiService = {
     return api.post('/chatbot/chat', payload);
   },
 
+  // Chat en flux (Server-Sent Events): onToken est appelé pour chaque jeton reçu
+  esgChatStream: async (question, { onToken, onMeta, onDone, onError } = {}) => {
+    const response = await fetch(`${API_BASE_URL}/chatbot/chat/stream`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ question })
+    });
+
+    if (!response.ok) {
+      const data = await response.json().catch(() => ({}));
+      throw new Error(data.error || `Server error: ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    const handlers = { meta: onMeta, done: onDone, error: onError };
+    let buffer = '';
+    let answer = '';
+
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      const events = buffer.split('\n\n');
+      buffer = events.pop();
+      for (const rawEvent of events) {
+        let eventName = 'message';
+        let data = '';
+        for (const line of rawEvent.split('\n')) {
+          if (line.startsWith('event: ')) eventName = line.slice(7);
+          else if (line.startsWith('data: ')) data += line.slice(6);
+        }
+        if (!data) continue;
+
+        const payload = JSON.parse(data);
+        if (eventName === 'message') {
+          answer += payload.token;
+          if (onToken) onToken(payload.token, answer);
+        } else if (handlers[eventName]) {
+          handlers[eventName](payload);
+        }
+      }
+    }
+
+    return answer;
+  },
+
   // Obtenir les modèles disponibles - CORRIGÉ
   getChatbotModels: () => api.get('/chatbot/models'),
 